@@ -0,0 +1,92 @@
+"""Benchmark: peak memory of buffered vs streamed export downloads.
+
+Starts a local stub that serves a CSV file of the given size and measures the
+peak Python memory (tracemalloc) while downloading it to a temporary file with
+``ActivityInfoClient.download_file`` + write (the previous behaviour, the whole
+file is held in memory) and with ``ActivityInfoClient.download_to_file``, which
+streams it in chunks.
+
+Run it from the CKAN virtualenv:
+
+    python benchmarks/bench_download_memory.py --size 200 --chunk-size 1024
+"""
+import argparse
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ckanext.activityinfo.data.base import ActivityInfoClient
+
+
+ROW = b"2024-01-01,Some partner,Some location,12345,A longer free text comment field\n"
+
+
+def make_handler(size):
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Length', str(size))
+            self.end_headers()
+            rows = ROW * (64 * 1024 // len(ROW))
+            sent = 0
+            while sent < size:
+                block = rows[:size - sent]
+                self.wfile.write(block)
+                sent += len(block)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def buffered(client, url):
+    with tempfile.TemporaryFile() as tmp:
+        tmp.write(client.download_file(url))
+
+
+def streamed(client, url, chunk_size):
+    with tempfile.TemporaryFile() as tmp:
+        client.download_to_file(url, tmp, chunk_size=chunk_size, max_size=0)
+
+
+def measure(label, func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<24} peak {peak / 1024 / 1024:9.1f} MB  time {elapsed:6.2f} s")
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100, help='File size in MB')
+    parser.add_argument('--chunk-size', type=int, default=1024, help='Chunk size in KB for the streamed download')
+    args = parser.parse_args()
+
+    size = args.size * 1024 * 1024
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(size))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    url = f"{base_url}/resources/jobs/benchmark/download.csv"
+    client = ActivityInfoClient(base_url=base_url, api_key="benchmark")
+
+    print(f"Downloading a {args.size} MB export")
+    before = measure("download_file (buffered)", lambda: buffered(client, url))
+    after = measure("download_to_file", lambda: streamed(client, url, args.chunk_size * 1024))
+    print(f"Peak memory reduction: {(before - after) / 1024 / 1024:.1f} MB")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
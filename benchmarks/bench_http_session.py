@@ -0,0 +1,94 @@
+"""Benchmark: fresh connection per call vs the pooled ActivityInfoClient session.
+
+Starts a local stub of the ActivityInfo API and measures the per-call latency of
+``requests.get`` (the previous behaviour, one TCP connection per call) against
+``ActivityInfoClient.get``, which reuses the keep-alive connections of the pooled
+session. ``--connect-delay`` adds a delay to every new connection to simulate the
+TCP + TLS handshake with activityinfo.org.
+
+Run it from the CKAN virtualenv:
+
+    python benchmarks/bench_http_session.py --calls 200 --connect-delay 30
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from ckanext.activityinfo.data.base import ActivityInfoClient
+
+
+BODY = json.dumps([{"databaseId": "db1", "label": "DB 1"}]).encode()
+
+
+def make_handler(connect_delay):
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Avoid Nagle + delayed ACK stalls on the keep-alive connections
+        disable_nagle_algorithm = True
+
+        def setup(self):
+            # Called once per connection, not once per request
+            time.sleep(connect_delay)
+            super().setup()
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def timed_calls(func, calls):
+    timings = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    print(
+        f"{label:<28} mean {statistics.mean(timings):7.2f} ms  "
+        f"median {statistics.median(timings):7.2f} ms  "
+        f"total {sum(timings):9.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--connect-delay', type=float, default=0, help='Milliseconds added to every new connection')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(args.connect_delay / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    url = f"{base_url}/resources/databases"
+    headers = {"Authorization": "Bearer benchmark"}
+
+    fresh = timed_calls(lambda: requests.get(url, headers=headers).json(), args.calls)
+    client = ActivityInfoClient(base_url=base_url, api_key="benchmark")
+    pooled = timed_calls(lambda: client.get("resources/databases"), args.calls)
+
+    print(f"{args.calls} calls, connect delay {args.connect_delay} ms")
+    report("requests.get (no pooling)", fresh)
+    report("ActivityInfoClient (pooled)", pooled)
+    print(f"Per-call latency reduction: {statistics.mean(fresh) - statistics.mean(pooled):.2f} ms")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""Benchmark: export job vs query API, end to end, for forms of several sizes.
+
+Starts a local stub of the ActivityInfo API and measures the time to get a form
+as a CSV file:
+ - Export job: start the job, poll its status until it completes, then download
+   the file (what the download jobs do for big forms).
+ - Query: stream the records with ``ActivityInfoClient.iter_form_records`` and
+   write the CSV with ``jobs.query.write_records`` (the path used for forms under
+   ``ckanext.activityinfo.query.max_records``).
+
+The stub completes an export ``--job-delay`` seconds after it starts, plus
+``--per-record`` ms per record; the query endpoint sends the records right away
+in chunks of ``--chunk-size`` rows. Status polls follow ``AdaptivePoller`` with
+its default intervals.
+
+Run it from the CKAN virtualenv:
+
+    python benchmarks/bench_query_path.py --records 100 1000 10000 --job-delay 2
+"""
+import argparse
+import io
+import itertools
+import json
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.jobs.polling import AdaptivePoller
+from ckanext.activityinfo.jobs.query import write_records
+
+
+COLUMNS = [
+    {'id': 'name', 'label': 'Name', 'formula': 'name', 'translate': False},
+    {'id': 'amount', 'label': 'Amount', 'formula': 'amount', 'translate': False},
+    {'id': 'region', 'label': 'Region', 'formula': 'region.NAME', 'translate': False},
+]
+
+
+def make_records(count):
+    return [[f"Record {i}", i * 1.5, f"Region {i % 10}"] for i in range(count)]
+
+
+def make_csv(records):
+    out = io.BytesIO()
+    write_records(iter(records), COLUMNS, out, 'csv')
+    return out.getvalue()
+
+
+def make_chunks(records, chunk_size):
+    chunks = []
+    for start in range(0, len(records), chunk_size):
+        rows = records[start:start + chunk_size]
+        chunk = {
+            "rows": len(rows),
+            "columns": {
+                column['id']: {"storage": "array", "values": [row[i] for row in rows]}
+                for i, column in enumerate(COLUMNS)
+            },
+        }
+        chunks.append(json.dumps(chunk).encode() + b"\n")
+    return chunks
+
+
+def make_handler(state, job_delay, per_record):
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if self.path == '/resources/jobs':
+                job_id = f"job{next(state['job_ids'])}"
+                state['jobs'][job_id] = time.monotonic() + job_delay + per_record * len(state['records'])
+                self._send_json({"id": job_id})
+            elif self.path == '/resources/query/chunks':
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Content-Length', str(sum(len(chunk) for chunk in state['chunks'])))
+                self.end_headers()
+                for chunk in state['chunks']:
+                    self.wfile.write(chunk)
+            else:
+                self.send_error(404)
+
+        def do_GET(self):
+            if self.path.startswith('/resources/jobs/'):
+                ready_at = state['jobs'][self.path.rsplit('/', 1)[1]]
+                if time.monotonic() >= ready_at:
+                    job_id = self.path.rsplit('/', 1)[1]
+                    self._send_json({
+                        "state": "completed", "percentComplete": 100,
+                        "result": {"downloadUrl": f"/download/{job_id}.csv"},
+                    })
+                else:
+                    self._send_json({"state": "started", "percentComplete": 0})
+            elif self.path.startswith('/download/'):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv')
+                self.send_header('Content-Length', str(len(state['csv'])))
+                self.end_headers()
+                self.wfile.write(state['csv'])
+            else:
+                self.send_error(404)
+
+        def _send_json(self, data):
+            body = json.dumps(data).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return StubHandler
+
+
+def export_job_path(client):
+    poller = AdaptivePoller()
+    job_id = client.start_job_download_form_data("form1", columns=COLUMNS)["id"]
+    while True:
+        status = client.get_job_status(job_id)
+        poller.observe(status.get('percentComplete', 0))
+        if status['state'] == 'completed':
+            break
+        poller.wait()
+    out = io.BytesIO()
+    client.download_to_file(f"{client.base_url}{status['result']['downloadUrl']}", out)
+    return out.getvalue()
+
+
+def query_path(client):
+    out = io.BytesIO()
+    write_records(client.iter_form_records("form1", COLUMNS), COLUMNS, out, 'csv')
+    return out.getvalue()
+
+
+def timed_runs(func, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    print(
+        f"{label:<28} mean {statistics.mean(timings):9.1f} ms  "
+        f"median {statistics.median(timings):9.1f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--job-delay', type=float, default=2, help='Seconds an export job takes to start')
+    parser.add_argument('--per-record', type=float, default=0.1, help='Milliseconds of export job per record')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per query chunk')
+    args = parser.parse_args()
+
+    state = {'job_ids': itertools.count(1), 'jobs': {}}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(state, args.job_delay, args.per_record / 1000))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ActivityInfoClient(base_url=f"http://127.0.0.1:{server.server_address[1]}", api_key="benchmark")
+
+    print(f"Export job delay {args.job_delay} s + {args.per_record} ms per record, {args.runs} runs")
+    for count in args.records:
+        records = make_records(count)
+        state['records'] = records
+        state['csv'] = make_csv(records)
+        state['chunks'] = make_chunks(records, args.chunk_size)
+        assert export_job_path(client) == query_path(client) == state['csv']
+
+        print(f"{count} records ({len(state['csv']) / 1024:.0f} KB)")
+        exported = timed_runs(lambda: export_job_path(client), args.runs)
+        queried = timed_runs(lambda: query_path(client), args.runs)
+        report("  export job", exported)
+        report("  query", queried)
+        print(f"  speedup x{statistics.mean(exported) / statistics.mean(queried):.1f}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
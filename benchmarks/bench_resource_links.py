@@ -0,0 +1,126 @@
+"""Benchmark: queries and time to list the CKAN resources linked to ActivityInfo forms.
+
+The forms page lists the resources linked to each form and sub-form, and the
+admin page lists the resources with a complete download. Previously each
+resource ran a package_show just to build its URL. Now resources and datasets
+are read with a single joined query, and the forms page reads the resources of
+all its forms at once (get_ckan_resources_by_form).
+
+Resources are inserted directly in the database (10 per dataset, spread over
+80 forms) to keep the setup fast.
+
+This is a pytest module because it needs a CKAN database. Run it from the CKAN
+virtualenv with the extension test config:
+
+    pytest --ckan-ini=test.ini benchmarks/bench_resource_links.py -s
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import and_, event
+
+from ckan import model
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo import utils
+
+
+pytest_plugins = ['ckanext.activityinfo.tests.fixtures']
+
+FORMS = 80
+RESOURCES_PER_DATASET = 10
+
+
+def _legacy_get_ckan_resources(form_id):
+    """The previous lookup: one query for the resources, then package_show per resource."""
+    resources = model.Session.query(model.Resource).filter(
+        and_(
+            model.Resource.state == 'active',
+            utils._extras_jsonb['activityinfo_form_id'].astext == form_id,
+        )
+    ).all()
+    ret = []
+    for res in resources:
+        pkg = toolkit.get_action('package_show')({'ignore_auth': True}, {'id': res.package_id})
+        resource_url = toolkit.url_for(
+            f"{pkg.get('type', 'dataset')}_resource.read", id=pkg['name'], resource_id=res.id
+        )
+        ret.append((res.name or 'Unnamed resource', resource_url))
+    return ret
+
+
+@contextmanager
+def count_queries():
+    counter = {'queries': 0}
+
+    def before_cursor_execute(*args, **kwargs):
+        counter['queries'] += 1
+
+    engine = model.meta.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _create_linked_resources(count):
+    form_ids = [f"form_{i:03d}" for i in range(FORMS)]
+    for start in range(0, count, RESOURCES_PER_DATASET):
+        package = model.Package(id=str(uuid.uuid4()), name=f"bench-{uuid.uuid4().hex}", type='dataset', state='active')
+        model.Session.add(package)
+        for position in range(min(RESOURCES_PER_DATASET, count - start)):
+            model.Session.add(model.Resource(
+                id=str(uuid.uuid4()),
+                package_id=package.id,
+                name=f"Resource {start + position}",
+                url='activityinfo.csv',
+                position=position,
+                state='active',
+                extras={
+                    'activityinfo_form_id': form_ids[(start + position) % FORMS],
+                    'activityinfo_status': 'complete',
+                },
+            ))
+    model.Session.commit()
+    return form_ids
+
+
+def _measure(func):
+    with count_queries() as counter:
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+    return result, counter['queries'], elapsed
+
+
+@pytest.mark.usefixtures('clean_db')
+@pytest.mark.parametrize('count', [100, 1000, 10000])
+def test_resource_links(app, count):
+    form_ids = _create_linked_resources(count)
+
+    with app.flask_app.test_request_context():
+        legacy, legacy_queries, legacy_time = _measure(
+            lambda: {form_id: _legacy_get_ckan_resources(form_id) for form_id in form_ids}
+        )
+        per_form, per_form_queries, per_form_time = _measure(
+            lambda: {form_id: utils.get_ckan_resources(form_id) for form_id in form_ids}
+        )
+        batched, batched_queries, batched_time = _measure(lambda: utils.get_ckan_resources_by_form(form_ids))
+        _, admin_queries, admin_time = _measure(lambda: utils.get_ai_resources(limit=count))
+
+    print()
+    print(f"{count} linked resources, {FORMS} forms")
+    print(f"{'lookup':<34}{'queries':>10}{'time (s)':>12}")
+    print(f"{'package_show per resource':<34}{legacy_queries:>10}{legacy_time:>12.3f}")
+    print(f"{'joined query per form':<34}{per_form_queries:>10}{per_form_time:>12.3f}")
+    print(f"{'get_ckan_resources_by_form':<34}{batched_queries:>10}{batched_time:>12.3f}")
+    print(f"{'get_ai_resources (admin page)':<34}{admin_queries:>10}{admin_time:>12.3f}")
+
+    assert {form_id: sorted(links) for form_id, links in legacy.items()} == \
+        {form_id: sorted(links) for form_id, links in batched.items()}
+    assert {form_id: sorted(links) for form_id, links in per_form.items()} == \
+        {form_id: sorted(links) for form_id, links in batched.items()}
+    assert batched_queries <= per_form_queries < legacy_queries
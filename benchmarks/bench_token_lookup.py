@@ -0,0 +1,89 @@
+"""Benchmark: database round-trips spent on ActivityInfo API key lookups per page.
+
+Every auth function, action and template helper of the extension looks up the
+API key of the current user. Previously each lookup ran get_site_user and
+user_show. Now the key is read with one query and cached for the request and,
+for a short time, for the process.
+
+This is a pytest module because it needs a CKAN database. Run it from the CKAN
+virtualenv with the extension test config:
+
+    pytest --ckan-ini=test.ini benchmarks/bench_token_lookup.py -s
+"""
+from contextlib import contextmanager
+from unittest import mock
+
+import pytest
+from sqlalchemy import event
+
+from ckan import model
+from ckan.plugins import toolkit
+from ckantoolkit.tests import factories as ckan_factories
+
+from ckanext.activityinfo import utils
+from ckanext.activityinfo.tests import factories
+
+
+pytest_plugins = ['ckanext.activityinfo.tests.fixtures']
+
+
+def _legacy_query_user_token(user_name_or_id):
+    """The previous lookup: get_site_user + user_show on every call."""
+    try:
+        plugin_extras = utils.get_activity_info_user_plugin_extras(user_name_or_id)
+    except toolkit.ObjectNotFound:
+        return None
+    return (plugin_extras or {}).get('activity_info', {}).get('api_key')
+
+
+@contextmanager
+def legacy_lookup():
+    with mock.patch.object(utils, '_query_user_token', _legacy_query_user_token), \
+            mock.patch.object(utils, '_get_request_token_cache', return_value=None), \
+            mock.patch.dict(toolkit.config, {'ckanext.activityinfo.token_cache_ttl': '0'}):
+        yield
+
+
+@contextmanager
+def count_queries():
+    counter = {'queries': 0}
+
+    def before_cursor_execute(*args, **kwargs):
+        counter['queries'] += 1
+
+    engine = model.meta.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _get(app, url, headers):
+    with count_queries() as counter:
+        app.get(url, headers=headers)
+    return counter['queries']
+
+
+@pytest.mark.usefixtures('clean_db')
+def test_token_lookup_queries_per_page(app):
+    user = factories.ActivityInfoUser()
+    headers = {'Authorization': user['token']}
+    dataset = ckan_factories.Dataset(user=user)
+    resource = factories.ActivityInfoResource(package_id=dataset['id'])
+    pages = {
+        'resource page': toolkit.url_for('resource.read', id=dataset['name'], resource_id=resource['id']),
+        'resource edit': toolkit.url_for('resource.edit', id=dataset['name'], resource_id=resource['id']),
+        'API key page': toolkit.url_for('activity_info.api_key'),
+    }
+
+    print()
+    print(f"{'page':<16}{'legacy':>10}{'cold cache':>14}{'warm cache':>14}")
+    for label, url in pages.items():
+        with legacy_lookup():
+            legacy = _get(app, url, headers)
+        utils.clear_user_token_cache()
+        cold = _get(app, url, headers)
+        warm = _get(app, url, headers)
+        print(f"{label:<16}{legacy:>10}{cold:>14}{warm:>14}")
+        assert warm <= cold <= legacy
@@ -1,19 +1,25 @@
 import logging
 from requests.exceptions import HTTPError
 from ckan.plugins import toolkit
-from ckanext.activityinfo.utils import get_user_token
+from ckanext.activityinfo.utils import get_resources_status, get_user_token
 from ckanext.activityinfo.data.base import ActivityInfoClient
 from ckanext.activityinfo.exceptions import ActivityInfoConnectionError
-from ckanext.activityinfo.jobs.download import download_activityinfo_resource
+from ckanext.activityinfo.jobs.dedupe import get_download_jobs
+from ckanext.activityinfo.jobs.download import enqueue_download_job
+from ckanext.activityinfo.jobs.progress import get_progress_many
 
 
 log = logging.getLogger(__name__)
 
+# Max resources in a single act_info_resource_status call
+MAX_STATUS_RESOURCES = 100
+
 
 @toolkit.side_effect_free
 def act_info_get_databases(context, data_dict):
     '''
     Action function to get ActivityInfo databases for a user.
+    Set refresh to true to skip the cached list.
     '''
     toolkit.check_access('act_info_get_databases', context, data_dict)
     user = context.get('user')
@@ -21,7 +27,7 @@ def act_info_get_databases(context, data_dict):
     token = get_user_token(user)
     aic = ActivityInfoClient(api_key=token)
     try:
-        databases = aic.get_databases()
+        databases = aic.get_databases(refresh=toolkit.asbool(data_dict.get('refresh', False)))
     except HTTPError as e:
         # We can expect a HTTPError 401 Client Error: Unauthorized for url: https://www.activityinfo.org/resources/databases
         # for users with an invalid API key
@@ -36,6 +42,7 @@ def act_info_get_databases(context, data_dict):
 def act_info_get_forms(context, data_dict):
     '''
     Action function to get ActivityInfo forms for a database.
+    Set refresh to true to skip the cached database tree.
     '''
     toolkit.check_access('act_info_get_forms', context, data_dict)
     user = context.get('user')
@@ -47,7 +54,9 @@ def act_info_get_forms(context, data_dict):
     token = get_user_token(user)
     aic = ActivityInfoClient(api_key=token)
     try:
-        data = aic.get_forms(database_id, include_db_data=True)
+        data = aic.get_forms(
+            database_id, include_db_data=True, refresh=toolkit.asbool(data_dict.get('refresh', False))
+        )
     except HTTPError as e:
         error = f"Error retrieving forms for database {database_id} and user {user}: {e}"
         log.error(error)
@@ -65,6 +74,7 @@ def act_info_get_forms(context, data_dict):
 def act_info_get_form(context, data_dict):
     '''
     Action function to get a specific ActivityInfo form.
+    Set refresh to true to skip the cached form schema.
     '''
     toolkit.check_access('act_info_get_form', context, data_dict)
     user = context.get('user')
@@ -79,7 +89,7 @@ def act_info_get_form(context, data_dict):
     token = get_user_token(user)
     aic = ActivityInfoClient(api_key=token)
     try:
-        form = aic.get_form(database_id, form_id)
+        form = aic.get_form(database_id, form_id, refresh=toolkit.asbool(data_dict.get('refresh', False)))
     except HTTPError as e:
         error = f"Error retrieving form {form_id} for database {database_id} and user {user}: {e}"
         log.error(error)
@@ -88,6 +98,36 @@ def act_info_get_form(context, data_dict):
     return form
 
 
+@toolkit.side_effect_free
+def act_info_get_form_columns(context, data_dict):
+    '''
+    Action function to get the columns of an ActivityInfo form, to choose the
+    activityinfo_columns of a resource.
+    Returns a list of dicts with the id, label and formula of each column.
+    Set refresh to true to build the columns again from the form schema.
+    '''
+    toolkit.check_access('act_info_get_form_columns', context, data_dict)
+    user = context.get('user')
+    form_id = data_dict.get('form_id')
+    if not form_id:
+        raise toolkit.ValidationError({'form_id': 'Missing value'})
+
+    log.debug(f"Getting ActivityInfo columns of form {form_id} for user {user}")
+    token = get_user_token(user)
+    aic = ActivityInfoClient(api_key=token)
+    try:
+        columns = aic.get_form_columns(form_id, refresh=toolkit.asbool(data_dict.get('refresh', False)))
+    except HTTPError as e:
+        error = f"Error retrieving columns of form {form_id} for user {user}: {e}"
+        log.error(error)
+        raise ActivityInfoConnectionError(error)
+
+    return [
+        {'id': column['id'], 'label': column['label'], 'formula': column['formula']}
+        for column in columns
+    ]
+
+
 def act_start_download_job(context, data_dict):
     '''
     Action function to start an ActivityInfo export job to download form data.
@@ -136,6 +176,65 @@ def act_info_get_job_status(context, data_dict):
     return job_status
 
 
+@toolkit.side_effect_free
+def act_info_resource_status(context, data_dict):
+    '''
+    Action function to get the download status of several ActivityInfo resources
+    in one call, for the pages polling the resources being updated.
+    resource_ids is a list or a comma separated string of resource IDs.
+    Returns a dict {resource_id: {status, progress, error, job_id}}. Missing
+    resources and resources the user can not see are left out.
+    '''
+    toolkit.check_access('act_info_resource_status', context, data_dict)
+    resource_ids = data_dict.get('resource_ids')
+    if isinstance(resource_ids, str):
+        resource_ids = resource_ids.split(',')
+    if not isinstance(resource_ids, list):
+        raise toolkit.ValidationError({'resource_ids': 'Missing value'})
+    # Keep the order, without duplicates
+    resource_ids = list(dict.fromkeys(
+        str(resource_id).strip() for resource_id in resource_ids if str(resource_id).strip()
+    ))
+    if not resource_ids:
+        raise toolkit.ValidationError({'resource_ids': 'Missing value'})
+    if len(resource_ids) > MAX_STATUS_RESOURCES:
+        raise toolkit.ValidationError(
+            {'resource_ids': f'At most {MAX_STATUS_RESOURCES} resources per call'}
+        )
+
+    resources = get_resources_status(resource_ids)
+    # Private datasets are checked once each, like package_show would
+    allowed = {}
+    for resource in resources.values():
+        package_id = resource['package_id']
+        if not resource['private'] or package_id in allowed:
+            continue
+        try:
+            toolkit.check_access('package_show', dict(context), {'id': package_id})
+            allowed[package_id] = True
+        except toolkit.NotAuthorized:
+            allowed[package_id] = False
+
+    visible = [
+        resource_id for resource_id in resource_ids
+        if resource_id in resources
+        and (not resources[resource_id]['private'] or allowed[resources[resource_id]['package_id']])
+    ]
+    # The download jobs write their live progress to Redis, it is newer than the saved status
+    live = get_progress_many(visible)
+    jobs = get_download_jobs(visible)
+    ret = {}
+    for resource_id in visible:
+        status = live.get(resource_id) or resources[resource_id]
+        ret[resource_id] = {
+            'status': status['status'],
+            'progress': status['progress'],
+            'error': status['error'],
+            'job_id': jobs.get(resource_id),
+        }
+    return ret
+
+
 def act_info_update_resource_file(context, data_dict):
     '''
     Action function to update a CKAN resource with the downloaded ActivityInfo file.
@@ -146,13 +245,14 @@ def act_info_update_resource_file(context, data_dict):
     if not resource_id:
         raise toolkit.ValidationError({'resource_id': 'Missing value'})
     log.info(f"ActivityInfo: Updating resource {resource_id} with downloaded file")
-    # Enqueue the download job, this will update the file and related metadata
-    job = toolkit.enqueue_job(
-        download_activityinfo_resource,
-        [resource_id, user_name],
+    # Enqueue the download job, this will update the file and related metadata.
+    # If the resource already has a queued or running download job, we get its ID.
+    job_id, created = enqueue_download_job(
+        [resource_id],
+        user_name,
         title=f"Download ActivityInfo for resource {resource_id}",
-        rq_kwargs={'timeout': 600}
     )
 
-    log.info(f"ActivityInfo: Enqueued download job for resource {resource_id} with job ID {job.id}")
-    return {'job_id': job.id, 'resource_id': resource_id}
+    if created:
+        log.info(f"ActivityInfo: Enqueued download job for resource {resource_id} with job ID {job_id}")
+    return {'job_id': job_id, 'resource_id': resource_id, 'already_queued': not created}
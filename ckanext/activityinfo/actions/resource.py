@@ -1,64 +1,174 @@
 import logging
+import re
 from datetime import datetime, timezone
 
+from ckan import model
 from ckan.plugins import toolkit
-from ckanext.activityinfo.jobs.download import download_activityinfo_resource
-from ckanext.activityinfo.utils import VALID_AUTO_UPDATE_VALUES
+from ckanext.activityinfo.jobs.bundle import BUNDLE_FORMATS
+from ckanext.activityinfo.jobs.convert import UPSTREAM_FORMATS, get_available_formats
+from ckanext.activityinfo.jobs.download import enqueue_download_job
+from ckanext.activityinfo.jobs.scheduler import notify_schedule_change
+from ckanext.activityinfo.schedules import get_max_runs, validate_frequency
+from ckanext.activityinfo.utils import get_export_columns, get_export_filter, get_next_run_at, is_form_bundle
 
 
 log = logging.getLogger(__name__)
 
+# IDs of the columns built by ActivityInfoClient.get_form_columns
+COLUMN_ID_RE = re.compile(r'^[\w.-]+$')
+MAX_FILTER_LENGTH = 2000
+
 
 def _validate_auto_update_fields(data_dict):
-    """Validate activityinfo_auto_update and activityinfo_auto_update_runs fields."""
+    """Validate activityinfo_auto_update and activityinfo_auto_update_runs fields.
+
+    The resource forms send custom frequencies (intervals and cron expressions)
+    as activityinfo_auto_update = 'custom' and activityinfo_auto_update_custom.
+    """
     errors = {}
 
+    custom = data_dict.pop('activityinfo_auto_update_custom', None)
+    if data_dict.get('activityinfo_auto_update') == 'custom':
+        data_dict['activityinfo_auto_update'] = (custom or '').strip()
+        if not data_dict['activityinfo_auto_update']:
+            errors['activityinfo_auto_update'] = 'Enter an interval (e.g. interval:6h) or a cron expression'
+
     auto_update = data_dict.get('activityinfo_auto_update')
-    if auto_update and auto_update not in VALID_AUTO_UPDATE_VALUES:
-        errors['activityinfo_auto_update'] = (
-            f'Invalid value. Must be one of: {", ".join(VALID_AUTO_UPDATE_VALUES)}'
-        )
+    if auto_update and not errors:
+        try:
+            validate_frequency(auto_update)
+        except ValueError as e:
+            errors['activityinfo_auto_update'] = f'Invalid value. {e}'
 
+    max_runs = get_max_runs()
     auto_update_runs = data_dict.get('activityinfo_auto_update_runs')
     if auto_update_runs is not None and auto_update_runs != '':
         try:
             runs = int(auto_update_runs)
-            if runs < 1 or runs > 20:
-                errors['activityinfo_auto_update_runs'] = 'Must be between 1 and 20'
+            if runs < 1 or runs > max_runs:
+                errors['activityinfo_auto_update_runs'] = f'Must be between 1 and {max_runs}'
         except (ValueError, TypeError):
-            errors['activityinfo_auto_update_runs'] = 'Must be a number between 1 and 20'
+            errors['activityinfo_auto_update_runs'] = f'Must be a number between 1 and {max_runs}'
+
+    if errors:
+        raise toolkit.ValidationError(errors)
+
+
+def _validate_export_fields(data_dict):
+    """Validate activityinfo_columns, activityinfo_filter and activityinfo_bundle fields.
+
+    activityinfo_columns is saved as a comma separated list of column IDs, the
+    API also accepts a list. Form bundles export every column and record of
+    each form, so they can not have columns or a filter.
+    """
+    errors = {}
+
+    if 'activityinfo_columns' in data_dict:
+        column_ids = get_export_columns(data_dict) or []
+        invalid = [column_id for column_id in column_ids if not COLUMN_ID_RE.match(column_id)]
+        if invalid:
+            errors['activityinfo_columns'] = f'Invalid column IDs: {", ".join(invalid)}'
+        elif len(set(column_ids)) != len(column_ids):
+            errors['activityinfo_columns'] = 'Each column can only be selected once'
+        else:
+            data_dict['activityinfo_columns'] = ','.join(column_ids)
+
+    if 'activityinfo_filter' in data_dict:
+        export_filter = get_export_filter(data_dict) or ''
+        if len(export_filter) > MAX_FILTER_LENGTH:
+            errors['activityinfo_filter'] = f'Must be at most {MAX_FILTER_LENGTH} characters'
+        else:
+            data_dict['activityinfo_filter'] = export_filter
+
+    if 'activityinfo_bundle' in data_dict:
+        data_dict['activityinfo_bundle'] = 'true' if is_form_bundle(data_dict) else ''
+    if is_form_bundle(data_dict) and not errors:
+        if get_export_columns(data_dict) or get_export_filter(data_dict):
+            errors['activityinfo_bundle'] = 'Form bundles export all the columns and records of each form'
 
     if errors:
         raise toolkit.ValidationError(errors)
 
 
+def _get_formats(data_dict):
+    """Get the formats of the new ActivityInfo resources, one resource per format.
+
+    Form bundles (see jobs.bundle) have their own formats.
+    """
+    # Support multiple formats (comma-separated) or single format
+    formats_str = data_dict.get('activityinfo_formats', '') or data_dict.get('activityinfo_format', 'csv')
+    formats = [f.strip().lower() for f in formats_str.split(',') if f.strip()]
+
+    bundle = is_form_bundle(data_dict)
+    # Ensure at least one format is selected
+    if not formats:
+        formats = ['zip'] if bundle else ['csv']
+    if bundle:
+        available_formats = list(BUNDLE_FORMATS)
+    else:
+        available_formats = get_available_formats() + list(UPSTREAM_FORMATS)
+    invalid_formats = [f for f in formats if f not in available_formats]
+    if invalid_formats:
+        raise toolkit.ValidationError({
+            'activityinfo_formats': f'Formats not available: {", ".join(invalid_formats)}'
+        })
+    return formats
+
+
+def _set_next_run_at(data_dict):
+    """Save when the resource is due for its next automatic update (see utils.get_next_run_at)."""
+    if 'activityinfo_auto_update' in data_dict:
+        data_dict['activityinfo_next_run_at'] = get_next_run_at(data_dict)
+
+
+def _get_schedule_state(resource_dict):
+    """Get the fields the scheduler daemon reads from a resource (see utils.get_auto_update_schedule)."""
+    return (
+        resource_dict.get('activityinfo_next_run_at') or '',
+        resource_dict.get('activityinfo_auto_update') or '',
+        resource_dict.get('activityinfo_status') == 'complete',
+    )
+
+
+def _create_or_update(original_action, context, data_dict):
+    """Run the original action and let the scheduler daemon know about the new schedule.
+
+    The download jobs patch the status and progress of the resources many
+    times, the scheduler is only notified when its schedule changed.
+    """
+    resource = model.Resource.get(data_dict['id']) if data_dict.get('id') else None
+    previous = _get_schedule_state(resource.extras if resource else {})
+    _set_next_run_at(data_dict)
+    result = original_action(context, data_dict)
+    if _get_schedule_state(result) != previous:
+        notify_schedule_change(result['id'])
+    return result
+
+
 @toolkit.chained_action
 def resource_create(original_action, context, data_dict):
     """ Chain resource_create to handle ActivityInfo imports.
         We must create one or more resources depending on the selected formats.
         Users can check more than one format, so we create a resource per format.
+        All of them are downloaded by a single job that exports the form once
+        (see jobs.download.download_activityinfo_resource_group).
     """
 
-    # Validate auto-update fields regardless of url_type
+    # Validate auto-update and export fields regardless of url_type
     _validate_auto_update_fields(data_dict)
+    _validate_export_fields(data_dict)
 
     # url_type = activityinfo means we are creating an ActivityInfo resource
     if data_dict.get('url_type') != 'activityinfo':
-        return original_action(context, data_dict)
+        return _create_or_update(original_action, context, data_dict)
 
     form_id = data_dict.get('activityinfo_form_id')
-    # Support multiple formats (comma-separated) or single format
-    formats_str = data_dict.get('activityinfo_formats', '') or data_dict.get('activityinfo_format', 'csv')
-    formats = [f.strip().lower() for f in formats_str.split(',') if f.strip()]
-
-    # Ensure at least one format is selected
-    if not formats:
-        formats = ['csv']
+    formats = _get_formats(data_dict)
 
     form_label = data_dict.get('activityinfo_form_label', 'ActivityInfo Export')
 
     if not form_id:
-        return original_action(context, data_dict)
+        return _create_or_update(original_action, context, data_dict)
 
     user = context.get('user')
     log.info(f"ActivityInfo: Creating resource(s) for form {form_id} as {formats} for user {user}")
@@ -92,6 +202,7 @@ def resource_create(original_action, context, data_dict):
         # Set the timestamp so the first auto-update waits the full interval
         resource_data['activityinfo_last_updated'] = datetime.now(timezone.utc).isoformat()
         resource_data['activityinfo_auto_update_count'] = 0
+        _set_next_run_at(resource_data)
 
         # Set name with format suffix if multiple formats
         if len(formats) > 1:
@@ -104,7 +215,7 @@ def resource_create(original_action, context, data_dict):
         # Create the resource with placeholder
         try:
             result = original_action(context, resource_data)
-            results.append(result)
+            results.append((result, format_type))
             if first_result is None:
                 first_result = result
         except toolkit.ValidationError as ve:
@@ -118,6 +229,7 @@ def resource_create(original_action, context, data_dict):
                 data_dict['activityinfo_form_label'] = None
                 data_dict['activityinfo_format'] = None
                 data_dict['activityinfo_formats'] = None
+                data_dict['activityinfo_bundle'] = None
                 data_dict['activityinfo_status'] = None
                 data_dict['activityinfo_progress'] = None
                 data_dict['activityinfo_error'] = None
@@ -126,15 +238,24 @@ def resource_create(original_action, context, data_dict):
                 log.error(f"ActivityInfo: Failed to create resource for format {format_type}: {ve}")
                 continue
 
-        # Enqueue the download job
-        toolkit.enqueue_job(
-            download_activityinfo_resource,
-            [result['id'], user],
-            title=f"Download ActivityInfo form: {form_label} ({format_type.upper()})",
-            rq_kwargs={'timeout': 600}
+    # Export the form once for all the formats, unless export groups are disabled
+    export_group = toolkit.asbool(toolkit.config.get('ckanext.activityinfo.export_group', True))
+    if export_group and len(results) > 1:
+        resource_ids = [result['id'] for result, _ in results]
+        enqueue_download_job(
+            resource_ids,
+            user,
+            title=f"Download ActivityInfo form: {form_label} ({', '.join(f for _, f in results).upper()})",
         )
-
-        log.info(f"ActivityInfo: Enqueued download job for resource {result['id']} ({format_type})")
+        log.info(f"ActivityInfo: Enqueued one download job for resources {resource_ids}")
+    else:
+        for result, format_type in results:
+            enqueue_download_job(
+                [result['id']],
+                user,
+                title=f"Download ActivityInfo form: {form_label} ({format_type.upper()})",
+            )
+            log.info(f"ActivityInfo: Enqueued download job for resource {result['id']} ({format_type})")
 
     # Return the first result (standard CKAN behavior expects single resource)
     return first_result
@@ -142,6 +263,12 @@ def resource_create(original_action, context, data_dict):
 
 @toolkit.chained_action
 def resource_update(original_action, context, data_dict):
-    """Chain resource_update to validate ActivityInfo auto-update fields."""
+    """Chain resource_update to validate ActivityInfo auto-update and export fields.
+
+    resource_patch also goes through this action, so activityinfo_next_run_at
+    follows every change of the auto-update fields (and of the status, for the
+    scheduler daemon).
+    """
     _validate_auto_update_fields(data_dict)
-    return original_action(context, data_dict)
+    _validate_export_fields(data_dict)
+    return _create_or_update(original_action, context, data_dict)
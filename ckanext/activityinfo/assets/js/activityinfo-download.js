@@ -19,6 +19,11 @@ ckan.module('activityinfo-download', function($) {
             this.formIdField = this.el.querySelector('#ai-form-id-field');
             this.formatsField = this.el.querySelector('#ai-formats-field');
             this.formLabelField = this.el.querySelector('#ai-form-label-field');
+            this.columnsField = this.el.querySelector('#ai-columns-field');
+            this.columnsOptions = this.el.querySelector('#ai-columns-options');
+            this.columnsFormId = null;
+            this.bundleCheckbox = this.el.querySelector('#ai-bundle-checkbox');
+            this.bundleField = this.el.querySelector('#ai-bundle-field');
             
             this.databasesLoaded = false;
             this.csrfToken = this.getCSRFToken();
@@ -67,6 +72,12 @@ ckan.module('activityinfo-download', function($) {
                     self.onFormatChange();
                 });
             });
+
+            if (this.bundleCheckbox) {
+                this.bundleCheckbox.addEventListener('change', function() {
+                    self.onBundleChange();
+                });
+            }
         },
 
         getCSRFToken: function() {
@@ -248,7 +259,10 @@ ckan.module('activityinfo-download', function($) {
             if (this.formSelect.value) {
                 this.el.querySelector('#ai-step-format').style.display = 'block';
                 this.el.querySelector('#ai-step-auto-update').style.display = 'block';
+                var bundle = this.bundleCheckbox && this.bundleCheckbox.checked;
+                this.el.querySelector('#ai-step-columns').style.display = bundle ? 'none' : 'block';
                 this.infoDiv.style.display = 'block';
+                this.loadColumns(this.formSelect.value);
 
                 // Restore format selection if editing
                 if (this.formatsField.value) {
@@ -260,12 +274,106 @@ ckan.module('activityinfo-download', function($) {
             } else {
                 this.el.querySelector('#ai-step-format').style.display = 'none';
                 this.el.querySelector('#ai-step-auto-update').style.display = 'none';
+                this.el.querySelector('#ai-step-columns').style.display = 'none';
                 this.infoDiv.style.display = 'none';
             }
         },
 
+        loadColumns: function(formId) {
+            var self = this;
+            if (this.columnsFormId === formId) return;
+            if (this.columnsFormId !== null) {
+                // The columns of the previous form do not apply to this one
+                this.columnsField.value = '';
+            }
+            this.columnsFormId = formId;
+            this.columnsOptions.innerHTML = '';
+            this.el.querySelector('#ai-columns-loading').style.display = 'block';
+
+            fetch('/api/action/act_info_get_form_columns', {
+                method: 'POST',
+                headers: this.setupHeaders(),
+                body: JSON.stringify({ form_id: formId })
+            })
+                .then(function(r) { return r.json(); })
+                .then(function(data) {
+                    self.el.querySelector('#ai-columns-loading').style.display = 'none';
+                    if (self.columnsFormId !== formId) return;
+                    if (!data.success) {
+                        var errorMsg = data.error ? (data.error.message || data.error.__type || JSON.stringify(data.error)) : 'Failed to load columns';
+                        self.showError(errorMsg);
+                        return;
+                    }
+                    var selected = self.columnsField.value ? self.columnsField.value.split(',') : [];
+                    data.result.forEach(function(column) {
+                        var div = document.createElement('div');
+                        div.className = 'form-check';
+                        var checkbox = document.createElement('input');
+                        checkbox.type = 'checkbox';
+                        checkbox.className = 'form-check-input ai-column-checkbox';
+                        checkbox.id = 'ai-column-' + column.id;
+                        checkbox.value = column.id;
+                        checkbox.checked = selected.indexOf(column.id) !== -1;
+                        checkbox.addEventListener('change', function() {
+                            self.onColumnChange();
+                        });
+                        var label = document.createElement('label');
+                        label.className = 'form-check-label';
+                        label.htmlFor = checkbox.id;
+                        label.textContent = column.label;
+                        div.appendChild(checkbox);
+                        div.appendChild(label);
+                        self.columnsOptions.appendChild(div);
+                    });
+                })
+                .catch(function(e) {
+                    self.el.querySelector('#ai-columns-loading').style.display = 'none';
+                    self.showError('Error loading columns: ' + e.message);
+                });
+        },
+
+        onColumnChange: function() {
+            // Keep the order of the form
+            var selected = [];
+            this.columnsOptions.querySelectorAll('.ai-column-checkbox').forEach(function(checkbox) {
+                if (checkbox.checked) {
+                    selected.push(checkbox.value);
+                }
+            });
+            this.columnsField.value = selected.join(',');
+        },
+
         onFormatChange: function() {
             this.updateHiddenFields();
+        },
+
+        onBundleChange: function() {
+            // Form bundles have their own formats and export all the columns and records
+            var bundle = this.bundleCheckbox.checked;
+            this.bundleField.value = bundle ? 'true' : '';
+            var anyChecked = false;
+            this.formatCheckboxes.forEach(function(checkbox) {
+                var allowed = checkbox.dataset[bundle ? 'bundle' : 'single'] === 'true';
+                checkbox.parentElement.style.display = allowed ? '' : 'none';
+                if (!allowed) {
+                    checkbox.checked = false;
+                }
+                anyChecked = anyChecked || checkbox.checked;
+            });
+            if (!anyChecked) {
+                var defaultFormat = this.el.querySelector('#ai-format-' + (bundle ? 'zip' : 'csv'));
+                if (defaultFormat) defaultFormat.checked = true;
+            }
+            this.el.querySelector('#ai-step-columns').style.display = bundle ? 'none' : 'block';
+            if (bundle) {
+                this.columnsField.value = '';
+                this.el.querySelector('#ai-filter-field').value = '';
+                this.columnsOptions.querySelectorAll('.ai-column-checkbox').forEach(function(checkbox) {
+                    checkbox.checked = false;
+                });
+                this.el.querySelector('#ai-filter-new').value = '';
+            }
+            this.updateHiddenFields();
         }
     };
 });
@@ -1,7 +1,24 @@
 (function() {
     'use strict';
 
-    var POLL_INTERVAL = 3000;
+    // All the resources being updated in the page are followed with a single
+    // event stream. Where it is not available, they are checked with a single
+    // act_info_resource_status call, and the interval grows while nothing changes.
+    var MIN_POLL_INTERVAL = 2000;
+    var MAX_POLL_INTERVAL = 30000;
+    var POLL_BACKOFF = 1.5;
+    var MAX_RESOURCES_PER_POLL = 100;
+    var PROCESSING_STATUSES = ['pending', 'exporting', 'downloading'];
+
+    // resource ID -> {labels: [elements], last: 'status:progress'}
+    var tracked = {};
+    var pollInterval = MIN_POLL_INTERVAL;
+    var pollTimer = null;
+    var polling = false;
+    var eventSource = null;
+    // resource ID -> true, for the resources followed by the open event stream
+    var streamed = {};
+    var streamAvailable = !!window.EventSource;
 
     document.addEventListener('DOMContentLoaded', function() {
         var buttons = document.querySelectorAll('.activityinfo-update-resource-btn');
@@ -10,6 +27,16 @@
                 handleUpdateClick(btn);
             });
         });
+
+        // Resources listed while their download is running
+        var labels = document.querySelectorAll('[data-activityinfo-status-resource-id]');
+        labels.forEach(function(label) {
+            if (PROCESSING_STATUSES.indexOf(label.dataset.activityinfoStatus) !== -1) {
+                addLabel(label.dataset.activityinfoStatusResourceId, label);
+            }
+        });
+        // A single stream for all of them
+        if (Object.keys(tracked).length) watch();
     });
 
     function getCSRFToken() {
@@ -45,38 +72,148 @@
                     statusLabel.innerHTML = '<i class="fa fa-exclamation-triangle"></i> Error: ' + msg;
                     return;
                 }
-                pollResourceStatus(resourceId, statusLabel);
+                track(resourceId, statusLabel);
             })
             .catch(function(e) {
                 statusLabel.innerHTML = '<i class="fa fa-exclamation-triangle"></i> Error: ' + e.message;
             });
     }
 
-    function pollResourceStatus(resourceId, statusLabel) {
-        fetch('/api/action/resource_show?id=' + encodeURIComponent(resourceId))
+    function track(resourceId, label) {
+        addLabel(resourceId, label);
+        watch();
+    }
+
+    function addLabel(resourceId, label) {
+        if (!tracked[resourceId]) {
+            tracked[resourceId] = { labels: [], last: null };
+        }
+        tracked[resourceId].labels.push(label);
+    }
+
+    function watch() {
+        if (!streamAvailable) {
+            // Check new updates soon
+            schedulePoll(MIN_POLL_INTERVAL);
+            return;
+        }
+        // Each stream counts against the per user limit until the server notices
+        // it was closed, so it is only opened again for resources it does not follow
+        var resourceIds = Object.keys(tracked).slice(0, MAX_RESOURCES_PER_POLL);
+        var missing = resourceIds.some(function(resourceId) { return !streamed[resourceId]; });
+        if (!eventSource || missing) openStream(resourceIds);
+    }
+
+    function openStream(resourceIds) {
+        closeStream();
+        resourceIds.forEach(function(resourceId) { streamed[resourceId] = true; });
+        eventSource = new EventSource('/activity-info/events/resources?resource_ids=' + encodeURIComponent(resourceIds.join(',')));
+        eventSource.addEventListener('progress', function(event) {
+            var res = JSON.parse(event.data);
+            if (tracked[res.resource_id]) {
+                updateResource(res.resource_id, res);
+            }
+        });
+        eventSource.addEventListener('end', closeStream);
+        eventSource.addEventListener('unavailable', fallBackToPolling);
+        eventSource.addEventListener('error', function() {
+            // Unless it is closed, the browser reconnects by itself
+            if (eventSource && eventSource.readyState === EventSource.CLOSED) {
+                fallBackToPolling();
+            }
+        });
+    }
+
+    function closeStream() {
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
+        }
+        streamed = {};
+    }
+
+    function fallBackToPolling() {
+        closeStream();
+        streamAvailable = false;
+        schedulePoll(MIN_POLL_INTERVAL);
+    }
+
+    function schedulePoll(interval) {
+        pollInterval = interval;
+        if (polling) return;
+        if (pollTimer) clearTimeout(pollTimer);
+        pollTimer = setTimeout(pollStatus, pollInterval);
+    }
+
+    function pollStatus() {
+        pollTimer = null;
+        var resourceIds = Object.keys(tracked).slice(0, MAX_RESOURCES_PER_POLL);
+        if (!resourceIds.length) return;
+
+        polling = true;
+        fetch('/api/action/act_info_resource_status?resource_ids=' + encodeURIComponent(resourceIds.join(',')))
             .then(function(r) { return r.json(); })
             .then(function(data) {
                 if (!data.success) {
-                    statusLabel.innerHTML = '<i class="fa fa-exclamation-triangle"></i> Error checking status';
-                    return;
-                }
-                var res = data.result;
-                var status = res.activityinfo_status;
-                var progress = res.activityinfo_progress || 0;
-
-                if (status === 'complete') {
-                    statusLabel.innerHTML = '<span class="badge badge-success"><i class="fa fa-check"></i> Resource updated successfully</span>';
-                } else if (status === 'error') {
-                    statusLabel.innerHTML = '<i class="fa fa-exclamation-triangle"></i> Error: ' + (res.activityinfo_error || 'Unknown error');
-                } else {
-                    statusLabel.innerHTML = '<i class="fa fa-spinner fa-spin"></i> Update in progress... ' + progress + '%';
-                    setTimeout(function() {
-                        pollResourceStatus(resourceId, statusLabel);
-                    }, POLL_INTERVAL);
+                    throw new Error('Error checking status');
                 }
+                var changed = false;
+                resourceIds.forEach(function(resourceId) {
+                    if (updateResource(resourceId, data.result[resourceId])) changed = true;
+                });
+                polling = false;
+                next(changed ? MIN_POLL_INTERVAL : pollInterval * POLL_BACKOFF);
             })
-            .catch(function(e) {
-                statusLabel.innerHTML = '<i class="fa fa-exclamation-triangle"></i> Error: ' + e.message;
+            .catch(function() {
+                // Keep the labels as they are and try again later
+                polling = false;
+                next(pollInterval * POLL_BACKOFF);
             });
     }
+
+    function next(interval) {
+        if (Object.keys(tracked).length) {
+            schedulePoll(Math.min(interval, MAX_POLL_INTERVAL));
+        }
+    }
+
+    function updateResource(resourceId, res) {
+        var entry = tracked[resourceId];
+        if (!res) {
+            // Deleted, or not visible to the user anymore
+            delete tracked[resourceId];
+            return true;
+        }
+        var state = res.status + ':' + res.progress;
+        var changed = state !== entry.last;
+        entry.last = state;
+
+        // The download job is claimed until it ends, so a queued job is not finished yet
+        var finished = !res.job_id && PROCESSING_STATUSES.indexOf(res.status) === -1;
+        entry.labels.forEach(function(label) {
+            label.innerHTML = renderStatus(res, finished);
+        });
+        if (finished) {
+            delete tracked[resourceId];
+            if (!Object.keys(tracked).length) closeStream();
+        }
+        return changed;
+    }
+
+    function renderStatus(res, finished) {
+        if (finished && res.status === 'complete') {
+            return '<span class="badge badge-success"><i class="fa fa-check"></i> Resource updated successfully</span>';
+        }
+        if (finished && res.status === 'error') {
+            return '<i class="fa fa-exclamation-triangle"></i> Error: ' + escapeHtml(res.error || 'Unknown error');
+        }
+        var progress = PROCESSING_STATUSES.indexOf(res.status) !== -1 ? ' ' + (res.progress || 0) + '%' : '';
+        return '<i class="fa fa-spinner fa-spin"></i> Update in progress...' + progress;
+    }
+
+    function escapeHtml(text) {
+        var div = document.createElement('div');
+        div.textContent = text;
+        return div.innerHTML;
+    }
 })();
@@ -21,6 +21,7 @@
         const formLabel = btn.dataset.formLabel;
         const downloadUrlTemplate = btn.dataset.downloadUrlTemplate;
         const jobStatusUrlTemplate = btn.dataset.jobStatusUrl;
+        const jobEventsUrlTemplate = btn.dataset.jobEventsUrl;
 
         // Get selected format from sibling select element within the btn-group
         const btnGroup = btn.closest('.btn-group');
@@ -44,7 +45,12 @@
             .then(function(data) {
                 if (data.success && data.job_id) {
                     const jobStatusUrl = jobStatusUrlTemplate.replace('__JOB_ID__', data.job_id);
-                    pollJobStatus(btn, data.job_id, jobStatusUrl, formLabel);
+                    if (window.EventSource && jobEventsUrlTemplate) {
+                        const jobEventsUrl = jobEventsUrlTemplate.replace('__JOB_ID__', data.job_id);
+                        watchJobEvents(btn, data.job_id, jobEventsUrl, jobStatusUrl, formLabel);
+                    } else {
+                        pollJobStatus(btn, data.job_id, jobStatusUrl, formLabel);
+                    }
                 } else {
                     throw new Error(data.error || 'Failed to start download job');
                 }
@@ -56,6 +62,28 @@
             });
     }
 
+    // Get the status changes pushed by the server, without polling
+    function watchJobEvents(btn, jobId, jobEventsUrl, jobStatusUrl, formLabel) {
+        const source = new EventSource(jobEventsUrl);
+        source.addEventListener('status', function(event) {
+            if (showJobStatus(btn, JSON.parse(event.data), formLabel)) {
+                source.close();
+            }
+        });
+        source.addEventListener('job_error', function(event) {
+            source.close();
+            setButtonLoading(btn, false);
+            showAlert('Error checking download status: ' + JSON.parse(event.data).error, 'danger');
+        });
+        source.addEventListener('error', function() {
+            if (source.readyState === EventSource.CLOSED) {
+                // The stream is not available, poll instead
+                pollJobStatus(btn, jobId, jobStatusUrl, formLabel);
+            }
+            // Otherwise the browser reconnects by itself
+        });
+    }
+
     function pollJobStatus(btn, jobId, jobStatusUrl, formLabel) {
         fetch(jobStatusUrl)
             .then(function(response) {
@@ -65,27 +93,7 @@
                 return response.json();
             })
             .then(function(data) {
-                const jobStatus = data.result || data;
-                const state = jobStatus.state;
-                const percentComplete = jobStatus.percentComplete || 0;
-
-                if (state === 'completed') {
-                    setButtonLoading(btn, false);
-                    // Use the full download URL from the response
-                    const downloadUrl = data.download_url;
-                    if (downloadUrl) {
-                        // Open in new tab to trigger download from ActivityInfo
-                        window.open(downloadUrl, '_blank');
-                        showAlert('Download ready for "' + formLabel + '"', 'success');
-                    } else {
-                        showAlert('Download completed but no download URL provided', 'warning');
-                    }
-                } else if (state === 'failed') {
-                    setButtonLoading(btn, false);
-                    showAlert('Download failed for "' + formLabel + '"', 'danger');
-                } else {
-                    // Still in progress
-                    setButtonLoading(btn, true, percentComplete + '%');
+                if (!showJobStatus(btn, data, formLabel)) {
                     setTimeout(function() {
                         pollJobStatus(btn, jobId, jobStatusUrl, formLabel);
                     }, POLL_INTERVAL);
@@ -98,6 +106,35 @@
             });
     }
 
+    // Show the job status, return true if the job ended
+    function showJobStatus(btn, data, formLabel) {
+        const jobStatus = data.result || data;
+        const state = jobStatus.state;
+        const percentComplete = jobStatus.percentComplete || 0;
+
+        if (state === 'completed') {
+            setButtonLoading(btn, false);
+            // Use the full download URL from the response
+            const downloadUrl = data.download_url;
+            if (downloadUrl) {
+                // Open in new tab to trigger download from ActivityInfo
+                window.open(downloadUrl, '_blank');
+                showAlert('Download ready for "' + formLabel + '"', 'success');
+            } else {
+                showAlert('Download completed but no download URL provided', 'warning');
+            }
+            return true;
+        }
+        if (state === 'failed') {
+            setButtonLoading(btn, false);
+            showAlert('Download failed for "' + formLabel + '"', 'danger');
+            return true;
+        }
+        // Still in progress
+        setButtonLoading(btn, true, percentComplete + '%');
+        return false;
+    }
+
     function setButtonLoading(btn, isLoading, progressText) {
         const textSpan = btn.querySelector('.download-text');
         const spinnerSpan = btn.querySelector('.download-spinner');
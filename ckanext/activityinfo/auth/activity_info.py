@@ -41,6 +41,12 @@ def act_info_get_form(context, data_dict):
     return {'success': True}
 
 
+@toolkit.auth_disallow_anonymous_access
+@require_activity_info_token_decorator
+def act_info_get_form_columns(context, data_dict):
+    return {'success': True}
+
+
 @toolkit.auth_disallow_anonymous_access
 @require_activity_info_token_decorator
 def act_start_download_job(context, data_dict):
@@ -57,3 +63,9 @@ def act_info_get_job_status(context, data_dict):
 @require_activity_info_token_decorator
 def act_info_update_resource_file(context, data_dict):
     return {'success': True}
+
+
+@toolkit.auth_allow_anonymous_access
+def act_info_resource_status(context, data_dict):
+    # The action only returns the resources the user can see
+    return {'success': True}
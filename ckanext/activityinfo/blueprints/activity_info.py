@@ -1,12 +1,19 @@
 import logging
-from flask import Blueprint
+from flask import Blueprint, Response, stream_with_context
 from ckan.common import current_user
 from ckan.plugins import toolkit
-from ckan.views.api import _finish_ok
+from ckan.views.api import _finish, _finish_ok
 from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.data.job_status import ExportJobStatus
+from ckanext.activityinfo.events import ResourceProgressStream, StreamLimit, export_job_events, format_event
 from ckanext.activityinfo.exceptions import ActivityInfoConnectionError
 from ckanext.activityinfo.helpers import get_activityinfo_enable_flag
-from ckanext.activityinfo.utils import get_activity_info_user_plugin_extras, get_ckan_resources, get_user_token
+from ckanext.activityinfo.utils import (
+    get_activity_info_user_plugin_extras,
+    get_ckan_resources_by_form,
+    get_user_token,
+    invalidate_user_token,
+)
 
 
 log = logging.getLogger(__name__)
@@ -47,7 +54,7 @@ def databases():
     try:
         ai_databases = toolkit.get_action('act_info_get_databases')(
             context={'user': toolkit.c.user},
-            data_dict={}
+            data_dict={'refresh': toolkit.request.args.get('refresh', False)}
         )
     except ActivityInfoConnectionError as e:
         message = f"Could not retrieve ActivityInfo databases: {e}"
@@ -72,7 +79,10 @@ def forms(database_id):
     try:
         data = toolkit.get_action('act_info_get_forms')(
             context={'user': toolkit.c.user},
-            data_dict={'database_id': database_id}
+            data_dict={
+                'database_id': database_id,
+                'refresh': toolkit.request.args.get('refresh', False),
+            }
         )
     except (ActivityInfoConnectionError, toolkit.ValidationError) as e:
         message = f"Could not retrieve ActivityInfo forms: {e}"
@@ -82,16 +92,13 @@ def forms(database_id):
 
     log.info(f"Retrieved {data}")
 
-    # Add urls and related CKAN resources to each form
+    # Add urls and related CKAN resources to each form and sub_form
     aic = ActivityInfoClient()
-    for form in data['forms']:
+    all_forms = data['forms'] + data.get('sub_forms', [])
+    resources_by_form = get_ckan_resources_by_form([form['id'] for form in all_forms])
+    for form in all_forms:
         form['url'] = aic.get_url_to_form(form['id'])
-        form['resources'] = get_ckan_resources(form['id'])
-
-    # Add urls to each sub_form
-    for sub_form in data.get('sub_forms', []):
-        sub_form['url'] = aic.get_url_to_form(sub_form['id'])
-        sub_form['resources'] = get_ckan_resources(sub_form['id'])
+        form['resources'] = resources_by_form[form['id']]
 
     extra_vars = {
         'forms': data['forms'],
@@ -109,7 +116,8 @@ def form(database_id, form_id):
             context={'user': toolkit.c.user},
             data_dict={
                 'database_id': database_id,
-                'form_id': form_id
+                'form_id': form_id,
+                'refresh': toolkit.request.args.get('refresh', False),
             }
         )
     except (ActivityInfoConnectionError, toolkit.ValidationError) as e:
@@ -153,6 +161,7 @@ def update_api_key():
             'plugin_extras': plugin_extras
         }
     )
+    invalidate_user_token(current_user.name, current_user.id)
     toolkit.h.flash_success('ActivityInfo API key updated successfully.')
     return toolkit.redirect_to('activity_info.databases')
 
@@ -176,6 +185,7 @@ def remove_api_key():
             'plugin_extras': plugin_extras
         }
     )
+    invalidate_user_token(current_user.name, current_user.id)
     toolkit.h.flash_success('ActivityInfo API key removed successfully.')
     return toolkit.redirect_to('activity_info.api_key')
 
@@ -207,19 +217,84 @@ def download_form_data(form_id, format='csv'):
 
 @activityinfo_bp.route('/job-status/<job_id>')
 def job_status(job_id):
-    """ Get the status of an ActivityInfo export job. """
+    """ Get the status of an ActivityInfo export job.
+        The status is shared with the other watchers of the job (see data.job_status).
+    """
+    toolkit.check_access('act_info_get_job_status', {'user': toolkit.c.user}, {'job_id': job_id})
     try:
-        job_status = toolkit.get_action('act_info_get_job_status')(
-            context={'user': toolkit.c.user},
-            data_dict={'job_id': job_id}
-        )
+        job_status, _ = _get_export_job_status(job_id).get(lambda: _fetch_job_status(job_id))
     except ActivityInfoConnectionError as e:
         error = f"Error getting job status for job {job_id} and user {toolkit.c.user}: {e}"
         log.error(error)
         return _finish_ok({'success': False, 'error': str(e)})
 
     log.info(f"Job status for {job_id}: {job_status}")
+    return _finish_ok(_job_status_result(job_status))
+
+
+@activityinfo_bp.route('/events/job/<job_id>')
+def job_events(job_id):
+    """ Stream the status of an ActivityInfo export job (Server-Sent Events).
+        A "status" event, with the same data as job_status, is sent on each change.
+    """
+    toolkit.check_access('act_info_get_job_status', {'user': toolkit.c.user}, {'job_id': job_id})
+    limit = StreamLimit(toolkit.c.user)
+    if not limit.acquire():
+        # The page polls job_status instead
+        return _too_many_streams()
+    job = _get_export_job_status(job_id)
+
+    def events():
+        try:
+            yield from export_job_events(job, lambda: _fetch_job_status(job_id), _job_status_result)
+        except ActivityInfoConnectionError as e:
+            log.error(f"Error streaming job status for job {job_id}: {e}")
+            yield format_event('job_error', {'success': False, 'error': str(e)})
+
+    return _event_stream(limit.wrap(events()))
+
+
+@activityinfo_bp.route('/events/resources')
+def resource_events():
+    """ Stream the download progress of resources (Server-Sent Events).
+        resource_ids is a comma separated list of resource IDs. The current status of each
+        resource (see act_info_resource_status) is sent first, then a "progress" event for
+        each update, and an "end" event when all the downloads are finished.
+        Anonymous users, and users with too many streams open, only get the current status
+        and an "unavailable" event: the page polls act_info_resource_status instead.
+    """
+    resource_ids = toolkit.request.args.get('resource_ids', '')
+    limit = StreamLimit(toolkit.c.user)
+    live = bool(toolkit.c.user) and limit.acquire()
+    stream = ResourceProgressStream(
+        list(dict.fromkeys(resource_id.strip() for resource_id in resource_ids.split(',') if resource_id.strip())),
+        live=live,
+    )
+    try:
+        statuses = toolkit.get_action('act_info_resource_status')(
+            context={'user': toolkit.c.user},
+            data_dict={'resource_ids': resource_ids},
+        )
+    except toolkit.ValidationError as e:
+        stream.close()
+        limit.release()
+        return _finish(400, {'success': False, 'error': e.error_dict}, content_type='json')
+    return _event_stream(limit.wrap(stream.events(statuses)))
+
+
+def _get_export_job_status(job_id):
+    # Export jobs belong to an API key, the watchers using the same key share the status
+    return ExportJobStatus(job_id, get_user_token(toolkit.c.user))
+
+
+def _fetch_job_status(job_id):
+    return toolkit.get_action('act_info_get_job_status')(
+        context={'user': toolkit.c.user},
+        data_dict={'job_id': job_id}
+    )
+
 
+def _job_status_result(job_status):
     # Build full download URL if job is completed
     full_download_url = None
     if job_status.get('state') == 'completed':
@@ -229,9 +304,21 @@ def job_status(job_id):
             aic = ActivityInfoClient()
             full_download_url = f"{aic.base_url}/{relative_url.lstrip('/')}"
 
-    ret = {
+    return {
         'success': True,
         'result': job_status,
         'download_url': full_download_url,
     }
-    return _finish_ok(ret)
+
+
+def _too_many_streams():
+    return _finish(429, {'success': False, 'error': 'Too many open event streams'}, content_type='json')
+
+
+def _event_stream(events):
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        # Do not let proxies buffer the events
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
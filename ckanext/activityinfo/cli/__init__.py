@@ -3,6 +3,7 @@ from ckanext.activityinfo.cli import (
     databases as cli_databases,
     forms as cli_forms,
     resources as cli_resources,
+    scheduler as cli_scheduler,
 )
 
 
@@ -26,12 +27,24 @@ def resources_group():
     pass
 
 
+@activityinfo.group(name='scheduler', short_help='ActivityInfo automatic updates scheduler')
+def scheduler_group():
+    pass
+
+
 # ckan activityinfo databases list -t xxxxxx
 databases_group.add_command(cli_databases.get_activityinfo_databases_list)
 
 # ckan activityinfo forms list -t xxxxx -d yyyyy [-s]
 forms_group.add_command(cli_forms.get_activityinfo_forms_list)
 
+# ckan activityinfo forms column-plans [-f form_id] [-v]
+# Export columns saved by form schema version
+forms_group.add_command(cli_forms.list_column_plans)
+
+# ckan activityinfo forms purge-column-plans [-f form_id]
+forms_group.add_command(cli_forms.purge_column_plans)
+
 # ckan activityinfo resources update-activity-info-resource -r xxxxx -u username
 # The user should have permissions to access the ActivityInfo API (API key) and the resource to update
 resources_group.add_command(cli_resources.update_activityinfo_resource)
@@ -39,3 +52,7 @@ resources_group.add_command(cli_resources.update_activityinfo_resource)
 # ckan activityinfo resources sync-auto-updates [--dry-run] [-v]
 # Find and update all resources due for automatic update (meant for cron)
 resources_group.add_command(cli_resources.sync_auto_updates)
+
+# ckan activityinfo scheduler run [--jitter N] [-v]
+# Long-running alternative to sync-auto-updates: run each update when it is due
+scheduler_group.add_command(cli_scheduler.run_scheduler)
@@ -42,4 +42,9 @@ def get_activityinfo_databases_list(activityinfo_token, verbose):
             click.secho(f"  ownerId: {database.get('ownerId', 'N/A')}")
 
     click.secho(f'Total ActivityInfo databases: {total}')
+    if verbose:
+        click.secho(
+            f"API retries: {aic.retry_stats['retries']} "
+            f"({aic.retry_stats['retry_wait']:.1f}s waiting)"
+        )
     logger.removeHandler(handler)
@@ -1,8 +1,10 @@
 import logging
+import time
 import click
 from requests.exceptions import HTTPError
 from ckanext.activityinfo.cli.logs import setup_cli_logging
 from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.data.column_plans import ColumnPlanCache
 from ckanext.activityinfo.exceptions import ActivityInfoConnectionError
 
 
@@ -54,4 +56,45 @@ def get_activityinfo_forms_list(activityinfo_token, database_id, include_sub_for
     total_sub_forms = len(forms.get('sub_forms', []))
 
     click.secho(f'Total ActivityInfo forms: {total_forms}, sub-forms: {total_sub_forms}')
+    if verbose:
+        click.secho(
+            f"API retries: {aic.retry_stats['retries']} "
+            f"({aic.retry_stats['retry_wait']:.1f}s waiting)"
+        )
     logger.removeHandler(handler)
+
+
+@click.command(
+    'column-plans',
+    short_help='List the saved export column plans'
+)
+@click.option('-f', '--form-id', default=None, help='Only the plans of this form')
+@click.option('-v', '--verbose', count=True)
+def list_column_plans(form_id, verbose):
+    """ List the export columns saved by form schema version. """
+
+    now = time.time()
+    plans = ColumnPlanCache().list(form_id)
+    for plan in sorted(plans, key=lambda p: (p.form_id, p.token_hash or '')):
+        age = int(now - plan.checked_at)
+        click.secho(
+            f"form {plan.form_id}: version {plan.schema_version}, {len(plan.columns)} columns, "
+            f"checked {age}s ago (token {(plan.token_hash or '')[:8]})"
+        )
+        if verbose:
+            for column in plan.columns:
+                click.secho(f"  {column['id']}: {column['label']}")
+
+    click.secho(f'Total column plans: {len(plans)}')
+
+
+@click.command(
+    'purge-column-plans',
+    short_help='Delete the saved export column plans'
+)
+@click.option('-f', '--form-id', default=None, help='Only the plans of this form')
+def purge_column_plans(form_id):
+    """ Delete the saved export column plans, they are built again on the next export. """
+
+    deleted = ColumnPlanCache().purge(form_id)
+    click.secho(f'Deleted column plans: {deleted}')
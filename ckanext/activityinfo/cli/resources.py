@@ -35,20 +35,39 @@ def update_activityinfo_resource(resource_id, user_name, verbose):
     '--dry-run', is_flag=True, default=False,
     help='Show what would be updated without actually running updates'
 )
-def sync_auto_updates(verbose, dry_run):
+@click.option(
+    '-w', '--workers', type=int, default=None,
+    help='Threads used to enqueue the jobs (default: ckanext.activityinfo.sync.workers)'
+)
+@click.option(
+    '--bulk/--no-bulk', default=None,
+    help='Enqueue the jobs and save the run counters in batches (default: ckanext.activityinfo.sync.bulk)'
+)
+def sync_auto_updates(verbose, dry_run, workers, bulk):
     """Find and update all ActivityInfo resources due for automatic update.
 
     This command is meant to be run from cron. It checks all resources with
-    activityinfo_auto_update set to 'daily' or 'weekly', verifies timing
-    and run limits, and triggers downloads for those that are due.
+    automatic updates (hourly, daily, weekly, intervals or cron expressions),
+    verifies timing and run limits, and triggers downloads for those that are due.
 
     Each resource is updated using the CKAN user who originally created it
     (stored in the activityinfo_user field).
     """
     handler, logger = setup_cli_logging(verbose)
-    summary = run_sync_auto_updates(dry_run=dry_run)
+    summary = run_sync_auto_updates(dry_run=dry_run, workers=workers, bulk=bulk)
     click.echo(
         f"\nSync complete: {summary['enqueued']} enqueued, "
         f"{summary['failed']} failed, {summary['skipped']} skipped."
     )
+    timing = summary['timing']
+    click.echo(
+        f"Took {timing['elapsed']:.2f}s ({timing['per_resource']:.3f}s per resource, "
+        f"{timing['mode']} mode, {timing['workers']} worker(s))."
+    )
+    site_uploads = summary['site_uploads']
+    if site_uploads:
+        click.echo(
+            f"Downloads on the site since the last sync: {site_uploads['uploaded']} uploaded, "
+            f"{site_uploads['unchanged']} unchanged (skip rate {site_uploads['skip_rate']:.0%})."
+        )
     logger.removeHandler(handler)
@@ -0,0 +1,38 @@
+import signal
+import click
+from ckanext.activityinfo.cli.logs import setup_cli_logging
+from ckanext.activityinfo.jobs.scheduler import Scheduler
+
+
+@click.command(
+    'run',
+    short_help='Run the ActivityInfo automatic updates when they are due'
+)
+@click.option('-v', '--verbose', count=True)
+@click.option(
+    '--jitter', type=int, default=None,
+    help='Max seconds added to the run time of each resource (default: ckanext.activityinfo.scheduler.jitter)'
+)
+def run_scheduler(verbose, jitter):
+    """Run the ActivityInfo automatic updates when they are due, until stopped.
+
+    An alternative to running sync-auto-updates from cron. The schedule is
+    read once from the database and followed as the resources change.
+    It is safe to run this command on several nodes: only one of them
+    (the leader) runs the updates.
+
+    Stop it with Ctrl+C or SIGTERM, the resource being updated is finished first.
+    """
+    handler, logger = setup_cli_logging(verbose)
+    scheduler = Scheduler(jitter=jitter)
+    signal.signal(signal.SIGTERM, lambda signum, frame: scheduler.stop())
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        pass
+    stats = scheduler.stats
+    click.echo(
+        f"\nScheduler stopped: {stats['enqueued']} enqueued, "
+        f"{stats['failed']} failed, {stats['skipped']} skipped."
+    )
+    logger.removeHandler(handler)
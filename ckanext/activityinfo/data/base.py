@@ -1,18 +1,142 @@
+import json
 import logging
+import time
+from contextlib import nullcontext
 from pathlib import Path
-import requests
+from requests.exceptions import ConnectionError, Timeout
+from ckan.plugins import toolkit
+from ckanext.activityinfo.data.column_plans import ColumnPlan, ColumnPlanCache
+from ckanext.activityinfo.data.cache import (
+    CacheEntry,
+    get_cache_ttl,
+    get_response_cache,
+    make_cache_key,
+    record_cache_stats,
+)
+from ckanext.activityinfo.data.rate_limit import get_export_slots, get_rate_limiter
+from ckanext.activityinfo.data.redis_store import hash_token
+from ckanext.activityinfo.data.retry import RETRY_STATUSES, RetryPolicy, record_stats
+from ckanext.activityinfo.data.session import get_session
+from ckanext.activityinfo.exceptions import ActivityInfoFileTooLargeError
 
 
 log = logging.getLogger(__name__)
 
 
+# Formats of the ActivityInfo export jobs
+EXPORT_FORMATS = ["CSV", "XLSX", "TEXT"]
+
+# Element types of the sub-forms of a form (not exported as columns, see get_form_bundle)
+SUB_FORM_TYPES = ('SUB_FORM', 'subform')
+
+# The ID of the records, added to each table of a form bundle to join the sub-form
+# records to their parent, and to the incremental exports to merge them (see jobs.incremental)
+RECORD_ID_COLUMN = {'id': '_id', 'label': 'Record ID', 'formula': '_id', 'translate': False}
+# The ID of the parent record of a sub-form record
+PARENT_ID_COLUMN = {'id': '_parent', 'label': 'Parent record ID', 'formula': '@parent', 'translate': False}
+
+
+def find_sub_forms(schema):
+    """Get the IDs of the sub-forms of a form schema, in the order of its elements."""
+    sub_form_ids = []
+    for element in schema.get('elements', []):
+        if element.get('type', '') in SUB_FORM_TYPES:
+            sub_form_id = (element.get('typeParameters') or {}).get('formId')
+            if sub_form_id and sub_form_id not in sub_form_ids:
+                sub_form_ids.append(sub_form_id)
+    return sub_form_ids
+
+
+def build_export_columns(schema):
+    """
+    Build the export columns of a form schema.
+    Sub-forms and sections are skipped. For reference fields, uses dot notation
+    (e.g. FIELD_ID.NAME) to export the human-readable label instead of the raw
+    record ID.
+    """
+    elements = schema.get('elements', [])
+
+    columns = []
+    for element in elements:
+        # Skip sub-forms and other non-field elements
+        element_type = element.get('type', '')
+        if element_type in SUB_FORM_TYPES or element_type == 'section':
+            continue
+
+        field_id = element.get('id')
+        label = element.get('label', field_id)
+
+        if element_type == 'multiselectreference':
+            # The API do not allow get names like single references.
+            columns.append({
+                'id': field_id,
+                'label': f"{label} [MultiReference ID]",
+                'formula': field_id,
+                'translate': False
+            })
+        elif element_type == 'reference':
+            # Raw reference ID column
+            columns.append({
+                'id': field_id,
+                'label': f"{label} [Reference ID]",
+                'formula': field_id,
+                'translate': False
+            })
+            # Human-readable name column
+            columns.append({
+                'id': f"{field_id}_name",
+                'label': label,
+                'formula': f"{field_id}.NAME",
+                'translate': False
+            })
+        else:
+            columns.append({
+                'id': field_id,
+                'label': label,
+                'formula': field_id,
+                'translate': False
+            })
+    return columns
+
+
+def _column_values(column, rows, column_id=None):
+    """Expand a column of a query chunk to a list of rows values.
+
+    Missing values of a short 'array' column are None.
+    """
+    if not column or column.get('storage') == 'empty':
+        return [None] * rows
+    if column.get('storage') == 'constant':
+        return [column.get('value')] * rows
+    values = column.get('values', [])
+    if len(values) < rows:
+        log.warning(f"Column {column_id} of the query chunk has {len(values)} values for {rows} rows")
+        values = values + [None] * (rows - len(values))
+    return values
+
+
 class ActivityInfoClient:
     """Base class for ActivityInfo API client."""
 
-    def __init__(self, base_url="https://www.activityinfo.org", api_key=None, debug=False):
+    def __init__(self, base_url="https://www.activityinfo.org", api_key=None, debug=False, session=None,
+                 retry_policy=None):
         self.base_url = base_url
         self.api_key = api_key
         self.debug = debug
+        # Pooled keep-alive session, shared by all the clients using the same base_url
+        self.session = session or get_session(self.base_url)
+        self.retry_policy = retry_policy or RetryPolicy.from_config()
+        # Retry counters for this client, see also data.retry.get_retry_stats
+        self.retry_stats = {'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0}
+        # Limits shared by all the workers using the same API key (None when disabled)
+        self.rate_limiter = get_rate_limiter(api_key)
+        self.export_slots = get_export_slots(api_key)
+        self.rate_limit_wait = 0.0
+        # Cache for databases, database trees and form schemas, see data.cache
+        self.response_cache = get_response_cache()
+        self.cache_stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'bypassed': 0}
+        # Export columns by form schema version, see data.column_plans
+        self.column_plans = ColumnPlanCache()
         self.responses_debug_dir = None
         if self.debug:
             here = Path(__file__).parent
@@ -29,12 +153,121 @@ class ActivityInfoClient:
         auth_headers = {"Authorization": f"Bearer {self.api_key}"}
         return auth_headers
 
-    def get(self, endpoint, params=None):
-        """Make a GET request to the ActivityInfo API."""
+    def _request(self, method, url, idempotent=None, **kwargs):
+        """Send a request to the ActivityInfo API through the pooled session.
+
+        Failed attempts (connection errors, 429 and 5xx responses) are retried
+        following self.retry_policy. Non idempotent requests (e.g. POST) are only
+        retried on 429 unless the caller flags them as idempotent.
+        The last response is returned as is, callers must check its status.
+        """
+        attempt = 1
+        self._count(requests=1)
+        while True:
+            if self.rate_limiter:
+                self.rate_limit_wait += self.rate_limiter.acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                if not self.retry_policy.is_retryable(attempt, method, idempotent):
+                    self._count(gave_up=1)
+                    raise
+                delay = self.retry_policy.get_delay(attempt)
+                reason = str(e)
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                if not self.retry_policy.is_retryable(attempt, method, idempotent, response.status_code):
+                    self._count(gave_up=1)
+                    return response
+                delay = self.retry_policy.get_delay(attempt, response)
+                reason = f"HTTP {response.status_code}"
+                response.close()
+
+            log.warning(
+                f"ActivityInfoClient {method} {url} failed ({reason}), "
+                f"retrying in {delay:.1f}s (attempt {attempt + 1}/{self.retry_policy.max_attempts})"
+            )
+            self._count(retries=1, retry_wait=delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _count(self, **counters):
+        for key, value in counters.items():
+            self.retry_stats[key] += value
+        record_stats(**counters)
+
+    def export_slot(self):
+        """Context manager holding one of the export job slots of this API key.
+
+        Does nothing when max_concurrent_exports is not configured.
+        """
+        if self.export_slots is None:
+            return nullcontext()
+        return self.export_slots.slot()
+
+    def renew_export_slot(self):
+        """Extend the lease of the export slot held, for exports running longer than export_slot_ttl."""
+        if self.export_slots is not None:
+            self.export_slots.renew()
+
+    def get(self, endpoint, params=None, cache=None, refresh=False):
+        """Make a GET request to the ActivityInfo API.
+
+        Args:
+            endpoint (str): The API endpoint, relative to base_url.
+            params (dict): Query string parameters.
+            cache (str): Kind of endpoint (see data.cache.DEFAULT_TTLS) to cache the
+                response for. None (or a TTL of 0) disables the cache.
+            refresh (bool): Ignore the cached response and cache a new one.
+        """
+        data, _ = self._get(endpoint, params=params, cache=cache, refresh=refresh)
+        return data
+
+    def _get(self, endpoint, params=None, cache=None, refresh=False, etag=None):
+        """Make a GET request to the ActivityInfo API, see get.
+
+        Args:
+            etag (str): The ETag of a response the caller already has.
+        Returns:
+            A tuple (data, ETag of the response). data is None if the response
+            still matches etag.
+        """
         log.info(f"ActivityInfoClient Making GET request to {endpoint}")
         headers = self.get_user_auth_headers()
         url = f"{self.base_url}/{endpoint}"
-        response = requests.get(url, headers=headers, params=params)
+
+        ttl = get_cache_ttl(cache) if cache else 0
+        cache_key = entry = None
+        if ttl > 0:
+            cache_key = make_cache_key(hash_token(self.api_key), url, params)
+            if refresh:
+                self._count_cache(bypassed=1)
+            else:
+                entry = self.response_cache.get(cache_key)
+            if entry and entry.fresh:
+                log.debug(f"ActivityInfoClient cache hit for {endpoint}")
+                self._count_cache(hits=1)
+                if etag and entry.etag == etag:
+                    return None, etag
+                return entry.data(), entry.etag
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        elif etag:
+            headers['If-None-Match'] = etag
+
+        response = self._request('GET', url, headers=headers, params=params)
+        if response.status_code == 304 and 'If-None-Match' in headers:
+            if not (entry and entry.etag):
+                return None, etag
+            log.debug(f"ActivityInfoClient cached response for {endpoint} revalidated")
+            self._count_cache(revalidated=1)
+            entry.expires_at = time.time() + ttl
+            self.response_cache.set(cache_key, entry)
+            if etag and entry.etag == etag:
+                return None, etag
+            return entry.data(), entry.etag
+
         response.raise_for_status()
         log.info(f"ActivityInfoClient GET request to {endpoint} completed")
         if self.debug:
@@ -45,35 +278,49 @@ class ActivityInfoClient:
                     f.write(response.text)
             except Exception as e:
                 log.debug(f"Failed to write debug response for {endpoint}: {e}")
-        return response.json()
-
-    def get_databases(self):
+        data = response.json()
+        response_etag = response.headers.get('ETag')
+        if cache_key:
+            self._count_cache(misses=1)
+            entry = CacheEntry(json.dumps(data), response_etag, time.time() + ttl)
+            self.response_cache.set(cache_key, entry)
+        return data, response_etag
+
+    def _count_cache(self, **counters):
+        for key, value in counters.items():
+            self.cache_stats[key] += value
+        record_cache_stats(**counters)
+
+    def get_databases(self, refresh=False):
         """ Fetch the list of databases for the authenticated user.
         Docs: https://www.activityinfo.org/support/docs/api/reference/getDatabases.html
+        Args:
+            refresh (bool): Ignore the cached list.
         Returns:
             A list of databases.
         Reponse sample: see ckanext/activityinfo/data/samples/databases.json
         """
-        return self.get("resources/databases")
+        return self.get("resources/databases", cache="databases", refresh=refresh)
 
-    def get_database(self, database_id):
+    def get_database(self, database_id, refresh=False):
         """ Fetch the details of a specific database.
         Docs: https://www.activityinfo.org/support/docs/api/reference/getDatabaseTree.html
         Args:
             database_id (str): The ID of the database to fetch.
+            refresh (bool): Ignore the cached database tree.
         Returns:
             A dictionary containing the details of the database.
             This include resources by types: DATABASE, FOLDER, REPORT, FORM and SUB_FORM
         Response sample: see ckanext/activityinfo/data/samples/database.json
         """
-        return self.get(f"resources/databases/{database_id}")
+        return self.get(f"resources/databases/{database_id}", cache="database", refresh=refresh)
 
-    def get_forms(self, database_id, include_db_data=True, include_sub_forms=True):
+    def get_forms(self, database_id, include_db_data=True, include_sub_forms=True, refresh=False):
         """ Fetch the list of forms for a specific database.
         There is not direct API endpoint
         We get the database nad the resources -> list -> filter type=FORM
         """
-        database = self.get_database(database_id)
+        database = self.get_database(database_id, refresh=refresh)
         forms = [
             resource for resource in database["resources"]
             if resource["type"] == "FORM"
@@ -90,19 +337,20 @@ class ActivityInfoClient:
             data["database"] = database
         return data
 
-    def get_form(self, database_id, form_id):
+    def get_form(self, database_id, form_id, refresh=False):
         """ Fetch the details of a specific form.
         Args:
             database_id (str): The ID of the database to fetch forms for.
             form_id (str): The ID of the form to fetch.
+            refresh (bool): Ignore the cached form schema.
         Returns:
             A dictionary containing the details of the form.
         See a data sample here ckanext/activityinfo/data/samples/form-tree-translated.json
 
         We here get the data schema, the actual data must be acceced in chunks from
-        POST /resources/query/chunks
+        POST /resources/query/chunks (see iter_form_records)
         """
-        return self.get(f"resources/form/{form_id}/tree/translated")
+        return self.get(f"resources/form/{form_id}/tree/translated", cache="form", refresh=refresh)
 
     def get_reference_field_records(self, form_id, element):
         """
@@ -135,67 +383,103 @@ class ActivityInfoClient:
             'records': records
         }
 
-    def get_form_columns(self, form_id):
+    def get_form_columns(self, form_id, column_ids=None, refresh=False):
         """
         Get the columns for a form to use in export requests.
-        Fetches the form schema and builds the columns array from the elements.
-        For reference fields, uses dot notation (e.g. FIELD_ID.NAME) to export
-        the human-readable label instead of the raw record ID.
+        Fetches the form schema and builds the columns array from the elements
+        (see build_export_columns). The columns are saved by schema version and
+        reused while the schema does not change, see data.column_plans.
 
         Args:
             form_id (str): The ID of the form.
+            column_ids (list): Only get these columns, in this order. The IDs are
+                the ones of the full list (e.g. FIELD_ID_name for a reference name).
+            refresh (bool): Ignore the saved columns and build them again.
         Returns:
             A list of column definitions for the export API.
+        Raises:
+            ValueError: if some column_ids are not columns of the form.
         """
-        form_tree = self.get_form(database_id=None, form_id=form_id)
-        forms_data = form_tree.get('forms', {})
-        form_data = forms_data.get(form_id, {})
-        schema = form_data.get('schema', {})
-        elements = schema.get('elements', [])
-
-        columns = []
-        for element in elements:
-            # Skip sub-forms and other non-field elements
-            element_type = element.get('type', '')
-            if element_type in ('SUB_FORM', 'section'):
-                continue
+        columns = self._get_column_plan(form_id, refresh=refresh).columns
 
-            field_id = element.get('id')
-            label = element.get('label', field_id)
-
-            if element_type == 'multiselectreference':
-                # The API do not allow get names like single references.
-                columns.append({
-                    'id': field_id,
-                    'label': f"{label} [MultiReference ID]",
-                    'formula': field_id,
-                    'translate': False
-                })
-            elif element_type == 'reference':
-                # Raw reference ID column
-                columns.append({
-                    'id': field_id,
-                    'label': f"{label} [Reference ID]",
-                    'formula': field_id,
-                    'translate': False
-                })
-                # Human-readable name column
-                columns.append({
-                    'id': f"{field_id}_name",
-                    'label': label,
-                    'formula': f"{field_id}.NAME",
-                    'translate': False
-                })
-            else:
-                columns.append({
-                    'id': field_id,
-                    'label': label,
-                    'formula': field_id,
-                    'translate': False
-                })
+        if column_ids:
+            columns_by_id = {column['id']: column for column in columns}
+            unknown = [column_id for column_id in column_ids if column_id not in columns_by_id]
+            if unknown:
+                raise ValueError(f"Unknown columns of form {form_id}: {', '.join(unknown)}")
+            columns = [columns_by_id[column_id] for column_id in column_ids]
 
         return columns
 
+    def get_form_bundle(self, form_id, refresh=False):
+        """
+        Get the tables to export a form with all its sub-forms in one export job.
+        Each table has the columns of get_form_columns plus the record ID, and the
+        sub-form tables also have the ID of the parent record to join them.
+
+        Args:
+            form_id (str): The ID of the parent form.
+            refresh (bool): Ignore the saved columns and build them again.
+        Returns:
+            A list of dicts with the form_id, label and columns of each table: the
+            form first, then its sub-forms (and their own sub-forms).
+        """
+        tables = []
+        pending = [(form_id, False)]
+        seen = set()
+        while pending:
+            table_form_id, is_sub_form = pending.pop(0)
+            if table_form_id in seen:
+                continue
+            seen.add(table_form_id)
+            plan = self._get_column_plan(table_form_id, refresh=refresh)
+            id_columns = [RECORD_ID_COLUMN, PARENT_ID_COLUMN] if is_sub_form else [RECORD_ID_COLUMN]
+            tables.append({
+                'form_id': table_form_id,
+                'label': plan.label or table_form_id,
+                'columns': id_columns + plan.columns,
+            })
+            pending.extend((sub_form_id, True) for sub_form_id in plan.sub_forms)
+        log.info(f"ActivityInfoClient form {form_id} bundle has {len(tables)} tables")
+        return tables
+
+    def _get_column_plan(self, form_id, refresh=False):
+        """Get the saved column plan of a form, checking its schema version when it is too old."""
+        plan = None if refresh else self.column_plans.get(self.api_key, form_id)
+        if plan and self.column_plans.is_fresh(plan):
+            log.debug(f"ActivityInfoClient using the column plan of form {form_id} (version {plan.schema_version})")
+            return plan
+
+        # With a saved plan, ask for the schema only if it changed since it was built
+        form_tree, etag = self._get_form_tree(form_id, etag=plan.etag if plan else None, refresh=refresh)
+        if form_tree is None:
+            log.debug(f"ActivityInfoClient schema of form {form_id} not modified, keeping its column plan")
+            self.column_plans.save(self.api_key, plan)
+            return plan
+
+        schema = form_tree.get('forms', {}).get(form_id, {}).get('schema', {})
+        schema_version = schema.get('schemaVersion')
+        if plan and schema_version is not None and schema_version == plan.schema_version:
+            plan.etag = etag
+        else:
+            plan = ColumnPlan(
+                form_id, schema_version, build_export_columns(schema), etag=etag,
+                label=schema.get('label'), sub_forms=find_sub_forms(schema),
+            )
+            log.info(f"ActivityInfoClient built the column plan of form {form_id} (version {schema_version})")
+        self.column_plans.save(self.api_key, plan)
+        return plan
+
+    def _get_form_tree(self, form_id, etag=None, refresh=False):
+        """Get the form schema, or None if it still matches the ETag.
+
+        The response is cached as the one of get_form.
+
+        Returns:
+            A tuple (form tree or None, ETag of the response).
+        """
+        return self._get(f"resources/form/{form_id}/tree/translated", cache="form", refresh=refresh, etag=etag)
+
     def get_url_to_database(self, database_id):
         """ Utility function to get the URL to access a database in ActivityInfo web app.
         Args:
@@ -215,7 +499,7 @@ class ActivityInfoClient:
         """
         return f"{self.base_url}/app#form/{form_id}/table"
 
-    def start_job_download_form_data(self, form_id, format="CSV", columns=None):
+    def start_job_download_form_data(self, form_id, format="CSV", columns=None, filter_formula=None):
         """
         Use the Jobs API to export form data as CSV.
         Read: https://www.activityinfo.org/support/docs/api/reference/exportFormJob.html
@@ -225,27 +509,43 @@ class ActivityInfoClient:
             form_id (str): The ID of the form to export.
             format (str): Export format (CSV, XLSX, etc.)
             columns (list): Column definitions. If None, fetches all columns from form schema.
+            filter_formula (str): Only export the records matching this formula.
         """
-        available_formats = ["CSV", "XLSX", "TEXT"]
-        if format not in available_formats:
-            raise ValueError(f"Invalid format. Supported formats are {available_formats}")
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Invalid format. Supported formats are {EXPORT_FORMATS}")
 
         # If no columns provided, fetch them from the form schema
         if columns is None:
             columns = self.get_form_columns(form_id)
             log.info(f"Fetched {len(columns)} columns for form {form_id}")
 
+        tables = [{"form_id": form_id, "columns": columns, "filter": filter_formula}]
+        return self.start_job_download_forms_data(tables, format=format)
+
+    def start_job_download_forms_data(self, tables, format="CSV"):
+        """
+        Use the Jobs API to export several forms in a single job, one table model
+        per form (e.g. a form and its sub-forms, see get_form_bundle).
+
+        Args:
+            tables (list): Dicts with the form_id, columns and optional filter of each table.
+            format (str): Export format (CSV, XLSX, etc.)
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Invalid format. Supported formats are {EXPORT_FORMATS}")
+
         endpoint = "resources/jobs"
         payload = {
             "type": "exportForm",
             "descriptor": {
                 "tableModels": [
                     {
-                        "formId": form_id,
-                        "columns": columns,
+                        "formId": table["form_id"],
+                        "columns": table["columns"],
                         "ordering": [],
-                        "filter": None,
+                        "filter": table.get("filter"),
                     }
+                    for table in tables
                 ],
                 "format": format,
                 "utcOffset": 0,
@@ -253,11 +553,60 @@ class ActivityInfoClient:
         }
         headers = self.get_user_auth_headers()
         url = f"{self.base_url}/{endpoint}"
-        response = requests.post(url, headers=headers, json=payload)
+        response = self._request('POST', url, headers=headers, json=payload)
         response.raise_for_status()
         job_info = response.json()
         return job_info
 
+    def iter_form_records(self, form_id, columns=None, filter_formula=None):
+        """
+        Stream the records of a form with the query API, without an export job.
+        POST https://www.activityinfo.org/resources/query/chunks
+        The response is a JSON column set per line (a chunk of rows), e.g.
+        {"rows": 2, "columns": {"name": {"storage": "array", "values": ["a", "b"]}}}
+        Only one chunk is held in memory at a time.
+
+        Args:
+            form_id (str): The ID of the form to query.
+            columns (list): Column definitions, as for start_job_download_form_data.
+                If None, fetches all columns from form schema.
+            filter_formula (str): Only query the records matching this formula.
+        Yields:
+            A list of values per record, in the order of columns.
+        """
+        if columns is None:
+            columns = self.get_form_columns(form_id)
+        column_ids = [column['id'] for column in columns]
+        payload = {
+            "rowSources": [{"rootFormId": form_id}],
+            "columns": [{"id": column['id'], "expression": column['formula']} for column in columns],
+            "truncateStrings": False,
+        }
+        if filter_formula:
+            payload["filter"] = filter_formula
+        url = f"{self.base_url}/resources/query/chunks"
+        headers = self.get_user_auth_headers()
+        # Queries do not change anything, they can be retried like a GET
+        response = self._request('POST', url, idempotent=True, headers=headers, json=payload, stream=True)
+        rows = 0
+        try:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                size = chunk.get('rows', 0)
+                values = [
+                    _column_values(chunk.get('columns', {}).get(column_id), size, column_id)
+                    for column_id in column_ids
+                ]
+                for i in range(size):
+                    yield [column[i] for column in values]
+                rows += size
+        finally:
+            response.close()
+        log.info(f"ActivityInfoClient queried {rows} records of form {form_id}")
+
     def get_job_status(self, job_id):
         """
         Get the status of a job.
@@ -292,7 +641,7 @@ class ActivityInfoClient:
             The content of the downloaded file.
         """
         headers = self.get_user_auth_headers()
-        response = requests.get(download_url, headers=headers)
+        response = self._request('GET', download_url, headers=headers)
         response.raise_for_status()
         return response.content
 
@@ -306,6 +655,55 @@ class ActivityInfoClient:
             The file contents as bytes
         """
         headers = {'Authorization': f'Bearer {self.api_key}'}
-        response = requests.get(url, headers=headers)
+        response = self._request('GET', url, headers=headers)
         response.raise_for_status()
         return response.content
+
+    def download_to_file(self, url: str, fileobj, chunk_size: int = None, max_size: int = None, hasher=None) -> int:
+        """Stream a file from ActivityInfo into a file object.
+
+        Only one chunk is held in memory at a time, whatever the size of the file.
+
+        Args:
+            url: The download URL
+            fileobj: A binary file object to write to
+            chunk_size: Bytes read at a time (default: ckanext.activityinfo.download.chunk_size)
+            max_size: Max bytes accepted, None or 0 for no limit
+                (default: ckanext.activityinfo.download.max_size, in MB)
+            hasher: Optional hashlib object updated with every chunk, to hash the
+                file without reading it again
+
+        Returns:
+            The number of bytes written
+
+        Raises:
+            ActivityInfoFileTooLargeError: if the file is over max_size. Part of the
+                file may have been written already.
+        """
+        if chunk_size is None:
+            chunk_size = toolkit.asint(toolkit.config.get('ckanext.activityinfo.download.chunk_size', 1024 * 1024))
+        if max_size is None:
+            max_size_mb = toolkit.asint(toolkit.config.get('ckanext.activityinfo.download.max_size', 0))
+            max_size = max_size_mb * 1024 * 1024
+
+        headers = {'Authorization': f'Bearer {self.api_key}'}
+        response = self._request('GET', url, headers=headers, stream=True)
+        try:
+            response.raise_for_status()
+            content_length = toolkit.asint(response.headers.get('Content-Length') or 0)
+            if max_size and content_length > max_size:
+                raise ActivityInfoFileTooLargeError(
+                    f"File size {content_length} bytes is over the max size of {max_size} bytes"
+                )
+            size = 0
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                size += len(chunk)
+                if max_size and size > max_size:
+                    raise ActivityInfoFileTooLargeError(f"File is over the max size of {max_size} bytes")
+                fileobj.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+        finally:
+            response.close()
+        log.info(f"ActivityInfoClient downloaded {size} bytes from {url}")
+        return size
@@ -0,0 +1,198 @@
+"""Cache for ActivityInfo API responses that change rarely.
+
+The list of databases, the database trees and the form schemas are cached per
+API key (identified by its hash) and URL. Each kind of endpoint has its own TTL.
+Responses are stored as JSON so callers always get their own copy of the data.
+
+Two backends are available:
+ - memory: an LRU cache per process (default).
+ - redis: the CKAN Redis instance, shared by the web and background job processes.
+
+Expired entries with an ETag are kept for a while to revalidate them with
+If-None-Match, so ActivityInfo can answer with a 304 instead of the full body.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from redis.exceptions import RedisError
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.data.redis_store import get_redis_connection, make_key
+
+
+log = logging.getLogger(__name__)
+
+# Default TTL (seconds) for each kind of cached endpoint
+DEFAULT_TTLS = {
+    'databases': 60,
+    'database': 120,
+    'form': 300,
+}
+
+# Process-wide cache counters, see get_cache_stats
+_stats = {'hits': 0, 'misses': 0, 'revalidated': 0, 'bypassed': 0}
+_stats_lock = threading.Lock()
+
+_memory_entries = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def get_cache_ttl(kind):
+    """Get the TTL in seconds for a kind of endpoint (see DEFAULT_TTLS). 0 disables the cache.
+
+    Config settings:
+        ckanext.activityinfo.cache.ttl.<kind>
+    """
+    if not toolkit.asbool(toolkit.config.get('ckanext.activityinfo.cache.enabled', True)):
+        return 0
+    default = DEFAULT_TTLS.get(kind, 0)
+    return toolkit.asint(toolkit.config.get(f'ckanext.activityinfo.cache.ttl.{kind}', default))
+
+
+def get_response_cache():
+    """Get the cache for the configured backend.
+
+    Config settings:
+        ckanext.activityinfo.cache.backend: memory or redis (default memory)
+        ckanext.activityinfo.cache.max_entries: max entries of the memory backend (default 500)
+        ckanext.activityinfo.cache.revalidate_for: seconds an expired entry with an ETag
+            is kept to revalidate it (default 3600)
+    """
+    config = toolkit.config
+    revalidate_for = toolkit.asint(config.get('ckanext.activityinfo.cache.revalidate_for', 3600))
+    backend = config.get('ckanext.activityinfo.cache.backend', 'memory')
+    if backend == 'redis':
+        return RedisResponseCache(revalidate_for=revalidate_for)
+    if backend != 'memory':
+        log.warning(f"Unknown ActivityInfo cache backend {backend}, using memory")
+    max_entries = toolkit.asint(config.get('ckanext.activityinfo.cache.max_entries', 500))
+    return MemoryResponseCache(max_entries=max_entries, revalidate_for=revalidate_for)
+
+
+def make_cache_key(token_hash, url, params=None):
+    """Build the cache key for a GET request."""
+    if params:
+        query = '&'.join(f'{key}={params[key]}' for key in sorted(params))
+        url = f'{url}?{query}'
+    return make_key('cache', token_hash, url)
+
+
+class CacheEntry:
+    """A cached response: the JSON body, its ETag and when it expires."""
+
+    def __init__(self, body, etag=None, expires_at=0):
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self):
+        return self.expires_at > time.time()
+
+    def data(self):
+        """Get a new copy of the cached data."""
+        return json.loads(self.body)
+
+    def dumps(self):
+        return json.dumps({'body': self.body, 'etag': self.etag, 'expires_at': self.expires_at})
+
+    @classmethod
+    def loads(cls, value):
+        return cls(**json.loads(value))
+
+
+class MemoryResponseCache:
+    """LRU cache shared by all the clients of this process."""
+
+    def __init__(self, max_entries=500, revalidate_for=3600):
+        self.max_entries = max_entries
+        self.revalidate_for = revalidate_for
+
+    def get(self, key):
+        with _memory_lock:
+            entry, keep_until = _memory_entries.get(key, (None, 0))
+            if entry is None:
+                return None
+            if keep_until <= time.time():
+                del _memory_entries[key]
+                return None
+            _memory_entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        keep_until = entry.expires_at + (self.revalidate_for if entry.etag else 0)
+        with _memory_lock:
+            _memory_entries[key] = (entry, keep_until)
+            _memory_entries.move_to_end(key)
+            while len(_memory_entries) > self.max_entries:
+                _memory_entries.popitem(last=False)
+
+    def delete(self, key):
+        with _memory_lock:
+            _memory_entries.pop(key, None)
+
+
+class RedisResponseCache:
+    """Cache shared through Redis. Errors are logged and handled as cache misses."""
+
+    def __init__(self, revalidate_for=3600, redis_conn=None):
+        self.revalidate_for = revalidate_for
+        self._redis = redis_conn
+
+    def get(self, key):
+        try:
+            self._redis = self._redis or get_redis_connection()
+            value = self._redis.get(key)
+        except RedisError as e:
+            log.warning(f"ActivityInfo cache: Redis not available: {e}")
+            return None
+        return CacheEntry.loads(value) if value else None
+
+    def set(self, key, entry):
+        keep_for = entry.expires_at - time.time() + (self.revalidate_for if entry.etag else 0)
+        if keep_for <= 0:
+            return
+        try:
+            self._redis = self._redis or get_redis_connection()
+            self._redis.set(key, entry.dumps(), ex=max(1, int(keep_for)))
+        except RedisError as e:
+            log.warning(f"ActivityInfo cache: could not store {key}: {e}")
+
+    def delete(self, key):
+        try:
+            self._redis = self._redis or get_redis_connection()
+            self._redis.delete(key)
+        except RedisError as e:
+            log.warning(f"ActivityInfo cache: could not delete {key}: {e}")
+
+
+def record_cache_stats(**counters):
+    """Add values to the process-wide cache counters (see get_cache_stats)."""
+    with _stats_lock:
+        for key, value in counters.items():
+            _stats[key] += value
+
+
+def get_cache_stats():
+    """Get the process-wide cache counters.
+
+    Returns:
+        A dict with the number of 'hits', 'misses', 'revalidated' (expired
+        entries confirmed by a 304 response) and 'bypassed' (refresh requests).
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.update({'hits': 0, 'misses': 0, 'revalidated': 0, 'bypassed': 0})
+
+
+def clear_memory_cache():
+    """Forget all the responses cached by this process."""
+    with _memory_lock:
+        _memory_entries.clear()
@@ -0,0 +1,147 @@
+"""Column plans of the ActivityInfo exports, kept by form schema version.
+
+The columns of an export are built from the form schema
+(resources/form/<id>/tree/translated). The schema rarely changes, but the
+download jobs run in new work processes and would fetch it for every export.
+
+The columns built for a form (its plan) are saved in Redis with the
+schemaVersion and the ETag of the schema response:
+ - For max_age seconds after it was built or last checked, the plan is used
+   without calling ActivityInfo.
+ - After that, the schema is requested again with If-None-Match. The plan is
+   kept when ActivityInfo answers 304 or the schemaVersion did not change, and
+   built again otherwise.
+
+Plans are kept per API key hash, as the schema (and its translated labels)
+depends on the user. If Redis is not reachable, the columns are built every time.
+"""
+import json
+import logging
+import time
+
+from redis.exceptions import RedisError
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.data.redis_store import get_redis_connection, hash_token, make_key
+
+
+log = logging.getLogger(__name__)
+
+
+def _plan_key(form_id, token_hash):
+    return make_key('column-plan', form_id, token_hash)
+
+
+class ColumnPlan:
+    """The export columns of a form, for a schema version.
+
+    The label and sub-forms of the form are kept too, to export form bundles
+    (see ActivityInfoClient.get_form_bundle).
+    """
+
+    def __init__(self, form_id, schema_version, columns, etag=None, checked_at=0, token_hash=None,
+                 label=None, sub_forms=None):
+        self.form_id = form_id
+        self.schema_version = schema_version
+        self.columns = columns
+        self.label = label
+        self.sub_forms = sub_forms or []
+        self.etag = etag
+        self.checked_at = checked_at
+        self.token_hash = token_hash
+
+    def dumps(self):
+        return json.dumps({
+            'form_id': self.form_id,
+            'schema_version': self.schema_version,
+            'columns': self.columns,
+            'label': self.label,
+            'sub_forms': self.sub_forms,
+            'etag': self.etag,
+            'checked_at': self.checked_at,
+        })
+
+    @classmethod
+    def loads(cls, value, token_hash=None):
+        return cls(token_hash=token_hash, **json.loads(value))
+
+
+class ColumnPlanCache:
+    """Column plans shared through Redis. Errors are logged and handled as cache misses.
+
+    Config settings:
+        ckanext.activityinfo.column_plans.max_age: seconds a plan is used before checking
+            the schema version again, 0 disables the plans (default 3600)
+        ckanext.activityinfo.column_plans.ttl: seconds a plan is kept after it was last
+            checked (default 2592000, 30 days)
+    """
+
+    def __init__(self, max_age=None, ttl=None):
+        config = toolkit.config
+        if max_age is None:
+            max_age = toolkit.asint(config.get('ckanext.activityinfo.column_plans.max_age', 3600))
+        if ttl is None:
+            ttl = toolkit.asint(config.get('ckanext.activityinfo.column_plans.ttl', 30 * 24 * 3600))
+        self.max_age = max_age
+        self.ttl = ttl
+
+    @property
+    def enabled(self):
+        return self.max_age > 0
+
+    def is_fresh(self, plan):
+        return time.time() - plan.checked_at < self.max_age
+
+    def get(self, api_key, form_id):
+        """Get the saved plan of a form, or None."""
+        if not self.enabled:
+            return None
+        token_hash = hash_token(api_key or '')
+        try:
+            value = get_redis_connection().get(_plan_key(form_id, token_hash))
+        except RedisError as e:
+            log.warning(f"Could not read the ActivityInfo column plan of form {form_id}: {e}")
+            return None
+        return ColumnPlan.loads(value, token_hash) if value else None
+
+    def save(self, api_key, plan):
+        """Save a plan, checked now."""
+        if not self.enabled:
+            return
+        plan.checked_at = time.time()
+        try:
+            get_redis_connection().set(
+                _plan_key(plan.form_id, hash_token(api_key or '')), plan.dumps(), ex=self.ttl
+            )
+        except RedisError as e:
+            log.warning(f"Could not save the ActivityInfo column plan of form {plan.form_id}: {e}")
+
+    def list(self, form_id=None):
+        """Get all the saved plans, or the plans of a form."""
+        pattern = _plan_key(form_id or '*', '*')
+        plans = []
+        try:
+            redis_conn = get_redis_connection()
+            for key in redis_conn.scan_iter(match=pattern):
+                value = redis_conn.get(key)
+                if value:
+                    key = key.decode() if isinstance(key, bytes) else key
+                    plans.append(ColumnPlan.loads(value, key.rsplit(':', 1)[-1]))
+        except RedisError as e:
+            log.warning(f"Could not list the ActivityInfo column plans: {e}")
+        return plans
+
+    def purge(self, form_id=None):
+        """Delete all the saved plans, or the plans of a form.
+
+        Returns:
+            The number of deleted plans.
+        """
+        pattern = _plan_key(form_id or '*', '*')
+        try:
+            redis_conn = get_redis_connection()
+            keys = list(redis_conn.scan_iter(match=pattern))
+            return redis_conn.delete(*keys) if keys else 0
+        except RedisError as e:
+            log.warning(f"Could not delete the ActivityInfo column plans: {e}")
+            return 0
@@ -0,0 +1,172 @@
+"""Status of the ActivityInfo export jobs, shared by all the pages watching them.
+
+Each page watching an export job asks for its status every few seconds. The
+last status is kept in Redis and reused for max_age seconds, and a single
+request at a time calls ActivityInfo for a job: the others wait for its result
+(single-flight) instead of making their own call.
+
+Export jobs belong to an API key, so the statuses are only shared by the
+watchers using the same key.
+"""
+import json
+import logging
+import time
+import uuid
+
+from redis.exceptions import RedisError
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.data.redis_store import RELEASE_SCRIPT, get_redis_connection, hash_token, make_key
+from ckanext.activityinfo.exceptions import ActivityInfoConnectionError
+
+
+log = logging.getLogger(__name__)
+
+EXPORT_JOB_FINAL_STATES = ('completed', 'failed')
+
+
+class ExportJobStatus:
+    """Shared status of an ActivityInfo export job.
+
+    Config settings:
+        ckanext.activityinfo.job_status.max_age: seconds a status is reused before
+            calling ActivityInfo again (default 2)
+        ckanext.activityinfo.job_status.wait_timeout: max seconds to wait for the
+            ActivityInfo call of another request (default 10)
+        ckanext.activityinfo.job_status.ttl: seconds the last status is kept (default 3600)
+    """
+
+    def __init__(self, job_id, api_key, max_age=None, wait_timeout=None):
+        config = toolkit.config
+        self.job_id = job_id
+        if max_age is None:
+            max_age = float(config.get('ckanext.activityinfo.job_status.max_age', 2))
+        if wait_timeout is None:
+            wait_timeout = float(config.get('ckanext.activityinfo.job_status.wait_timeout', 10))
+        self.max_age = max_age
+        self.wait_timeout = wait_timeout
+        self.ttl = toolkit.asint(config.get('ckanext.activityinfo.job_status.ttl', 3600))
+        token = hash_token(api_key or '')
+        self.status_key = make_key('export-job', token, job_id)
+        self.lock_key = make_key('export-job', token, job_id, 'in-flight')
+        self.channel = make_key('events', 'export-job', token, job_id)
+
+    def get_cached(self):
+        """Get the last status saved by any watcher, or None."""
+        entry = self._read()
+        return entry['status'] if entry else None
+
+    def get(self, fetch):
+        """Get the status of the job, calling fetch() (the ActivityInfo API) only if
+        the saved status is too old and no other request is calling it.
+
+        Returns:
+            A tuple (status, fetched), fetched is True if this call used fetch().
+
+        Raises:
+            ActivityInfoConnectionError: if the ActivityInfo call failed, here or in
+                the request this one waited for.
+        """
+        entry = self._read()
+        if self._is_usable(entry):
+            return entry['status'], False
+
+        lock_value = uuid.uuid4().hex
+        if self._lock(lock_value):
+            try:
+                status = self._fetch(fetch)
+                self.save(status)
+            finally:
+                self._release(lock_value)
+            return status, True
+
+        # Another request is calling ActivityInfo right now
+        status = self._wait()
+        if status is not None:
+            return status, False
+        if entry:
+            log.warning(f"No new status for the ActivityInfo export job {self.job_id}, using the last one")
+            return entry['status'], False
+        log.warning(f"No status for the ActivityInfo export job {self.job_id}, getting it again")
+        return fetch(), True
+
+    def save(self, status):
+        """Keep the status and send it to the other watchers."""
+        self._publish({'status': status, 'fetched_at': time.time()}, keep=True)
+
+    def _fetch(self, fetch):
+        try:
+            return fetch()
+        except Exception as e:
+            # Do not leave the waiting requests until their timeout
+            self._publish({'error': str(e)})
+            raise
+
+    def _is_usable(self, entry):
+        if not entry:
+            return False
+        if entry['status'].get('state') in EXPORT_JOB_FINAL_STATES:
+            return True
+        return time.time() - entry['fetched_at'] < self.max_age
+
+    def _read(self):
+        try:
+            value = get_redis_connection().get(self.status_key)
+        except RedisError as e:
+            log.warning(f"Could not read the status of the ActivityInfo export job {self.job_id}: {e}")
+            return None
+        return json.loads(value) if value else None
+
+    def _publish(self, entry, keep=False):
+        value = json.dumps(entry)
+        try:
+            pipe = get_redis_connection().pipeline()
+            if keep:
+                pipe.set(self.status_key, value, ex=self.ttl)
+            pipe.publish(self.channel, value)
+            pipe.execute()
+        except RedisError as e:
+            log.warning(f"Could not save the status of the ActivityInfo export job {self.job_id}: {e}")
+
+    def _lock(self, value):
+        try:
+            timeout = max(int(self.wait_timeout * 1000), 1)
+            return bool(get_redis_connection().set(self.lock_key, value, nx=True, px=timeout))
+        except RedisError as e:
+            log.warning(f"Could not lock the ActivityInfo export job {self.job_id}: {e}")
+            return True
+
+    def _release(self, value):
+        try:
+            get_redis_connection().register_script(RELEASE_SCRIPT)(keys=[self.lock_key], args=[value])
+        except RedisError as e:
+            log.warning(f"Could not unlock the ActivityInfo export job {self.job_id}: {e}")
+
+    def _wait(self):
+        """Wait for the status fetched by another request, None on timeout."""
+        deadline = time.monotonic() + self.wait_timeout
+        pubsub = None
+        try:
+            pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self.channel)
+            # The other request may have finished before the subscription
+            entry = self._read()
+            if self._is_usable(entry):
+                return entry['status']
+            while time.monotonic() < deadline:
+                message = pubsub.get_message(timeout=min(1, max(deadline - time.monotonic(), 0)))
+                if not message or message['type'] != 'message':
+                    continue
+                entry = json.loads(message['data'])
+                if 'error' in entry:
+                    raise ActivityInfoConnectionError(entry['error'])
+                return entry['status']
+        except RedisError as e:
+            log.warning(f"Could not wait for the status of the ActivityInfo export job {self.job_id}: {e}")
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except RedisError:
+                    pass
+        return None
@@ -0,0 +1,236 @@
+"""Client-side rate limits per ActivityInfo API key.
+
+All the web and worker processes using the same API key share a token bucket
+(requests per second) and a budget of export jobs running at the same time.
+Both live in Redis so they apply across RQ workers. If Redis is not reachable
+the limits fall back to per-process counters.
+"""
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from redis.exceptions import RedisError
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.data.redis_store import get_redis_connection, hash_token, make_key
+from ckanext.activityinfo.exceptions import ActivityInfoRateLimitError
+
+
+log = logging.getLogger(__name__)
+
+# Refill the bucket for the time elapsed since the last call and take one token.
+# Returns the seconds to wait before a token is available (0 if we got one).
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+# Drop expired leases and take a slot if there is room left. Returns 1 on success.
+EXPORT_SLOT_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return 1
+end
+return 0
+"""
+
+_local_buckets = {}
+_local_slots = {}
+_local_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key):
+    """Get the rate limiter for an API key, None if rate limiting is disabled.
+
+    Config settings:
+        ckanext.activityinfo.rate_limit.requests_per_second: 0 disables the limit (default 0)
+        ckanext.activityinfo.rate_limit.burst: requests allowed at once after idle time
+            (default: requests_per_second, min 1)
+    """
+    rate = float(toolkit.config.get('ckanext.activityinfo.rate_limit.requests_per_second', 0) or 0)
+    if not api_key or rate <= 0:
+        return None
+    burst = float(toolkit.config.get('ckanext.activityinfo.rate_limit.burst', 0) or max(1.0, rate))
+    return TokenBucketRateLimiter(hash_token(api_key), rate, burst)
+
+
+def get_export_slots(api_key):
+    """Get the export job budget for an API key, None if unlimited.
+
+    Config settings:
+        ckanext.activityinfo.rate_limit.max_concurrent_exports: 0 means unlimited (default 0)
+        ckanext.activityinfo.rate_limit.export_slot_wait: max seconds to wait for a free slot (default 600)
+        ckanext.activityinfo.rate_limit.export_slot_ttl: seconds after which a slot held by
+            a crashed worker is released (default 900)
+    """
+    limit = toolkit.asint(toolkit.config.get('ckanext.activityinfo.rate_limit.max_concurrent_exports', 0) or 0)
+    if not api_key or limit <= 0:
+        return None
+    max_wait = float(toolkit.config.get('ckanext.activityinfo.rate_limit.export_slot_wait', 600))
+    ttl = toolkit.asint(toolkit.config.get('ckanext.activityinfo.rate_limit.export_slot_ttl', 900))
+    return ExportSlots(hash_token(api_key), limit, max_wait=max_wait, ttl=ttl)
+
+
+class TokenBucketRateLimiter:
+    """Token bucket shared through Redis by all the clients using the same API key."""
+
+    def __init__(self, token_hash, rate, burst, redis_conn=None):
+        self.token_hash = token_hash
+        self.rate = rate
+        self.burst = burst
+        self.key = make_key('rate-limit', token_hash)
+        self._redis = redis_conn
+        self._script = None
+
+    def acquire(self):
+        """Block until a request can be sent. Returns the seconds waited."""
+        waited = 0.0
+        while True:
+            wait = self._take()
+            if wait <= 0:
+                if waited:
+                    log.debug(f"Rate limit for token {self.token_hash}: waited {waited:.2f}s")
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def _take(self):
+        try:
+            if self._script is None:
+                self._redis = self._redis or get_redis_connection()
+                self._script = self._redis.register_script(TOKEN_BUCKET_SCRIPT)
+            wait = self._script(keys=[self.key], args=[self.rate, self.burst, time.time()])
+            return float(wait)
+        except RedisError as e:
+            log.warning(f"Rate limit: Redis not available, using a per-process limit: {e}")
+            return self._take_local()
+
+    def _take_local(self):
+        now = time.monotonic()
+        with _local_lock:
+            tokens, ts = _local_buckets.get(self.key, (self.burst, now))
+            tokens = min(self.burst, tokens + max(0.0, now - ts) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            _local_buckets[self.key] = (tokens, now)
+        return wait
+
+
+class ExportSlots:
+    """Limit the export jobs running at the same time with the same API key.
+
+    Each slot is a lease with an expiry time, so a worker killed in the middle
+    of an export does not hold its slot forever. Exports running longer than
+    the lease renew it while they poll, see renew.
+    """
+
+    POLL_INTERVAL = 2
+
+    def __init__(self, token_hash, limit, max_wait=600, ttl=900, redis_conn=None):
+        self.token_hash = token_hash
+        self.limit = limit
+        self.max_wait = max_wait
+        self.ttl = ttl
+        self.key = make_key('export-slots', token_hash)
+        self._redis = redis_conn
+        self._script = None
+        # Slots held by the slot() blocks running, with the time of their last renewal
+        self._held = {}
+
+    @contextmanager
+    def slot(self):
+        """Hold an export slot while the block runs.
+
+        Raises ActivityInfoRateLimitError if no slot gets free after max_wait seconds.
+        """
+        slot_id = uuid.uuid4().hex
+        waited = 0.0
+        while not self._acquire(slot_id):
+            if waited >= self.max_wait:
+                raise ActivityInfoRateLimitError(
+                    f"No free export slot for token {self.token_hash} after {waited:.0f}s "
+                    f"({self.limit} exports already running)"
+                )
+            time.sleep(self.POLL_INTERVAL)
+            waited += self.POLL_INTERVAL
+        if waited:
+            log.info(f"Waited {waited:.0f}s for a free export slot for token {self.token_hash}")
+        self._held[slot_id] = time.monotonic()
+        try:
+            yield slot_id
+        finally:
+            self._held.pop(slot_id, None)
+            self._release(slot_id)
+
+    def renew(self):
+        """Extend the lease of the slots held, at most every third of the lease time."""
+        now = time.monotonic()
+        for slot_id, renewed_at in list(self._held.items()):
+            if now - renewed_at < self.ttl / 3:
+                continue
+            self._held[slot_id] = now
+            expires_at = time.time() + self.ttl
+            try:
+                self._redis = self._redis or get_redis_connection()
+                with self._redis.pipeline() as pipe:
+                    # XX: a slot already released or expired is not taken again
+                    pipe.zadd(self.key, {slot_id: expires_at}, xx=True)
+                    pipe.expire(self.key, self.ttl)
+                    pipe.execute()
+            except RedisError as e:
+                log.warning(f"Export slots: could not renew slot {slot_id}: {e}")
+            with _local_lock:
+                slots = _local_slots.get(self.key, {})
+                if slot_id in slots:
+                    slots[slot_id] = expires_at
+
+    def _acquire(self, slot_id):
+        now = time.time()
+        try:
+            if self._script is None:
+                self._redis = self._redis or get_redis_connection()
+                self._script = self._redis.register_script(EXPORT_SLOT_SCRIPT)
+            return bool(self._script(keys=[self.key], args=[now, self.limit, now + self.ttl, slot_id, self.ttl]))
+        except RedisError as e:
+            log.warning(f"Export slots: Redis not available, using a per-process limit: {e}")
+            with _local_lock:
+                slots = {s: exp for s, exp in _local_slots.get(self.key, {}).items() if exp > now}
+                acquired = len(slots) < self.limit
+                if acquired:
+                    slots[slot_id] = now + self.ttl
+                _local_slots[self.key] = slots
+            return acquired
+
+    def _release(self, slot_id):
+        if self._redis is not None:
+            try:
+                self._redis.zrem(self.key, slot_id)
+            except RedisError as e:
+                log.warning(f"Export slots: could not release slot {slot_id}, it will expire: {e}")
+        with _local_lock:
+            _local_slots.get(self.key, {}).pop(slot_id, None)
@@ -0,0 +1,33 @@
+"""Access to the CKAN Redis instance, shared by all the ActivityInfo workers."""
+import hashlib
+import logging
+
+from ckan.lib.redis import connect_to_redis
+from ckan.plugins import toolkit
+
+
+log = logging.getLogger(__name__)
+
+# Delete the key only if it still has our value, to release a lock or a claim
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def get_redis_connection():
+    """Get a connection to the Redis instance CKAN uses for background jobs."""
+    return connect_to_redis()
+
+
+def make_key(*parts):
+    """Build a Redis key namespaced by site and extension."""
+    site_id = toolkit.config.get('ckan.site_id', 'default')
+    return ':'.join([site_id, 'ckanext-activityinfo'] + [str(part) for part in parts])
+
+
+def hash_token(api_key):
+    """Identify an API key in Redis keys and logs without exposing it."""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
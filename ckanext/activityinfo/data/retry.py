@@ -0,0 +1,129 @@
+"""Retry policy for the ActivityInfo API client."""
+import logging
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from ckan.plugins import toolkit
+
+
+log = logging.getLogger(__name__)
+
+# Methods that can be safely sent twice
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Process-wide retry counters, see get_retry_stats
+_stats = {'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0}
+_stats_lock = threading.Lock()
+
+
+class RetryPolicy:
+    """Decide when and how long to wait before retrying a request.
+
+    Args:
+        max_attempts: Total attempts per request, including the first one (1 disables retries).
+        backoff_base: Seconds to wait before the first retry. Doubles on each new attempt.
+        backoff_max: Max seconds to wait between two attempts.
+        jitter: Randomize the backoff ("full jitter") so parallel workers do not retry in sync.
+        max_retry_after: Max seconds we accept to wait when the server sends a Retry-After header.
+    """
+
+    def __init__(self, max_attempts=3, backoff_base=1.0, backoff_max=30.0, jitter=True, max_retry_after=120.0):
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.max_retry_after = max_retry_after
+
+    @classmethod
+    def from_config(cls):
+        """Build the policy from the ckanext.activityinfo.retry.* config settings."""
+        config = toolkit.config
+        return cls(
+            max_attempts=toolkit.asint(config.get('ckanext.activityinfo.retry.max_attempts', 3)),
+            backoff_base=float(config.get('ckanext.activityinfo.retry.backoff_base', 1.0)),
+            backoff_max=float(config.get('ckanext.activityinfo.retry.backoff_max', 30.0)),
+            jitter=toolkit.asbool(config.get('ckanext.activityinfo.retry.jitter', True)),
+            max_retry_after=float(config.get('ckanext.activityinfo.retry.max_retry_after', 120.0)),
+        )
+
+    def is_retryable(self, attempt, method, idempotent=None, status_code=None):
+        """Check if a failed attempt can be retried.
+
+        Args:
+            attempt: The number of the attempt that just failed (starting at 1).
+            method: The HTTP method.
+            idempotent: Override the idempotency inferred from the method
+                (e.g. read-only POST queries).
+            status_code: The response status, None for connection errors.
+        """
+        if attempt >= self.max_attempts:
+            return False
+        if status_code is not None and status_code not in RETRY_STATUSES:
+            return False
+        # 429 means the request was rejected before being processed,
+        # so it is safe to send it again whatever the method is.
+        if status_code == 429:
+            return True
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        return idempotent
+
+    def get_delay(self, attempt, response=None):
+        """Get the seconds to wait before the next attempt.
+
+        A Retry-After header from the server takes precedence over the backoff.
+        """
+        retry_after = get_retry_after(response) if response is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+
+        delay = min(self.backoff_base * (2 ** (attempt - 1)), self.backoff_max)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+def get_retry_after(response):
+    """Parse the Retry-After header (seconds or HTTP date). Returns seconds or None."""
+    value = response.headers.get('Retry-After') if getattr(response, 'headers', None) else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        log.debug(f"Ignoring invalid Retry-After header: {value}")
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def record_stats(**counters):
+    """Add values to the process-wide retry counters (see get_retry_stats)."""
+    with _stats_lock:
+        for key, value in counters.items():
+            _stats[key] += value
+
+
+def get_retry_stats():
+    """Get the process-wide retry counters.
+
+    Returns:
+        A dict with the number of 'requests', 'retries', 'gave_up' (requests
+        that failed after the last attempt) and 'retry_wait' (seconds spent
+        waiting between attempts).
+    """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_retry_stats():
+    with _stats_lock:
+        _stats.update({'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0})
@@ -0,0 +1,59 @@
+"""Pooled HTTP sessions shared by all ActivityInfoClient instances."""
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from ckan.plugins import toolkit
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(base_url):
+    """Get the pooled requests session for a base URL.
+
+    Sessions are shared per process and per base_url, so every client talking to
+    the same ActivityInfo server reuses the same keep-alive connections.
+    The process ID is part of the key: RQ forks a work horse for each job and
+    sockets must not be shared between the parent and the forked child.
+
+    Config settings:
+        ckanext.activityinfo.http.pool_size: max connections kept open per host (default 10)
+        ckanext.activityinfo.http.keep_alive: keep connections open between requests (default true)
+    """
+    pool_size = toolkit.asint(toolkit.config.get('ckanext.activityinfo.http.pool_size', DEFAULT_POOL_SIZE))
+    keep_alive = toolkit.asbool(toolkit.config.get('ckanext.activityinfo.http.keep_alive', True))
+    key = (os.getpid(), base_url, pool_size, keep_alive)
+
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _build_session(pool_size, keep_alive)
+            _sessions[key] = session
+            log.debug(f"Created HTTP session for {base_url} (pool_size: {pool_size}, keep_alive: {keep_alive})")
+    return session
+
+
+def close_sessions():
+    """Close all the pooled sessions of this process and forget them."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def _build_session(pool_size, keep_alive):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
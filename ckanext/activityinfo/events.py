@@ -0,0 +1,241 @@
+"""Server-Sent Events streams for the ActivityInfo downloads.
+
+Instead of polling, the browser keeps a connection open and gets an event for
+each status change:
+ - Resource downloads: the download jobs publish every progress update to a
+   Redis channel per resource (see jobs.progress.set_progress).
+ - Export jobs started from the forms page: the streams share the status of
+   the job (see data.job_status), and get the statuses fetched by the other
+   watchers as soon as they are saved.
+
+Each stream holds a web worker, so it ends after
+ckanext.activityinfo.events.timeout seconds. The browser reconnects by
+itself and gets the current status first. For the same reason anonymous
+users only get the current status, and each user can only keep a few
+streams open (see StreamLimit): the others poll instead.
+"""
+import json
+import logging
+import time
+
+from redis.exceptions import RedisError
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.data.job_status import EXPORT_JOB_FINAL_STATES
+from ckanext.activityinfo.data.redis_store import get_redis_connection, make_key
+from ckanext.activityinfo.jobs.progress import PROCESSING_STATUSES, progress_channel
+
+
+log = logging.getLogger(__name__)
+
+
+def format_event(event, data):
+    """Format a message of a text/event-stream response."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def get_stream_settings():
+    """Get the stream timing settings.
+
+    Config settings:
+        ckanext.activityinfo.events.timeout: max seconds of a stream (default 300)
+        ckanext.activityinfo.events.keepalive: seconds between keepalive comments (default 15)
+
+    Returns:
+        A tuple (timeout, keepalive).
+    """
+    config = toolkit.config
+    return (
+        toolkit.asint(config.get('ckanext.activityinfo.events.timeout', 300)),
+        toolkit.asint(config.get('ckanext.activityinfo.events.keepalive', 15)),
+    )
+
+
+def is_resource_finished(status):
+    """Check if a resource status (see act_info_resource_status) will not change anymore."""
+    return not status.get('job_id') and status.get('status') not in PROCESSING_STATUSES
+
+
+class StreamLimit:
+    """Count the event streams open by a user, in all the web workers.
+
+    Config settings:
+        ckanext.activityinfo.events.max_streams_per_user: 0 means unlimited (default 3)
+    """
+
+    def __init__(self, user):
+        self.key = make_key('event-streams', user)
+        self.max_streams = toolkit.asint(
+            toolkit.config.get('ckanext.activityinfo.events.max_streams_per_user', 3)
+        )
+        self.counted = False
+
+    def acquire(self):
+        """Count a new stream. Returns False if the user already has max_streams open."""
+        if self.max_streams <= 0:
+            return True
+        timeout, _ = get_stream_settings()
+        try:
+            redis_conn = get_redis_connection()
+            with redis_conn.pipeline() as pipe:
+                pipe.incr(self.key)
+                # The count of a worker killed with open streams does not last
+                pipe.expire(self.key, timeout + 60)
+                count, _ = pipe.execute()
+            if count > self.max_streams:
+                redis_conn.decr(self.key)
+                return False
+            self.counted = True
+        except RedisError as e:
+            log.warning(f"Could not count the ActivityInfo event streams: {e}")
+        return True
+
+    def release(self):
+        if not self.counted:
+            return
+        self.counted = False
+        try:
+            get_redis_connection().decr(self.key)
+        except RedisError as e:
+            log.warning(f"Could not count the ActivityInfo event streams: {e}")
+
+    def wrap(self, events):
+        """Yield the events, and release the stream when they end or the client disconnects."""
+        try:
+            yield from events
+        finally:
+            self.release()
+
+
+class _Stream:
+    """Redis subscription feeding an event stream."""
+
+    def __init__(self, channels, timeout=None, keepalive=None, subscribe=True):
+        default_timeout, default_keepalive = get_stream_settings()
+        self.timeout = default_timeout if timeout is None else timeout
+        self.keepalive = default_keepalive if keepalive is None else keepalive
+        self.pubsub = None
+        self.last_sent = time.monotonic()
+        if not subscribe:
+            return
+        # Subscribe before reading the current status, so no update is missed
+        try:
+            self.pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+            self.pubsub.subscribe(*channels)
+        except RedisError as e:
+            log.warning(f"Could not subscribe to the ActivityInfo events: {e}")
+            self.close()
+
+    def messages(self, deadline):
+        """Yield the decoded messages until the deadline, and None as a keepalive."""
+        while time.monotonic() < deadline:
+            message = None
+            if self.pubsub is not None:
+                try:
+                    message = self.pubsub.get_message(timeout=min(1, max(deadline - time.monotonic(), 0)))
+                except RedisError as e:
+                    log.warning(f"Lost the ActivityInfo events subscription: {e}")
+                    self.close()
+            else:
+                time.sleep(min(1, max(deadline - time.monotonic(), 0)))
+            if message and message['type'] == 'message':
+                self.last_sent = time.monotonic()
+                yield message['channel'].decode(), json.loads(message['data'])
+            elif time.monotonic() - self.last_sent >= self.keepalive:
+                self.last_sent = time.monotonic()
+                yield None
+
+    def close(self):
+        if self.pubsub is not None:
+            try:
+                self.pubsub.close()
+            except RedisError:
+                pass
+        self.pubsub = None
+
+
+class ResourceProgressStream(_Stream):
+    """Progress events of several resource downloads.
+
+    Without live updates, only the current status is sent, then an
+    'unavailable' event if some downloads are still running.
+    """
+
+    def __init__(self, resource_ids, timeout=None, keepalive=None, live=True):
+        self.channels = {progress_channel(resource_id): resource_id for resource_id in resource_ids}
+        super().__init__(list(self.channels), timeout=timeout, keepalive=keepalive, subscribe=live)
+
+    def events(self, statuses):
+        """Yield the events of the resources, until they are all finished.
+
+        Args:
+            statuses: the current status of the resources, from act_info_resource_status.
+                Resources missing here (not found or not visible) are not followed.
+        """
+        deadline = time.monotonic() + self.timeout
+        pending = set()
+        try:
+            for resource_id, status in statuses.items():
+                yield format_event('progress', dict(status, resource_id=resource_id))
+                if not is_resource_finished(status):
+                    pending.add(resource_id)
+            if not pending:
+                yield format_event('end', {})
+                return
+            if self.pubsub is None:
+                # Without Redis or live updates, the browser falls back to polling
+                yield format_event('unavailable', {})
+                return
+            for item in self.messages(deadline):
+                if item is None:
+                    yield ': keepalive\n\n'
+                    continue
+                channel, values = item
+                resource_id = self.channels[channel]
+                if resource_id not in pending:
+                    continue
+                values['resource_id'] = resource_id
+                yield format_event('progress', values)
+                if values['status'] not in PROCESSING_STATUSES:
+                    pending.discard(resource_id)
+                    if not pending:
+                        yield format_event('end', {})
+                        return
+        finally:
+            self.close()
+
+
+def export_job_events(job, fetch, render, timeout=None, keepalive=None):
+    """Yield a status event for each change of an export job, until it ends.
+
+    Args:
+        job: the data.job_status.ExportJobStatus of the job.
+        fetch: function calling ActivityInfo for the job status.
+        render: function building the event data from the job status.
+    """
+    stream = _Stream([job.channel], timeout=timeout, keepalive=keepalive)
+    deadline = time.monotonic() + stream.timeout
+    last = None
+    try:
+        while time.monotonic() < deadline:
+            status, _ = job.get(fetch)
+            if status != last:
+                last = status
+                stream.last_sent = time.monotonic()
+                yield format_event('status', render(status))
+                if status['state'] in EXPORT_JOB_FINAL_STATES:
+                    return
+            # Wait until the status is too old, or for the status fetched by another watcher
+            next_poll = min(deadline, time.monotonic() + job.max_age)
+            for item in stream.messages(next_poll):
+                if item is None:
+                    yield ': keepalive\n\n'
+                    continue
+                status = item[1].get('status')
+                if status is not None and status != last:
+                    last = status
+                    yield format_event('status', render(status))
+                    if status['state'] in EXPORT_JOB_FINAL_STATES:
+                        return
+    finally:
+        stream.close()
@@ -1,3 +1,23 @@
 class ActivityInfoConnectionError(Exception):
     """Custom exception for ActivityInfo connection errors."""
     pass
+
+
+class ActivityInfoRateLimitError(Exception):
+    """Raised when the client-side rate limits do not allow to call ActivityInfo."""
+    pass
+
+
+class ActivityInfoFileTooLargeError(Exception):
+    """Raised when a file downloaded from ActivityInfo is over the configured max size."""
+    pass
+
+
+class ActivityInfoUploadError(Exception):
+    """Raised when some resources of a download could not be updated.
+
+    The error of each failed resource is already saved, resource_ids has their IDs.
+    """
+    def __init__(self, message, resource_ids):
+        super().__init__(message)
+        self.resource_ids = resource_ids
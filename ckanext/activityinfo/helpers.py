@@ -1,6 +1,10 @@
 import logging
 from ckan.common import current_user
 from ckan.plugins import toolkit
+from ckanext.activityinfo.jobs.bundle import BUNDLE_FORMATS
+from ckanext.activityinfo.jobs.convert import get_available_formats
+from ckanext.activityinfo.jobs.progress import PROCESSING_STATUSES, get_progress
+from ckanext.activityinfo.schedules import get_max_runs
 from ckanext.activityinfo.utils import get_user_token
 
 
@@ -34,12 +38,26 @@ def get_activityinfo_status(resource):
     }
 
 
+def add_live_progress(resource):
+    """Update the status and progress of a resource being downloaded with the live
+    values saved by the download job (the resource itself is only patched from
+    time to time, see jobs.progress).
+    """
+    if not is_activityinfo_processing(resource):
+        return resource
+    live = get_progress(resource['id']) if resource.get('id') else None
+    if live and live['status'] in PROCESSING_STATUSES:
+        resource['activityinfo_status'] = live['status']
+        resource['activityinfo_progress'] = live['progress']
+    return resource
+
+
 def is_activityinfo_processing(resource):
     """Check if an ActivityInfo resource is still processing."""
     if not is_activityinfo_resource(resource):
         return False
     status = resource.get('activityinfo_status')
-    return status in ('pending', 'exporting', 'downloading')
+    return status in PROCESSING_STATUSES
 
 
 def is_activityinfo_resource(resource):
@@ -47,6 +65,21 @@ def is_activityinfo_resource(resource):
     return bool(resource.get('activityinfo_form_id'))
 
 
+def get_activityinfo_formats():
+    """Get the formats users can choose for new ActivityInfo resources."""
+    return get_available_formats()
+
+
+def get_activityinfo_bundle_formats():
+    """Get the formats users can choose for new form bundle resources (see jobs.bundle)."""
+    return list(BUNDLE_FORMATS)
+
+
+def get_activityinfo_max_runs():
+    """Get the max number of automatic updates users can choose for a resource."""
+    return get_max_runs()
+
+
 def get_activityinfo_enable_flag():
     """Check if the ActivityInfo extension is enabled via the feature flag."""
     return toolkit.asbool(toolkit.config.get('ckanext.activityinfo.activityinfo_enabled', 'true'))
@@ -0,0 +1,130 @@
+"""Form bundles: a form exported together with all its sub-forms.
+
+Sub-forms are not columns of their parent form, so they need their own export.
+Resources with activityinfo_bundle export the form and its sub-forms with a
+single ActivityInfo export job, one table model per form (see
+ActivityInfoClient.get_form_bundle), and save the tables as:
+ - zip: a ZIP file with a CSV file per form.
+ - xlsx: an XLSX file with a sheet per form. It is converted from the CSV
+   files, or exported by ActivityInfo when openpyxl is not installed.
+
+The CSV export of several tables is a ZIP file. It is packed again with the
+names of the forms and fixed timestamps, so the hash of an unchanged bundle
+matches the last download (see ckanext.activityinfo.skip_unchanged).
+"""
+import hashlib
+import logging
+import os
+import shutil
+import zipfile
+
+
+log = logging.getLogger(__name__)
+
+# Formats of the form bundle resources
+BUNDLE_FORMATS = ('zip', 'xlsx')
+
+# XLSX sheet names are limited to 31 characters
+MAX_TABLE_NAME_LENGTH = 31
+
+# Fixed time of the packed files, the oldest a ZIP file supports
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _safe_name(label):
+    return "".join(c if c.isalnum() or c in '-_ ' else '_' for c in label).strip()
+
+
+def get_table_names(tables):
+    """Get the CSV file names of the tables of a bundle.
+
+    The names are the form labels, unique and short enough to be XLSX sheet names.
+    """
+    names = []
+    for table in tables:
+        base = _safe_name(table['label'])[:MAX_TABLE_NAME_LENGTH] or 'Form'
+        name = base
+        number = 2
+        while name in names:
+            suffix = f" {number}"
+            name = base[:MAX_TABLE_NAME_LENGTH - len(suffix)] + suffix
+            number += 1
+        names.append(name)
+    return [f"{name}.csv" for name in names]
+
+
+def match_table_files(file_names, tables):
+    """Find the file of each table in a bundle export.
+
+    A file matches a table when its name, without the extension, is the form
+    ID or the form label (as is or with the characters not allowed in file
+    names replaced). A label shared by several tables does not match.
+
+    Returns:
+        The file names, in the order of the tables.
+
+    Raises:
+        ValueError: if a table has no file, or several.
+    """
+    labels = [table['label'] for table in tables]
+    matched = []
+    for table in tables:
+        keys = {table['form_id']}
+        if labels.count(table['label']) == 1:
+            keys.update((table['label'], _safe_name(table['label'])))
+        candidates = [
+            name for name in file_names
+            if os.path.splitext(os.path.basename(name))[0] in keys
+        ]
+        if len(candidates) != 1:
+            raise ValueError(
+                f"Can not find the file of form {table['form_id']} ({table['label']}) "
+                f"in the bundle export: {file_names}"
+            )
+        matched.append(candidates[0])
+    return matched
+
+
+def _zip_info(name):
+    info = zipfile.ZipInfo(name, date_time=ZIP_DATE_TIME)
+    info.compress_type = zipfile.ZIP_DEFLATED
+    return info
+
+
+def pack_bundle(src_path, dst_path, tables):
+    """Save a CSV export of a bundle as a ZIP file with a CSV file per form.
+
+    Args:
+        src_path: The downloaded export. A ZIP file with a CSV file per table,
+            named after the form (see match_table_files), or a CSV file if the
+            form has no sub-forms.
+        dst_path: Where to write the ZIP file.
+        tables: The tables of the export, see ActivityInfoClient.get_form_bundle.
+
+    Returns:
+        The SHA-256 of the ZIP file.
+
+    Raises:
+        ValueError: if the files of the export do not match the tables.
+    """
+    names = get_table_names(tables)
+    with zipfile.ZipFile(dst_path, 'w') as dst:
+        if zipfile.is_zipfile(src_path):
+            with zipfile.ZipFile(src_path) as src:
+                members = [info.filename for info in src.infolist() if not info.is_dir()]
+                for member, name in zip(match_table_files(members, tables), names):
+                    with src.open(member) as table, dst.open(_zip_info(name), 'w') as out:
+                        shutil.copyfileobj(table, out, CHUNK_SIZE)
+        elif len(tables) > 1:
+            raise ValueError(f"The bundle export of {len(tables)} forms is not a ZIP file")
+        else:
+            with open(src_path, 'rb') as table, dst.open(_zip_info(names[0]), 'w') as out:
+                shutil.copyfileobj(table, out, CHUNK_SIZE)
+
+    hasher = hashlib.sha256()
+    with open(dst_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
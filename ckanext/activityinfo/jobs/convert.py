@@ -0,0 +1,188 @@
+"""Convert ActivityInfo CSV exports to other formats.
+
+When several formats of the same form are requested, the download job exports
+the form once as CSV and produces the other formats locally. All conversions
+read the CSV file row by row (or block by block), so memory use does not
+depend on the export size.
+
+Form bundles (a ZIP file with a CSV file per form, see jobs.bundle) are
+converted to XLSX with a sheet per form.
+
+XLSX needs openpyxl and Parquet needs pyarrow. Both are optional:
+ - without openpyxl, XLSX files are exported by ActivityInfo as before.
+ - without pyarrow, the Parquet format is not available.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import zipfile
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import pyarrow
+    import pyarrow.csv
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+log = logging.getLogger(__name__)
+
+# Formats ActivityInfo can export by itself
+UPSTREAM_FORMATS = ('csv', 'xlsx', 'text')
+
+MIME_TYPES = {
+    'csv': 'text/csv',
+    'tsv': 'text/tab-separated-values',
+    'json': 'application/json',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+    'zip': 'application/zip',
+}
+
+# Numbers without leading zeros, other values (e.g. codes like 007) stay as text in XLSX
+NUMBER_RE = re.compile(r'^-?(0|[1-9]\d*)(\.\d+)?$')
+
+
+def can_convert(format_type):
+    """Check if a format can be produced locally from a CSV export."""
+    if format_type in ('csv', 'tsv', 'json'):
+        return True
+    if format_type == 'xlsx':
+        return openpyxl is not None
+    if format_type == 'parquet':
+        return pyarrow is not None
+    return False
+
+
+def can_convert_bundle(format_type):
+    """Check if a format can be produced locally from a form bundle."""
+    if format_type == 'zip':
+        return True
+    if format_type == 'xlsx':
+        return openpyxl is not None
+    return False
+
+
+def get_available_formats():
+    """Get the formats users can choose for ActivityInfo resources."""
+    formats = ['csv', 'xlsx', 'tsv', 'json']
+    if pyarrow is not None:
+        formats.append('parquet')
+    return formats
+
+
+def get_mime_type(format_type):
+    return MIME_TYPES.get(format_type, 'text/csv')
+
+
+def convert_csv(src_path, dst_path, format_type, sheet_name='Data'):
+    """Convert a CSV file to format_type.
+
+    Raises:
+        ValueError: if the format is not supported (or its library is not installed).
+    """
+    if not can_convert(format_type):
+        raise ValueError(f"Can not convert ActivityInfo CSV exports to {format_type}")
+    log.debug(f"Converting {src_path} to {format_type}")
+    if format_type == 'csv':
+        shutil.copyfile(src_path, dst_path)
+    elif format_type == 'tsv':
+        _csv_to_tsv(src_path, dst_path)
+    elif format_type == 'json':
+        _csv_to_json(src_path, dst_path)
+    elif format_type == 'xlsx':
+        _csv_to_xlsx(src_path, dst_path, sheet_name)
+    elif format_type == 'parquet':
+        _csv_to_parquet(src_path, dst_path)
+
+
+def convert_bundle(src_path, dst_path, format_type, sheet_name=None):
+    """Convert a form bundle to format_type. Each form gets a sheet named after its CSV file.
+
+    sheet_name is not used, it is accepted to be called like convert_csv.
+
+    Raises:
+        ValueError: if the format is not supported (or its library is not installed).
+    """
+    if not can_convert_bundle(format_type):
+        raise ValueError(f"Can not convert ActivityInfo form bundles to {format_type}")
+    log.debug(f"Converting bundle {src_path} to {format_type}")
+    if format_type == 'zip':
+        shutil.copyfile(src_path, dst_path)
+    elif format_type == 'xlsx':
+        _bundle_to_xlsx(src_path, dst_path)
+
+
+def _read_rows(src_path):
+    with open(src_path, newline='', encoding='utf-8-sig') as src:
+        yield from csv.reader(src)
+
+
+def _csv_to_tsv(src_path, dst_path):
+    with open(dst_path, 'w', newline='', encoding='utf-8') as dst:
+        writer = csv.writer(dst, delimiter='\t')
+        for row in _read_rows(src_path):
+            writer.writerow(row)
+
+
+def _csv_to_json(src_path, dst_path):
+    """Write a JSON array with one object per row, keyed by the CSV header."""
+    rows = _read_rows(src_path)
+    header = next(rows, [])
+    with open(dst_path, 'w', encoding='utf-8') as dst:
+        dst.write('[')
+        for i, row in enumerate(rows):
+            dst.write(',\n' if i else '\n')
+            dst.write(json.dumps(dict(zip(header, row)), ensure_ascii=False))
+        dst.write('\n]\n')
+
+
+def _cell_value(value):
+    if NUMBER_RE.match(value):
+        return float(value) if '.' in value else int(value)
+    return value
+
+
+def _append_rows(sheet, rows):
+    header = next(rows, None)
+    if header is not None:
+        sheet.append(header)
+    for row in rows:
+        sheet.append([_cell_value(value) for value in row])
+
+
+def _csv_to_xlsx(src_path, dst_path, sheet_name):
+    # The write only mode streams rows to disk instead of keeping the sheet in memory
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_name[:31])
+    _append_rows(sheet, _read_rows(src_path))
+    workbook.save(dst_path)
+
+
+def _bundle_to_xlsx(src_path, dst_path):
+    workbook = openpyxl.Workbook(write_only=True)
+    with zipfile.ZipFile(src_path) as src:
+        for info in src.infolist():
+            sheet = workbook.create_sheet(title=os.path.splitext(os.path.basename(info.filename))[0][:31])
+            with src.open(info) as table:
+                _append_rows(sheet, csv.reader(io.TextIOWrapper(table, encoding='utf-8-sig', newline='')))
+    workbook.save(dst_path)
+
+
+def _csv_to_parquet(src_path, dst_path):
+    header = next(_read_rows(src_path), [])
+    # Read every column as text: types guessed from the first block may not fit the next ones
+    convert_options = pyarrow.csv.ConvertOptions(column_types={name: pyarrow.string() for name in header})
+    reader = pyarrow.csv.open_csv(src_path, convert_options=convert_options)
+    with pyarrow.parquet.ParquetWriter(dst_path, reader.schema) as writer:
+        for batch in reader:
+            writer.write_batch(batch)
@@ -0,0 +1,220 @@
+"""Deduplication of ActivityInfo download jobs and exports.
+
+Downloads can be requested from the UI, the API, the CLI and the auto-update
+sync at the same time. Two layers avoid doing the same work twice:
+ - Download jobs: the RQ job of each resource is saved in Redis until the job
+   ends. Asking to download a resource that already has a queued or running
+   job returns that job instead of enqueueing a new one.
+ - Exports: download jobs needing the same export (same form, format and
+   columns) share a single ActivityInfo export job, see SharedExport. The API
+   key is part of the key because ActivityInfo applies the permissions of its
+   user to the exported data.
+
+If Redis is not reachable nothing is deduplicated.
+"""
+import hashlib
+import logging
+import time
+
+from redis.exceptions import RedisError
+from rq.exceptions import NoSuchJobError
+from rq.job import Job
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.data.redis_store import RELEASE_SCRIPT, get_redis_connection, hash_token, make_key
+
+
+log = logging.getLogger(__name__)
+
+ENDED_JOB_STATUSES = ('finished', 'failed', 'stopped', 'canceled')
+
+# Set the key if it is missing or still has the value ARGV[1], else return its value
+CLAIM_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current or current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return false
+end
+return current
+"""
+
+
+def _job_key(resource_id):
+    return make_key('download-job', resource_id)
+
+
+def _release(keys, value):
+    try:
+        script = get_redis_connection().register_script(RELEASE_SCRIPT)
+        for key in keys:
+            script(keys=[key], args=[value])
+    except RedisError as e:
+        log.warning(f"Could not release the ActivityInfo keys {keys}: {e}")
+
+
+def _is_active(job_id):
+    try:
+        job = Job.fetch(job_id, connection=get_redis_connection())
+    except NoSuchJobError:
+        # Claimed but not enqueued yet. If the caller died the claim expires.
+        return True
+    return job.get_status() not in ENDED_JOB_STATUSES
+
+
+def _claim(script, resource_id, job_id, ttl):
+    """Save job_id as the download job of the resource, unless it has an active one.
+
+    The key is only replaced, by CLAIM_SCRIPT, if it still has the value
+    checked in RQ, so two claims can not both succeed.
+
+    Returns:
+        The ID of the active job, None if the resource was claimed.
+    """
+    checked = ''
+    while True:
+        current = script(keys=[_job_key(resource_id)], args=[checked, job_id, ttl])
+        if current is None:
+            return None
+        current = current.decode()
+        if _is_active(current):
+            return current
+        # The job ended, replace it if nobody claimed the resource meanwhile
+        checked = current
+
+
+def claim_download_jobs(resource_ids, job_id, ttl):
+    """Save job_id as the download job of the resources.
+
+    Args:
+        resource_ids: The CKAN resource IDs the job will download
+        job_id: The ID of the RQ job about to be enqueued
+        ttl: Seconds the claim is kept if the job never releases it
+
+    Returns:
+        The ID of the queued or running job if every resource already has one,
+        in which case nothing is claimed. None if the resources were claimed.
+    """
+    try:
+        redis_conn = get_redis_connection()
+        script = redis_conn.register_script(CLAIM_SCRIPT)
+        active = {}
+        for resource_id in resource_ids:
+            active_job_id = _claim(script, resource_id, job_id, ttl)
+            if active_job_id is not None:
+                active[resource_id] = active_job_id
+        if active and len(active) == len(resource_ids):
+            return active[resource_ids[0]]
+        # The job downloads the other resources anyway, it takes over their downloads
+        for resource_id in active:
+            redis_conn.set(_job_key(resource_id), job_id, ex=ttl)
+    except RedisError as e:
+        log.warning(f"Could not check the ActivityInfo download jobs of {resource_ids}: {e}")
+    return None
+
+
+def get_download_jobs(resource_ids):
+    """Get the queued or running download job of the resources, without checking it in RQ.
+
+    Returns:
+        A dict {resource_id: job_id} with the resources having a download job.
+    """
+    if not resource_ids:
+        return {}
+    try:
+        job_ids = get_redis_connection().mget([_job_key(resource_id) for resource_id in resource_ids])
+    except RedisError as e:
+        log.warning(f"Could not read the ActivityInfo download jobs of {resource_ids}: {e}")
+        return {}
+    return {
+        resource_id: job_id.decode()
+        for resource_id, job_id in zip(resource_ids, job_ids)
+        if job_id is not None
+    }
+
+
+def get_active_download_jobs(resource_ids):
+    """Get the queued or running download job of the resources, checked in RQ.
+
+    Returns:
+        A dict {resource_id: job_id} with the resources having an active download job.
+    """
+    jobs = get_download_jobs(resource_ids)
+    try:
+        return {resource_id: job_id for resource_id, job_id in jobs.items() if _is_active(job_id)}
+    except RedisError as e:
+        log.warning(f"Could not check the ActivityInfo download jobs of {resource_ids}: {e}")
+        return {}
+
+
+def release_download_jobs(resource_ids, job_id):
+    """Forget job_id as the download job of the resources, once it ended (or failed to enqueue)."""
+    _release([_job_key(resource_id) for resource_id in resource_ids], job_id)
+
+
+class SharedExport:
+    """One ActivityInfo export job shared by all the download jobs needing it.
+
+    The first job starts the export and publishes its ActivityInfo job ID. The
+    jobs asking for the same export while it runs poll that job instead of
+    starting a new one. The first job to see the export end forgets it, so the
+    next download gets fresh data.
+
+    Config settings:
+        ckanext.activityinfo.shared_exports: share exports between jobs (default true)
+    """
+
+    PENDING = b'pending'
+    WAIT_INTERVAL = 1
+
+    def __init__(self, api_key, form_id, export_format, columns=None, export_filter=None, ttl=3600, max_wait=30):
+        descriptor = ','.join(sorted(columns or [])) + f'|{export_filter or ""}'
+        columns_hash = hashlib.sha256(descriptor.encode('utf-8')).hexdigest()[:16]
+        self.key = make_key('export', hash_token(api_key), form_id, export_format, columns_hash)
+        self.ttl = int(ttl)
+        self.max_wait = max_wait
+        self.enabled = toolkit.asbool(toolkit.config.get('ckanext.activityinfo.shared_exports', True))
+
+    def start(self, start_export):
+        """Join the running export or start a new one with start_export().
+
+        Args:
+            start_export: A function starting the ActivityInfo export and returning its job ID
+
+        Returns:
+            A tuple (job_id, joined). joined is True if another download started the export.
+        """
+        if not self.enabled:
+            return start_export(), False
+
+        started_at = time.monotonic()
+        while True:
+            try:
+                redis_conn = get_redis_connection()
+                if redis_conn.set(self.key, self.PENDING, nx=True, ex=self.max_wait):
+                    break
+                current = redis_conn.get(self.key)
+            except RedisError as e:
+                log.warning(f"Could not share the ActivityInfo export {self.key}: {e}")
+                return start_export(), False
+            if current is not None and current != self.PENDING:
+                log.info(f"Joining the running ActivityInfo export {current.decode()}")
+                return current.decode(), True
+            if time.monotonic() - started_at >= self.max_wait:
+                return start_export(), False
+            time.sleep(self.WAIT_INTERVAL)
+
+        try:
+            job_id = start_export()
+        except Exception:
+            _release([self.key], self.PENDING)
+            raise
+        try:
+            redis_conn.set(self.key, job_id, ex=self.ttl)
+        except RedisError as e:
+            log.warning(f"Could not share the ActivityInfo export {self.key}: {e}")
+        return job_id, False
+
+    def finish(self, job_id):
+        """Forget the export once it completed, failed or timed out."""
+        if self.enabled:
+            _release([self.key], job_id)
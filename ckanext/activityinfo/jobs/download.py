@@ -1,19 +1,148 @@
 """Background jobs for ActivityInfo downloads."""
 from __future__ import annotations
 
+import functools
+import hashlib
 import logging
+import os
 import tempfile
-import time
+import uuid
+from contextlib import contextmanager
 
+from ckan.lib.jobs import get_queue
 from ckan.plugins import toolkit
+from rq import Queue, get_current_job
 from werkzeug.datastructures import FileStorage
 
-from ckanext.activityinfo.utils import get_user_token
+from ckanext.activityinfo.utils import get_export_columns, get_export_filter, get_user_token, is_form_bundle
 from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.exceptions import (
+    ActivityInfoFileTooLargeError,
+    ActivityInfoRateLimitError,
+    ActivityInfoUploadError,
+)
+from ckanext.activityinfo.jobs.bundle import pack_bundle
+from ckanext.activityinfo.jobs.convert import (
+    UPSTREAM_FORMATS,
+    can_convert,
+    can_convert_bundle,
+    convert_bundle,
+    convert_csv,
+    get_mime_type,
+)
+from ckanext.activityinfo.jobs.dedupe import SharedExport, claim_download_jobs, release_download_jobs
+from ckanext.activityinfo.jobs.incremental import IncrementalSync, SchemaChangedError, is_incremental_enabled
+from ckanext.activityinfo.jobs.polling import AdaptivePoller
+from ckanext.activityinfo.jobs.progress import ProgressThrottle, record_upload_outcome, set_progress
+from ckanext.activityinfo.jobs.query import (
+    count_csv_records,
+    estimate_record_count,
+    get_query_max_records,
+    use_query_path,
+    write_records,
+)
 
 
 log = logging.getLogger(__name__)
 
+# Records between two progress updates of the query path
+QUERY_PROGRESS_STEP = 1000
+
+
+def get_download_job_timeout(exports: int = 1) -> int:
+    """Get the RQ timeout for download jobs, in seconds.
+
+    ckanext.activityinfo.download.job_timeout is the time for one ActivityInfo
+    export. It defaults to the max polling time (ckanext.activityinfo.polling.max_timeout)
+    plus 10 minutes to download and upload the file, plus the max wait for an
+    export slot (ckanext.activityinfo.rate_limit.export_slot_wait) when the
+    concurrent exports are limited.
+
+    Args:
+        exports: The number of ActivityInfo exports the job may run. A group
+            of resources runs at most one export per resource.
+    """
+    config = toolkit.config
+    default = float(config.get('ckanext.activityinfo.polling.max_timeout', 3600)) + 600
+    if toolkit.asint(config.get('ckanext.activityinfo.rate_limit.max_concurrent_exports', 0) or 0) > 0:
+        default += float(config.get('ckanext.activityinfo.rate_limit.export_slot_wait', 600))
+    default = int(default)
+    timeout = toolkit.asint(config.get('ckanext.activityinfo.download.job_timeout', default))
+    return timeout * max(1, exports)
+
+
+def enqueue_download_job(resource_ids: list, user: str, title: str) -> tuple:
+    """Enqueue the download of resources, unless it is already queued or running.
+
+    One resource is downloaded by download_activityinfo_resource and several
+    by download_activityinfo_resource_group. See jobs.dedupe.
+
+    Returns:
+        A tuple (job_id, created). created is False when the resources already
+        had a queued or running download job, whose ID is returned.
+    """
+    job_id = str(uuid.uuid4())
+    timeout = get_download_job_timeout(len(resource_ids))
+    active_job_id = claim_download_jobs(resource_ids, job_id, ttl=timeout)
+    if active_job_id:
+        log.info(f"ActivityInfo: Resources {resource_ids} already have the download job {active_job_id}")
+        return active_job_id, False
+
+    if len(resource_ids) == 1:
+        job_func, args = download_activityinfo_resource, [resource_ids[0], user]
+    else:
+        job_func, args = download_activityinfo_resource_group, [resource_ids, user]
+    try:
+        job = toolkit.enqueue_job(job_func, args, title=title, rq_kwargs={'timeout': timeout, 'job_id': job_id})
+    except Exception:
+        release_download_jobs(resource_ids, job_id)
+        raise
+    return job.id, True
+
+
+def enqueue_download_jobs(downloads: list) -> list:
+    """Enqueue download_activityinfo_resource jobs with a single Redis pipeline.
+
+    Same jobs as act_info_update_resource_file, without a round trip to Redis
+    per job. Resources with a queued or running download job are not enqueued
+    again.
+
+    Args:
+        downloads: (resource_id, user) tuples
+
+    Returns:
+        (job_id, created) tuples in the same order, see enqueue_download_job
+    """
+    queue = get_queue()
+    timeout = get_download_job_timeout()
+    jobs = []
+    job_datas = []
+    for resource_id, user in downloads:
+        job_id = str(uuid.uuid4())
+        active_job_id = claim_download_jobs([resource_id], job_id, ttl=timeout)
+        if active_job_id:
+            jobs.append((active_job_id, False))
+            continue
+        jobs.append((job_id, True))
+        job_datas.append(Queue.prepare_data(
+            download_activityinfo_resource,
+            args=[resource_id, user],
+            timeout=timeout,
+            job_id=job_id,
+            meta={'title': f"Download ActivityInfo for resource {resource_id}"},
+        ))
+    if job_datas:
+        try:
+            with queue.connection.pipeline() as pipe:
+                queue.enqueue_many(job_datas, pipeline=pipe)
+                pipe.execute()
+        except Exception:
+            for (resource_id, _), (job_id, created) in zip(downloads, jobs):
+                if created:
+                    release_download_jobs([resource_id], job_id)
+            raise
+    return jobs
+
 
 def download_activityinfo_resource(resource_id: str, user: str) -> None:
     """Background job to download ActivityInfo data and update the resource.
@@ -22,92 +151,703 @@ def download_activityinfo_resource(resource_id: str, user: str) -> None:
         resource_id: The CKAN resource ID
         user: The username who initiated the download
     """
+    download_activityinfo_resource_group([resource_id], user)
+
+
+def download_activityinfo_resource_group(resource_ids: list, user: str) -> None:
+    """Background job to download one ActivityInfo form to several resources.
+
+    The resources are different formats of the same form. The form is exported
+    once (as CSV) and the other formats are converted locally, see jobs.convert.
+    Formats that can not be converted here are exported by ActivityInfo.
+
+    Resources whose export did not change since the last download are not
+    uploaded again, see _update_targets_with_file.
+
+    Form bundles export the form with all its sub-forms, see jobs.bundle.
+
+    Args:
+        resource_ids: The CKAN resource IDs, all linked to the same form
+        user: The username who initiated the download
+    """
+    try:
+        _download_resource_group(resource_ids, user)
+    finally:
+        # New downloads of these resources can be enqueued again
+        job = get_current_job()
+        if job is not None:
+            release_download_jobs(resource_ids, job.id)
+
 
-    log.info(f"ActivityInfo Job: Starting download for resource {resource_id}")
+def _download_resource_group(resource_ids: list, user: str) -> None:
+    log.info(f"ActivityInfo Job: Starting download for resources {resource_ids}")
 
     context = {'user': user}
 
-    resource = toolkit.get_action('resource_show')(context, {'id': resource_id})
+    resources = [toolkit.get_action('resource_show')(context, {'id': resource_id}) for resource_id in resource_ids]
 
-    form_id = resource.get('activityinfo_form_id')
-    format_type = resource.get('activityinfo_format', 'csv').lower()
-    form_label = resource.get('activityinfo_form_label', 'ActivityInfo Export')
+    form_id = resources[0].get('activityinfo_form_id')
+    form_label = resources[0].get('activityinfo_form_label', 'ActivityInfo Export')
 
     if not form_id:
         raise ValueError("Missing activityinfo_form_id")
-
-    _update_resource_status(toolkit.fresh_context(context), resource_id, 'exporting', 0)
+    if any(resource.get('activityinfo_form_id') != form_id for resource in resources):
+        raise ValueError("All the resources of a download group must use the same ActivityInfo form")
+    column_ids = get_export_columns(resources[0])
+    row_filter = get_export_filter(resources[0])
+    if any(get_export_columns(resource) != column_ids or get_export_filter(resource) != row_filter
+           for resource in resources):
+        raise ValueError("All the resources of a download group must use the same columns and filter")
+    bundle = is_form_bundle(resources[0])
+    if any(is_form_bundle(resource) != bundle for resource in resources):
+        raise ValueError("All the resources of a download group must be form bundles, or none of them")
+
+    targets = [(resource['id'], resource.get('activityinfo_format', 'csv').lower()) for resource in resources]
+    resource_ids = [resource_id for resource_id, _ in targets]
+    _update_resources_status(context, resource_ids, 'exporting', 0)
 
     token = get_user_token(user)
     if not token:
-        _update_resource_status(toolkit.fresh_context(context), resource_id, 'error', 0, 'No API key configured')
+        _update_resources_status(context, resource_ids, 'error', 0, 'No API key configured')
         raise ValueError("No ActivityInfo API key configured for user")
 
     client = ActivityInfoClient(api_key=token)
 
-    log.info(f"ActivityInfo Job: Starting export for form {form_id}")
-    job_info = client.start_job_download_form_data(form_id, format=format_type.upper())
-    job_id = job_info.get('id') or job_info.get('jobId')
+    exports, unavailable = _plan_bundle_exports(targets) if bundle else _plan_exports(targets)
+    for resource_id, format_type in unavailable:
+        _update_resource_status(
+            toolkit.fresh_context(context), resource_id, 'error', 0, f"The {format_type} format is not available"
+        )
+
+    # A failed export does not stop the other ones, the job fails once they are done
+    errors = []
+    for export_format, export_targets in exports.items():
+        export_ids = [resource_id for resource_id, _ in export_targets]
+        rate_limited = [error for error in errors if isinstance(error, ActivityInfoRateLimitError)]
+        if rate_limited:
+            _update_resources_status(context, export_ids, 'error', 0, str(rate_limited[0]))
+            continue
+        try:
+            # Do not run more upstream exports at once than the token budget allows
+            with client.export_slot():
+                _export_group_targets(
+                    client, context, export_targets, form_id, export_format, form_label, resources,
+                    bundle=bundle, column_ids=column_ids, row_filter=row_filter,
+                )
+        except ActivityInfoUploadError as e:
+            # Only the failed resources have an error, the others are complete
+            log.error(f"ActivityInfo Job: The {export_format} export of resources {e.resource_ids} failed: {e}")
+            errors.append(e)
+        except Exception as e:
+            log.error(f"ActivityInfo Job: The {export_format} export of resources {export_ids} failed: {e}")
+            _update_resources_status(context, export_ids, 'error', 0, str(e))
+            errors.append(e)
+
+    if errors:
+        raise errors[0]
+    if unavailable:
+        raise ValueError(f"ActivityInfo formats not available: {[format_type for _, format_type in unavailable]}")
+
+
+def _export_group_targets(client: ActivityInfoClient, context: dict, targets: list, form_id: str,
+                          export_format: str, form_label: str, resources: list, bundle: bool = False,
+                          column_ids: list = None, row_filter: str = None) -> None:
+    """Run one export of a download group and upload it to its targets."""
+    current_resources = {resource['id']: resource for resource in resources}
+    if bundle:
+        _export_bundle_and_update(
+            client, context, targets, form_id, export_format, form_label, current_resources=current_resources,
+        )
+    else:
+        _export_and_update(
+            client, context, targets, form_id, export_format, form_label, current_resources=current_resources,
+            column_ids=column_ids, row_filter=row_filter,
+        )
+
+
+def _plan_exports(targets: list) -> tuple:
+    """Group the (resource_id, format) targets by the format to export from ActivityInfo.
+
+    A single target in a format ActivityInfo supports is exported as is. Otherwise
+    CSV is exported once and converted locally to every format we can convert to,
+    and the other formats ActivityInfo supports are exported on their own.
+
+    Returns:
+        A tuple with a dict {export_format: [targets]} and a list of the
+        targets in formats that are not available.
+    """
+    if len(targets) == 1 and targets[0][1] in UPSTREAM_FORMATS:
+        return {targets[0][1]: targets}, []
+    exports = {}
+    unavailable = []
+    for target in targets:
+        format_type = target[1]
+        if can_convert(format_type):
+            exports.setdefault('csv', []).append(target)
+        elif format_type in UPSTREAM_FORMATS:
+            exports.setdefault(format_type, []).append(target)
+        else:
+            unavailable.append(target)
+    return exports, unavailable
+
+
+def _plan_bundle_exports(targets: list) -> tuple:
+    """Group the (resource_id, format) targets of a form bundle by the format to export.
+
+    The bundle is exported once as CSV (a CSV file per form) and packed or converted
+    locally. XLSX is exported by ActivityInfo when it can not be converted here.
+
+    Returns:
+        A tuple with a dict {export_format: [targets]} and a list of the
+        targets in formats that are not available.
+    """
+    exports = {}
+    unavailable = []
+    for target in targets:
+        format_type = target[1]
+        if can_convert_bundle(format_type):
+            exports.setdefault('csv', []).append(target)
+        elif format_type == 'xlsx':
+            exports.setdefault(format_type, []).append(target)
+        else:
+            unavailable.append(target)
+    return exports, unavailable
+
+
+def _export_and_update(client: ActivityInfoClient, context: dict, targets: list,
+                       form_id: str, export_format: str, form_label: str,
+                       current_resources: dict = None, column_ids: list = None,
+                       row_filter: str = None) -> None:
+    """Run the ActivityInfo export job, wait for it and upload the file to the resources.
+
+    CSV exports of small forms use the query API instead of an export job, see jobs.query.
+    CSV exports only transfer the records modified since the last download when
+    ckanext.activityinfo.incremental.enabled is set, see jobs.incremental.
+
+    Args:
+        targets: (resource_id, format) tuples. Formats other than export_format
+            are converted from the exported file.
+        current_resources: The target resources by ID, as they were before the
+            export. Used to skip the upload of unchanged exports.
+        column_ids: Only export these columns (see activityinfo_columns).
+        row_filter: Only export the records matching this formula (see activityinfo_filter).
+    """
+    resource_ids = [resource_id for resource_id, _ in targets]
+    # Poll for job completion, see AdaptivePoller for the intervals and timeout
+    poller = AdaptivePoller.from_config()
+
+    sync = None
+    if export_format == 'csv' and is_incremental_enabled():
+        resources = [(current_resources or {}).get(resource_id, {}) for resource_id in resource_ids]
+        sync = IncrementalSync(client.api_key, form_id, resources, column_ids=column_ids, row_filter=row_filter)
+
+    try:
+        _run_export(client, context, targets, form_id, export_format, form_label, poller, current_resources, sync,
+                    column_ids, row_filter)
+    except SchemaChangedError as e:
+        log.warning(f"ActivityInfo Job: {e}, running a full export for resources {resource_ids}")
+        sync.full()
+        _run_export(client, context, targets, form_id, export_format, form_label, poller, current_resources, sync,
+                    column_ids, row_filter)
+    log.info(f"ActivityInfo Job: Successfully updated resources {resource_ids}")
+    _log_job_stats(client, poller, resource_ids)
+
+
+def _run_export(client: ActivityInfoClient, context: dict, targets: list, form_id: str,
+                export_format: str, form_label: str, poller: AdaptivePoller,
+                current_resources: dict = None, sync: IncrementalSync = None,
+                column_ids: list = None, row_filter: str = None) -> None:
+    resource_ids = [resource_id for resource_id, _ in targets]
+    columns = None
+    export_filter = row_filter
+    if column_ids or sync is not None:
+        try:
+            columns = client.get_form_columns(form_id, column_ids=column_ids)
+        except ValueError as e:
+            _update_resources_status(context, resource_ids, 'error', 0, str(e))
+            raise
+    if sync is not None:
+        columns = sync.get_columns(columns)
+        if sync.get_filter():
+            log.info(f"ActivityInfo Job: Exporting the records of form {form_id} modified since {sync.since}")
+            export_filter = _combine_filters(row_filter, sync.get_filter())
+
+    resources = [(current_resources or {}).get(resource_id, {}) for resource_id in resource_ids]
+    if export_format == 'csv' and use_query_path(resources):
+        _query_and_update(client, context, targets, form_id, form_label, columns, export_filter,
+                          current_resources, sync)
+        return
+
+    shared_export = SharedExport(
+        client.api_key, form_id, export_format,
+        columns=[column['id'] for column in columns] if columns else None,
+        export_filter=export_filter,
+        ttl=poller.max_timeout,
+    )
+    status = _run_shared_export(
+        client, context, resource_ids, poller, shared_export,
+        lambda: _start_export_job(client, form_id, export_format, columns, export_filter),
+    )
+    _download_export(client, context, targets, status, export_format, form_label, poller, current_resources, sync)
+
+
+def _run_shared_export(client: ActivityInfoClient, context: dict, resource_ids: list, poller: AdaptivePoller,
+                       shared_export: SharedExport, start_export) -> dict:
+    """Start the ActivityInfo export job, or join the same running export, and wait for it.
+
+    Jobs needing the same export at the same time share it, see jobs.dedupe.
+
+    Args:
+        start_export: A function starting the export job and returning its ID.
+
+    Returns:
+        The status of the completed job.
+    """
+    try:
+        job_id, joined = shared_export.start(start_export)
+    except ValueError:
+        _update_resources_status(context, resource_ids, 'error', 0, 'Failed to start export job')
+        raise
+    if joined:
+        log.info(f"ActivityInfo Job: Sharing the running export {job_id} for resources {resource_ids}")
+
+    try:
+        return _wait_for_export(client, context, resource_ids, job_id, poller)
+    finally:
+        shared_export.finish(job_id)
+
+
+def _query_and_update(client: ActivityInfoClient, context: dict, targets: list, form_id: str,
+                      form_label: str, columns: list = None, export_filter: str = None,
+                      current_resources: dict = None, sync: IncrementalSync = None) -> None:
+    """Stream the records with the query API and upload the file, without an export job.
+
+    The file is written as CSV, or as JSON when all the targets are JSON. The other
+    formats are converted from the CSV, as for the exports.
+    """
+    resource_ids = [resource_id for resource_id, _ in targets]
+    if columns is None:
+        columns = client.get_form_columns(form_id)
+    query_format = 'csv'
+    if sync is None and all(format_type == 'json' for _, format_type in targets):
+        query_format = 'json'
+    log.info(f"ActivityInfo Job: Querying the records of form {form_id} as {query_format}")
+    _update_resources_status(context, resource_ids, 'downloading', 0)
+
+    # A delta has fewer records than the last download, do not report a wrong progress
+    expected = None if sync is not None and sync.is_delta else estimate_record_count(
+        [(current_resources or {}).get(resource_id, {}) for resource_id in resource_ids]
+    )
+    throttle = ProgressThrottle()
+    throttle.mark_persisted('downloading', 0)
+
+    def records():
+        for i, record in enumerate(client.iter_form_records(form_id, columns, export_filter), 1):
+            if expected and i % QUERY_PROGRESS_STEP == 0:
+                progress = min(99, i * 100 // expected)
+                _report_progress(toolkit.fresh_context(context), resource_ids, throttle, 'downloading', progress)
+            yield record
+
+    with _tmp_files() as tmp_paths:
+        tmp = _create_tmp_file(query_format)
+        tmp_paths.append(tmp.name)
+        hasher = hashlib.sha256()
+        with tmp:
+            count = write_records(records(), columns, tmp, query_format, hasher)
+        log.info(f"ActivityInfo Job: Wrote {count} records for resources {resource_ids}")
+        # A sync merges the records into the last full file, count the merged file
+        count_records = count_csv_records if sync is not None else lambda path: count
+        _sync_and_update(
+            context, targets, tmp.name, hasher.hexdigest(), query_format, form_label, tmp_paths,
+            current_resources=current_resources, sync=sync, count_records=count_records,
+        )
+
+
+def _export_bundle_and_update(client: ActivityInfoClient, context: dict, targets: list,
+                              form_id: str, export_format: str, form_label: str,
+                              current_resources: dict = None) -> None:
+    """Export a form and all its sub-forms with a single ActivityInfo export job
+    and upload the tables to the resources, see jobs.bundle.
+
+    Args:
+        targets: (resource_id, format) tuples, in BUNDLE_FORMATS.
+        export_format: csv to pack (or convert) the CSV tables locally, or xlsx to
+            upload the ActivityInfo XLSX file as is.
+        current_resources: The target resources by ID, as they were before the
+            export. Used to skip the upload of unchanged exports.
+    """
+    resource_ids = [resource_id for resource_id, _ in targets]
+    poller = AdaptivePoller.from_config()
+
+    tables = client.get_form_bundle(form_id)
+
+    shared_export = SharedExport(
+        client.api_key, form_id, f'bundle-{export_format}',
+        columns=[table['form_id'] for table in tables],
+        ttl=poller.max_timeout,
+    )
+    status = _run_shared_export(
+        client, context, resource_ids, poller, shared_export,
+        lambda: _start_bundle_export_job(client, form_id, tables, export_format),
+    )
+    _download_bundle_export(client, context, targets, status, tables, export_format, form_label, poller,
+                            current_resources)
+    log.info(f"ActivityInfo Job: Successfully updated resources {resource_ids}")
+    _log_job_stats(client, poller, resource_ids)
+
 
+def _start_bundle_export_job(client: ActivityInfoClient, form_id: str, tables: list, export_format: str) -> str:
+    """Start the ActivityInfo export job of a form bundle and get its ID."""
+    log.info(f"ActivityInfo Job: Starting {export_format} export for form {form_id} and {len(tables) - 1} sub-forms")
+    job_info = client.start_job_download_forms_data(tables, format=export_format.upper())
+    job_id = job_info.get('id') or job_info.get('jobId')
     if not job_id:
-        _update_resource_status(toolkit.fresh_context(context), resource_id, 'error', 0, 'Failed to start export job')
         raise ValueError("Failed to start ActivityInfo export job")
+    log.debug(f"ActivityInfo Job: Export job started with ID {job_id}")
+    return job_id
+
+
+def _download_bundle_export(client: ActivityInfoClient, context: dict, targets: list, status: dict,
+                            tables: list, export_format: str, form_label: str, poller: AdaptivePoller,
+                            current_resources: dict = None) -> None:
+    """Download a completed bundle export and upload it to the target resources.
+
+    CSV exports are packed as a ZIP file with a CSV file per form (see jobs.bundle.pack_bundle)
+    and converted to the other formats of the targets.
+    """
+    # The suffix does not matter, ActivityInfo may send a ZIP file or a single CSV file
+    with _tmp_files() as tmp_paths:
+        export_path, export_hash = _download_export_file(
+            client, context, targets, status, export_format, poller, tmp_paths,
+        )
+        upload_format = export_format
+        if export_format == 'csv':
+            packed = _create_tmp_file('zip')
+            packed.close()
+            tmp_paths.append(packed.name)
+            export_hash = pack_bundle(export_path, packed.name, tables)
+            export_path, upload_format = packed.name, 'zip'
+        _update_targets_with_file(
+            toolkit.fresh_context(context), targets, export_path, upload_format, _safe_label(form_label),
+            export_hash=export_hash, current_resources=current_resources, converter=convert_bundle,
+        )
 
+
+def _combine_filters(*formulas) -> str:
+    """Build a formula matching the records that match all the formulas."""
+    formulas = [formula for formula in formulas if formula]
+    if len(formulas) == 1:
+        return formulas[0]
+    return ' && '.join(f"({formula})" for formula in formulas)
+
+
+def _start_export_job(client: ActivityInfoClient, form_id: str, export_format: str,
+                      columns: list = None, export_filter: str = None) -> str:
+    """Start the ActivityInfo export job and get its ID."""
+    log.info(f"ActivityInfo Job: Starting {export_format} export for form {form_id}")
+    kwargs = {}
+    if columns is not None:
+        kwargs['columns'] = columns
+    if export_filter:
+        kwargs['filter_formula'] = export_filter
+    job_info = client.start_job_download_form_data(form_id, format=export_format.upper(), **kwargs)
+    job_id = job_info.get('id') or job_info.get('jobId')
+    if not job_id:
+        raise ValueError("Failed to start ActivityInfo export job")
     log.debug(f"ActivityInfo Job: Export job started with ID {job_id}")
+    return job_id
+
 
-    # Poll for job completion
-    max_wait = 300  # 5 minutes max
-    poll_interval = 3
-    elapsed = 0
+def _wait_for_export(client: ActivityInfoClient, context: dict, resource_ids: list,
+                     job_id: str, poller: AdaptivePoller) -> dict:
+    """Poll the ActivityInfo export job until it completes.
 
-    while elapsed < max_wait:
+    Returns:
+        The status of the completed job.
+
+    Raises:
+        ValueError: if the job failed or timed out.
+    """
+    # The caller already saved the 'exporting' status
+    throttle = ProgressThrottle()
+    throttle.mark_persisted('exporting', 0)
+
+    while True:
         status = client.get_job_status(job_id)
         state = status.get('state')
         percent = status.get('percentComplete', 0)
+        poller.observe(percent)
         # Update progress
-        _update_resource_status(toolkit.fresh_context(context), resource_id, 'exporting', percent)
+        _report_progress(toolkit.fresh_context(context), resource_ids, throttle, 'exporting', percent)
 
         if state == 'completed':
-            result = status.get('result', {})
-            download_url = result.get('downloadUrl') if isinstance(result, dict) else None
-            if not download_url:
-                raise ValueError("Export completed but no download URL provided")
+            log.debug(
+                f"ActivityInfo Job: {throttle.writes} progress updates saved to resources {resource_ids}, "
+                f"{throttle.skipped} only saved as live progress"
+            )
+            return status
+
+        elif state == 'failed':
+            error = status.get('error', 'Unknown error')
+            _update_resources_status(context, resource_ids, 'error', percent, error)
+            _log_job_stats(client, poller, resource_ids)
+            raise ValueError(f"ActivityInfo export job failed: {error}")
+
+        if poller.timed_out():
+            break
+        client.renew_export_slot()
+        poller.wait()
 
-            log.info(f"ActivityInfo Job: Export completed, downloading from {download_url}")
-            _update_resource_status(toolkit.fresh_context(context), resource_id, 'downloading', 100)
+    _update_resources_status(context, resource_ids, 'error', 0, 'Timeout waiting for export job to complete')
+    _log_job_stats(client, poller, resource_ids)
+    raise ValueError(f"ActivityInfo export job timed out after {poller.elapsed:.0f} seconds")
 
-            # Download the file
-            if not download_url.startswith('http'):
-                download_url = f"{client.base_url}/{download_url.lstrip('/')}"
 
-            file_data = client.download_file(download_url)
+def _download_export(client: ActivityInfoClient, context: dict, targets: list, status: dict,
+                     export_format: str, form_label: str, poller: AdaptivePoller,
+                     current_resources: dict = None, sync: IncrementalSync = None) -> None:
+    """Download a completed export and upload it to the target resources.
 
-            # Generate filename
-            safe_label = "".join(c if c.isalnum() or c in '-_ ' else '_' for c in form_label)
-            filename = f"{safe_label}.{format_type}"
+    With a sync, the export is merged into the last full file first (see jobs.incremental).
+    """
+    with _tmp_files() as tmp_paths:
+        export_path, export_hash = _download_export_file(
+            client, context, targets, status, export_format, poller, tmp_paths,
+        )
+        count_records = None
+        max_records = get_query_max_records()
+        if export_format == 'csv' and max_records > 0:
+            # Only needed to choose the query path (see jobs.query), big files are not read to the end
+            count_records = functools.partial(count_csv_records, limit=max_records)
+        _sync_and_update(
+            context, targets, export_path, export_hash, export_format, form_label, tmp_paths,
+            current_resources=current_resources, sync=sync, count_records=count_records,
+        )
 
-            # Save to temp file and update resource
-            _update_resource_with_file(toolkit.fresh_context(context), resource_id, file_data, filename, format_type)
 
-            log.info(f"ActivityInfo Job: Successfully updated resource {resource_id}")
-            return
+def _sync_and_update(context: dict, targets: list, export_path: str, export_hash: str,
+                     export_format: str, form_label: str, tmp_paths: list,
+                     current_resources: dict = None, sync: IncrementalSync = None,
+                     count_records=None) -> None:
+    """Merge a downloaded file into the last full file, with a sync, and upload it to the targets.
 
-        elif state == 'failed':
-            error = status.get('error', 'Unknown error')
-            _update_resource_status(toolkit.fresh_context(context), resource_id, 'error', percent, error)
-            raise ValueError(f"ActivityInfo export job failed: {error}")
+    Args:
+        tmp_paths: The temporary files of the download (see _tmp_files), the merged file is added.
+        count_records: Called with the path of the uploaded file to get the
+            activityinfo_record_count extra. Not saved if None.
+    """
+    extras = {}
+    if sync is not None:
+        export_path, export_hash = sync.apply(export_path)
+        tmp_paths.append(export_path)
+        extras = sync.get_extras()
+    if count_records is not None:
+        extras['activityinfo_record_count'] = count_records(export_path)
+    _update_targets_with_file(
+        toolkit.fresh_context(context), targets, export_path, export_format, _safe_label(form_label),
+        export_hash=export_hash, current_resources=current_resources, extras=extras,
+    )
+
+
+def _download_export_file(client: ActivityInfoClient, context: dict, targets: list, status: dict,
+                          export_format: str, poller: AdaptivePoller, tmp_paths: list) -> tuple:
+    """Download the file of a completed export to a temporary file, added to tmp_paths.
+
+    The file is streamed to disk so the worker memory does not grow with the export
+    size, and hashed on the way to detect unchanged exports.
 
-        time.sleep(poll_interval)
-        elapsed += poll_interval
+    Returns:
+        A tuple (path, sha256).
+    """
+    resource_ids = [resource_id for resource_id, _ in targets]
+    result = status.get('result', {})
+    download_url = result.get('downloadUrl') if isinstance(result, dict) else None
+    if not download_url:
+        raise ValueError("Export completed but no download URL provided")
+
+    log.info(f"ActivityInfo Job: Export completed, downloading from {download_url}")
+    _update_resources_status(context, resource_ids, 'downloading', 100)
+    if not download_url.startswith('http'):
+        download_url = f"{client.base_url}/{download_url.lstrip('/')}"
+
+    tmp = _create_tmp_file(export_format)
+    tmp_paths.append(tmp.name)
+    hasher = hashlib.sha256()
+    try:
+        with tmp:
+            size = client.download_to_file(download_url, tmp, hasher=hasher)
+    except ActivityInfoFileTooLargeError as e:
+        _update_resources_status(context, resource_ids, 'error', 100, str(e))
+        _log_job_stats(client, poller, resource_ids)
+        raise
+    log.info(f"ActivityInfo Job: Downloaded {size} bytes for resources {resource_ids}")
+    return tmp.name, hasher.hexdigest()
 
-    _update_resource_status(toolkit.fresh_context(context), resource_id, 'error', 0, 'Timeout waiting for export job to complete')
-    raise ValueError(f"ActivityInfo export job timed out after {max_wait} seconds")
+
+@contextmanager
+def _tmp_files():
+    """Collect the paths of temporary files and remove the files at the end of the block."""
+    tmp_paths = []
+    try:
+        yield tmp_paths
+    finally:
+        for path in set(tmp_paths):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _safe_label(form_label: str) -> str:
+    """Get the file name of the exports of a form, without the extension."""
+    return "".join(c if c.isalnum() or c in '-_ ' else '_' for c in form_label)
+
+
+def _update_targets_with_file(context: dict, targets: list, export_path: str,
+                              export_format: str, safe_label: str, export_hash: str = '',
+                              current_resources: dict = None, extras: dict = None,
+                              converter=convert_csv) -> None:
+    """Upload the exported file, or a conversion of it, to each target resource.
+
+    A failed conversion only fails its own resource, the others are still updated.
+
+    The SHA-256 of the export (with the target format) is saved in the
+    activityinfo_content_hash extra. When it matches the hash of the current
+    upload, the file is not uploaded again: no new file in the storage and no
+    new file to index, only the status changes.
+
+    extras are other resource fields to save with the file (e.g. the sync watermark).
+    converter produces the other formats from the export (convert_bundle for form bundles).
+
+    Raises:
+        ActivityInfoUploadError: if some resources could not be updated, once
+            the error of each one is saved.
+    """
+    current_resources = current_resources or {}
+    failed = []
+    for resource_id, format_type in targets:
+        filename = f"{safe_label}.{format_type}"
+        content_hash = f"{format_type}:{export_hash}" if export_hash else ''
+        try:
+            if _is_unchanged(current_resources.get(resource_id), content_hash, filename):
+                log.info(
+                    f"ActivityInfo Job: {format_type} export unchanged, skipping the upload to resource {resource_id}"
+                )
+                _mark_unchanged(toolkit.fresh_context(context), resource_id, extras)
+            elif format_type == export_format:
+                _upload_resource_file(
+                    toolkit.fresh_context(context), resource_id, export_path, filename, format_type, content_hash,
+                    extras,
+                )
+            else:
+                _convert_and_upload(
+                    toolkit.fresh_context(context), resource_id, export_path, filename, format_type, content_hash,
+                    extras, converter, safe_label,
+                )
+        except Exception:
+            # The error is already saved in the resource
+            failed.append(resource_id)
+
+    if failed:
+        raise ActivityInfoUploadError(f"ActivityInfo Job: could not update resources {failed}", failed)
+
+
+def _convert_and_upload(context: dict, resource_id: str, export_path: str, filename: str,
+                        format_type: str, content_hash: str, extras: dict, converter, safe_label: str) -> None:
+    """Convert the export to the format of the resource and upload it."""
+    converted = _create_tmp_file(format_type)
+    converted.close()
+    try:
+        try:
+            converter(export_path, converted.name, format_type, sheet_name=safe_label or 'Data')
+        except Exception as e:
+            error = f"Failed to convert the export to {format_type}: {e}"
+            log.error(f"ActivityInfo Job: {error} (resource {resource_id})")
+            _update_resource_status(toolkit.fresh_context(context), resource_id, 'error', 100, error)
+            raise
+        _upload_resource_file(context, resource_id, converted.name, filename, format_type, content_hash, extras)
+    finally:
+        os.remove(converted.name)
+
+
+def _is_unchanged(resource: dict, content_hash: str, filename: str) -> bool:
+    """Check if the resource already has an upload of this exact content."""
+    if not resource or not content_hash:
+        return False
+    if not toolkit.asbool(toolkit.config.get('ckanext.activityinfo.skip_unchanged', True)):
+        return False
+    if resource.get('url_type') != 'upload' or not resource.get('url', '').endswith(filename):
+        return False
+    return resource.get('activityinfo_content_hash') == content_hash
+
+
+def _mark_unchanged(context: dict, resource_id: str, extras: dict = None) -> None:
+    """Complete the download of an unchanged export without uploading it."""
+    try:
+        toolkit.get_action('resource_patch')(
+            context,
+            dict(
+                extras or {},
+                id=resource_id,
+                activityinfo_status='complete',
+                activityinfo_progress=100,
+                activityinfo_error='',
+            )
+        )
+    except Exception as e:
+        error = f"ActivityInfo Job: Failed to complete resource {resource_id} with an unchanged export: {e}"
+        log.error(error)
+        _update_resource_status(toolkit.fresh_context(context), resource_id, 'error', 100, error)
+        raise
+    set_progress(resource_id, 'complete', 100)
+    record_upload_outcome('unchanged')
+
+
+def _log_job_stats(client: ActivityInfoClient, poller: AdaptivePoller, resource_ids: list) -> None:
+    """Log the API calls, retries and polls of the export.
+
+    The poll stats are also saved in the RQ job meta (activityinfo_polls and
+    activityinfo_wall_time) to tune the ckanext.activityinfo.polling.* settings.
+    """
+    stats = client.retry_stats
+    log.info(
+        f"ActivityInfo Job: {stats['requests']} API requests for resources {resource_ids}, "
+        f"{stats['retries']} retries ({stats['retry_wait']:.1f}s waiting), {stats['gave_up']} gave up"
+    )
+    poll_stats = poller.stats()
+    log.info(
+        f"ActivityInfo Job: polled the export {poll_stats['polls']} times "
+        f"in {poll_stats['wall_time']:.1f}s for resources {resource_ids}"
+    )
+    job = get_current_job()
+    if job is not None:
+        job.meta['activityinfo_polls'] = poll_stats['polls']
+        job.meta['activityinfo_wall_time'] = poll_stats['wall_time']
+        job.save_meta()
+
+
+def _report_progress(context: dict, resource_ids: list, throttle: ProgressThrottle,
+                     status: str, progress: int, error: str = '') -> None:
+    """Save the live progress and update the resources only when the throttle allows it."""
+    if throttle.should_persist(status, progress, error):
+        _update_resources_status(context, resource_ids, status, progress, error)
+        throttle.mark_persisted(status, progress, error)
+    else:
+        for resource_id in resource_ids:
+            set_progress(resource_id, status, progress, error)
+        throttle.skipped += 1
+
+
+def _update_resources_status(context: dict, resource_ids: list, status: str,
+                             progress: int, error: str = '') -> None:
+    """Update the ActivityInfo status fields on several resources."""
+    for resource_id in resource_ids:
+        _update_resource_status(toolkit.fresh_context(context), resource_id, status, progress, error)
 
 
 def _update_resource_status(context: dict, resource_id: str, status: str,
                             progress: int, error: str = '') -> None:
     """Update the ActivityInfo status fields on a resource."""
 
+    set_progress(resource_id, status, progress, error)
     toolkit.get_action('resource_patch')(
         context,
         {
@@ -119,50 +859,48 @@ def _update_resource_status(context: dict, resource_id: str, status: str,
     )
 
 
-def _update_resource_with_file(context: dict, resource_id: str,
-                               file_data: bytes, filename: str, format_type: str) -> None:
-    """Update resource with the downloaded file."""
+def _create_tmp_file(format_type: str):
+    """Create a named temporary file in ckanext.activityinfo.tmp_dir. The caller must remove it."""
     suffix = f'.{format_type}'
     # Potential error in custom cases
     tmp_folder = toolkit.config.get('ckanext.activityinfo.tmp_dir', 'sys_tmp')
     if not tmp_folder or tmp_folder == 'sys_tmp':
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
-    else:
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=tmp_folder)
+        return tempfile.NamedTemporaryFile(delete=False, suffix=suffix)
+    return tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=tmp_folder)
 
-    tmp.write(file_data)
-    tmp_path = tmp.name
-    tmp.close()
-
-    if format_type == 'xlsx':
-        mime_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-    else:
-        mime_type = 'text/csv'
 
-    f = open(tmp_path, 'rb')
+def _upload_resource_file(context: dict, resource_id: str, tmp_path: str,
+                          filename: str, format_type: str, content_hash: str = '',
+                          extras: dict = None) -> None:
+    """Upload a downloaded file to the resource and mark it as complete."""
+    mime_type = get_mime_type(format_type)
 
-    file_storage = FileStorage(
-        stream=f,
-        filename=filename,
-        content_type=mime_type
-    )
-
-    try:
-        toolkit.get_action('resource_patch')(
-            context,
-            {
-                'id': resource_id,
-                'upload': file_storage,
-                'url': filename,
-                'activityinfo_status': 'complete',
-                'activityinfo_progress': 100,
-                'activityinfo_error': '',
-            }
+    with open(tmp_path, 'rb') as f:
+        file_storage = FileStorage(
+            stream=f,
+            filename=filename,
+            content_type=mime_type
         )
-    except Exception as e:
-        error = f"ActivityInfo Job: Failed to update resource {resource_id} with downloaded file: {e}"
-        log.error(error)
-        _update_resource_status(toolkit.fresh_context(context), resource_id, 'error', 100, error)
-        raise
 
-    f.close()
+        try:
+            toolkit.get_action('resource_patch')(
+                context,
+                dict(
+                    extras or {},
+                    id=resource_id,
+                    upload=file_storage,
+                    url=filename,
+                    activityinfo_status='complete',
+                    activityinfo_progress=100,
+                    activityinfo_error='',
+                    activityinfo_content_hash=content_hash,
+                )
+            )
+        except Exception as e:
+            error = f"ActivityInfo Job: Failed to update resource {resource_id} with downloaded file: {e}"
+            log.error(error)
+            _update_resource_status(toolkit.fresh_context(context), resource_id, 'error', 100, error)
+            raise
+
+    set_progress(resource_id, 'complete', 100)
+    record_upload_outcome('uploaded')
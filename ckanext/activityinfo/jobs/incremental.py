@@ -0,0 +1,259 @@
+"""Incremental (delta) downloads of ActivityInfo forms.
+
+A full export of a big form transfers every record, even when only a few of
+them changed since the last download. In incremental mode:
+ - The exports get a record ID column, and the last full CSV of each form is
+   kept as a snapshot (per API key, the records a key can see may differ, and
+   per selection of columns and filter).
+ - The resources remember the start of their last export
+   (activityinfo_sync_watermark) and of their last full export
+   (activityinfo_last_full_sync).
+ - The next downloads only export the records modified since the watermark
+   (or since the snapshot, if it is older), and merge them into the snapshot
+   by record ID to build the full file.
+
+Deleted records (and records that stopped matching the filter of the
+resource) are not in the deltas, so a full export runs every
+full_refresh_days. A full export also runs when there is no snapshot or
+watermark, or when the columns of the form changed.
+
+Only CSV exports (and the formats converted from them) are incremental.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.data.base import RECORD_ID_COLUMN
+from ckanext.activityinfo.data.redis_store import hash_token
+
+
+log = logging.getLogger(__name__)
+
+DEFAULT_FILTER = '_lastEditTime >= DATE({year}, {month}, {day})'
+
+
+class SchemaChangedError(ValueError):
+    """Raised when a delta export does not have the columns of the snapshot."""
+    pass
+
+
+def is_incremental_enabled():
+    """Check if the CSV downloads are incremental.
+
+    Config settings:
+        ckanext.activityinfo.incremental.enabled: (default false)
+    """
+    if not toolkit.asbool(toolkit.config.get('ckanext.activityinfo.incremental.enabled', False)):
+        return False
+    if not get_snapshot_dir():
+        log.warning("Incremental ActivityInfo downloads need ckan.storage_path or "
+                    "ckanext.activityinfo.incremental.snapshot_dir")
+        return False
+    return True
+
+
+def get_snapshot_dir():
+    """Get the folder of the form snapshots.
+
+    Config settings:
+        ckanext.activityinfo.incremental.snapshot_dir: (default <ckan.storage_path>/activityinfo/snapshots)
+    """
+    snapshot_dir = toolkit.config.get('ckanext.activityinfo.incremental.snapshot_dir')
+    if snapshot_dir:
+        return snapshot_dir
+    storage_path = toolkit.config.get('ckan.storage_path')
+    if not storage_path:
+        return None
+    return os.path.join(storage_path, 'activityinfo', 'snapshots')
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+class IncrementalSync:
+    """Plan and merge the incremental download of a form to a group of resources.
+
+    Config settings:
+        ckanext.activityinfo.incremental.full_refresh_days: days between two full
+            exports, to drop the deleted records (default 30)
+        ckanext.activityinfo.incremental.overlap: seconds the watermark is moved back,
+            for the clock differences and the records saved during the export (default 3600)
+        ckanext.activityinfo.incremental.filter: formula selecting the modified records,
+            with the {year}, {month}, {day} and {timestamp} (seconds) of the watermark
+            (default _lastEditTime >= DATE({year}, {month}, {day}))
+    """
+
+    def __init__(self, api_key, form_id, resources, now=None, column_ids=None, row_filter=None):
+        config = toolkit.config
+        self.form_id = form_id
+        self.started_at = now or datetime.now(timezone.utc)
+        self.full_refresh = timedelta(
+            days=toolkit.asint(config.get('ckanext.activityinfo.incremental.full_refresh_days', 30))
+        )
+        self.overlap = timedelta(
+            seconds=toolkit.asint(config.get('ckanext.activityinfo.incremental.overlap', 3600))
+        )
+        self.filter_template = config.get('ckanext.activityinfo.incremental.filter', DEFAULT_FILTER)
+        name = f"{hash_token(api_key)}-{form_id}"
+        if column_ids or row_filter:
+            selection = json.dumps([column_ids or [], row_filter or ''])
+            name += '-' + hashlib.sha256(selection.encode('utf-8')).hexdigest()[:16]
+        self.snapshot_path = os.path.join(get_snapshot_dir(), f"{name}.csv")
+        self.since = self._get_since(resources)
+
+    @property
+    def is_delta(self):
+        return self.since is not None
+
+    def _get_since(self, resources):
+        """Get the watermark of the delta export, None for a full export."""
+        if not os.path.exists(self.snapshot_path):
+            return None
+        # The snapshot is shared by the resources of the form and may be older than
+        # their watermark (e.g. a resource moved to another form)
+        snapshot_time = datetime.fromtimestamp(os.path.getmtime(self.snapshot_path), timezone.utc)
+        watermarks = [snapshot_time - self.overlap]
+        for resource in resources:
+            watermark = _parse_timestamp(resource.get('activityinfo_sync_watermark'))
+            last_full_sync = _parse_timestamp(resource.get('activityinfo_last_full_sync'))
+            if watermark is None or last_full_sync is None:
+                return None
+            if self.started_at - last_full_sync >= self.full_refresh:
+                return None
+            watermarks.append(watermark)
+        # Resources updated at different times: the oldest watermark covers them all
+        return min(watermarks)
+
+    def full(self):
+        """Switch to a full export."""
+        self.since = None
+
+    def get_columns(self, columns):
+        """Add the record ID column, needed to merge the deltas."""
+        return list(columns) + [RECORD_ID_COLUMN]
+
+    def get_filter(self):
+        """Get the export filter formula, None for a full export."""
+        if self.since is None:
+            return None
+        return self.filter_template.format(
+            year=self.since.year,
+            month=self.since.month,
+            day=self.since.day,
+            timestamp=int(self.since.timestamp()),
+        )
+
+    def get_extras(self):
+        """Get the resource fields to save with the downloaded file."""
+        extras = {'activityinfo_sync_watermark': (self.started_at - self.overlap).isoformat()}
+        if self.since is None:
+            extras['activityinfo_last_full_sync'] = self.started_at.isoformat()
+        return extras
+
+    def apply(self, export_path):
+        """Build the full CSV from the export and keep it as the new snapshot.
+
+        Returns:
+            A tuple (path, sha256) of the full CSV. The caller must remove the file
+            if it is not export_path.
+
+        Raises:
+            SchemaChangedError: if the delta can not be merged into the snapshot.
+        """
+        path = export_path
+        if self.since is not None:
+            merged = tempfile.NamedTemporaryFile(delete=False, suffix='.csv', dir=os.path.dirname(export_path))
+            merged.close()
+            try:
+                updated, added = merge_delta(self.snapshot_path, export_path, merged.name)
+            except Exception:
+                os.remove(merged.name)
+                raise
+            log.info(
+                f"ActivityInfo Job: merged the changes of form {self.form_id} since {self.since.isoformat()}: "
+                f"{updated} records updated, {added} added"
+            )
+            path = merged.name
+        self._save_snapshot(path)
+        return path, _hash_file(path)
+
+    def _save_snapshot(self, path):
+        os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        # Copy next to the snapshot, then replace it at once
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.tmp"
+        shutil.copyfile(path, tmp_path)
+        # The snapshot has the records as they were when the export started
+        timestamp = self.started_at.timestamp()
+        os.utime(tmp_path, (timestamp, timestamp))
+        os.replace(tmp_path, self.snapshot_path)
+
+
+def merge_delta(snapshot_path, delta_path, dst_path):
+    """Write the snapshot rows, replaced by the delta rows with the same record ID,
+    followed by the new records of the delta.
+
+    Only the delta is kept in memory.
+
+    Returns:
+        A tuple (updated, added) with the number of records.
+
+    Raises:
+        SchemaChangedError: if the files do not have the same header, or no record ID column.
+    """
+    with open(delta_path, newline='', encoding='utf-8-sig') as delta_file:
+        delta_rows = csv.reader(delta_file)
+        delta_header = next(delta_rows, None)
+        if delta_header is None:
+            raise SchemaChangedError("The delta export is empty")
+        id_index = _get_id_index(delta_header)
+        changes = {row[id_index]: row for row in delta_rows if len(row) > id_index}
+
+    updated = 0
+    with open(snapshot_path, newline='', encoding='utf-8-sig') as snapshot_file, \
+            open(dst_path, 'w', newline='', encoding='utf-8') as dst:
+        snapshot_rows = csv.reader(snapshot_file)
+        header = next(snapshot_rows, None)
+        if header != delta_header:
+            raise SchemaChangedError("The columns of the form changed since the last full export")
+        writer = csv.writer(dst)
+        writer.writerow(header)
+        for row in snapshot_rows:
+            record_id = row[id_index] if len(row) > id_index else None
+            if record_id in changes:
+                row = changes.pop(record_id)
+                updated += 1
+            writer.writerow(row)
+        added = len(changes)
+        writer.writerows(changes.values())
+    return updated, added
+
+
+def _get_id_index(header):
+    try:
+        return header.index(RECORD_ID_COLUMN['label'])
+    except ValueError:
+        raise SchemaChangedError(f"The export has no {RECORD_ID_COLUMN['label']} column")
+
+
+def _hash_file(path, chunk_size=1024 * 1024):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
@@ -0,0 +1,101 @@
+"""Adaptive polling of ActivityInfo export jobs."""
+import logging
+import time
+
+from ckan.plugins import toolkit
+
+
+log = logging.getLogger(__name__)
+
+
+class AdaptivePoller:
+    """Decide how long to wait between two job status checks and when to give up.
+
+    Polling starts fast, so small exports are picked up right away. Once the job
+    reports some progress, the remaining time is extrapolated from the observed
+    rate and the next poll is scheduled half way to the expected end. Without
+    progress, the interval grows by the backoff factor.
+
+    The job times out when it does not advance for `timeout` seconds, so big
+    exports can run as long as they keep progressing, up to `max_timeout`.
+
+    Args:
+        min_interval: First (and shortest) interval between polls, in seconds.
+        max_interval: Longest interval between polls, in seconds.
+        backoff: Factor applied to the interval while there is no progress.
+        timeout: Seconds without progress before giving up.
+        max_timeout: Max total seconds, even if the job is still advancing.
+    """
+
+    def __init__(self, min_interval=0.5, max_interval=15.0, backoff=1.5, timeout=300.0, max_timeout=3600.0):
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.backoff = max(1.0, backoff)
+        self.timeout = timeout
+        self.max_timeout = max(timeout, max_timeout)
+        self.started_at = time.monotonic()
+        self.interval = min_interval
+        self.polls = 0
+        self.first_progress = None
+        self.last_progress = 0
+        self.last_progress_at = self.started_at
+
+    @classmethod
+    def from_config(cls):
+        """Build the poller from the ckanext.activityinfo.polling.* config settings."""
+        config = toolkit.config
+        return cls(
+            min_interval=float(config.get('ckanext.activityinfo.polling.min_interval', 0.5)),
+            max_interval=float(config.get('ckanext.activityinfo.polling.max_interval', 15)),
+            backoff=float(config.get('ckanext.activityinfo.polling.backoff', 1.5)),
+            timeout=float(config.get('ckanext.activityinfo.polling.timeout', 300)),
+            max_timeout=float(config.get('ckanext.activityinfo.polling.max_timeout', 3600)),
+        )
+
+    @property
+    def elapsed(self):
+        """Seconds since the poller was created."""
+        return time.monotonic() - self.started_at
+
+    def observe(self, percent):
+        """Record the progress reported by a poll and compute the next interval."""
+        now = time.monotonic()
+        self.polls += 1
+        percent = percent or 0
+        if self.first_progress is None:
+            self.first_progress = (percent, now)
+        if percent > self.last_progress:
+            self.last_progress = percent
+            self.last_progress_at = now
+
+        remaining = self.estimate_remaining()
+        if remaining is None:
+            self.interval = min(self.max_interval, self.interval * self.backoff) if self.polls > 1 else self.min_interval
+        else:
+            self.interval = min(self.max_interval, max(self.min_interval, remaining / 2))
+
+    def estimate_remaining(self):
+        """Extrapolate the seconds left from the progress rate, None without progress."""
+        if self.first_progress is None:
+            return None
+        first_percent, first_at = self.first_progress
+        advanced = self.last_progress - first_percent
+        spent = self.last_progress_at - first_at
+        if advanced <= 0 or spent <= 0:
+            return None
+        rate = advanced / spent
+        return (100 - self.last_progress) / rate
+
+    def timed_out(self):
+        """Check if we must stop waiting for the job."""
+        now = time.monotonic()
+        if now - self.started_at >= self.max_timeout:
+            return True
+        return now - self.last_progress_at >= self.timeout
+
+    def wait(self):
+        """Sleep until the next poll."""
+        time.sleep(self.interval)
+
+    def stats(self):
+        return {'polls': self.polls, 'wall_time': round(self.elapsed, 2)}
@@ -0,0 +1,187 @@
+"""Live progress of ActivityInfo downloads.
+
+Each resource_patch is a new package revision, a search index update and an
+activity entry, so the download jobs do not write every poll to the resource.
+The live status and progress go to Redis, and the resource is only patched on
+status changes or big enough progress steps (see ProgressThrottle).
+"""
+import json
+import logging
+import time
+
+from redis.exceptions import RedisError
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.data.redis_store import get_redis_connection, make_key
+
+
+log = logging.getLogger(__name__)
+
+PROCESSING_STATUSES = ('pending', 'exporting', 'downloading')
+
+
+def _progress_key(resource_id):
+    return make_key('progress', resource_id)
+
+
+def progress_channel(resource_id):
+    """Redis channel where every progress update of a resource is published (see events)."""
+    return make_key('events', 'progress', resource_id)
+
+
+def set_progress(resource_id, status, progress, error=''):
+    """Save the live status of a resource download.
+
+    Config settings:
+        ckanext.activityinfo.progress.ttl: seconds the live status is kept (default 86400)
+    """
+    ttl = toolkit.asint(toolkit.config.get('ckanext.activityinfo.progress.ttl', 86400))
+    key = _progress_key(resource_id)
+    values = {
+        'status': status,
+        'progress': int(progress or 0),
+        'error': error or '',
+        'updated_at': time.time(),
+    }
+    try:
+        redis_conn = get_redis_connection()
+        pipe = redis_conn.pipeline()
+        pipe.hset(key, mapping=values)
+        pipe.expire(key, ttl)
+        pipe.publish(progress_channel(resource_id), json.dumps(values))
+        pipe.execute()
+    except RedisError as e:
+        log.warning(f"Could not save the ActivityInfo progress of resource {resource_id}: {e}")
+
+
+def get_progress(resource_id):
+    """Get the live status of a resource download.
+
+    Returns:
+        A dict with 'status', 'progress', 'error' and 'updated_at' keys, or None if unknown.
+    """
+    try:
+        values = get_redis_connection().hgetall(_progress_key(resource_id))
+    except RedisError as e:
+        log.warning(f"Could not read the ActivityInfo progress of resource {resource_id}: {e}")
+        return None
+    return _decode_progress(values)
+
+
+def get_progress_many(resource_ids):
+    """Get the live status of several resource downloads with one Redis round trip.
+
+    Returns:
+        A dict {resource_id: progress dict (see get_progress)} with the known resources only.
+    """
+    try:
+        pipe = get_redis_connection().pipeline(transaction=False)
+        for resource_id in resource_ids:
+            pipe.hgetall(_progress_key(resource_id))
+        results = pipe.execute()
+    except RedisError as e:
+        log.warning(f"Could not read the ActivityInfo progress of resources {resource_ids}: {e}")
+        return {}
+    progress = {}
+    for resource_id, values in zip(resource_ids, results):
+        decoded = _decode_progress(values)
+        if decoded:
+            progress[resource_id] = decoded
+    return progress
+
+
+def _decode_progress(values):
+    if not values:
+        return None
+    values = {key.decode(): value.decode() for key, value in values.items()}
+    return {
+        'status': values.get('status'),
+        'progress': int(values.get('progress') or 0),
+        'error': values.get('error', ''),
+        'updated_at': float(values.get('updated_at') or 0),
+    }
+
+
+class ProgressThrottle:
+    """Decide when a progress update must be written to the resource.
+
+    Status changes are always persisted. Progress within the same status is
+    only persisted when it moved at least min_delta points and min_interval
+    seconds passed since the last write.
+
+    Config settings:
+        ckanext.activityinfo.progress.min_interval: seconds (default 30)
+        ckanext.activityinfo.progress.min_delta: percentage points (default 25)
+    """
+
+    def __init__(self, min_interval=None, min_delta=None):
+        config = toolkit.config
+        if min_interval is None:
+            min_interval = float(config.get('ckanext.activityinfo.progress.min_interval', 30))
+        if min_delta is None:
+            min_delta = toolkit.asint(config.get('ckanext.activityinfo.progress.min_delta', 25))
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self.persisted = None
+        self.persisted_at = 0.0
+        self.writes = 0
+        self.skipped = 0
+
+    def should_persist(self, status, progress, error=''):
+        if self.persisted is None:
+            return True
+        last_status, last_progress, last_error = self.persisted
+        if status != last_status or error != last_error:
+            return True
+        if abs((progress or 0) - (last_progress or 0)) < self.min_delta:
+            return False
+        return time.monotonic() - self.persisted_at >= self.min_interval
+
+    def mark_persisted(self, status, progress, error=''):
+        self.persisted = (status, progress, error)
+        self.persisted_at = time.monotonic()
+        self.writes += 1
+
+
+UPLOAD_OUTCOMES = ('uploaded', 'unchanged')
+
+
+def _upload_outcomes_key():
+    return make_key('upload_outcomes')
+
+
+def record_upload_outcome(outcome):
+    """Count a finished download: 'uploaded' (new file) or 'unchanged' (upload skipped).
+
+    The counters are shared by all the download jobs of the site, whatever
+    started them (sync-auto-updates, the scheduler, the UI or the API).
+    """
+    try:
+        get_redis_connection().hincrby(_upload_outcomes_key(), outcome, 1)
+    except RedisError as e:
+        log.warning(f"Could not save the ActivityInfo upload outcome: {e}")
+
+
+def pop_site_upload_outcomes():
+    """Get and reset the upload outcomes counted since the last call.
+
+    These are site-wide counters, not the outcomes of a given sync run: they
+    include every download job finished since the last call.
+
+    Returns:
+        A dict with 'uploaded', 'unchanged' and 'skip_rate' (unchanged / total, 0 to 1).
+    """
+    key = _upload_outcomes_key()
+    try:
+        pipe = get_redis_connection().pipeline()
+        pipe.hgetall(key)
+        pipe.delete(key)
+        values, _ = pipe.execute()
+    except RedisError as e:
+        log.warning(f"Could not read the ActivityInfo upload outcomes: {e}")
+        values = {}
+    values = {name.decode(): int(value) for name, value in values.items()}
+    outcomes = {outcome: values.get(outcome, 0) for outcome in UPLOAD_OUTCOMES}
+    total = sum(outcomes.values())
+    outcomes['skip_rate'] = round(outcomes['unchanged'] / total, 3) if total else 0.0
+    return outcomes
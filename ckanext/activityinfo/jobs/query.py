@@ -0,0 +1,129 @@
+"""Direct query path for small and medium ActivityInfo forms.
+
+An export job takes a few round trips (start the job, poll its status until it
+completes, download the file) and most of its wall time is spent waiting for
+the next poll. For forms with few records it is faster to stream the records
+with the query API (see ActivityInfoClient.iter_form_records) and write the
+file here.
+
+The path is chosen from the number of records of the last download, saved in
+the activityinfo_record_count extra of the resources. Forms with more records
+than ckanext.activityinfo.query.max_records, and forms that were never
+downloaded, use an export job.
+"""
+import csv
+import json
+import logging
+
+from ckan.plugins import toolkit
+
+
+log = logging.getLogger(__name__)
+
+
+def get_query_max_records():
+    """Get the max number of records of a form downloaded with the query API.
+
+    Config settings:
+        ckanext.activityinfo.query.max_records: (default 5000, 0 to always use export jobs)
+    """
+    return toolkit.asint(toolkit.config.get('ckanext.activityinfo.query.max_records', 5000))
+
+
+def estimate_record_count(resources):
+    """Get the number of records of the last download of the resources, None if unknown."""
+    counts = []
+    for resource in resources:
+        try:
+            counts.append(int(resource.get('activityinfo_record_count')))
+        except (TypeError, ValueError):
+            return None
+    return max(counts) if counts else None
+
+
+def use_query_path(resources):
+    """Check if the records of a form can be downloaded with the query API."""
+    max_records = get_query_max_records()
+    if max_records <= 0:
+        return False
+    count = estimate_record_count(resources)
+    return count is not None and count <= max_records
+
+
+def count_csv_records(path, limit=None):
+    """Count the records of a CSV file, without its header.
+
+    Stops reading after limit + 1 records: the exact count of a big file is not needed.
+    """
+    count = 0
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        rows = csv.reader(f)
+        next(rows, None)
+        for _ in rows:
+            count += 1
+            if limit is not None and count > limit:
+                break
+    return count
+
+
+class _Output:
+    """Text output encoding to a binary file, and hashing what is written."""
+
+    def __init__(self, fileobj, hasher=None):
+        self.fileobj = fileobj
+        self.hasher = hasher
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        self.fileobj.write(data)
+        if self.hasher is not None:
+            self.hasher.update(data)
+
+
+def _format_value(value):
+    """Format a query value like the CSV exports of ActivityInfo."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def write_records(records, columns, fileobj, format_type, hasher=None):
+    """Write the query records to a binary file.
+
+    The files are the same as the CSV exports of ActivityInfo, and as their JSON
+    conversion (see convert._csv_to_json), so switching paths does not change them.
+
+    Args:
+        records: lists of values, in the order of columns (see iter_form_records).
+        columns: the column definitions, their labels are the header.
+        format_type: csv or json.
+        hasher: Optional hashlib object updated with the written bytes.
+
+    Returns:
+        The number of records written.
+    """
+    header = [column['label'] for column in columns]
+    output = _Output(fileobj, hasher)
+    count = 0
+    if format_type == 'csv':
+        writer = csv.writer(output)
+        writer.writerow(header)
+        for record in records:
+            writer.writerow([_format_value(value) for value in record])
+            count += 1
+    elif format_type == 'json':
+        output.write('[')
+        for record in records:
+            output.write(',\n' if count else '\n')
+            output.write(json.dumps(dict(zip(header, map(_format_value, record))), ensure_ascii=False))
+            count += 1
+        output.write('\n]\n')
+    else:
+        raise ValueError(f"Can not write ActivityInfo query records as {format_type}")
+    return count
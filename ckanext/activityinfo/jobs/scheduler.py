@@ -0,0 +1,327 @@
+"""Daemon running the ActivityInfo automatic updates when they are due.
+
+An alternative to running sync-auto-updates from cron, see
+`ckan activityinfo scheduler run`:
+ - The next run of every resource with automatic updates is read once from
+   the database and kept in a heap. The daemon sleeps until the first one is
+   due instead of scanning all the resources every few hours.
+ - Each resource runs at its activityinfo_next_run_at plus a jitter derived
+   from its ID, so resources created together are not all exported by
+   ActivityInfo at the same moment. Cron frequencies already include a spread
+   (see schedules.get_spread) and get no jitter.
+ - resource_create and resource_update publish the IDs of the changed
+   resources (notify_schedule_change). The daemon reads them again and moves
+   them in the heap. The whole schedule is also reloaded from time to time,
+   in case a notification was missed.
+ - Several nodes can run the daemon. A Redis lock elects the leader, the only
+   one running updates. Another node takes over if the leader stops renewing
+   the lock.
+"""
+import hashlib
+import heapq
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from redis.exceptions import RedisError
+from ckan import model
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo import utils
+from ckanext.activityinfo.schedules import CronSchedule, parse_frequency
+from ckanext.activityinfo.data.redis_store import RELEASE_SCRIPT, get_redis_connection, make_key
+
+
+log = logging.getLogger(__name__)
+
+# Extend the lock only if we still hold it
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _changes_channel():
+    return make_key('scheduler', 'changes')
+
+
+def notify_schedule_change(resource_id):
+    """Tell the running scheduler that the auto-update settings or status of a resource changed."""
+    try:
+        get_redis_connection().publish(_changes_channel(), resource_id)
+    except RedisError as e:
+        log.warning(f"Could not notify the ActivityInfo scheduler about resource {resource_id}: {e}")
+
+
+def _parse_next_run_at(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).astimezone(timezone.utc)
+    except (ValueError, TypeError):
+        log.warning(f"Invalid activityinfo_next_run_at value: {value}")
+        return None
+
+
+class Scheduler:
+    """Run the automatic updates of the ActivityInfo resources when they are due.
+
+    Config settings:
+        ckanext.activityinfo.scheduler.jitter: max seconds added to the run time of each resource (default 600)
+        ckanext.activityinfo.scheduler.lock_ttl: seconds the leader lock lasts if not renewed (default 60)
+        ckanext.activityinfo.scheduler.reload_interval: seconds between full reloads of the schedule (default 3600)
+    """
+
+    def __init__(self, jitter=None, lock_ttl=None, reload_interval=None, node_id=None):
+        config = toolkit.config
+        if jitter is None:
+            jitter = toolkit.asint(config.get('ckanext.activityinfo.scheduler.jitter', 600))
+        if lock_ttl is None:
+            lock_ttl = toolkit.asint(config.get('ckanext.activityinfo.scheduler.lock_ttl', 60))
+        if reload_interval is None:
+            reload_interval = toolkit.asint(config.get('ckanext.activityinfo.scheduler.reload_interval', 3600))
+        self.jitter = max(0, jitter)
+        self.lock_ttl = max(3, lock_ttl)
+        self.reload_interval = reload_interval
+        self.node_id = node_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lock_key = make_key('scheduler', 'leader')
+        self.is_leader = False
+        self.stats = {'enqueued': 0, 'failed': 0, 'skipped': 0}
+        # Heap of (run_at, resource_id). Entries not matching _scheduled were moved or removed.
+        self._heap = []
+        self._scheduled = {}
+        self._pubsub = None
+        self._loaded_at = None
+        self._renewed_at = None
+        self._stop_event = threading.Event()
+
+    @property
+    def renew_interval(self):
+        return self.lock_ttl / 3
+
+    def get_jitter(self, resource_id, frequency=None):
+        """Seconds added to the run time of a resource, always the same for a given resource.
+
+        The jitter is at most a tenth of the time between two runs of the frequency.
+        """
+        max_jitter = self.jitter
+        try:
+            schedule = parse_frequency(frequency)
+        except ValueError:
+            schedule = None
+        if isinstance(schedule, CronSchedule):
+            return 0
+        if schedule is not None:
+            max_jitter = int(min(max_jitter, schedule.min_gap.total_seconds() / 10))
+        if max_jitter <= 0:
+            return 0
+        digest = hashlib.sha256(resource_id.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % (max_jitter + 1)
+
+    def get_next(self):
+        """Get the (run_at, resource_id) of the next resource to run, None if nothing is scheduled."""
+        while self._heap:
+            run_at, resource_id = self._heap[0]
+            if self._scheduled.get(resource_id) == run_at:
+                return run_at, resource_id
+            heapq.heappop(self._heap)
+        return None
+
+    def set_next_run(self, resource_id, next_run_at, frequency=None):
+        """Schedule a resource at next_run_at (plus its jitter), or remove it if next_run_at is empty."""
+        run_at = _parse_next_run_at(next_run_at)
+        if run_at is None:
+            self._scheduled.pop(resource_id, None)
+            return None
+        run_at += timedelta(seconds=self.get_jitter(resource_id, frequency))
+        if self._scheduled.get(resource_id) != run_at:
+            self._scheduled[resource_id] = run_at
+            heapq.heappush(self._heap, (run_at, resource_id))
+        return run_at
+
+    def load(self):
+        """Read the schedule of all the resources from the database."""
+        self._heap = []
+        self._scheduled = {}
+        for resource_id, (next_run_at, frequency) in utils.get_auto_update_schedule().items():
+            self.set_next_run(resource_id, next_run_at, frequency)
+        self._loaded_at = time.monotonic()
+        log.info(f"Loaded the schedule of {len(self._scheduled)} ActivityInfo resource(s)")
+
+    def refresh(self, resource_ids):
+        """Read the schedule of the changed resources from the database."""
+        schedule = utils.get_auto_update_schedule(resource_ids)
+        for resource_id in resource_ids:
+            self.set_next_run(resource_id, *schedule.get(resource_id, (None, None)))
+        log.debug(f"Rescheduled ActivityInfo resource(s) {sorted(resource_ids)}")
+
+    def run_due(self, now=None):
+        """Run the resources due at now (default: the current time)."""
+        now = now or datetime.now(timezone.utc)
+        while self.is_leader and not self._stop_event.is_set():
+            entry = self.get_next()
+            if entry is None or entry[0] > now:
+                return
+            heapq.heappop(self._heap)
+            del self._scheduled[entry[1]]
+            try:
+                self.run_resource(entry[1], now)
+            except Exception as e:
+                # Try again after the next reload, an error must not stop the daemon
+                log.exception(f"Could not run the automatic update of ActivityInfo resource {entry[1]}: {e}")
+                self.stats['failed'] += 1
+                model.Session.rollback()
+            if time.monotonic() - self._renewed_at >= self.renew_interval:
+                self._elect()
+
+    def run_resource(self, resource_id, now=None):
+        """Enqueue the update of a resource if it is still due, then schedule its next run.
+
+        Returns:
+            The sync-auto-updates summary detail of the resource, None if it was not due anymore.
+        """
+        now_iso = (now or datetime.now(timezone.utc)).astimezone(timezone.utc).isoformat(timespec='seconds')
+        detail = None
+        next_run_at, frequency = utils.get_auto_update_schedule([resource_id]).get(resource_id, (None, None))
+        if next_run_at and next_run_at <= now_iso:
+            resource = model.Resource.get(resource_id)
+            if resource is None or resource.state != 'active':
+                # Deleted since its schedule was read
+                self.set_next_run(resource_id, None)
+                return None
+            detail = utils.sync_resource_auto_update(resource.as_dict())
+            self.stats[detail['status']] += 1
+            next_run_at, frequency = utils.get_auto_update_schedule([resource_id]).get(resource_id, (None, None))
+            if next_run_at and next_run_at <= now_iso:
+                # Skipped or failed: try again after the next reload, like sync-auto-updates
+                next_run_at = None
+        self.set_next_run(resource_id, next_run_at, frequency)
+        return detail
+
+    def run(self):
+        """Run until stop() is called."""
+        log.info(f"ActivityInfo scheduler {self.node_id} started")
+        try:
+            while not self._stop_event.is_set():
+                self.step()
+        finally:
+            self.close()
+        log.info(
+            f"ActivityInfo scheduler {self.node_id} stopped: {self.stats['enqueued']} enqueued, "
+            f"{self.stats['failed']} failed, {self.stats['skipped']} skipped"
+        )
+
+    def step(self):
+        """Check the leadership, run the due resources and wait for the next one or a change."""
+        was_leader = self.is_leader
+        self._elect()
+        if self.is_leader:
+            if not was_leader:
+                log.info(f"ActivityInfo scheduler {self.node_id} is the leader")
+            if not was_leader or self._pubsub is None or \
+                    time.monotonic() - self._loaded_at >= self.reload_interval:
+                # Subscribe before loading so no change is missed
+                if self._pubsub is None:
+                    self._subscribe()
+                self.load()
+        elif was_leader:
+            log.warning(f"ActivityInfo scheduler {self.node_id} lost the leadership")
+            self._unsubscribe()
+            self._heap = []
+            self._scheduled = {}
+
+        try:
+            self.run_due()
+        finally:
+            # Do not keep a transaction open while sleeping
+            model.Session.remove()
+        self.wait(self._get_timeout())
+
+    def wait(self, timeout):
+        """Sleep for timeout seconds, or until a scheduled resource changes."""
+        if self._pubsub is None:
+            self._stop_event.wait(timeout)
+            return
+
+        deadline = time.monotonic() + timeout
+        changed = set()
+        while not changed and not self._stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                # Check the stop event every second
+                message = self._pubsub.get_message(timeout=min(remaining, 1))
+                while message is not None:
+                    changed.add(message['data'].decode())
+                    message = self._pubsub.get_message()
+            except RedisError as e:
+                # The schedule is reloaded at the next step, some changes may be lost
+                log.warning(f"Lost the ActivityInfo scheduler notifications: {e}")
+                self._unsubscribe()
+                self._stop_event.wait(min(remaining, self.renew_interval))
+                return
+        if changed:
+            try:
+                self.refresh(changed)
+            finally:
+                model.Session.remove()
+
+    def stop(self):
+        """Stop the scheduler after the current resource."""
+        self._stop_event.set()
+
+    def close(self):
+        """Release the leadership and the notifications."""
+        self._unsubscribe()
+        if self.is_leader:
+            try:
+                get_redis_connection().register_script(RELEASE_SCRIPT)(keys=[self.lock_key], args=[self.node_id])
+            except RedisError as e:
+                log.warning(f"Could not release the ActivityInfo scheduler lock: {e}")
+            self.is_leader = False
+
+    def _get_timeout(self):
+        timeout = self.renew_interval
+        next_entry = self.get_next() if self.is_leader else None
+        if next_entry is not None:
+            timeout = min(timeout, (next_entry[0] - datetime.now(timezone.utc)).total_seconds())
+        return max(0, timeout)
+
+    def _elect(self):
+        """Renew or take the leader lock."""
+        try:
+            redis_conn = get_redis_connection()
+            renew = redis_conn.register_script(RENEW_SCRIPT)
+            self.is_leader = bool(
+                renew(keys=[self.lock_key], args=[self.node_id, self.lock_ttl])
+                or redis_conn.set(self.lock_key, self.node_id, nx=True, ex=self.lock_ttl)
+            )
+        except RedisError as e:
+            log.warning(f"Could not check the ActivityInfo scheduler lock: {e}")
+            self.is_leader = False
+        if self.is_leader:
+            self._renewed_at = time.monotonic()
+        return self.is_leader
+
+    def _subscribe(self):
+        try:
+            self._pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(_changes_channel())
+        except RedisError as e:
+            log.warning(f"Could not subscribe to the ActivityInfo scheduler notifications: {e}")
+            self._pubsub = None
+
+    def _unsubscribe(self):
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except RedisError:
+                pass
+            self._pubsub = None
@@ -0,0 +1,46 @@
+"""Add indexes on the ActivityInfo resource extras
+
+Resource.extras is a text column, so the ActivityInfo lookups in utils.py
+cast it to JSONB and read one key (e.g. extras::jsonb ->> 'activityinfo_form_id').
+Without an index on the same expression every lookup scans and parses the
+extras of all the resources of the portal.
+
+The indexes only include active resources, like the lookups. They are built
+concurrently so the resource table is not locked on big portals.
+
+Revision ID: 809ba95941d0
+Revises:
+Create Date: 2026-10-18 10:12:41.525061
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '809ba95941d0'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+INDEXED_EXTRAS = {
+    'idx_resource_activityinfo_form_id': 'activityinfo_form_id',
+    'idx_resource_activityinfo_status': 'activityinfo_status',
+    'idx_resource_activityinfo_auto_update': 'activityinfo_auto_update',
+}
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for index_name, extra in INDEXED_EXTRAS.items():
+            op.execute(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} "
+                f"ON resource ((extras::jsonb ->> '{extra}')) "
+                f"WHERE state = 'active'"
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for index_name in INDEXED_EXTRAS:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
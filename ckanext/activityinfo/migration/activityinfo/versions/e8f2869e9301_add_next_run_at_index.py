@@ -0,0 +1,33 @@
+"""Add an index on activityinfo_next_run_at
+
+The resources due for automatic update are read ordered by
+extras::jsonb ->> 'activityinfo_next_run_at', see
+utils.iter_resources_due_for_auto_update.
+
+Revision ID: e8f2869e9301
+Revises: 809ba95941d0
+Create Date: 2026-10-18 11:02:17.204118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8f2869e9301'
+down_revision = '809ba95941d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_resource_activityinfo_next_run_at "
+            "ON resource ((extras::jsonb ->> 'activityinfo_next_run_at'), id) "
+            "WHERE state = 'active'"
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_resource_activityinfo_next_run_at")
@@ -17,6 +17,7 @@ class ActivityinfoPlugin(plugins.SingletonPlugin):
     plugins.implements(plugins.IBlueprint)
     plugins.implements(plugins.IClick)
     plugins.implements(plugins.IConfigurer)
+    plugins.implements(plugins.IResourceController, inherit=True)
     plugins.implements(plugins.ITemplateHelpers)
 
     # IConfigurer
@@ -26,6 +27,11 @@ class ActivityinfoPlugin(plugins.SingletonPlugin):
         toolkit.add_public_directory(config_, "public")
         toolkit.add_resource("assets", "activityinfo")
 
+    # IResourceController
+
+    def before_resource_show(self, resource_dict):
+        return helpers.add_live_progress(resource_dict)
+
     # IActions
 
     def get_actions(self):
@@ -33,9 +39,11 @@ class ActivityinfoPlugin(plugins.SingletonPlugin):
             'act_info_get_databases': activity_info_actions.act_info_get_databases,
             'act_info_get_forms': activity_info_actions.act_info_get_forms,
             'act_info_get_form': activity_info_actions.act_info_get_form,
+            'act_info_get_form_columns': activity_info_actions.act_info_get_form_columns,
             'act_info_get_job_status': activity_info_actions.act_info_get_job_status,
             'act_start_download_job': activity_info_actions.act_start_download_job,
             'act_info_update_resource_file': activity_info_actions.act_info_update_resource_file,
+            'act_info_resource_status': activity_info_actions.act_info_resource_status,
             'resource_create': activityinfo_res_actions.resource_create,
             'resource_update': activityinfo_res_actions.resource_update,
         }
@@ -47,9 +55,11 @@ class ActivityinfoPlugin(plugins.SingletonPlugin):
             'act_info_get_databases': activity_info_auth.act_info_get_databases,
             'act_info_get_forms': activity_info_auth.act_info_get_forms,
             'act_info_get_form': activity_info_auth.act_info_get_form,
+            'act_info_get_form_columns': activity_info_auth.act_info_get_form_columns,
             'act_info_get_job_status': activity_info_auth.act_info_get_job_status,
             'act_start_download_job': activity_info_auth.act_start_download_job,
             'act_info_update_resource_file': activity_info_auth.act_info_update_resource_file,
+            'act_info_resource_status': activity_info_auth.act_info_resource_status,
         }
 
     # ITemplateHelpers
@@ -58,6 +68,9 @@ class ActivityinfoPlugin(plugins.SingletonPlugin):
         return {
             'get_activity_info_api_key': helpers.get_activity_info_api_key,
             'get_activityinfo_enable_flag': helpers.get_activityinfo_enable_flag,
+            'get_activityinfo_formats': helpers.get_activityinfo_formats,
+            'get_activityinfo_bundle_formats': helpers.get_activityinfo_bundle_formats,
+            'get_activityinfo_max_runs': helpers.get_activityinfo_max_runs,
             'is_activityinfo_resource': helpers.is_activityinfo_resource,
         }
 
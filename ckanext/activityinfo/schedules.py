@@ -0,0 +1,217 @@
+"""Automatic update frequencies of the ActivityInfo resources.
+
+The activityinfo_auto_update field accepts:
+ - never
+ - hourly, daily or weekly
+ - interval:<number><unit>, with the unit m (minutes), h (hours), d (days)
+   or w (weeks). E.g. interval:6h
+ - cron:<expression>, a cron expression with 5 fields: minute, hour, day of
+   the month, month and day of the week (0 or 7 is Sunday). E.g.
+   cron:30 2 * * 1-5 runs at 02:30 from Monday to Friday. Times are in
+   ckanext.activityinfo.auto_update.timezone (default UTC).
+
+Interval frequencies count from the last update. Cron frequencies run at
+fixed times, so all the resources with the same expression would start their
+exports together: each resource is delayed by a stable offset derived from
+its ID (see get_spread).
+"""
+import hashlib
+import re
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:
+    # Python 3.8
+    from backports.zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from ckan.plugins import toolkit
+
+
+NAMED_INTERVALS = {
+    'hourly': timedelta(hours=1),
+    'daily': timedelta(hours=24),
+    'weekly': timedelta(days=7),
+}
+
+INTERVAL_RE = re.compile(r'^interval:(\d+)([mhdw])$')
+INTERVAL_UNITS = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+# Longer intervals would overflow the dates of the next runs
+MAX_INTERVAL = timedelta(days=3660)
+
+# (name, min, max) of the cron fields
+CRON_FIELDS = (
+    ('minute', 0, 59),
+    ('hour', 0, 23),
+    ('day of month', 1, 31),
+    ('month', 1, 12),
+    ('day of week', 0, 7),
+)
+
+
+class IntervalSchedule:
+    """Run every `interval` since the last update."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.min_gap = interval
+
+    def next_run(self, last_run):
+        return last_run + self.interval
+
+
+class CronSchedule:
+    """Run at the times matching a cron expression."""
+
+    def __init__(self, expression, tz=timezone.utc):
+        parts = expression.split()
+        if len(parts) != len(CRON_FIELDS):
+            raise ValueError(
+                'A cron expression needs 5 fields: minute, hour, day of month, month and day of week'
+            )
+        self.expression = ' '.join(parts)
+        self.tz = tz
+        minutes, hours, days, months, weekdays = [
+            _parse_cron_field(part, *field) for part, field in zip(parts, CRON_FIELDS)
+        ]
+        self.minutes = sorted(minutes)
+        self.hours = sorted(hours)
+        self.days = days
+        self.months = months
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        # Like cron, if both days are restricted a day matching any of them runs
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+        # Shortest time between two runs, used to limit the frequency and the spread
+        times = [hour * 60 + minute for hour in self.hours for minute in self.minutes]
+        gaps = [b - a for a, b in zip(times, times[1:])] + [times[0] + 24 * 60 - times[-1]]
+        self.min_gap = timedelta(minutes=min(gaps))
+
+    def _runs_on(self, day):
+        if day.month not in self.months:
+            return False
+        day_matches = day.day in self.days
+        weekday_matches = day.isoweekday() % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_matches and weekday_matches
+        return day_matches or weekday_matches
+
+    def next_run(self, last_run):
+        """Get the first run after last_run, in UTC."""
+        start = last_run.astimezone(self.tz).replace(tzinfo=None, second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        # Enough to find a run on February 29th
+        for _ in range(366 * 8):
+            if self._runs_on(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        run = datetime(day.year, day.month, day.day, hour, minute)
+                        if run >= start:
+                            return run.replace(tzinfo=self.tz).astimezone(timezone.utc)
+            day += timedelta(days=1)
+        raise ValueError(f'The cron expression "{self.expression}" never runs')
+
+
+def _parse_cron_field(value, name, low, high):
+    """Get the set of values matching a cron field (e.g. "*/15", "1-5" or "0,30")."""
+    values = set()
+    for part in value.split(','):
+        match = re.match(r'^(\*|\d+(?:-\d+)?)(?:/(\d+))?$', part)
+        if not match:
+            raise ValueError(f'Invalid {name} in cron expression: {value}')
+        span, step = match.group(1), int(match.group(2) or 1)
+        if span == '*':
+            start, end = low, high
+        elif '-' in span:
+            start, end = (int(bound) for bound in span.split('-'))
+        else:
+            start = end = int(span)
+            if match.group(2):
+                end = high
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f'Invalid {name} in cron expression: {value} (must be {low}-{high})')
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def get_timezone():
+    """Get the time zone of the cron frequencies (ckanext.activityinfo.auto_update.timezone, default UTC)."""
+    name = toolkit.config.get('ckanext.activityinfo.auto_update.timezone', 'UTC')
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f'Invalid ckanext.activityinfo.auto_update.timezone: {name}')
+
+
+def parse_frequency(value):
+    """Get the schedule of an activityinfo_auto_update value.
+
+    Returns:
+        An IntervalSchedule or CronSchedule, None for 'never' (or no value).
+
+    Raises:
+        ValueError: if the value is not a valid frequency.
+    """
+    if not value or value == 'never':
+        return None
+    if value in NAMED_INTERVALS:
+        return IntervalSchedule(NAMED_INTERVALS[value])
+    match = INTERVAL_RE.match(value)
+    if match:
+        try:
+            interval = timedelta(**{INTERVAL_UNITS[match.group(2)]: int(match.group(1))})
+        except OverflowError:
+            interval = None
+        if interval is None or interval > MAX_INTERVAL:
+            raise ValueError(f'The interval can not be longer than {MAX_INTERVAL.days} days')
+        if not interval:
+            raise ValueError('The interval must be greater than zero')
+        return IntervalSchedule(interval)
+    if value.startswith('cron:'):
+        return CronSchedule(value[len('cron:'):], tz=get_timezone())
+    raise ValueError(
+        'Must be never, hourly, daily, weekly, an interval (e.g. interval:6h) '
+        'or a cron expression (e.g. cron:0 2 * * *)'
+    )
+
+
+def validate_frequency(value):
+    """Check an activityinfo_auto_update value, including the minimum time between runs.
+
+    Config settings:
+        ckanext.activityinfo.auto_update.min_interval: minimum minutes between two runs (default 15)
+
+    Raises:
+        ValueError: if the value is not valid.
+    """
+    schedule = parse_frequency(value)
+    if schedule is None:
+        return
+    min_interval = toolkit.asint(toolkit.config.get('ckanext.activityinfo.auto_update.min_interval', 15))
+    if schedule.min_gap < timedelta(minutes=min_interval):
+        raise ValueError(f'Automatic updates can not run more often than every {min_interval} minutes')
+    # Cron expressions like "0 0 30 2 *" never run
+    schedule.next_run(datetime.now(timezone.utc))
+
+
+def get_max_runs():
+    """Get the max value of activityinfo_auto_update_runs (ckanext.activityinfo.auto_update.max_runs, default 20)."""
+    return toolkit.asint(toolkit.config.get('ckanext.activityinfo.auto_update.max_runs', 20))
+
+
+def get_spread(resource_id, period):
+    """Get the delay, always the same for a resource, added to its runs to spread the load.
+
+    The delay is at most ckanext.activityinfo.auto_update.max_spread seconds
+    (default 600) and a tenth of the period between runs.
+
+    Returns:
+        A timedelta.
+    """
+    max_spread = toolkit.asint(toolkit.config.get('ckanext.activityinfo.auto_update.max_spread', 600))
+    max_spread = int(min(max_spread, period.total_seconds() / 10))
+    if max_spread <= 0 or not resource_id:
+        return timedelta(0)
+    digest = hashlib.sha256(resource_id.encode('utf-8')).hexdigest()
+    return timedelta(seconds=int(digest[:8], 16) % (max_spread + 1))
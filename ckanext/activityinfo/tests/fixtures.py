@@ -1,5 +1,8 @@
 import pytest
+from ckanext.activityinfo.data.cache import clear_memory_cache
+from ckanext.activityinfo.data.column_plans import ColumnPlanCache
 from ckanext.activityinfo.tests import factories
+from ckanext.activityinfo.utils import clear_user_token_cache
 
 
 @pytest.fixture
@@ -12,3 +15,15 @@ def ai_user_with_api_key():
 @pytest.fixture(autouse=True)
 def load_standard_plugins(with_plugins):
     pass
+
+
+# Do not share cached ActivityInfo API keys, responses and column plans between tests
+@pytest.fixture(autouse=True)
+def clear_activity_info_caches():
+    clear_user_token_cache()
+    clear_memory_cache()
+    ColumnPlanCache().purge()
+    yield
+    clear_user_token_cache()
+    clear_memory_cache()
+    ColumnPlanCache().purge()
@@ -107,3 +107,42 @@ class TestActInfoGetFormsAction:
                 data_dict={}
             )
         assert 'database_id' in str(excinfo.value)
+
+
+@pytest.mark.usefixtures("clean_db")
+class TestActInfoGetFormColumnsAction:
+    def test_get_form_columns(self, ai_user_with_api_key):
+        user = ai_user_with_api_key
+        fake_columns = [
+            {"id": "ref1", "label": "Province [Reference ID]", "formula": "ref1", "translate": False},
+            {"id": "ref1_name", "label": "Province", "formula": "ref1.NAME", "translate": False},
+        ]
+        with mock.patch(
+            "ckanext.activityinfo.data.base.ActivityInfoClient.get_form_columns",
+            return_value=fake_columns,
+        ):
+            result = toolkit.get_action('act_info_get_form_columns')(
+                context={'user': user['name']},
+                data_dict={'form_id': 'form01'}
+            )
+        assert result == [
+            {"id": "ref1", "label": "Province [Reference ID]", "formula": "ref1"},
+            {"id": "ref1_name", "label": "Province", "formula": "ref1.NAME"},
+        ]
+
+    def test_get_form_columns_no_api_key_user(self):
+        user = ckan_factories.User()
+        with pytest.raises(toolkit.NotAuthorized):
+            toolkit.get_action('act_info_get_form_columns')(
+                context={'user': user['name']},
+                data_dict={'form_id': 'form01'}
+            )
+
+    def test_get_form_columns_missing_form_id(self, ai_user_with_api_key):
+        user = ai_user_with_api_key
+        with pytest.raises(toolkit.ValidationError) as excinfo:
+            toolkit.get_action('act_info_get_form_columns')(
+                context={'user': user['name']},
+                data_dict={}
+            )
+        assert 'form_id' in str(excinfo.value)
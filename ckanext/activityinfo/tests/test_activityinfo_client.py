@@ -22,6 +22,7 @@ class SimpleRequestsMock:
                     self._data = data
                     self.status_code = 200
                     self.text = ""
+                    self.headers = {}
                 def raise_for_status(self): pass  # noqa E306
                 def json(self): return self._data  # noqa E306
             return Resp(self._get_registry[url])
@@ -31,6 +32,7 @@ class SimpleRequestsMock:
                     self._data = data
                     self.status_code = 200
                     self.text = ""
+                    self.headers = {}
                 def raise_for_status(self): pass  # noqa E306
                 def json(self): return self._data  # noqa E306
             return Resp(self._post_registry[url])
@@ -41,18 +43,14 @@ class SimpleRequestsMock:
 def requests_mock_fixture(monkeypatch):
     mocker = SimpleRequestsMock()
 
-    def fake_get(url, headers=None, params=None, **kwargs):
-        if url.startswith("https://www.activityinfo.org/"):
-            return mocker("get", url)
-        return requests.sessions.Session().get(url, headers=headers, params=params, **kwargs)
+    original_request = requests.Session.request
 
-    def fake_post(url, headers=None, json=None, **kwargs):
+    def fake_request(self, method, url, **kwargs):
         if url.startswith("https://www.activityinfo.org/"):
-            return mocker("post", url)
-        return requests.sessions.Session().post(url, headers=headers, json=json, **kwargs)
+            return mocker(method, url)
+        return original_request(self, method, url, **kwargs)
 
-    monkeypatch.setattr(requests, "get", fake_get)
-    monkeypatch.setattr(requests, "post", fake_post)
+    monkeypatch.setattr(requests.Session, "request", fake_request)
     return mocker
 
 
@@ -194,6 +192,27 @@ def test_get_form(requests_mock_fixture, client):
     assert result["id"] == form_id
 
 
+def test_clients_share_pooled_session():
+    client_a = ActivityInfoClient(api_key="key-a")
+    client_b = ActivityInfoClient(api_key="key-b")
+    other_server = ActivityInfoClient(base_url="https://other.example.org", api_key="key-a")
+    assert client_a.session is client_b.session
+    assert client_a.session is not other_server.session
+
+
+@pytest.mark.ckan_config('ckanext.activityinfo.http.pool_size', '3')
+def test_pooled_session_uses_configured_pool_size():
+    client = ActivityInfoClient(api_key="test-api-key")
+    adapter = client.session.get_adapter("https://www.activityinfo.org/")
+    assert adapter._pool_maxsize == 3
+
+
+@pytest.mark.ckan_config('ckanext.activityinfo.http.keep_alive', 'false')
+def test_pooled_session_without_keep_alive():
+    client = ActivityInfoClient(api_key="test-api-key")
+    assert client.session.headers["Connection"] == "close"
+
+
 def test_get_user_auth_headers_no_api_key():
     client = ActivityInfoClient(api_key=None)
     with pytest.raises(ValueError):
@@ -376,6 +395,32 @@ def test_get_form_columns_mixed_fields(requests_mock_fixture, client):
     assert columns[5]["label"] == "ARG Province"
 
 
+def test_get_form_columns_selection(requests_mock_fixture, client):
+    form_id = "f1"
+    url = f"https://www.activityinfo.org/resources/form/{form_id}/tree/translated"
+    fake_response = {
+        "forms": {
+            form_id: {
+                "schema": {
+                    "databaseId": "db1",
+                    "elements": [
+                        {"id": "name", "label": "Name", "type": "FREE_TEXT"},
+                        {"id": "year", "label": "Year", "type": "quantity"},
+                        {"id": "ref1", "label": "Province", "type": "reference", "range": [{"formId": "prov"}]},
+                    ]
+                }
+            }
+        }
+    }
+    requests_mock_fixture.get(url, json=fake_response)
+
+    columns = client.get_form_columns(form_id, column_ids=["ref1_name", "name"])
+    assert [column["formula"] for column in columns] == ["ref1.NAME", "name"]
+
+    with pytest.raises(ValueError, match="year2"):
+        client.get_form_columns(form_id, column_ids=["name", "year2"])
+
+
 def test_start_job_download_form_data(requests_mock_fixture, client):
     form_id = "f1"
     form_url = f"https://www.activityinfo.org/resources/form/{form_id}/tree/translated"
@@ -13,11 +13,11 @@ class TestActivityInfoClientFormats:
         fake_response.raise_for_status = mock.Mock()
 
         with mock.patch.object(client, "get_form_columns", return_value=fake_columns):
-            with mock.patch("requests.post", return_value=fake_response) as mock_post:
+            with mock.patch("requests.Session.request", return_value=fake_response) as mock_request:
                 result = client.start_job_download_form_data("form01", format="CSV")
                 assert result["id"] == "job123"
                 # Verify the payload contains the correct format
-                call_kwargs = mock_post.call_args[1]
+                call_kwargs = mock_request.call_args[1]
                 assert call_kwargs["json"]["descriptor"]["format"] == "CSV"
 
     def test_start_job_valid_xlsx_format(self):
@@ -29,10 +29,10 @@ class TestActivityInfoClientFormats:
         fake_response.raise_for_status = mock.Mock()
 
         with mock.patch.object(client, "get_form_columns", return_value=fake_columns):
-            with mock.patch("requests.post", return_value=fake_response) as mock_post:
+            with mock.patch("requests.Session.request", return_value=fake_response) as mock_request:
                 result = client.start_job_download_form_data("form01", format="XLSX")
                 assert result["id"] == "job123"
-                call_kwargs = mock_post.call_args[1]
+                call_kwargs = mock_request.call_args[1]
                 assert call_kwargs["json"]["descriptor"]["format"] == "XLSX"
 
     def test_start_job_valid_text_format(self):
@@ -44,10 +44,10 @@ class TestActivityInfoClientFormats:
         fake_response.raise_for_status = mock.Mock()
 
         with mock.patch.object(client, "get_form_columns", return_value=fake_columns):
-            with mock.patch("requests.post", return_value=fake_response) as mock_post:
+            with mock.patch("requests.Session.request", return_value=fake_response) as mock_request:
                 result = client.start_job_download_form_data("form01", format="TEXT")
                 assert result["id"] == "job123"
-                call_kwargs = mock_post.call_args[1]
+                call_kwargs = mock_request.call_args[1]
                 assert call_kwargs["json"]["descriptor"]["format"] == "TEXT"
 
     def test_start_job_invalid_format_raises_error(self):
@@ -71,7 +71,7 @@ class TestActivityInfoClientFormats:
         fake_response.raise_for_status = mock.Mock()
 
         with mock.patch.object(client, "get_form_columns", return_value=fake_columns):
-            with mock.patch("requests.post", return_value=fake_response) as mock_post:
+            with mock.patch("requests.Session.request", return_value=fake_response) as mock_request:
                 client.start_job_download_form_data("form01")
-                call_kwargs = mock_post.call_args[1]
+                call_kwargs = mock_request.call_args[1]
                 assert call_kwargs["json"]["descriptor"]["format"] == "CSV"
@@ -0,0 +1,128 @@
+import time
+from unittest import mock
+import pytest
+from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.data.cache import (
+    CacheEntry,
+    MemoryResponseCache,
+    RedisResponseCache,
+    get_cache_stats,
+    get_cache_ttl,
+    get_response_cache,
+    reset_cache_stats,
+)
+
+
+def _response(status_code=200, data=None, etag=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = {"ETag": etag} if etag else {}
+    response.json.return_value = data
+    return response
+
+
+@pytest.fixture
+def client():
+    return ActivityInfoClient(api_key="test-api-key")
+
+
+class TestCacheConfig:
+    def test_default_ttls(self):
+        assert get_cache_ttl("databases") == 60
+        assert get_cache_ttl("form") == 300
+        assert get_cache_ttl("unknown") == 0
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.cache.ttl.form', '0')
+    def test_ttl_from_config(self):
+        assert get_cache_ttl("form") == 0
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.cache.enabled', 'false')
+    def test_cache_disabled(self):
+        assert get_cache_ttl("databases") == 0
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.cache.backend', 'redis')
+    def test_redis_backend(self):
+        assert isinstance(get_response_cache(), RedisResponseCache)
+
+    def test_memory_backend_by_default(self):
+        assert isinstance(get_response_cache(), MemoryResponseCache)
+
+
+class TestClientCache:
+    def test_second_call_is_a_hit(self, client):
+        response = _response(data=[{"databaseId": "db1"}])
+        with mock.patch("requests.Session.request", return_value=response) as mock_request:
+            first = client.get_databases()
+            second = client.get_databases()
+        assert first == second == [{"databaseId": "db1"}]
+        assert mock_request.call_count == 1
+        assert client.cache_stats["misses"] == 1
+        assert client.cache_stats["hits"] == 1
+
+    def test_callers_get_a_copy(self, client):
+        with mock.patch("requests.Session.request", return_value=_response(data=[{"databaseId": "db1"}])):
+            client.get_databases()[0]["url"] = "changed"
+            assert "url" not in client.get_databases()[0]
+
+    def test_cache_is_per_token(self, client):
+        with mock.patch("requests.Session.request", return_value=_response(data=[])) as mock_request:
+            client.get_databases()
+            ActivityInfoClient(api_key="other-api-key").get_databases()
+        assert mock_request.call_count == 2
+
+    def test_refresh_bypasses_the_cache(self, client):
+        responses = [_response(data=["old"]), _response(data=["new"])]
+        with mock.patch("requests.Session.request", side_effect=responses):
+            client.get_databases()
+            assert client.get_databases(refresh=True) == ["new"]
+            # The refreshed response is cached
+            assert client.get_databases() == ["new"]
+        assert client.cache_stats["bypassed"] == 1
+
+    def test_expired_entry_is_revalidated_with_etag(self, client):
+        responses = [_response(data=["db1"], etag='"v1"'), _response(status_code=304)]
+        with mock.patch("requests.Session.request", side_effect=responses) as mock_request:
+            client.get_databases()
+            later = time.time() + 3600
+            with mock.patch("ckanext.activityinfo.data.cache.time.time", return_value=later):
+                assert client.get_databases() == ["db1"]
+        headers = mock_request.call_args[1]["headers"]
+        assert headers["If-None-Match"] == '"v1"'
+        assert client.cache_stats["revalidated"] == 1
+
+    def test_job_status_is_not_cached(self, client):
+        response = _response(data={"state": "started"})
+        with mock.patch("requests.Session.request", return_value=response) as mock_request:
+            client.get_job_status("job1")
+            client.get_job_status("job1")
+        assert mock_request.call_count == 2
+
+    def test_process_stats(self, client):
+        reset_cache_stats()
+        with mock.patch("requests.Session.request", return_value=_response(data=[])):
+            client.get_databases()
+            client.get_databases()
+        stats = get_cache_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+
+
+class TestBackends:
+    def test_memory_lru_eviction(self):
+        cache = MemoryResponseCache(max_entries=2)
+        expires_at = time.time() + 60
+        cache.set("a", CacheEntry("1", expires_at=expires_at))
+        cache.set("b", CacheEntry("2", expires_at=expires_at))
+        cache.get("a")
+        cache.set("c", CacheEntry("3", expires_at=expires_at))
+        assert cache.get("b") is None
+        assert cache.get("a").data() == 1
+
+    def test_redis_roundtrip(self):
+        cache = RedisResponseCache()
+        cache.set("test-key", CacheEntry('{"a": 1}', etag='"v1"', expires_at=time.time() + 60))
+        entry = cache.get("test-key")
+        assert entry.data() == {"a": 1}
+        assert entry.etag == '"v1"'
+        cache.delete("test-key")
+        assert cache.get("test-key") is None
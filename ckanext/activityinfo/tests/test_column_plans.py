@@ -0,0 +1,160 @@
+"""Tests for the export column plans kept by form schema version."""
+import time
+from unittest import mock
+
+from click.testing import CliRunner
+
+from ckanext.activityinfo.cli.forms import list_column_plans, purge_column_plans
+from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.data.cache import clear_memory_cache
+from ckanext.activityinfo.data.column_plans import ColumnPlan, ColumnPlanCache
+
+
+URL = "https://www.activityinfo.org/resources/form/form1/tree/translated"
+
+
+def _form_tree(schema_version, elements):
+    return {"forms": {"form1": {"schema": {"schemaVersion": schema_version, "elements": elements}}}}
+
+
+NAME = {"id": "name", "label": "Name", "type": "text"}
+YEAR = {"id": "year", "label": "Year", "type": "quantity"}
+
+
+def _response(data=None, status_code=200, etag=None):
+    response = mock.Mock(status_code=status_code, headers={'ETag': etag} if etag else {})
+    response.json.return_value = data
+    return response
+
+
+def _expire(client, form_id="form1"):
+    """Make the saved plan, and the cached schema, old enough to be checked again."""
+    plan = client.column_plans.get(client.api_key, form_id)
+    with mock.patch("time.time", return_value=time.time() - 2 * client.column_plans.max_age):
+        client.column_plans.save(client.api_key, plan)
+    clear_memory_cache()
+
+
+class TestColumnPlans:
+    def test_fresh_plan_skips_the_schema(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [NAME]))) as mock_request:
+            first = client.get_form_columns("form1")
+            second = client.get_form_columns("form1")
+
+        assert first == second == [{"id": "name", "label": "Name", "formula": "name", "translate": False}]
+        assert mock_request.call_count == 1
+        # Also for other clients with the same API key (e.g. a new download job)
+        other = ActivityInfoClient(api_key="test-api-key")
+        with mock.patch("requests.Session.request") as mock_request:
+            assert other.get_form_columns("form1") == first
+        mock_request.assert_not_called()
+
+    def test_not_modified(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [NAME]), etag='"v1"')):
+            columns = client.get_form_columns("form1")
+        _expire(client)
+
+        with mock.patch("requests.Session.request", return_value=_response(status_code=304)) as mock_request:
+            assert client.get_form_columns("form1") == columns
+
+        assert mock_request.call_args[1]["headers"]["If-None-Match"] == '"v1"'
+        assert client.column_plans.is_fresh(client.column_plans.get(client.api_key, "form1"))
+
+    def test_same_schema_version(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [NAME]), etag='"a"')):
+            columns = client.get_form_columns("form1")
+        _expire(client)
+
+        # A new ETag (e.g. other response headers) with the same schema version
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [NAME]), etag='"b"')):
+            assert client.get_form_columns("form1") == columns
+
+        assert client.column_plans.get(client.api_key, "form1").etag == '"b"'
+
+    def test_new_schema_version(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [NAME]))):
+            client.get_form_columns("form1")
+        _expire(client)
+
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(2, [NAME, YEAR]))):
+            columns = client.get_form_columns("form1", column_ids=["year"])
+
+        assert columns == [{"id": "year", "label": "Year", "formula": "year", "translate": False}]
+        assert client.column_plans.get(client.api_key, "form1").schema_version == 2
+
+    def test_refresh(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [NAME]))):
+            client.get_form_columns("form1")
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [NAME, YEAR]))):
+            assert len(client.get_form_columns("form1", refresh=True)) == 2
+
+    def test_disabled(self):
+        with mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.column_plans.max_age': '0'}):
+            client = ActivityInfoClient(api_key="test-api-key")
+        response = _response(_form_tree(1, [NAME]))
+        with mock.patch("requests.Session.request", return_value=response) as mock_request:
+            client.get_form_columns("form1")
+            client.get_form_columns("form1")
+
+        # The schema is still a cached response
+        assert mock_request.call_count == 1
+        assert client.cache_stats["hits"] == 1
+        assert ColumnPlanCache().list() == []
+
+    def test_cached_schema_matches_the_plan(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [NAME]), etag='"v1"')):
+            columns = client.get_form_columns("form1")
+        # Only the plan is old, the schema response is still cached
+        plan = client.column_plans.get(client.api_key, "form1")
+        with mock.patch("time.time", return_value=time.time() - 2 * client.column_plans.max_age):
+            client.column_plans.save(client.api_key, plan)
+
+        with mock.patch("requests.Session.request") as mock_request:
+            assert client.get_form_columns("form1") == columns
+        mock_request.assert_not_called()
+
+    def test_plans_per_api_key(self):
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [NAME]))):
+            ActivityInfoClient(api_key="key1").get_form_columns("form1")
+        with mock.patch("requests.Session.request", return_value=_response(_form_tree(1, [YEAR]))):
+            columns = ActivityInfoClient(api_key="key2").get_form_columns("form1")
+        assert columns[0]["id"] == "year"
+
+
+class TestColumnPlansCLI:
+    def _save_plans(self):
+        cache = ColumnPlanCache()
+        cache.save("key", ColumnPlan("form1", 3, [{"id": "name", "label": "Name", "formula": "name"}]))
+        cache.save("key", ColumnPlan("form2", 1, []))
+
+    def test_list(self):
+        self._save_plans()
+
+        result = CliRunner().invoke(list_column_plans, ["-v"])
+
+        assert result.exit_code == 0, result.output
+        assert "form form1: version 3, 1 columns" in result.output
+        assert "  name: Name" in result.output
+        assert "Total column plans: 2" in result.output
+
+    def test_purge_a_form(self):
+        self._save_plans()
+
+        result = CliRunner().invoke(purge_column_plans, ["--form-id", "form1"])
+
+        assert result.exit_code == 0, result.output
+        assert "Deleted column plans: 1" in result.output
+        assert [plan.form_id for plan in ColumnPlanCache().list()] == ["form2"]
+
+    def test_purge_all(self):
+        self._save_plans()
+
+        CliRunner().invoke(purge_column_plans, [])
+
+        assert ColumnPlanCache().list() == []
@@ -0,0 +1,196 @@
+import csv
+import json
+from unittest import mock
+import pytest
+from ckanext.activityinfo.exceptions import ActivityInfoUploadError
+from ckanext.activityinfo.jobs import convert
+from ckanext.activityinfo.jobs.convert import can_convert, convert_csv, get_available_formats
+from ckanext.activityinfo.jobs.download import _download_resource_group, _export_and_update, _plan_exports
+
+
+CSV_DATA = "﻿Name,Code,Amount\nAlice,007,12\nBob,1,3.5\n"
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_text(CSV_DATA, encoding="utf-8")
+    return path
+
+
+class TestConvert:
+    def test_tsv(self, csv_file, tmp_path):
+        dst = tmp_path / "export.tsv"
+        convert_csv(csv_file, dst, "tsv")
+        with open(dst, newline="") as f:
+            rows = list(csv.reader(f, delimiter="\t"))
+        assert rows == [["Name", "Code", "Amount"], ["Alice", "007", "12"], ["Bob", "1", "3.5"]]
+
+    def test_json(self, csv_file, tmp_path):
+        dst = tmp_path / "export.json"
+        convert_csv(csv_file, dst, "json")
+        data = json.loads(dst.read_text())
+        assert data == [
+            {"Name": "Alice", "Code": "007", "Amount": "12"},
+            {"Name": "Bob", "Code": "1", "Amount": "3.5"},
+        ]
+
+    def test_json_without_rows(self, tmp_path):
+        src = tmp_path / "empty.csv"
+        src.write_text("Name,Code\n")
+        dst = tmp_path / "empty.json"
+        convert_csv(src, dst, "json")
+        assert json.loads(dst.read_text()) == []
+
+    def test_xlsx(self, csv_file, tmp_path):
+        openpyxl = pytest.importorskip("openpyxl")
+        dst = tmp_path / "export.xlsx"
+        convert_csv(csv_file, dst, "xlsx", sheet_name="My form")
+        sheet = openpyxl.load_workbook(dst)["My form"]
+        rows = list(sheet.values)
+        # Numbers are numbers, codes with leading zeros stay as text
+        assert rows == [("Name", "Code", "Amount"), ("Alice", "007", 12), ("Bob", 1, 3.5)]
+
+    def test_parquet(self, csv_file, tmp_path):
+        pytest.importorskip("pyarrow")
+        import pyarrow.parquet
+        dst = tmp_path / "export.parquet"
+        convert_csv(csv_file, dst, "parquet")
+        table = pyarrow.parquet.read_table(dst)
+        assert table.column_names == ["Name", "Code", "Amount"]
+        assert table.column("Code").to_pylist() == ["007", "1"]
+
+    def test_unavailable_format(self, csv_file, tmp_path):
+        with mock.patch.object(convert, "pyarrow", None):
+            assert not can_convert("parquet")
+            assert "parquet" not in get_available_formats()
+            with pytest.raises(ValueError):
+                convert_csv(csv_file, tmp_path / "export.parquet", "parquet")
+
+
+class TestPlanExports:
+    def test_single_upstream_format_is_exported_as_is(self):
+        assert _plan_exports([("r1", "xlsx")]) == ({"xlsx": [("r1", "xlsx")]}, [])
+
+    def test_single_local_format_is_converted_from_csv(self):
+        assert _plan_exports([("r1", "json")]) == ({"csv": [("r1", "json")]}, [])
+
+    def test_group_uses_one_csv_export(self):
+        with mock.patch.object(convert, "openpyxl", mock.Mock()):
+            exports, unavailable = _plan_exports([("r1", "csv"), ("r2", "xlsx"), ("r3", "tsv")])
+        assert exports == {"csv": [("r1", "csv"), ("r2", "xlsx"), ("r3", "tsv")]}
+        assert unavailable == []
+
+    def test_xlsx_falls_back_to_upstream_export(self):
+        with mock.patch.object(convert, "openpyxl", None):
+            exports, _ = _plan_exports([("r1", "csv"), ("r2", "xlsx")])
+        assert exports == {"csv": [("r1", "csv")], "xlsx": [("r2", "xlsx")]}
+
+    def test_unavailable_formats(self):
+        with mock.patch.object(convert, "pyarrow", None):
+            exports, unavailable = _plan_exports([("r1", "csv"), ("r2", "parquet")])
+        assert exports == {"csv": [("r1", "csv")]}
+        assert unavailable == [("r2", "parquet")]
+
+
+class TestGroupExport:
+    def test_one_export_for_all_formats(self, tmp_path):
+        client = mock.Mock(api_key="test-api-key", base_url="https://www.activityinfo.org", retry_stats={
+            'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0,
+        })
+        client.start_job_download_form_data.return_value = {"id": "job1"}
+        client.get_job_status.return_value = {
+            "state": "completed", "percentComplete": 100, "result": {"downloadUrl": "/download/job1.csv"},
+        }
+
+        def download_to_file(url, fileobj, hasher=None):
+            fileobj.write(CSV_DATA.encode("utf-8"))
+            return len(CSV_DATA)
+        client.download_to_file.side_effect = download_to_file
+
+        uploads = {}
+
+        def resource_patch(context, data_dict):
+            if 'upload' in data_dict:
+                upload = data_dict['upload']
+                uploads[data_dict['id']] = (upload.filename, upload.content_type, upload.stream.read())
+
+        targets = [("res-csv", "csv"), ("res-tsv", "tsv"), ("res-json", "json")]
+        with mock.patch('ckan.plugins.toolkit.get_action', return_value=resource_patch), \
+                mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.tmp_dir': str(tmp_path)}):
+            _export_and_update(client, {'user': 'test'}, targets, 'form1', 'csv', 'My form')
+
+        client.start_job_download_form_data.assert_called_once_with('form1', format='CSV')
+        assert client.download_to_file.call_count == 1
+        assert uploads["res-csv"][0] == "My form.csv"
+        assert uploads["res-tsv"][:2] == ("My form.tsv", "text/tab-separated-values")
+        assert json.loads(uploads["res-json"][2])[0]["Name"] == "Alice"
+        # Temporary files are removed
+        assert list(tmp_path.iterdir()) == []
+
+    def test_failed_export_does_not_stop_the_group(self):
+        resources = {
+            resource_id: {'id': resource_id, 'activityinfo_form_id': 'form1', 'activityinfo_format': format_type}
+            for resource_id, format_type in [("res-csv", "csv"), ("res-text", "text")]
+        }
+        statuses = {}
+
+        def get_action(name):
+            if name == 'resource_show':
+                return lambda context, data_dict: resources[data_dict['id']]
+            return lambda context, data_dict: statuses.update({data_dict['id']: data_dict['activityinfo_status']})
+
+        with mock.patch('ckan.plugins.toolkit.get_action', side_effect=get_action), \
+                mock.patch('ckanext.activityinfo.jobs.download.get_user_token', return_value='token'), \
+                mock.patch('ckanext.activityinfo.jobs.download.ActivityInfoClient'), \
+                mock.patch('ckanext.activityinfo.jobs.download.set_progress'), \
+                mock.patch('ckanext.activityinfo.jobs.download._export_and_update',
+                           side_effect=[ValueError("Export job failed"), None]) as export:
+            with pytest.raises(ValueError, match="Export job failed"):
+                _download_resource_group(list(resources), 'test')
+
+        assert [call[0][4] for call in export.call_args_list] == ['csv', 'text']
+        assert statuses == {"res-csv": "error", "res-text": "exporting"}
+
+    def test_failed_conversion_only_fails_its_resource(self, tmp_path):
+        resources = {
+            resource_id: {'id': resource_id, 'activityinfo_form_id': 'form1', 'activityinfo_format': format_type}
+            for resource_id, format_type in [("res-csv", "csv"), ("res-xlsx", "xlsx"), ("res-json", "json")]
+        }
+        client = mock.MagicMock(api_key="test-api-key", base_url="https://www.activityinfo.org", retry_stats={
+            'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0,
+        })
+        client.start_job_download_form_data.return_value = {"id": "job1"}
+        client.get_job_status.return_value = {
+            "state": "completed", "percentComplete": 100, "result": {"downloadUrl": "/download/job1.csv"},
+        }
+
+        def download_to_file(url, fileobj, hasher=None):
+            fileobj.write(CSV_DATA.encode("utf-8"))
+            return len(CSV_DATA)
+        client.download_to_file.side_effect = download_to_file
+        statuses = {}
+
+        def get_action(name):
+            if name == 'resource_show':
+                return lambda context, data_dict: resources[data_dict['id']]
+            return lambda context, data_dict: statuses.update(
+                {data_dict['id']: (data_dict['activityinfo_status'], data_dict.get('activityinfo_error'))}
+            )
+
+        broken_openpyxl = mock.Mock(**{'Workbook.side_effect': ValueError("Broken workbook")})
+        with mock.patch('ckan.plugins.toolkit.get_action', side_effect=get_action), \
+                mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.tmp_dir': str(tmp_path)}), \
+                mock.patch.object(convert, "openpyxl", broken_openpyxl), \
+                mock.patch('ckanext.activityinfo.jobs.download.get_user_token', return_value='token'), \
+                mock.patch('ckanext.activityinfo.jobs.download.ActivityInfoClient', return_value=client), \
+                mock.patch('ckanext.activityinfo.jobs.download.set_progress'):
+            with pytest.raises(ActivityInfoUploadError) as excinfo:
+                _download_resource_group(list(resources), 'test')
+
+        assert excinfo.value.resource_ids == ["res-xlsx"]
+        assert client.start_job_download_form_data.call_count == 1
+        assert statuses["res-csv"] == ('complete', '')
+        assert statuses["res-json"] == ('complete', '')
+        assert statuses["res-xlsx"][0] == 'error'
+        assert statuses["res-xlsx"][1].startswith("Failed to convert the export to xlsx")
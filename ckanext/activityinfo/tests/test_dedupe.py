@@ -0,0 +1,144 @@
+import uuid
+from unittest import mock
+import pytest
+from redis.exceptions import RedisError
+from rq.job import Job
+from ckanext.activityinfo.data.redis_store import get_redis_connection
+from ckanext.activityinfo.jobs.dedupe import SharedExport, _job_key, claim_download_jobs, release_download_jobs
+from ckanext.activityinfo.jobs.download import _export_and_update
+
+
+def _ended_job(status='finished'):
+    job = Job.create(func='builtins.print', connection=get_redis_connection(), id=uuid.uuid4().hex)
+    job.set_status(status)
+    job.save()
+    return job.id
+
+
+def _shared_export(form_id, **kwargs):
+    return SharedExport("test-api-key", form_id, 'csv', **kwargs)
+
+
+class TestClaimDownloadJobs:
+    def test_claim_and_release(self):
+        resource_ids = [uuid.uuid4().hex, uuid.uuid4().hex]
+        assert claim_download_jobs(resource_ids, 'job1', ttl=60) is None
+        # The job is not enqueued yet, the claim still counts as active
+        assert claim_download_jobs(resource_ids, 'job2', ttl=60) == 'job1'
+
+        release_download_jobs(resource_ids, 'job1')
+        assert claim_download_jobs(resource_ids, 'job2', ttl=60) is None
+
+    def test_release_keeps_newer_claims(self):
+        resource_id = uuid.uuid4().hex
+        assert claim_download_jobs([resource_id], 'job1', ttl=60) is None
+        release_download_jobs([resource_id], 'other-job')
+        assert claim_download_jobs([resource_id], 'job2', ttl=60) == 'job1'
+
+    @pytest.mark.parametrize('status', ['finished', 'failed'])
+    def test_ended_jobs_do_not_count(self, status):
+        resource_id = uuid.uuid4().hex
+        ended = _ended_job(status)
+        assert claim_download_jobs([resource_id], ended, ttl=60) is None
+        assert claim_download_jobs([resource_id], 'job2', ttl=60) is None
+
+    def test_new_job_if_some_resources_are_not_queued(self):
+        queued, other = uuid.uuid4().hex, uuid.uuid4().hex
+        assert claim_download_jobs([queued], 'job1', ttl=60) is None
+        assert claim_download_jobs([queued, other], 'job2', ttl=60) is None
+
+    def test_concurrent_claim_of_an_ended_job(self):
+        resource_id = uuid.uuid4().hex
+        ended = _ended_job()
+        assert claim_download_jobs([resource_id], ended, ttl=60) is None
+
+        def claimed_meanwhile(job_id):
+            # Another download claims the resource while this one checks the ended job
+            if job_id == ended:
+                get_redis_connection().set(_job_key(resource_id), 'job1')
+                return False
+            return True
+
+        with mock.patch('ckanext.activityinfo.jobs.dedupe._is_active', side_effect=claimed_meanwhile):
+            assert claim_download_jobs([resource_id], 'job2', ttl=60) == 'job1'
+        assert get_redis_connection().get(_job_key(resource_id)) == b'job1'
+
+    def test_without_redis(self):
+        with mock.patch('ckanext.activityinfo.jobs.dedupe.get_redis_connection', side_effect=RedisError("down")):
+            assert claim_download_jobs([uuid.uuid4().hex], 'job1', ttl=60) is None
+
+
+class TestSharedExport:
+    def test_second_download_joins_the_export(self):
+        form_id = uuid.uuid4().hex
+        start_export = mock.Mock(return_value='ai-job-1')
+
+        assert _shared_export(form_id).start(start_export) == ('ai-job-1', False)
+        assert _shared_export(form_id).start(start_export) == ('ai-job-1', True)
+        start_export.assert_called_once()
+
+    def test_new_export_after_finish(self):
+        form_id = uuid.uuid4().hex
+        first = _shared_export(form_id)
+        first.start(lambda: 'ai-job-1')
+        first.finish('ai-job-1')
+
+        assert _shared_export(form_id).start(lambda: 'ai-job-2') == ('ai-job-2', False)
+
+    def test_key_depends_on_api_key_and_columns(self):
+        form_id = uuid.uuid4().hex
+        shared = _shared_export(form_id)
+        assert "test-api-key" not in shared.key
+        assert shared.key != SharedExport("other-api-key", form_id, 'csv').key
+        assert shared.key != SharedExport("test-api-key", form_id, 'xlsx').key
+        assert shared.key != _shared_export(form_id, columns=['name']).key
+        assert _shared_export(form_id, columns=['b', 'a']).key == _shared_export(form_id, columns=['a', 'b']).key
+
+    def test_failed_start_is_released(self):
+        form_id = uuid.uuid4().hex
+        with pytest.raises(ValueError):
+            _shared_export(form_id).start(mock.Mock(side_effect=ValueError("No job")))
+
+        assert _shared_export(form_id).start(lambda: 'ai-job-1') == ('ai-job-1', False)
+
+    def test_stops_waiting_for_a_pending_export(self):
+        form_id = uuid.uuid4().hex
+        get_redis_connection().set(_shared_export(form_id).key, SharedExport.PENDING)
+
+        with mock.patch('ckanext.activityinfo.jobs.dedupe.time.sleep'):
+            assert _shared_export(form_id, max_wait=0).start(lambda: 'ai-job-1') == ('ai-job-1', False)
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.shared_exports', 'false')
+    def test_disabled(self):
+        form_id = uuid.uuid4().hex
+        start_export = mock.Mock(side_effect=['ai-job-1', 'ai-job-2'])
+
+        assert _shared_export(form_id).start(start_export) == ('ai-job-1', False)
+        assert _shared_export(form_id).start(start_export) == ('ai-job-2', False)
+
+
+class TestDownloadJoinsExport:
+    def test_download_polls_the_running_export(self, tmp_path):
+        form_id = uuid.uuid4().hex
+        _shared_export(form_id).start(lambda: 'ai-job-1')
+
+        client = mock.Mock(api_key="test-api-key", base_url="https://www.activityinfo.org", retry_stats={
+            'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0,
+        })
+        client.get_job_status.return_value = {
+            "state": "completed", "percentComplete": 100, "result": {"downloadUrl": "/download/ai-job-1.csv"},
+        }
+
+        def download_to_file(url, fileobj, hasher=None):
+            fileobj.write(b"a,b\n1,2\n")
+            return 8
+        client.download_to_file.side_effect = download_to_file
+
+        with mock.patch('ckan.plugins.toolkit.get_action', return_value=mock.Mock()), \
+                mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.tmp_dir': str(tmp_path)}):
+            _export_and_update(client, {'user': 'test'}, [('res1', 'csv')], form_id, 'csv', 'My form')
+
+        client.start_job_download_form_data.assert_not_called()
+        client.get_job_status.assert_called_with('ai-job-1')
+        # The export is forgotten once it ended
+        assert _shared_export(form_id).start(lambda: 'ai-job-2') == ('ai-job-2', False)
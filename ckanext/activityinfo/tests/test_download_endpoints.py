@@ -121,6 +121,21 @@ class TestDownloadEndpoints:
             assert data["result"]["state"] == "failed"
             assert data["download_url"] is None
 
+    def test_job_status_shared_by_watchers(self, app, setup_data):
+        """Test that watchers polling the same job within max_age make one ActivityInfo call"""
+        environ = {"Authorization": setup_data.activityinfo_user["token"]}
+        job_id = "job_shared_123"
+
+        with mock.patch(
+            "ckanext.activityinfo.data.base.ActivityInfoClient.get_job_status",
+            return_value={"id": job_id, "state": "started", "percentComplete": 50},
+        ) as get_job_status:
+            for _ in range(3):
+                resp = app.get(f"/activity-info/job-status/{job_id}", headers=environ)
+                assert resp.json["result"]["percentComplete"] == 50
+
+            get_job_status.assert_called_once()
+
 
 @pytest.mark.usefixtures("clean_db")
 class TestDownloadActions:
@@ -214,9 +229,43 @@ class TestUpdateResourceFileAction:
                 download_activityinfo_resource,
                 [resource['id'], user_name],
                 title=f"Download ActivityInfo for resource {resource['id']}",
-                rq_kwargs={'timeout': 600}
+                rq_kwargs={'timeout': 4200, 'job_id': mock.ANY}
+            )
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.download.job_timeout', '900')
+    def test_update_resource_file_job_timeout(self, setup_data):
+        """Test that the download job timeout can be configured"""
+        resource = factories.ActivityInfoResource()
+
+        with mock.patch('ckanext.activityinfo.actions.activity_info.toolkit.enqueue_job') as mock_enqueue:
+            toolkit.get_action('act_info_update_resource_file')(
+                context={'user': setup_data.activityinfo_user['name']},
+                data_dict={'resource_id': resource['id']}
             )
 
+            assert mock_enqueue.call_args[1]['rq_kwargs']['timeout'] == 900
+
+    def test_update_resource_file_already_queued(self, setup_data):
+        """Test that a resource with a queued download job does not get a second one"""
+        user_name = setup_data.activityinfo_user['name']
+        resource = factories.ActivityInfoResource()
+
+        with mock.patch('ckanext.activityinfo.actions.activity_info.toolkit.enqueue_job') as mock_enqueue:
+            mock_enqueue.side_effect = lambda *args, **kwargs: mock.Mock(id=kwargs['rq_kwargs']['job_id'])
+            first = toolkit.get_action('act_info_update_resource_file')(
+                context={'user': user_name},
+                data_dict={'resource_id': resource['id']}
+            )
+            second = toolkit.get_action('act_info_update_resource_file')(
+                context={'user': user_name},
+                data_dict={'resource_id': resource['id']}
+            )
+
+        mock_enqueue.assert_called_once()
+        assert first['already_queued'] is False
+        assert second['already_queued'] is True
+        assert second['job_id'] == first['job_id']
+
     def test_update_resource_file_missing_resource_id(self, setup_data):
         """Test that act_info_update_resource_file raises error when resource_id is missing"""
         user_name = setup_data.activityinfo_user['name']
@@ -0,0 +1,94 @@
+import io
+import os
+from unittest import mock
+import pytest
+from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.exceptions import ActivityInfoFileTooLargeError
+from ckanext.activityinfo.jobs.download import _export_and_update
+
+
+def _stream_response(chunks, content_length=None):
+    response = mock.Mock()
+    response.status_code = 200
+    response.headers = {"Content-Length": str(content_length)} if content_length else {}
+    response.iter_content.return_value = iter(chunks)
+    return response
+
+
+@pytest.fixture
+def client():
+    return ActivityInfoClient(api_key="test-api-key")
+
+
+class TestDownloadToFile:
+    def test_writes_chunks(self, client):
+        response = _stream_response([b"a,b\n", b"1,2\n"])
+        out = io.BytesIO()
+        with mock.patch("requests.Session.request", return_value=response) as mock_request:
+            size = client.download_to_file("https://www.activityinfo.org/file.csv", out, chunk_size=4)
+
+        assert out.getvalue() == b"a,b\n1,2\n"
+        assert size == 8
+        assert mock_request.call_args[1]["stream"] is True
+        response.iter_content.assert_called_once_with(chunk_size=4)
+        response.close.assert_called_once()
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.download.chunk_size', '512')
+    def test_chunk_size_from_config(self, client):
+        response = _stream_response([b"data"])
+        with mock.patch("requests.Session.request", return_value=response):
+            client.download_to_file("https://www.activityinfo.org/file.csv", io.BytesIO())
+        response.iter_content.assert_called_once_with(chunk_size=512)
+
+    def test_max_size_from_content_length(self, client):
+        response = _stream_response([b"x" * 10], content_length=10)
+        out = io.BytesIO()
+        with mock.patch("requests.Session.request", return_value=response):
+            with pytest.raises(ActivityInfoFileTooLargeError):
+                client.download_to_file("https://www.activityinfo.org/file.csv", out, max_size=5)
+        assert out.getvalue() == b""
+        response.close.assert_called_once()
+
+    def test_max_size_while_streaming(self, client):
+        response = _stream_response([b"x" * 4, b"x" * 4])
+        with mock.patch("requests.Session.request", return_value=response):
+            with pytest.raises(ActivityInfoFileTooLargeError):
+                client.download_to_file("https://www.activityinfo.org/file.csv", io.BytesIO(), max_size=6)
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.download.max_size', '1')
+    def test_max_size_from_config_in_mb(self, client):
+        response = _stream_response([b"x" * 1024 * 1024, b"x"])
+        with mock.patch("requests.Session.request", return_value=response):
+            with pytest.raises(ActivityInfoFileTooLargeError):
+                client.download_to_file("https://www.activityinfo.org/file.csv", io.BytesIO())
+
+
+class TestExportJobStreaming:
+    def test_export_streams_to_a_tmp_file(self, tmp_path):
+        client = mock.Mock(api_key="test-api-key", base_url="https://www.activityinfo.org", retry_stats={
+            'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0,
+        })
+        client.start_job_download_form_data.return_value = {"id": "job1"}
+        client.get_job_status.return_value = {
+            "state": "completed", "percentComplete": 100, "result": {"downloadUrl": "/download/job1.csv"},
+        }
+
+        def download_to_file(url, fileobj, hasher=None):
+            fileobj.write(b"a,b\n1,2\n")
+            return 8
+        client.download_to_file.side_effect = download_to_file
+
+        uploads = []
+
+        def resource_patch(context, data_dict):
+            if 'upload' in data_dict:
+                uploads.append((data_dict['upload'].filename, data_dict['upload'].stream.read()))
+
+        with mock.patch('ckan.plugins.toolkit.get_action', return_value=resource_patch), \
+                mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.tmp_dir': str(tmp_path)}):
+            _export_and_update(client, {'user': 'test'}, [('res1', 'csv')], 'form1', 'csv', 'My form')
+
+        assert uploads == [("My form.csv", b"a,b\n1,2\n")]
+        assert client.download_to_file.call_args[0][0] == "https://www.activityinfo.org/download/job1.csv"
+        # The temporary file is removed after the upload
+        assert os.listdir(tmp_path) == []
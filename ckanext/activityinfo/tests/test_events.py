@@ -0,0 +1,192 @@
+"""Tests for the Server-Sent Events streams of the downloads."""
+import json
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.data.job_status import ExportJobStatus
+from ckanext.activityinfo.events import ResourceProgressStream, StreamLimit, export_job_events, format_event
+from ckanext.activityinfo.jobs.progress import set_progress
+from ckanext.activityinfo.tests import factories
+
+
+def _parse(events):
+    """Get the (event, data) pairs of a text/event-stream body, without the keepalives."""
+    ret = []
+    for message in ''.join(events).split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in message.splitlines() if not line.startswith(':'))
+        if lines:
+            ret.append((lines['event'], json.loads(lines['data'])))
+    return ret
+
+
+class TestResourceProgressStream:
+    def test_format_event(self):
+        assert format_event('end', {}) == 'event: end\ndata: {}\n\n'
+
+    def test_progress_until_finished(self):
+        resource_id = str(uuid.uuid4())
+        stream = ResourceProgressStream([resource_id], timeout=5)
+        set_progress(resource_id, 'exporting', 50)
+        set_progress(resource_id, 'complete', 100)
+
+        events = _parse(stream.events({
+            resource_id: {'status': 'pending', 'progress': 0, 'error': '', 'job_id': 'job-1'},
+        }))
+
+        assert [(event, data.get('status')) for event, data in events] == [
+            ('progress', 'pending'),
+            ('progress', 'exporting'),
+            ('progress', 'complete'),
+            ('end', None),
+        ]
+        assert events[1][1]['resource_id'] == resource_id
+        assert events[1][1]['progress'] == 50
+
+    def test_finished_resources(self):
+        resource_id = str(uuid.uuid4())
+        stream = ResourceProgressStream([resource_id], timeout=5)
+
+        events = _parse(stream.events({
+            resource_id: {'status': 'complete', 'progress': 100, 'error': '', 'job_id': None},
+        }))
+
+        assert [event for event, _ in events] == ['progress', 'end']
+        assert stream.pubsub is None
+
+    def test_timeout_and_keepalive(self):
+        resource_id = str(uuid.uuid4())
+        stream = ResourceProgressStream([resource_id], timeout=1.5, keepalive=0)
+
+        events = list(stream.events({
+            resource_id: {'status': 'exporting', 'progress': 10, 'error': '', 'job_id': 'job-1'},
+        }))
+
+        assert ': keepalive\n\n' in events
+        # The browser reconnects after a timeout
+        assert [event for event, _ in _parse(events)] == ['progress']
+
+    def test_without_live_updates(self):
+        resource_id = str(uuid.uuid4())
+        stream = ResourceProgressStream([resource_id], timeout=5, live=False)
+
+        events = _parse(stream.events({
+            resource_id: {'status': 'exporting', 'progress': 10, 'error': '', 'job_id': 'job-1'},
+        }))
+
+        assert [event for event, _ in events] == ['progress', 'unavailable']
+
+
+class TestStreamLimit:
+    def test_max_streams_per_user(self):
+        user = str(uuid.uuid4())
+        with mock.patch.dict(toolkit.config, {'ckanext.activityinfo.events.max_streams_per_user': '2'}):
+            first, second, third = StreamLimit(user), StreamLimit(user), StreamLimit(user)
+            assert first.acquire()
+            assert second.acquire()
+            assert not third.acquire()
+            assert StreamLimit(str(uuid.uuid4())).acquire()
+
+            # The stream is released when its events end
+            list(first.wrap(iter(['event'])))
+            assert third.acquire()
+
+
+class TestExportJobEvents:
+    def test_events(self):
+        statuses = [
+            {'state': 'started', 'percentComplete': 10},
+            {'state': 'started', 'percentComplete': 10},
+            {'state': 'started', 'percentComplete': 60},
+            {'state': 'completed', 'percentComplete': 100},
+        ]
+        job = ExportJobStatus(str(uuid.uuid4()), 'key-1', max_age=0.01)
+
+        events = _parse(export_job_events(job, mock.Mock(side_effect=statuses), lambda status: status, timeout=5))
+
+        # Only the changes are sent
+        assert [data['percentComplete'] for _, data in events] == [10, 60, 100]
+
+    def test_statuses_fetched_by_other_watchers(self):
+        job_id = str(uuid.uuid4())
+        job = ExportJobStatus(job_id, 'key-1', max_age=60)
+        job.save({'state': 'started', 'percentComplete': 10})
+        events = export_job_events(job, mock.Mock(), lambda status: status, timeout=5)
+
+        assert _parse([next(events)])[0][1]['percentComplete'] == 10
+        ExportJobStatus(job_id, 'key-1').save({'state': 'completed', 'percentComplete': 100})
+        assert [data['state'] for _, data in _parse(events)] == ['completed']
+
+
+@pytest.fixture
+def setup_data():
+    obj = SimpleNamespace()
+    obj.activityinfo_user = factories.ActivityInfoUser()
+    return obj
+
+
+@pytest.mark.usefixtures("clean_db")
+class TestEventEndpoints:
+
+    def test_resource_events(self, app, setup_data):
+        resource = factories.ActivityInfoResource()
+
+        resp = app.get('/activity-info/events/resources', query_string={'resource_ids': resource['id']})
+
+        assert resp.status_code == 200
+        assert resp.headers['Content-Type'].startswith('text/event-stream')
+        events = _parse([resp.get_data(as_text=True)])
+        assert events[0][0] == 'progress'
+        assert events[0][1]['resource_id'] == resource['id']
+        assert events[0][1]['status'] == 'complete'
+        assert events[-1][0] == 'end'
+
+    def test_resource_events_too_many_streams(self, app, setup_data):
+        resource = factories.ActivityInfoResource(activityinfo_status='exporting')
+        environ = {"Authorization": setup_data.activityinfo_user["token"]}
+
+        with mock.patch('ckanext.activityinfo.blueprints.activity_info.StreamLimit.acquire', return_value=False):
+            resp = app.get(
+                '/activity-info/events/resources', query_string={'resource_ids': resource['id']}, headers=environ,
+            )
+
+        events = _parse([resp.get_data(as_text=True)])
+        assert [event for event, _ in events] == ['progress', 'unavailable']
+
+    def test_resource_events_missing_ids(self, app):
+        resp = app.get('/activity-info/events/resources')
+        assert resp.status_code == 400
+
+    def test_job_events(self, app, setup_data):
+        environ = {"Authorization": setup_data.activityinfo_user["token"]}
+        job_id = str(uuid.uuid4())
+        fake_status = {
+            "id": job_id,
+            "state": "completed",
+            "percentComplete": 100,
+            "result": {"downloadUrl": f"/resources/jobs/{job_id}/download"},
+        }
+
+        with mock.patch(
+            "ckanext.activityinfo.data.base.ActivityInfoClient.get_job_status",
+            return_value=fake_status,
+        ) as get_job_status:
+            resp = app.get(f"/activity-info/events/job/{job_id}", headers=environ)
+            events = _parse([resp.get_data(as_text=True)])
+            # The job-status route gets the saved status
+            status = app.get(f"/activity-info/job-status/{job_id}", headers=environ).json
+
+        assert events == [('status', {
+            'success': True,
+            'result': fake_status,
+            'download_url': f"https://www.activityinfo.org/resources/jobs/{job_id}/download",
+        })]
+        assert status['result']['state'] == 'completed'
+        get_job_status.assert_called_once()
+
+    def test_job_events_unauthorized(self, app):
+        with pytest.raises(toolkit.NotAuthorized):
+            app.get(f"/activity-info/events/job/{uuid.uuid4()}")
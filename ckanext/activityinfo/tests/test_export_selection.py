@@ -0,0 +1,151 @@
+"""Tests for the columns and filter of ActivityInfo resources."""
+from unittest import mock
+
+import pytest
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.actions.resource import _validate_export_fields
+from ckanext.activityinfo.jobs.download import _combine_filters, _export_and_update
+from ckanext.activityinfo.jobs.incremental import IncrementalSync
+from ckanext.activityinfo.utils import get_export_columns, get_export_filter
+
+
+COLUMNS = [
+    {'id': 'name', 'label': 'Name', 'formula': 'name'},
+    {'id': 'year', 'label': 'Year', 'formula': 'year'},
+]
+
+
+class TestExportFields:
+    def test_columns_from_a_list(self):
+        data_dict = {'activityinfo_columns': ['name', ' ref1_name ', '']}
+        _validate_export_fields(data_dict)
+        assert data_dict['activityinfo_columns'] == 'name,ref1_name'
+
+    def test_columns_from_a_string(self):
+        data_dict = {'activityinfo_columns': 'name, year,'}
+        _validate_export_fields(data_dict)
+        assert data_dict['activityinfo_columns'] == 'name,year'
+
+    def test_no_columns(self):
+        data_dict = {'activityinfo_columns': ''}
+        _validate_export_fields(data_dict)
+        assert data_dict['activityinfo_columns'] == ''
+
+    def test_invalid_columns(self):
+        with pytest.raises(toolkit.ValidationError) as excinfo:
+            _validate_export_fields({'activityinfo_columns': 'name,year;drop'})
+        assert 'activityinfo_columns' in excinfo.value.error_dict
+
+    def test_duplicated_columns(self):
+        with pytest.raises(toolkit.ValidationError) as excinfo:
+            _validate_export_fields({'activityinfo_columns': 'name,name'})
+        assert 'activityinfo_columns' in excinfo.value.error_dict
+
+    def test_filter(self):
+        data_dict = {'activityinfo_filter': '  year >= 2024 '}
+        _validate_export_fields(data_dict)
+        assert data_dict['activityinfo_filter'] == 'year >= 2024'
+
+    def test_filter_too_long(self):
+        with pytest.raises(toolkit.ValidationError) as excinfo:
+            _validate_export_fields({'activityinfo_filter': 'x' * 2001})
+        assert 'activityinfo_filter' in excinfo.value.error_dict
+
+    def test_fields_not_sent(self):
+        data_dict = {'name': 'My resource'}
+        _validate_export_fields(data_dict)
+        assert data_dict == {'name': 'My resource'}
+
+    def test_get_selection(self):
+        assert get_export_columns({'activityinfo_columns': 'name,year'}) == ['name', 'year']
+        assert get_export_columns({'activityinfo_columns': ''}) is None
+        assert get_export_columns({}) is None
+        assert get_export_filter({'activityinfo_filter': ' '}) is None
+        assert get_export_filter({'activityinfo_filter': 'year > 1'}) == 'year > 1'
+
+
+def test_combine_filters():
+    assert _combine_filters('year > 1', None) == 'year > 1'
+    assert _combine_filters(None, 'b') == 'b'
+    assert _combine_filters('year > 1', 'b') == '(year > 1) && (b)'
+
+
+class TestSelectedExport:
+    def _client(self):
+        client = mock.Mock(api_key="key", base_url="https://www.activityinfo.org", retry_stats={
+            'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0,
+        })
+        client.get_form_columns.return_value = COLUMNS
+        client.start_job_download_form_data.return_value = {"id": "job1"}
+        client.get_job_status.return_value = {
+            "state": "completed", "percentComplete": 100, "result": {"downloadUrl": "/download/job1.csv"},
+        }
+
+        def download_to_file(url, fileobj, hasher=None):
+            data = b"Name,Year\nAlice,2024\n"
+            fileobj.write(data)
+            hasher.update(data)
+            return len(data)
+        client.download_to_file.side_effect = download_to_file
+        return client
+
+    def _run(self, client, tmp_path, **kwargs):
+        patches = []
+
+        def resource_patch(context, data_dict):
+            patches.append(data_dict)
+
+        with mock.patch('ckan.plugins.toolkit.get_action', return_value=resource_patch), \
+                mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.tmp_dir': str(tmp_path)}):
+            _export_and_update(client, {'user': 'test'}, [('res1', 'csv')], 'form1', 'csv', 'My form',
+                               current_resources={'res1': {'id': 'res1'}}, **kwargs)
+        return patches
+
+    def test_columns_and_filter_are_exported(self, tmp_path):
+        client = self._client()
+
+        self._run(client, tmp_path, column_ids=['name', 'year'], row_filter='year >= 2024')
+
+        client.get_form_columns.assert_called_once_with('form1', column_ids=['name', 'year'])
+        kwargs = client.start_job_download_form_data.call_args[1]
+        assert kwargs['columns'] == COLUMNS
+        assert kwargs['filter_formula'] == 'year >= 2024'
+
+    def test_all_columns(self, tmp_path):
+        client = self._client()
+
+        self._run(client, tmp_path)
+
+        client.get_form_columns.assert_not_called()
+        assert client.start_job_download_form_data.call_args[1] == {'format': 'CSV'}
+
+    def test_unknown_columns(self, tmp_path):
+        client = self._client()
+        client.get_form_columns.side_effect = ValueError("Unknown columns of form form1: year2")
+
+        patches = []
+
+        def resource_patch(context, data_dict):
+            patches.append(data_dict)
+
+        with mock.patch('ckan.plugins.toolkit.get_action', return_value=resource_patch):
+            with pytest.raises(ValueError):
+                _export_and_update(client, {'user': 'test'}, [('res1', 'csv')], 'form1', 'csv', 'My form',
+                                   column_ids=['year2'])
+
+        assert patches[-1]['activityinfo_status'] == 'error'
+        assert 'year2' in patches[-1]['activityinfo_error']
+        client.start_job_download_form_data.assert_not_called()
+
+
+def test_snapshot_per_selection(tmp_path):
+    with mock.patch.dict('ckan.plugins.toolkit.config', {
+        'ckanext.activityinfo.incremental.snapshot_dir': str(tmp_path),
+    }):
+        paths = {
+            IncrementalSync('key', 'form1', []).snapshot_path,
+            IncrementalSync('key', 'form1', [], column_ids=['name']).snapshot_path,
+            IncrementalSync('key', 'form1', [], row_filter='year > 1').snapshot_path,
+        }
+    assert len(paths) == 3
@@ -0,0 +1,208 @@
+"""Tests for the form bundles: a form exported with all its sub-forms."""
+import io
+import zipfile
+from unittest import mock
+
+import pytest
+from ckan.plugins import toolkit
+
+from ckanext.activityinfo.actions.resource import _validate_export_fields
+from ckanext.activityinfo.data.base import ActivityInfoClient, build_export_columns, find_sub_forms
+from ckanext.activityinfo.jobs import convert
+from ckanext.activityinfo.jobs.bundle import get_table_names, match_table_files, pack_bundle
+from ckanext.activityinfo.jobs.download import _export_bundle_and_update, _plan_bundle_exports
+
+
+PARENT_TREE = {"forms": {"parent": {"schema": {
+    "schemaVersion": 1, "label": "Households", "elements": [
+        {"id": "name", "label": "Name", "type": "FREE_TEXT"},
+        {"id": "members", "label": "Members", "type": "subform", "typeParameters": {"formId": "child"}},
+    ],
+}}}}
+
+CHILD_TREE = {"forms": {"child": {"schema": {
+    "schemaVersion": 4, "label": "Members", "elements": [
+        {"id": "age", "label": "Age", "type": "quantity"},
+    ],
+}}}}
+
+TABLES = [
+    {'form_id': 'parent', 'label': 'Households', 'columns': []},
+    {'form_id': 'child', 'label': 'Members', 'columns': []},
+]
+
+
+def _tree_response(url):
+    response = mock.Mock(status_code=200, headers={})
+    response.json.return_value = PARENT_TREE if '/form/parent/' in url else CHILD_TREE
+    return response
+
+
+def _zip_export(path, files, date_time=(2026, 1, 1, 0, 0, 0)):
+    with zipfile.ZipFile(path, 'w') as export:
+        for name, content in files:
+            export.writestr(zipfile.ZipInfo(name, date_time=date_time), content)
+
+
+class TestBundleTables:
+    def test_sub_forms_are_not_columns(self):
+        schema = PARENT_TREE["forms"]["parent"]["schema"]
+        assert [column['id'] for column in build_export_columns(schema)] == ['name']
+        assert find_sub_forms(schema) == ['child']
+
+    def test_get_form_bundle(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        with mock.patch("requests.Session.request", side_effect=lambda method, url, **kwargs: _tree_response(url)):
+            tables = client.get_form_bundle("parent")
+
+        assert [(table['form_id'], table['label']) for table in tables] == [
+            ('parent', 'Households'), ('child', 'Members'),
+        ]
+        assert [column['formula'] for column in tables[0]['columns']] == ['_id', 'name']
+        assert [column['formula'] for column in tables[1]['columns']] == ['_id', '@parent', 'age']
+
+    def test_export_job_with_a_table_per_form(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"id": "job1"}
+        with mock.patch("requests.Session.request", return_value=response) as mock_request:
+            tables = [dict(table, columns=[{'id': 'name'}]) for table in TABLES]
+            assert client.start_job_download_forms_data(tables, format="CSV") == {"id": "job1"}
+
+        descriptor = mock_request.call_args[1]["json"]["descriptor"]
+        assert [model["formId"] for model in descriptor["tableModels"]] == ['parent', 'child']
+        assert descriptor["format"] == "CSV"
+
+    def test_table_names(self):
+        tables = [{'label': 'Members: adults'}, {'label': 'Members: adults'}, {'label': 'x' * 40}, {'label': ''}]
+        assert get_table_names(tables) == [
+            'Members_ adults.csv', 'Members_ adults 2.csv', f"{'x' * 31}.csv", 'Form.csv',
+        ]
+
+
+class TestPackBundle:
+    def test_zip_export(self, tmp_path):
+        src = tmp_path / "export.zip"
+        _zip_export(src, [("child.csv", "Age\n3\n"), ("parent.csv", "Name\nA\n")])
+        dst = tmp_path / "bundle.zip"
+
+        export_hash = pack_bundle(str(src), str(dst), TABLES)
+
+        with zipfile.ZipFile(dst) as bundle:
+            assert bundle.namelist() == ['Households.csv', 'Members.csv']
+            assert bundle.read('Members.csv') == b"Age\n3\n"
+
+        # Same tables exported at another time, same file
+        _zip_export(src, [("child.csv", "Age\n3\n"), ("parent.csv", "Name\nA\n")], date_time=(2026, 2, 1, 0, 0, 0))
+        assert pack_bundle(str(src), str(tmp_path / "again.zip"), TABLES) == export_hash
+
+    def test_files_matched_by_form_id_or_label(self):
+        assert match_table_files(['export/Members.csv', 'export/parent.csv'], TABLES) == [
+            'export/parent.csv', 'export/Members.csv',
+        ]
+        tables = [{'form_id': 'f1', 'label': 'Visits: 2026'}, {'form_id': 'f2', 'label': 'Visits: 2026'}]
+        with pytest.raises(ValueError):
+            # The label of several forms does not tell them apart
+            match_table_files(['Visits_ 2026.csv', 'f2.csv'], tables)
+        assert match_table_files(['f2.csv', 'f1.csv'], tables) == ['f1.csv', 'f2.csv']
+
+    def test_unknown_files(self, tmp_path):
+        src = tmp_path / "export.zip"
+        _zip_export(src, [("1.csv", "Name\nA\n"), ("2.csv", "Age\n3\n")])
+
+        with pytest.raises(ValueError):
+            pack_bundle(str(src), str(tmp_path / "bundle.zip"), TABLES)
+
+    def test_csv_export(self, tmp_path):
+        src = tmp_path / "export.csv"
+        src.write_text("Name\nA\n")
+        dst = tmp_path / "bundle.zip"
+
+        pack_bundle(str(src), str(dst), TABLES[:1])
+
+        with zipfile.ZipFile(dst) as bundle:
+            assert bundle.namelist() == ['Households.csv']
+
+    def test_to_xlsx(self, tmp_path):
+        openpyxl = pytest.importorskip("openpyxl")
+        src = tmp_path / "bundle.zip"
+        _zip_export(src, [("Households.csv", "Name\nA\n"), ("Members.csv", "Age\n3\n")])
+        dst = tmp_path / "bundle.xlsx"
+
+        convert.convert_bundle(str(src), str(dst), 'xlsx')
+
+        workbook = openpyxl.load_workbook(dst)
+        assert workbook.sheetnames == ['Households', 'Members']
+        assert [list(row) for row in workbook['Members'].values] == [['Age'], [3]]
+
+
+class TestPlanBundleExports:
+    def test_converted(self):
+        with mock.patch.object(convert, "openpyxl", mock.Mock()):
+            exports, unavailable = _plan_bundle_exports([('r1', 'zip'), ('r2', 'xlsx'), ('r3', 'json')])
+        assert exports == {'csv': [('r1', 'zip'), ('r2', 'xlsx')]}
+        assert unavailable == [('r3', 'json')]
+
+    def test_xlsx_from_activityinfo(self):
+        with mock.patch.object(convert, "openpyxl", None):
+            exports, _ = _plan_bundle_exports([('r1', 'zip'), ('r2', 'xlsx')])
+        assert exports == {'csv': [('r1', 'zip')], 'xlsx': [('r2', 'xlsx')]}
+
+
+class TestBundleDownload:
+    def _client(self, export):
+        client = mock.Mock(api_key="key", base_url="https://www.activityinfo.org", retry_stats={
+            'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0,
+        })
+        client.get_form_bundle.return_value = TABLES
+        client.start_job_download_forms_data.return_value = {"id": "job1"}
+        client.get_job_status.return_value = {
+            "state": "completed", "percentComplete": 100, "result": {"downloadUrl": "/download/job1.zip"},
+        }
+
+        def download_to_file(url, fileobj, hasher=None):
+            fileobj.write(export)
+            hasher.update(export)
+            return len(export)
+        client.download_to_file.side_effect = download_to_file
+        return client
+
+    def test_one_export_for_all_the_forms(self, tmp_path):
+        export = io.BytesIO()
+        _zip_export(export, [("child.csv", "Age\n3\n"), ("parent.csv", "Name\nA\n")])
+        client = self._client(export.getvalue())
+        uploads = []
+
+        def resource_patch(context, data_dict):
+            if 'upload' in data_dict:
+                data_dict = dict(data_dict, upload=data_dict['upload'].stream.read())
+                uploads.append(data_dict)
+
+        with mock.patch('ckan.plugins.toolkit.get_action', return_value=resource_patch), \
+                mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.tmp_dir': str(tmp_path)}):
+            _export_bundle_and_update(client, {'user': 'test'}, [('res1', 'zip')], 'parent', 'csv', 'Households')
+
+        client.start_job_download_forms_data.assert_called_once_with(TABLES, format='CSV')
+        client.start_job_download_form_data.assert_not_called()
+        assert uploads[0]['url'] == 'Households.zip'
+        assert uploads[0]['activityinfo_content_hash'].startswith('zip:')
+        with zipfile.ZipFile(io.BytesIO(uploads[0]['upload'])) as bundle:
+            assert bundle.namelist() == ['Households.csv', 'Members.csv']
+        # Temporary files are removed
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestBundleFields:
+    def test_bundle(self):
+        data_dict = {'activityinfo_bundle': 'on'}
+        _validate_export_fields(data_dict)
+        assert data_dict['activityinfo_bundle'] == 'true'
+
+        data_dict = {'activityinfo_bundle': False}
+        _validate_export_fields(data_dict)
+        assert data_dict['activityinfo_bundle'] == ''
+
+    def test_bundle_with_columns(self):
+        with pytest.raises(toolkit.ValidationError) as excinfo:
+            _validate_export_fields({'activityinfo_bundle': True, 'activityinfo_columns': 'name'})
+        assert 'activityinfo_bundle' in excinfo.value.error_dict
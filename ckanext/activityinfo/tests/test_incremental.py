@@ -0,0 +1,214 @@
+"""Tests for the incremental (delta) downloads."""
+import csv
+import os
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import pytest
+
+from ckanext.activityinfo.jobs.download import _export_and_update
+from ckanext.activityinfo.jobs.incremental import IncrementalSync, SchemaChangedError, merge_delta
+
+
+SNAPSHOT = "﻿Name,Amount,Record ID\nAlice,12,r1\nBob,3,r2\nCarol,7,r3\n"
+DELTA = "﻿Name,Amount,Record ID\nBob,4,r2\nDave,1,r4\n"
+NOW = datetime(2026, 3, 10, 12, 0, tzinfo=timezone.utc)
+
+
+def _rows(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.reader(f))
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path):
+    snapshot_dir = tmp_path / "snapshots"
+    with mock.patch.dict('ckan.plugins.toolkit.config', {
+        'ckanext.activityinfo.incremental.enabled': 'true',
+        'ckanext.activityinfo.incremental.snapshot_dir': str(snapshot_dir),
+    }):
+        yield snapshot_dir
+
+
+def _synced_resource(days_since_full=1):
+    return {
+        'activityinfo_sync_watermark': (NOW - timedelta(days=1)).isoformat(),
+        'activityinfo_last_full_sync': (NOW - timedelta(days=days_since_full)).isoformat(),
+    }
+
+
+def _write_snapshot(sync, taken_at=NOW):
+    os.makedirs(os.path.dirname(sync.snapshot_path), exist_ok=True)
+    with open(sync.snapshot_path, 'w', encoding='utf-8') as f:
+        f.write(SNAPSHOT)
+    os.utime(sync.snapshot_path, (taken_at.timestamp(), taken_at.timestamp()))
+
+
+class TestMergeDelta:
+    def test_merge(self, tmp_path):
+        snapshot, delta, merged = tmp_path / "snapshot.csv", tmp_path / "delta.csv", tmp_path / "merged.csv"
+        snapshot.write_text(SNAPSHOT, encoding='utf-8')
+        delta.write_text(DELTA, encoding='utf-8')
+
+        assert merge_delta(snapshot, delta, merged) == (1, 1)
+        assert _rows(merged) == [
+            ['Name', 'Amount', 'Record ID'],
+            ['Alice', '12', 'r1'],
+            ['Bob', '4', 'r2'],
+            ['Carol', '7', 'r3'],
+            ['Dave', '1', 'r4'],
+        ]
+
+    def test_columns_changed(self, tmp_path):
+        snapshot, delta = tmp_path / "snapshot.csv", tmp_path / "delta.csv"
+        snapshot.write_text(SNAPSHOT, encoding='utf-8')
+        delta.write_text("Name,Amount,Region,Record ID\nBob,4,North,r2\n", encoding='utf-8')
+
+        with pytest.raises(SchemaChangedError):
+            merge_delta(snapshot, delta, tmp_path / "merged.csv")
+
+    def test_no_record_id(self, tmp_path):
+        snapshot, delta = tmp_path / "snapshot.csv", tmp_path / "delta.csv"
+        snapshot.write_text("Name\nAlice\n", encoding='utf-8')
+        delta.write_text("Name\nBob\n", encoding='utf-8')
+
+        with pytest.raises(SchemaChangedError):
+            merge_delta(snapshot, delta, tmp_path / "merged.csv")
+
+
+class TestIncrementalSync:
+    def test_full_without_snapshot(self, snapshot_dir):
+        sync = IncrementalSync('key', 'form1', [_synced_resource()], now=NOW)
+        assert not sync.is_delta
+        assert sync.get_filter() is None
+
+    def test_delta(self, snapshot_dir):
+        _write_snapshot(IncrementalSync('key', 'form1', [], now=NOW))
+        older = dict(_synced_resource(), activityinfo_sync_watermark=(NOW - timedelta(days=3)).isoformat())
+
+        sync = IncrementalSync('key', 'form1', [_synced_resource(), older], now=NOW)
+
+        # The oldest watermark of the group
+        assert sync.since == NOW - timedelta(days=3)
+        assert sync.get_filter() == '_lastEditTime >= DATE(2026, 3, 7)'
+
+    def test_snapshot_older_than_the_watermark(self, snapshot_dir):
+        _write_snapshot(IncrementalSync('key', 'form1', [], now=NOW), taken_at=NOW - timedelta(days=5))
+
+        sync = IncrementalSync('key', 'form1', [_synced_resource()], now=NOW)
+
+        assert sync.since == NOW - timedelta(days=5, hours=1)
+
+    @pytest.mark.parametrize('resource', [
+        {},
+        {'activityinfo_sync_watermark': NOW.isoformat()},
+        _synced_resource(days_since_full=31),
+    ])
+    def test_full_refresh(self, snapshot_dir, resource):
+        _write_snapshot(IncrementalSync('key', 'form1', [], now=NOW))
+        assert not IncrementalSync('key', 'form1', [resource], now=NOW).is_delta
+
+    def test_snapshots_per_api_key(self, snapshot_dir):
+        _write_snapshot(IncrementalSync('key', 'form1', [], now=NOW))
+        assert not IncrementalSync('other-key', 'form1', [_synced_resource()], now=NOW).is_delta
+
+    def test_extras(self, snapshot_dir):
+        full = IncrementalSync('key', 'form1', [], now=NOW).get_extras()
+        assert full == {
+            'activityinfo_sync_watermark': (NOW - timedelta(hours=1)).isoformat(),
+            'activityinfo_last_full_sync': NOW.isoformat(),
+        }
+        _write_snapshot(IncrementalSync('key', 'form1', [], now=NOW))
+        delta = IncrementalSync('key', 'form1', [_synced_resource()], now=NOW).get_extras()
+        assert list(delta) == ['activityinfo_sync_watermark']
+
+    def test_apply(self, snapshot_dir, tmp_path):
+        sync = IncrementalSync('key', 'form1', [], now=NOW)
+        _write_snapshot(sync)
+        sync = IncrementalSync('key', 'form1', [_synced_resource()], now=NOW)
+        delta = tmp_path / "delta.csv"
+        delta.write_text(DELTA, encoding='utf-8')
+
+        path, content_hash = sync.apply(str(delta))
+
+        assert path != str(delta)
+        assert len(_rows(path)) == 5
+        # The merged file is the new snapshot
+        assert _rows(sync.snapshot_path) == _rows(path)
+        assert len(content_hash) == 64
+        os.remove(path)
+
+
+class TestIncrementalExport:
+    def _client(self, exports):
+        client = mock.Mock(api_key="key", base_url="https://www.activityinfo.org", retry_stats={
+            'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0,
+        })
+        client.get_form_columns.return_value = [{'id': 'name', 'label': 'Name', 'formula': 'name'}]
+        client.start_job_download_form_data.return_value = {"id": "job1"}
+        client.get_job_status.return_value = {
+            "state": "completed", "percentComplete": 100, "result": {"downloadUrl": "/download/job1.csv"},
+        }
+        exports = iter(exports)
+
+        def download_to_file(url, fileobj, hasher=None):
+            data = next(exports).encode('utf-8')
+            fileobj.write(data)
+            hasher.update(data)
+            return len(data)
+        client.download_to_file.side_effect = download_to_file
+        return client
+
+    def _run(self, client, tmp_path, resource):
+        patches = []
+
+        def resource_patch(context, data_dict):
+            if 'upload' in data_dict:
+                data_dict = dict(data_dict, upload=data_dict['upload'].stream.read().decode('utf-8-sig'))
+            patches.append(data_dict)
+
+        with mock.patch('ckan.plugins.toolkit.get_action', return_value=resource_patch), \
+                mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.tmp_dir': str(tmp_path)}):
+            _export_and_update(
+                client, {'user': 'test'}, [('res1', 'csv')], 'form1', 'csv', 'My form',
+                current_resources={'res1': dict(resource, id='res1')},
+            )
+        return [patch for patch in patches if 'upload' in patch]
+
+    def test_delta_is_merged(self, snapshot_dir, tmp_path):
+        now = datetime.now(timezone.utc)
+        _write_snapshot(IncrementalSync('key', 'form1', []), taken_at=now)
+        resource = {
+            'activityinfo_sync_watermark': (now - timedelta(days=1)).isoformat(),
+            'activityinfo_last_full_sync': (now - timedelta(days=2)).isoformat(),
+        }
+        client = self._client([DELTA])
+
+        uploads = self._run(client, tmp_path, resource)
+
+        kwargs = client.start_job_download_form_data.call_args[1]
+        assert kwargs['filter_formula'].startswith('_lastEditTime >= DATE(')
+        assert kwargs['columns'][-1]['formula'] == '_id'
+        assert 'Bob,4,r2' in uploads[0]['upload']
+        assert 'Dave,1,r4' in uploads[0]['upload']
+        assert 'activityinfo_last_full_sync' not in uploads[0]
+        assert uploads[0]['activityinfo_sync_watermark']
+        # Temporary files are removed
+        assert list(tmp_path.iterdir()) == [snapshot_dir]
+
+    def test_full_export_when_the_columns_changed(self, snapshot_dir, tmp_path):
+        now = datetime.now(timezone.utc)
+        _write_snapshot(IncrementalSync('key', 'form1', []), taken_at=now)
+        resource = {
+            'activityinfo_sync_watermark': (now - timedelta(days=1)).isoformat(),
+            'activityinfo_last_full_sync': (now - timedelta(days=2)).isoformat(),
+        }
+        full = "Name,Amount,Region,Record ID\nAlice,12,North,r1\n"
+        client = self._client(["Name,Amount,Region,Record ID\nBob,4,North,r2\n", full])
+
+        uploads = self._run(client, tmp_path, resource)
+
+        assert client.start_job_download_form_data.call_count == 2
+        assert 'filter_formula' not in client.start_job_download_form_data.call_args[1]
+        assert uploads[0]['upload'] == full
+        assert uploads[0]['activityinfo_last_full_sync']
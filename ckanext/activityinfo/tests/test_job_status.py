@@ -0,0 +1,102 @@
+"""Tests for the export job status shared by the watchers of a job."""
+import threading
+import time
+import uuid
+from unittest import mock
+
+import pytest
+
+from ckanext.activityinfo.data.job_status import ExportJobStatus
+from ckanext.activityinfo.exceptions import ActivityInfoConnectionError
+
+
+STARTED = {'state': 'started', 'percentComplete': 10}
+
+
+class TestExportJobStatus:
+    def test_reused_while_fresh(self):
+        job_id = str(uuid.uuid4())
+        fetch = mock.Mock(return_value=STARTED)
+
+        assert ExportJobStatus(job_id, 'key-1', max_age=60).get(fetch) == (STARTED, True)
+        assert ExportJobStatus(job_id, 'key-1', max_age=60).get(fetch) == (STARTED, False)
+        fetch.assert_called_once()
+
+    def test_fetched_again_when_too_old(self):
+        job = ExportJobStatus(str(uuid.uuid4()), 'key-1', max_age=0)
+        fetch = mock.Mock(return_value=STARTED)
+
+        job.get(fetch)
+        job.get(fetch)
+
+        assert fetch.call_count == 2
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.job_status.max_age', '30')
+    def test_max_age_from_config(self):
+        assert ExportJobStatus('job', 'key-1').max_age == 30
+
+    def test_api_keys_do_not_share_statuses(self):
+        job_id = str(uuid.uuid4())
+        ExportJobStatus(job_id, 'key-1', max_age=60).get(mock.Mock(return_value=STARTED))
+
+        assert ExportJobStatus(job_id, 'key-2').get_cached() is None
+
+    def test_final_status_is_not_fetched_again(self):
+        job_id = str(uuid.uuid4())
+        fetch = mock.Mock(return_value={'state': 'completed', 'percentComplete': 100})
+        ExportJobStatus(job_id, 'key-1', max_age=0).get(fetch)
+
+        assert ExportJobStatus(job_id, 'key-1', max_age=0).get(fetch)[1] is False
+        fetch.assert_called_once()
+
+    def test_concurrent_requests_share_one_call(self):
+        job_id = str(uuid.uuid4())
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.5)
+            return STARTED
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(ExportJobStatus(job_id, 'key-1', max_age=60).get(fetch)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert [status for status, _ in results] == [STARTED] * 5
+        assert sorted(fetched for _, fetched in results) == [False] * 4 + [True]
+
+    def test_waiting_requests_get_the_error(self):
+        job_id = str(uuid.uuid4())
+        started = threading.Event()
+
+        def fetch():
+            started.set()
+            time.sleep(0.5)
+            raise ActivityInfoConnectionError('Unauthorized')
+
+        def first():
+            with pytest.raises(ActivityInfoConnectionError):
+                ExportJobStatus(job_id, 'key-1').get(fetch)
+
+        thread = threading.Thread(target=first)
+        thread.start()
+        started.wait(5)
+        with pytest.raises(ActivityInfoConnectionError):
+            ExportJobStatus(job_id, 'key-1').get(mock.Mock())
+        thread.join()
+
+    def test_wait_timeout(self):
+        job_id = str(uuid.uuid4())
+        job = ExportJobStatus(job_id, 'key-1', wait_timeout=0.5)
+        # Another request holds the call and never ends
+        assert job._lock('other')
+        fetch = mock.Mock(return_value=STARTED)
+
+        assert ExportJobStatus(job_id, 'key-1', wait_timeout=0.5).get(fetch) == (STARTED, True)
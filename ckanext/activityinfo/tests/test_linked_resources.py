@@ -0,0 +1,63 @@
+from unittest import mock
+import pytest
+from ckantoolkit.tests import factories as ckan_factories
+from ckanext.activityinfo.tests import factories
+from ckanext.activityinfo.utils import get_ai_resources, get_ckan_resources, get_ckan_resources_by_form
+
+
+@pytest.fixture
+def request_context(app):
+    with app.flask_app.test_request_context():
+        yield
+
+
+@pytest.mark.usefixtures("clean_db", "request_context")
+class TestGetCkanResources:
+    def test_resources_by_form(self):
+        dataset = ckan_factories.Dataset(name='linked-dataset')
+        first = factories.ActivityInfoResource(package_id=dataset['id'], name='First', activityinfo_form_id='form01')
+        factories.ActivityInfoResource(package_id=dataset['id'], name='Second', activityinfo_form_id='form01')
+        factories.ActivityInfoResource(package_id=dataset['id'], name='Other', activityinfo_form_id='form02')
+
+        result = get_ckan_resources_by_form(['form01', 'form02', 'form03'])
+
+        assert [name for name, _ in result['form01']] == ['First', 'Second']
+        assert [name for name, _ in result['form02']] == ['Other']
+        assert result['form03'] == []
+        assert result['form01'][0][1] == f"/dataset/linked-dataset/resource/{first['id']}"
+
+    def test_single_form(self):
+        resource = factories.ActivityInfoResource(activityinfo_form_id='form01')
+        assert [name for name, _ in get_ckan_resources('form01')] == [resource['name']]
+
+    def test_no_forms(self):
+        assert get_ckan_resources_by_form([]) == {}
+
+    def test_does_not_call_package_show(self):
+        factories.ActivityInfoResource(activityinfo_form_id='form01')
+        with mock.patch('ckan.plugins.toolkit.get_action') as get_action:
+            assert len(get_ckan_resources('form01')) == 1
+        get_action.assert_not_called()
+
+
+@pytest.mark.usefixtures("clean_db", "request_context")
+class TestGetAIResources:
+    def test_complete_resources_with_package(self):
+        dataset = ckan_factories.Dataset(name='linked-dataset', title='Linked dataset')
+        resource = factories.ActivityInfoResource(package_id=dataset['id'])
+        factories.ActivityInfoResource(package_id=dataset['id'], activityinfo_status='error')
+
+        result = get_ai_resources()
+
+        assert len(result) == 1
+        assert result[0]['id'] == resource['id']
+        assert result[0]['final_url'] == f"/dataset/linked-dataset/resource/{resource['id']}"
+        assert result[0]['package'] == {
+            'id': dataset['id'], 'name': 'linked-dataset', 'title': 'Linked dataset', 'type': 'dataset',
+        }
+
+    def test_limit(self):
+        dataset = ckan_factories.Dataset()
+        for _ in range(3):
+            factories.ActivityInfoResource(package_id=dataset['id'])
+        assert len(get_ai_resources(limit=2)) == 2
@@ -0,0 +1,80 @@
+from unittest import mock
+import pytest
+from ckanext.activityinfo.jobs.polling import AdaptivePoller
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    fake_clock = FakeClock()
+    with mock.patch("ckanext.activityinfo.jobs.polling.time.monotonic", fake_clock):
+        yield fake_clock
+
+
+class TestAdaptivePoller:
+    def test_starts_fast(self, clock):
+        poller = AdaptivePoller(min_interval=0.5)
+        poller.observe(0)
+        assert poller.interval == 0.5
+
+    def test_backs_off_without_progress(self, clock):
+        poller = AdaptivePoller(min_interval=1, max_interval=4, backoff=2)
+        intervals = []
+        for _ in range(5):
+            poller.observe(0)
+            intervals.append(poller.interval)
+            clock.now += poller.interval
+        assert intervals == [1, 2, 4, 4, 4]
+
+    def test_extrapolates_remaining_time(self, clock):
+        poller = AdaptivePoller(min_interval=0.5, max_interval=60)
+        poller.observe(0)
+        clock.now += 10
+        poller.observe(20)
+        # 2% per second: 40s left, next poll half way
+        assert poller.estimate_remaining() == 40
+        assert poller.interval == 20
+
+    def test_interval_is_capped(self, clock):
+        poller = AdaptivePoller(min_interval=0.5, max_interval=15)
+        poller.observe(0)
+        clock.now += 100
+        poller.observe(1)
+        assert poller.interval == 15
+
+    def test_timeout_is_extended_while_progressing(self, clock):
+        poller = AdaptivePoller(timeout=60, max_timeout=600)
+        for percent in range(0, 100, 10):
+            clock.now += 50
+            poller.observe(percent)
+            assert not poller.timed_out()
+        clock.now += 61
+        assert poller.timed_out()
+
+    def test_max_timeout(self, clock):
+        poller = AdaptivePoller(timeout=60, max_timeout=120)
+        for percent in (10, 20, 30):
+            clock.now += 50
+            poller.observe(percent)
+        assert poller.timed_out()
+
+    def test_stats(self, clock):
+        poller = AdaptivePoller()
+        poller.observe(0)
+        clock.now += 2.5
+        poller.observe(50)
+        assert poller.stats() == {'polls': 2, 'wall_time': 2.5}
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.polling.timeout', '900')
+    @pytest.mark.ckan_config('ckanext.activityinfo.polling.min_interval', '2')
+    def test_from_config(self):
+        poller = AdaptivePoller.from_config()
+        assert poller.timeout == 900
+        assert poller.min_interval == 2
@@ -0,0 +1,96 @@
+import uuid
+from unittest import mock
+import pytest
+from ckanext.activityinfo.helpers import add_live_progress
+from ckanext.activityinfo.jobs.download import _export_and_update
+from ckanext.activityinfo.jobs.progress import ProgressThrottle, get_progress, get_progress_many, set_progress
+
+
+class TestProgressStore:
+    def test_set_and_get(self):
+        resource_id = str(uuid.uuid4())
+        set_progress(resource_id, 'exporting', 42)
+        progress = get_progress(resource_id)
+        assert progress['status'] == 'exporting'
+        assert progress['progress'] == 42
+        assert progress['error'] == ''
+
+    def test_unknown_resource(self):
+        assert get_progress(str(uuid.uuid4())) is None
+
+    def test_get_many(self):
+        first, second, unknown = (str(uuid.uuid4()) for _ in range(3))
+        set_progress(first, 'exporting', 10)
+        set_progress(second, 'error', 0, 'Export failed')
+        progress = get_progress_many([first, second, unknown])
+        assert set(progress) == {first, second}
+        assert progress[first]['progress'] == 10
+        assert progress[second]['error'] == 'Export failed'
+
+
+class TestProgressThrottle:
+    def test_first_update_is_persisted(self):
+        assert ProgressThrottle().should_persist('exporting', 0)
+
+    def test_status_changes_are_persisted(self):
+        throttle = ProgressThrottle(min_interval=3600, min_delta=100)
+        throttle.mark_persisted('exporting', 10)
+        assert throttle.should_persist('downloading', 10)
+        assert throttle.should_persist('exporting', 10, 'Some error')
+
+    def test_small_progress_steps_are_not_persisted(self):
+        throttle = ProgressThrottle(min_interval=0, min_delta=25)
+        throttle.mark_persisted('exporting', 10)
+        assert not throttle.should_persist('exporting', 20)
+        assert throttle.should_persist('exporting', 40)
+
+    def test_min_interval(self):
+        throttle = ProgressThrottle(min_interval=30, min_delta=1)
+        throttle.mark_persisted('exporting', 10)
+        assert not throttle.should_persist('exporting', 90)
+        throttle.persisted_at -= 31
+        assert throttle.should_persist('exporting', 90)
+
+
+class TestExportProgressWrites:
+    @pytest.mark.ckan_config('ckanext.activityinfo.progress.min_interval', '3600')
+    def test_polls_do_not_patch_the_resource(self):
+        resource_id = str(uuid.uuid4())
+        client = mock.Mock(api_key="test-api-key", base_url="https://www.activityinfo.org", retry_stats={
+            'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0,
+        })
+        client.start_job_download_form_data.return_value = {"id": "job1"}
+        statuses = [{"state": "started", "percentComplete": percent} for percent in range(0, 100, 10)]
+        statuses.append({"state": "failed", "percentComplete": 90, "error": "Boom"})
+        client.get_job_status.side_effect = statuses
+        resource_patch = mock.Mock()
+
+        with mock.patch('ckan.plugins.toolkit.get_action', return_value=resource_patch), \
+                mock.patch('ckanext.activityinfo.jobs.polling.time.sleep'):
+            with pytest.raises(ValueError):
+                _export_and_update(client, {'user': 'test'}, [(resource_id, 'csv')], 'form1', 'csv', 'My form')
+
+        # Only the final error is written to the resource, the polls go to the live progress
+        assert resource_patch.call_count == 1
+        assert resource_patch.call_args[0][1]['activityinfo_status'] == 'error'
+        assert get_progress(resource_id)['status'] == 'error'
+
+
+class TestLiveProgress:
+    def test_processing_resource_gets_live_progress(self):
+        resource_id = str(uuid.uuid4())
+        set_progress(resource_id, 'exporting', 60)
+        resource = {
+            'id': resource_id, 'activityinfo_form_id': 'form1',
+            'activityinfo_status': 'exporting', 'activityinfo_progress': 10,
+        }
+        assert add_live_progress(resource)['activityinfo_progress'] == 60
+
+    def test_finished_resource_is_not_changed(self):
+        resource_id = str(uuid.uuid4())
+        set_progress(resource_id, 'exporting', 60)
+        resource = {
+            'id': resource_id, 'activityinfo_form_id': 'form1',
+            'activityinfo_status': 'complete', 'activityinfo_progress': 100,
+        }
+        assert add_live_progress(resource)['activityinfo_progress'] == 100
@@ -0,0 +1,195 @@
+"""Tests for the direct query path of small forms."""
+import hashlib
+import io
+import json
+from unittest import mock
+
+import pytest
+
+from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.jobs.convert import convert_csv
+from ckanext.activityinfo.jobs.download import _export_and_update
+from ckanext.activityinfo.jobs.query import count_csv_records, estimate_record_count, use_query_path, write_records
+
+
+COLUMNS = [
+    {'id': 'name', 'label': 'Name', 'formula': 'name'},
+    {'id': 'amount', 'label': 'Amount', 'formula': 'amount'},
+]
+
+CHUNKS = [
+    {"rows": 2, "columns": {
+        "name": {"storage": "array", "values": ["Alice", "Bob, Jr."]},
+        "amount": {"storage": "array", "values": [12.0, None]},
+    }},
+    {"rows": 1, "columns": {
+        "name": {"storage": "constant", "value": "Carol"},
+        "amount": {"storage": "empty"},
+    }},
+]
+
+CSV = "Name,Amount\r\nAlice,12\r\n\"Bob, Jr.\",\r\nCarol,\r\n"
+
+
+def _query_response(chunks):
+    response = mock.Mock()
+    response.status_code = 200
+    response.iter_lines.return_value = iter([json.dumps(chunk).encode() for chunk in chunks] + [b""])
+    return response
+
+
+class TestIterFormRecords:
+    def test_records(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        response = _query_response(CHUNKS)
+        with mock.patch("requests.Session.request", return_value=response) as mock_request:
+            records = list(client.iter_form_records("form1", COLUMNS, filter_formula="amount > 1"))
+
+        assert records == [["Alice", 12.0], ["Bob, Jr.", None], ["Carol", None]]
+        args, kwargs = mock_request.call_args
+        assert args == ("POST", "https://www.activityinfo.org/resources/query/chunks")
+        assert kwargs["stream"] is True
+        assert kwargs["json"]["rowSources"] == [{"rootFormId": "form1"}]
+        assert kwargs["json"]["columns"] == [
+            {"id": "name", "expression": "name"}, {"id": "amount", "expression": "amount"},
+        ]
+        assert kwargs["json"]["filter"] == "amount > 1"
+        response.close.assert_called_once()
+
+    def test_short_column(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        chunk = {"rows": 2, "columns": {
+            "name": {"storage": "array", "values": ["Alice", "Bob"]},
+            "amount": {"storage": "array", "values": [12.0]},
+        }}
+        with mock.patch("requests.Session.request", return_value=_query_response([chunk])):
+            records = list(client.iter_form_records("form1", COLUMNS))
+
+        assert records == [["Alice", 12.0], ["Bob", None]]
+
+
+class TestWriteRecords:
+    def test_csv(self):
+        out = io.BytesIO()
+        hasher = hashlib.sha256()
+        count = write_records(iter([["Alice", 12.0], ["Bob, Jr.", None], ["Carol", None]]), COLUMNS, out, 'csv',
+                              hasher=hasher)
+
+        assert count == 3
+        assert out.getvalue().decode() == CSV
+        assert hasher.hexdigest() == hashlib.sha256(CSV.encode()).hexdigest()
+
+    def test_json_same_as_the_conversion(self, tmp_path):
+        src = tmp_path / "export.csv"
+        src.write_text(CSV, newline='')
+        converted = tmp_path / "export.json"
+        convert_csv(str(src), str(converted), 'json')
+
+        out = io.BytesIO()
+        write_records(iter([["Alice", 12.0], ["Bob, Jr.", None], ["Carol", None]]), COLUMNS, out, 'json')
+
+        assert out.getvalue().decode() == converted.read_text()
+
+    def test_unsupported_format(self):
+        with pytest.raises(ValueError):
+            write_records(iter([]), COLUMNS, io.BytesIO(), 'xlsx')
+
+
+class TestChoosePath:
+    def test_estimate(self):
+        assert estimate_record_count([{'activityinfo_record_count': '10'}, {'activityinfo_record_count': 30}]) == 30
+        assert estimate_record_count([{'activityinfo_record_count': '10'}, {}]) is None
+        assert estimate_record_count([]) is None
+
+    def test_use_query_path(self):
+        with mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.query.max_records': '100'}):
+            assert use_query_path([{'activityinfo_record_count': '100'}])
+            assert not use_query_path([{'activityinfo_record_count': '101'}])
+            assert not use_query_path([{}])
+
+    def test_disabled(self):
+        with mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.query.max_records': '0'}):
+            assert not use_query_path([{'activityinfo_record_count': '1'}])
+
+    def test_count_csv_records(self, tmp_path):
+        path = tmp_path / "export.csv"
+        path.write_text(CSV, newline='')
+        assert count_csv_records(str(path)) == 3
+        assert count_csv_records(str(path), limit=1) == 2
+
+
+class TestQueryDownload:
+    def _client(self):
+        client = mock.Mock(api_key="key", base_url="https://www.activityinfo.org", retry_stats={
+            'requests': 0, 'retries': 0, 'retry_wait': 0.0, 'gave_up': 0,
+        })
+        client.get_form_columns.return_value = COLUMNS
+        client.iter_form_records.side_effect = lambda *args: iter([["Alice", 12.0], ["Bob, Jr.", None]])
+        client.start_job_download_form_data.return_value = {"id": "job1"}
+        client.get_job_status.return_value = {
+            "state": "completed", "percentComplete": 100, "result": {"downloadUrl": "/download/job1.csv"},
+        }
+
+        def download_to_file(url, fileobj, hasher=None):
+            data = CSV.encode('utf-8')
+            fileobj.write(data)
+            hasher.update(data)
+            return len(data)
+        client.download_to_file.side_effect = download_to_file
+        return client
+
+    def _run(self, client, tmp_path, targets, record_count=None):
+        patches = []
+
+        def resource_patch(context, data_dict):
+            if 'upload' in data_dict:
+                data_dict = dict(data_dict, upload=data_dict['upload'].stream.read().decode('utf-8-sig'))
+            patches.append(data_dict)
+
+        resources = {resource_id: {'id': resource_id} for resource_id, _ in targets}
+        if record_count is not None:
+            for resource in resources.values():
+                resource['activityinfo_record_count'] = record_count
+        with mock.patch('ckan.plugins.toolkit.get_action', return_value=resource_patch), \
+                mock.patch.dict('ckan.plugins.toolkit.config', {'ckanext.activityinfo.tmp_dir': str(tmp_path)}):
+            _export_and_update(client, {'user': 'test'}, targets, 'form1', 'csv', 'My form',
+                               current_resources=resources)
+        return [patch for patch in patches if 'upload' in patch]
+
+    def test_small_form_is_queried(self, tmp_path):
+        client = self._client()
+
+        uploads = self._run(client, tmp_path, [('res1', 'csv')], record_count='10')
+
+        client.start_job_download_form_data.assert_not_called()
+        client.iter_form_records.assert_called_once_with('form1', COLUMNS, None)
+        assert uploads[0]['upload'] == "Name,Amount\r\nAlice,12\r\n\"Bob, Jr.\",\r\n"
+        assert uploads[0]['activityinfo_record_count'] == 2
+        # Temporary files are removed
+        assert list(tmp_path.iterdir()) == []
+
+    def test_json_is_written_directly(self, tmp_path):
+        client = self._client()
+
+        uploads = self._run(client, tmp_path, [('res1', 'json')], record_count='10')
+
+        assert json.loads(uploads[0]['upload']) == [{"Name": "Alice", "Amount": "12"}, {"Name": "Bob, Jr.", "Amount": ""}]
+        assert uploads[0]['url'] == 'My form.json'
+
+    def test_unknown_count_uses_an_export_job(self, tmp_path):
+        client = self._client()
+
+        uploads = self._run(client, tmp_path, [('res1', 'csv')])
+
+        client.iter_form_records.assert_not_called()
+        client.start_job_download_form_data.assert_called_once()
+        # The next download can use the query path
+        assert uploads[0]['activityinfo_record_count'] == 3
+
+    def test_big_form_uses_an_export_job(self, tmp_path):
+        client = self._client()
+
+        self._run(client, tmp_path, [('res1', 'csv')], record_count='50000')
+
+        client.iter_form_records.assert_not_called()
+        client.start_job_download_form_data.assert_called_once()
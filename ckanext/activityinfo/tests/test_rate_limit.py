@@ -0,0 +1,131 @@
+import time
+import uuid
+from unittest import mock
+import pytest
+from redis.exceptions import RedisError
+from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.data.rate_limit import (
+    ExportSlots,
+    TokenBucketRateLimiter,
+    get_export_slots,
+    get_rate_limiter,
+)
+from ckanext.activityinfo.exceptions import ActivityInfoRateLimitError
+
+
+def _broken_redis():
+    conn = mock.Mock()
+    conn.register_script.side_effect = RedisError("Connection refused")
+    return conn
+
+
+class TestRateLimitConfig:
+    def test_disabled_by_default(self):
+        assert get_rate_limiter("key") is None
+        assert get_export_slots("key") is None
+        client = ActivityInfoClient(api_key="key")
+        assert client.rate_limiter is None
+        assert client.export_slots is None
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.rate_limit.requests_per_second', '4')
+    def test_requests_per_second(self):
+        limiter = get_rate_limiter("my-secret-token")
+        assert limiter.rate == 4
+        assert limiter.burst == 4
+        # The Redis key does not expose the API key
+        assert "my-secret-token" not in limiter.key
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.rate_limit.max_concurrent_exports', '2')
+    def test_max_concurrent_exports(self):
+        assert get_export_slots("key").limit == 2
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.rate_limit.requests_per_second', '4')
+    def test_no_limiter_without_api_key(self):
+        assert get_rate_limiter(None) is None
+
+
+class TestTokenBucket:
+    def test_redis_bucket(self):
+        limiter = TokenBucketRateLimiter(uuid.uuid4().hex, rate=1, burst=2)
+        assert limiter._take() == 0
+        assert limiter._take() == 0
+        assert 0 < limiter._take() <= 1
+
+    def test_bucket_shared_by_clients_with_same_token(self):
+        token_hash = uuid.uuid4().hex
+        assert TokenBucketRateLimiter(token_hash, rate=1, burst=1)._take() == 0
+        assert TokenBucketRateLimiter(token_hash, rate=1, burst=1)._take() > 0
+
+    def test_local_fallback_without_redis(self):
+        limiter = TokenBucketRateLimiter(uuid.uuid4().hex, rate=1, burst=1, redis_conn=_broken_redis())
+        assert limiter._take() == 0
+        assert limiter._take() > 0
+
+    def test_acquire_waits_for_a_token(self):
+        limiter = TokenBucketRateLimiter(uuid.uuid4().hex, rate=1, burst=1)
+        with mock.patch.object(limiter, "_take", side_effect=[0.5, 0]):
+            with mock.patch("ckanext.activityinfo.data.rate_limit.time.sleep") as mock_sleep:
+                assert limiter.acquire() == 0.5
+        mock_sleep.assert_called_once_with(0.5)
+
+    def test_client_waits_for_the_limiter_before_each_request(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        client.rate_limiter = mock.Mock()
+        client.rate_limiter.acquire.return_value = 0.25
+        response = mock.Mock(status_code=200)
+        response.json.return_value = []
+        with mock.patch("requests.Session.request", return_value=response):
+            client.get_databases()
+        client.rate_limiter.acquire.assert_called_once()
+        assert client.rate_limit_wait == 0.25
+
+
+class TestExportSlots:
+    def test_slots_limit_concurrent_exports(self):
+        slots = ExportSlots(uuid.uuid4().hex, limit=1, max_wait=0)
+        with slots.slot():
+            with pytest.raises(ActivityInfoRateLimitError):
+                with slots.slot():
+                    pass
+        # The slot is released when the export finishes
+        with slots.slot():
+            pass
+
+    def test_expired_slots_are_released(self):
+        slots = ExportSlots(uuid.uuid4().hex, limit=1, max_wait=0, ttl=60)
+        assert slots._acquire("crashed-worker")
+        assert not slots._acquire("next-worker")
+        later = time.time() + 120
+        with mock.patch("ckanext.activityinfo.data.rate_limit.time.time", return_value=later):
+            assert slots._acquire("next-worker")
+
+    def test_long_exports_renew_their_slot(self):
+        slots = ExportSlots(uuid.uuid4().hex, limit=1, max_wait=0, ttl=60)
+        with slots.slot():
+            later = time.time() + 50
+            with mock.patch("ckanext.activityinfo.data.rate_limit.time.time", return_value=later), \
+                    mock.patch("ckanext.activityinfo.data.rate_limit.time.monotonic", return_value=time.monotonic() + 50):
+                slots.renew()
+            # Past the first lease, the slot is still held
+            with mock.patch("ckanext.activityinfo.data.rate_limit.time.time", return_value=later + 30):
+                assert not slots._acquire("next-worker")
+
+    def test_script_registered_once(self):
+        redis_conn = mock.Mock()
+        redis_conn.register_script.return_value.return_value = 1
+        slots = ExportSlots(uuid.uuid4().hex, limit=1, redis_conn=redis_conn)
+        assert slots._acquire("worker-1")
+        assert slots._acquire("worker-2")
+        redis_conn.register_script.assert_called_once()
+
+    def test_local_fallback_without_redis(self):
+        slots = ExportSlots(uuid.uuid4().hex, limit=1, max_wait=0, redis_conn=_broken_redis())
+        with slots.slot():
+            with pytest.raises(ActivityInfoRateLimitError):
+                with slots.slot():
+                    pass
+
+    def test_client_export_slot_is_a_noop_when_unlimited(self):
+        client = ActivityInfoClient(api_key="test-api-key")
+        with client.export_slot():
+            pass
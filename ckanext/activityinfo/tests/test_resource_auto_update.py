@@ -73,6 +73,38 @@ class TestAutoUpdateFieldsOnCreate:
             )
         assert 'activityinfo_auto_update' in exc_info.value.error_dict
 
+    @pytest.mark.parametrize('auto_update', ['hourly', 'interval:6h', 'cron:0 2 * * 1-5'])
+    def test_create_resource_with_custom_frequency(self, setup_data, auto_update):
+        """Test creating a resource with the finer-grained frequencies."""
+        resource = factories.ActivityInfoResource(activityinfo_auto_update=auto_update)
+        assert resource['activityinfo_auto_update'] == auto_update
+        assert resource['activityinfo_next_run_at'] != ''
+
+    def test_create_resource_custom_frequency_from_form(self, setup_data):
+        """Test that the custom frequency field of the form is saved as activityinfo_auto_update."""
+        resource = factories.ActivityInfoResource(
+            activityinfo_auto_update='custom',
+            activityinfo_auto_update_custom=' interval:30m ',
+        )
+        assert resource['activityinfo_auto_update'] == 'interval:30m'
+        assert 'activityinfo_auto_update_custom' not in resource
+
+    @pytest.mark.parametrize('auto_update', ['custom', 'interval:5m', 'cron:*/5 * * * *', 'cron:0 0 30 2 *'])
+    def test_create_resource_invalid_custom_frequency(self, setup_data, auto_update):
+        """Test that invalid, too frequent or never running frequencies are rejected."""
+        with pytest.raises(toolkit.ValidationError) as exc_info:
+            factories.ActivityInfoResource(activityinfo_auto_update=auto_update)
+        assert 'activityinfo_auto_update' in exc_info.value.error_dict
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.auto_update.max_runs', '100')
+    def test_create_resource_max_runs_from_config(self, setup_data):
+        """Test that the max number of runs can be raised, e.g. for hourly updates."""
+        resource = factories.ActivityInfoResource(
+            activityinfo_auto_update='hourly',
+            activityinfo_auto_update_runs=100,
+        )
+        assert int(resource['activityinfo_auto_update_runs']) == 100
+
     def test_create_resource_invalid_runs_zero(self, setup_data):
         """Test that 0 runs is rejected."""
         with pytest.raises(toolkit.ValidationError) as exc_info:
@@ -0,0 +1,114 @@
+"""Tests for the bulk act_info_resource_status action."""
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from ckan.plugins import toolkit
+from ckantoolkit.tests import factories as ckan_factories
+
+from ckanext.activityinfo.jobs.dedupe import claim_download_jobs, release_download_jobs
+from ckanext.activityinfo.jobs.progress import set_progress
+from ckanext.activityinfo.tests import factories
+from ckanext.activityinfo.utils import get_resources_status
+
+
+@pytest.fixture
+def setup_data():
+    obj = SimpleNamespace()
+    obj.activityinfo_user = factories.ActivityInfoUser()
+    obj.regular_user = ckan_factories.UserWithToken()
+    return obj
+
+
+def _status(resource_ids, user=''):
+    return toolkit.get_action('act_info_resource_status')(
+        context={'user': user},
+        data_dict={'resource_ids': resource_ids},
+    )
+
+
+@pytest.mark.usefixtures("clean_db")
+class TestResourceStatusAction:
+
+    def test_several_resources(self, setup_data):
+        complete = factories.ActivityInfoResource()
+        failed = factories.ActivityInfoResource(
+            activityinfo_status='error', activityinfo_progress=0, activityinfo_error='Export failed'
+        )
+
+        result = _status([complete['id'], failed['id']])
+
+        assert result == {
+            complete['id']: {'status': 'complete', 'progress': 100, 'error': '', 'job_id': None},
+            failed['id']: {'status': 'error', 'progress': 0, 'error': 'Export failed', 'job_id': None},
+        }
+
+    def test_comma_separated_ids(self, setup_data):
+        first = factories.ActivityInfoResource()
+        second = factories.ActivityInfoResource()
+
+        result = _status(f"{first['id']},{second['id']}")
+
+        assert set(result) == {first['id'], second['id']}
+
+    def test_live_progress_and_queued_job(self, setup_data):
+        resource = factories.ActivityInfoResource(activityinfo_status='pending', activityinfo_progress=0)
+        set_progress(resource['id'], 'exporting', 40)
+        claim_download_jobs([resource['id']], 'job-1', 60)
+
+        try:
+            result = _status([resource['id']])
+        finally:
+            release_download_jobs([resource['id']], 'job-1')
+
+        assert result[resource['id']] == {'status': 'exporting', 'progress': 40, 'error': '', 'job_id': 'job-1'}
+
+    def test_one_query_for_all_the_resources(self, setup_data):
+        resources = [factories.ActivityInfoResource() for _ in range(5)]
+
+        with mock.patch(
+            'ckanext.activityinfo.actions.activity_info.get_resources_status', wraps=get_resources_status
+        ) as mock_get_status:
+            result = _status([resource['id'] for resource in resources])
+
+        mock_get_status.assert_called_once()
+        assert len(result) == 5
+
+    def test_missing_resources_are_left_out(self, setup_data):
+        resource = factories.ActivityInfoResource()
+
+        result = _status([resource['id'], str(uuid.uuid4())])
+
+        assert list(result) == [resource['id']]
+
+    def test_private_resources(self, setup_data):
+        org = ckan_factories.Organization(users=[{'name': setup_data.regular_user['name'], 'capacity': 'member'}])
+        dataset = ckan_factories.Dataset(owner_org=org['id'], private=True)
+        resource = factories.ActivityInfoResource(package_id=dataset['id'])
+
+        # Anonymous users and users outside the organization do not see it
+        assert _status([resource['id']]) == {}
+        assert _status([resource['id']], ckan_factories.User()['name']) == {}
+        assert resource['id'] in _status([resource['id']], setup_data.regular_user['name'])
+
+    def test_missing_resource_ids(self, setup_data):
+        with pytest.raises(toolkit.ValidationError):
+            _status([])
+        with pytest.raises(toolkit.ValidationError):
+            toolkit.get_action('act_info_resource_status')(context={'user': ''}, data_dict={})
+
+    def test_too_many_resources(self, setup_data):
+        with pytest.raises(toolkit.ValidationError):
+            _status([str(uuid.uuid4()) for _ in range(101)])
+
+    def test_api_get(self, app, setup_data):
+        resource = factories.ActivityInfoResource()
+
+        response = app.get(
+            '/api/action/act_info_resource_status',
+            query_string={'resource_ids': resource['id']},
+        )
+
+        assert response.status_code == 200
+        assert response.json['result'][resource['id']]['status'] == 'complete'
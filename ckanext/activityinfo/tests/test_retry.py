@@ -0,0 +1,118 @@
+from unittest import mock
+import pytest
+from requests.exceptions import ConnectionError, HTTPError
+from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.data.retry import RetryPolicy, get_retry_after
+
+
+def _response(status_code, data=None, headers=None):
+    response = mock.Mock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    response.json.return_value = data
+    if status_code >= 400:
+        response.raise_for_status.side_effect = HTTPError(f"{status_code} Error")
+    return response
+
+
+@pytest.fixture
+def client():
+    policy = RetryPolicy(max_attempts=3, backoff_base=0.5, jitter=False)
+    return ActivityInfoClient(api_key="test-api-key", retry_policy=policy)
+
+
+@pytest.fixture
+def no_sleep():
+    with mock.patch("ckanext.activityinfo.data.base.time.sleep") as mock_sleep:
+        yield mock_sleep
+
+
+class TestRetryPolicy:
+    def test_exponential_backoff_without_jitter(self):
+        policy = RetryPolicy(backoff_base=1.0, backoff_max=3.0, jitter=False)
+        assert policy.get_delay(1) == 1.0
+        assert policy.get_delay(2) == 2.0
+        assert policy.get_delay(3) == 3.0
+
+    def test_jitter_stays_below_backoff(self):
+        policy = RetryPolicy(backoff_base=1.0, jitter=True)
+        for _ in range(20):
+            assert 0 <= policy.get_delay(2) <= 2.0
+
+    def test_retry_after_seconds_takes_precedence(self):
+        policy = RetryPolicy(backoff_base=1.0, jitter=False)
+        assert policy.get_delay(1, _response(429, headers={"Retry-After": "7"})) == 7.0
+
+    def test_retry_after_is_capped(self):
+        policy = RetryPolicy(max_retry_after=10)
+        assert policy.get_delay(1, _response(503, headers={"Retry-After": "3600"})) == 10
+
+    def test_retry_after_http_date_in_the_past(self):
+        response = _response(503, headers={"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})
+        assert get_retry_after(response) == 0.0
+
+    def test_retry_after_invalid_value(self):
+        assert get_retry_after(_response(503, headers={"Retry-After": "soon"})) is None
+
+    def test_post_only_retried_when_idempotent(self):
+        policy = RetryPolicy(max_attempts=3)
+        assert policy.is_retryable(1, "GET", status_code=502)
+        assert not policy.is_retryable(1, "POST", status_code=502)
+        assert policy.is_retryable(1, "POST", idempotent=True, status_code=502)
+        assert policy.is_retryable(1, "POST", status_code=429)
+
+    def test_no_retry_after_max_attempts(self):
+        policy = RetryPolicy(max_attempts=2)
+        assert not policy.is_retryable(2, "GET", status_code=503)
+
+    def test_client_errors_are_not_retried(self):
+        assert not RetryPolicy().is_retryable(1, "GET", status_code=404)
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.retry.max_attempts', '5')
+    @pytest.mark.ckan_config('ckanext.activityinfo.retry.jitter', 'false')
+    def test_from_config(self):
+        policy = RetryPolicy.from_config()
+        assert policy.max_attempts == 5
+        assert policy.jitter is False
+
+
+class TestClientRetries:
+    def test_get_retries_on_server_error(self, client, no_sleep):
+        responses = [_response(502), _response(200, data=[{"databaseId": "db1"}])]
+        with mock.patch("requests.Session.request", side_effect=responses) as mock_request:
+            result = client.get_databases()
+
+        assert result == [{"databaseId": "db1"}]
+        assert mock_request.call_count == 2
+        no_sleep.assert_called_once_with(0.5)
+        assert client.retry_stats["retries"] == 1
+        assert client.retry_stats["retry_wait"] == 0.5
+
+    def test_get_honours_retry_after(self, client, no_sleep):
+        responses = [_response(429, headers={"Retry-After": "4"}), _response(200, data=[])]
+        with mock.patch("requests.Session.request", side_effect=responses):
+            client.get_databases()
+        no_sleep.assert_called_once_with(4.0)
+
+    def test_get_gives_up_after_max_attempts(self, client, no_sleep):
+        responses = [_response(503), _response(503), _response(503)]
+        with mock.patch("requests.Session.request", side_effect=responses) as mock_request:
+            with pytest.raises(HTTPError):
+                client.get_databases()
+        assert mock_request.call_count == 3
+        assert client.retry_stats["retries"] == 2
+        assert client.retry_stats["gave_up"] == 1
+
+    def test_get_retries_connection_errors(self, client, no_sleep):
+        side_effect = [ConnectionError("reset"), _response(200, data=[])]
+        with mock.patch("requests.Session.request", side_effect=side_effect) as mock_request:
+            client.get_databases()
+        assert mock_request.call_count == 2
+
+    def test_start_export_job_is_not_retried_on_server_error(self, client, no_sleep):
+        columns = [{"id": "c1", "label": "C1", "formula": "c1", "translate": False}]
+        with mock.patch("requests.Session.request", return_value=_response(502)) as mock_request:
+            with pytest.raises(HTTPError):
+                client.start_job_download_form_data("form01", columns=columns)
+        assert mock_request.call_count == 1
+        no_sleep.assert_not_called()
@@ -0,0 +1,293 @@
+"""Tests for the auto-update scheduler daemon."""
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from click.testing import CliRunner
+from ckan.plugins import toolkit
+from ckantoolkit.tests import factories as ckan_factories
+
+from ckanext.activityinfo.cli.scheduler import run_scheduler
+from ckanext.activityinfo.jobs.scheduler import Scheduler, notify_schedule_change
+from ckanext.activityinfo.tests import factories
+
+
+def _iso(dt):
+    return dt.astimezone(timezone.utc).isoformat(timespec='seconds')
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler(jitter=0, lock_ttl=30, node_id=uuid.uuid4().hex)
+    # Each test gets its own lock
+    scheduler.lock_key += f":{uuid.uuid4().hex}"
+    yield scheduler
+    scheduler.close()
+
+
+@pytest.fixture
+def setup_data():
+    obj = SimpleNamespace()
+    obj.activityinfo_user = factories.ActivityInfoUser()
+    obj.regular_user = ckan_factories.UserWithToken()
+    return obj
+
+
+class TestSchedule:
+    def test_next_resource_first(self, scheduler):
+        now = datetime.now(timezone.utc)
+        scheduler.set_next_run('later', _iso(now + timedelta(hours=2)))
+        scheduler.set_next_run('sooner', _iso(now + timedelta(hours=1)))
+        assert scheduler.get_next()[1] == 'sooner'
+
+    def test_moved_and_removed_resources(self, scheduler):
+        now = datetime.now(timezone.utc)
+        scheduler.set_next_run('res1', _iso(now + timedelta(hours=1)))
+        scheduler.set_next_run('res2', _iso(now + timedelta(hours=2)))
+        scheduler.set_next_run('res1', _iso(now + timedelta(hours=3)))
+        assert scheduler.get_next()[1] == 'res2'
+
+        scheduler.set_next_run('res2', '')
+        assert scheduler.get_next()[1] == 'res1'
+        scheduler.set_next_run('res1', None)
+        assert scheduler.get_next() is None
+
+    def test_jitter(self):
+        scheduler = Scheduler(jitter=600)
+        jitters = {scheduler.get_jitter(str(uuid.uuid4())) for _ in range(50)}
+        assert all(0 <= jitter <= 600 for jitter in jitters)
+        # Resources are spread, and each one always gets the same jitter
+        assert len(jitters) > 1
+        assert scheduler.get_jitter('res1') == scheduler.get_jitter('res1')
+
+        next_run_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        run_at = scheduler.set_next_run('res1', _iso(next_run_at))
+        assert run_at == next_run_at + timedelta(seconds=scheduler.get_jitter('res1'))
+
+    def test_jitter_depends_on_the_frequency(self):
+        scheduler = Scheduler(jitter=3600)
+        resource_ids = [str(uuid.uuid4()) for _ in range(50)]
+        # At most a tenth of the time between runs
+        assert all(scheduler.get_jitter(resource_id, 'hourly') <= 360 for resource_id in resource_ids)
+        assert max(scheduler.get_jitter(resource_id, 'weekly') for resource_id in resource_ids) > 360
+        # Cron frequencies are already spread by get_next_run_at
+        assert scheduler.get_jitter(resource_ids[0], 'cron:0 * * * *') == 0
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.scheduler.jitter', '30')
+    def test_jitter_from_config(self):
+        assert Scheduler().jitter == 30
+
+    def test_run_due_resources_only(self, scheduler):
+        now = datetime.now(timezone.utc)
+        scheduler.set_next_run('due', _iso(now - timedelta(minutes=1)))
+        scheduler.set_next_run('not-due', _iso(now + timedelta(hours=1)))
+        scheduler._elect()
+
+        with mock.patch.object(scheduler, 'run_resource') as run_resource:
+            scheduler.run_due(now)
+
+        run_resource.assert_called_once_with('due', now)
+        assert scheduler.get_next()[1] == 'not-due'
+
+    def test_errors_do_not_stop_the_run(self, scheduler):
+        now = datetime.now(timezone.utc)
+        scheduler.set_next_run('broken', _iso(now - timedelta(minutes=2)))
+        scheduler.set_next_run('due', _iso(now - timedelta(minutes=1)))
+        scheduler._elect()
+
+        with mock.patch.object(scheduler, 'run_resource', side_effect=[Exception('DB error'), None]) as run_resource:
+            scheduler.run_due(now)
+
+        assert [call[0][0] for call in run_resource.call_args_list] == ['broken', 'due']
+        assert scheduler.stats['failed'] == 1
+        assert scheduler.get_next() is None
+
+    def test_followers_do_not_run_resources(self, scheduler):
+        scheduler.set_next_run('due', _iso(datetime.now(timezone.utc) - timedelta(minutes=1)))
+        with mock.patch.object(scheduler, 'run_resource') as run_resource:
+            scheduler.run_due()
+        run_resource.assert_not_called()
+
+    def test_wakes_up_when_the_next_resource_is_due(self, scheduler):
+        scheduler._elect()
+        scheduler.set_next_run('res1', _iso(datetime.now(timezone.utc) + timedelta(seconds=5)))
+        assert 3 < scheduler._get_timeout() <= 5
+        # Never sleep longer than the lock renewal interval
+        scheduler.set_next_run('res1', _iso(datetime.now(timezone.utc) + timedelta(hours=5)))
+        assert scheduler._get_timeout() == scheduler.renew_interval
+
+
+class TestLeaderElection:
+    def test_single_leader(self, scheduler):
+        other = Scheduler(jitter=0, lock_ttl=30, node_id=uuid.uuid4().hex)
+        other.lock_key = scheduler.lock_key
+
+        assert scheduler._elect() is True
+        assert other._elect() is False
+        # The leader renews its lock
+        assert scheduler._elect() is True
+
+        scheduler.close()
+        assert other._elect() is True
+        other.close()
+
+    def test_leader_loads_the_schedule(self, scheduler):
+        with mock.patch('ckanext.activityinfo.jobs.scheduler.utils.get_auto_update_schedule') as get_schedule, \
+                mock.patch.object(scheduler, 'wait'):
+            get_schedule.return_value = {'res1': (_iso(datetime.now(timezone.utc) + timedelta(hours=1)), 'daily')}
+            scheduler.step()
+            scheduler.step()
+
+        # Loaded once, when elected
+        get_schedule.assert_called_once_with()
+        assert scheduler.is_leader
+        assert scheduler.get_next()[1] == 'res1'
+
+
+class TestNotifications:
+    def test_changed_resources_are_rescheduled(self, scheduler):
+        scheduler._elect()
+        scheduler._subscribe()
+        next_run_at = _iso(datetime.now(timezone.utc) + timedelta(hours=1))
+
+        with mock.patch('ckanext.activityinfo.jobs.scheduler.utils.get_auto_update_schedule') as get_schedule:
+            get_schedule.return_value = {'res1': (next_run_at, 'daily')}
+            notify_schedule_change('res1')
+            scheduler.wait(5)
+
+        get_schedule.assert_called_once_with({'res1'})
+        assert scheduler.get_next()[1] == 'res1'
+
+
+@pytest.mark.usefixtures("clean_db")
+class TestSchedulerResources:
+    def _fake_update(self, ctx, dd):
+        return {'job_id': 'test-job', 'resource_id': dd['resource_id']}
+
+    def test_load(self, scheduler, setup_data):
+        due = factories.ActivityInfoResource(
+            activityinfo_auto_update='daily',
+            activityinfo_auto_update_runs=5,
+            activityinfo_auto_update_count=0,
+            activityinfo_last_updated='',
+        )
+        factories.ActivityInfoResource(activityinfo_auto_update='never')
+        factories.ActivityInfoResource(
+            activityinfo_auto_update='daily',
+            activityinfo_auto_update_runs=1,
+            activityinfo_auto_update_count=1,
+        )
+
+        scheduler.load()
+
+        assert scheduler.get_next()[1] == due['id']
+        assert list(scheduler._scheduled) == [due['id']]
+
+    def test_run_resource(self, scheduler, setup_data):
+        user_name = setup_data.activityinfo_user['name']
+        resource = factories.ActivityInfoResource(
+            activityinfo_auto_update='daily',
+            activityinfo_auto_update_runs=5,
+            activityinfo_auto_update_count=0,
+            activityinfo_last_updated='',
+            activityinfo_user=user_name,
+        )
+
+        with mock.patch.dict('ckan.logic._actions', {'act_info_update_resource_file': self._fake_update}):
+            detail = scheduler.run_resource(resource['id'])
+
+        assert detail['status'] == 'enqueued'
+        assert scheduler.stats['enqueued'] == 1
+        updated = toolkit.get_action('resource_show')({'ignore_auth': True}, {'id': resource['id']})
+        assert int(updated['activityinfo_auto_update_count']) == 1
+        # The next run is a day later
+        run_at = scheduler._scheduled[resource['id']]
+        assert timedelta(hours=23) < run_at - datetime.now(timezone.utc) <= timedelta(hours=24)
+
+    def test_resource_not_due_anymore(self, scheduler, setup_data):
+        resource = factories.ActivityInfoResource(
+            activityinfo_auto_update='weekly',
+            activityinfo_auto_update_runs=5,
+            activityinfo_auto_update_count=1,
+            activityinfo_last_updated=datetime.now(timezone.utc).isoformat(),
+        )
+
+        with mock.patch('ckanext.activityinfo.jobs.scheduler.utils.sync_resource_auto_update') as sync:
+            assert scheduler.run_resource(resource['id']) is None
+
+        sync.assert_not_called()
+        assert resource['id'] in scheduler._scheduled
+
+    def test_skipped_resource_waits_for_the_next_reload(self, scheduler, setup_data):
+        resource = factories.ActivityInfoResource(
+            activityinfo_auto_update='daily',
+            activityinfo_auto_update_runs=5,
+            activityinfo_auto_update_count=0,
+            activityinfo_last_updated='',
+            activityinfo_user='',
+        )
+
+        detail = scheduler.run_resource(resource['id'])
+
+        assert detail['status'] == 'skipped'
+        assert scheduler.get_next() is None
+
+    def test_resource_deleted_after_the_load(self, scheduler, setup_data):
+        resource = factories.ActivityInfoResource(
+            activityinfo_auto_update='daily',
+            activityinfo_auto_update_runs=5,
+            activityinfo_auto_update_count=0,
+            activityinfo_last_updated='',
+            activityinfo_user=setup_data.activityinfo_user['name'],
+        )
+        scheduler._elect()
+        scheduler.load()
+        schedule = {resource['id']: (_iso(datetime.now(timezone.utc) - timedelta(minutes=1)), 'daily')}
+        toolkit.get_action('resource_delete')({'ignore_auth': True}, {'id': resource['id']})
+
+        with mock.patch('ckanext.activityinfo.jobs.scheduler.utils.get_auto_update_schedule', return_value=schedule), \
+                mock.patch('ckanext.activityinfo.jobs.scheduler.utils.sync_resource_auto_update') as sync:
+            scheduler.run_due()
+
+        sync.assert_not_called()
+        assert scheduler.stats['failed'] == 0
+        assert scheduler.get_next() is None
+
+    def test_update_notifies_the_scheduler(self, setup_data):
+        resource = factories.ActivityInfoResource(activityinfo_auto_update='daily')
+        with mock.patch('ckanext.activityinfo.actions.resource.notify_schedule_change') as notify:
+            toolkit.get_action('resource_patch')(
+                {'ignore_auth': True},
+                {'id': resource['id'], 'activityinfo_auto_update': 'weekly'},
+            )
+        notify.assert_called_once_with(resource['id'])
+
+    def test_progress_does_not_notify_the_scheduler(self, setup_data):
+        resource = factories.ActivityInfoResource(activityinfo_auto_update='daily', activityinfo_status='exporting')
+        with mock.patch('ckanext.activityinfo.actions.resource.notify_schedule_change') as notify:
+            toolkit.get_action('resource_patch')(
+                {'ignore_auth': True},
+                {'id': resource['id'], 'activityinfo_progress': 50},
+            )
+            notify.assert_not_called()
+
+            toolkit.get_action('resource_patch')(
+                {'ignore_auth': True},
+                {'id': resource['id'], 'activityinfo_status': 'complete', 'activityinfo_progress': 100},
+            )
+        # A complete resource is scheduled again
+        notify.assert_called_once_with(resource['id'])
+
+
+class TestSchedulerCLI:
+    def test_run_until_stopped(self):
+        def run(scheduler):
+            scheduler.stats['enqueued'] = 2
+
+        with mock.patch.object(Scheduler, 'run', autospec=True, side_effect=run):
+            result = CliRunner().invoke(run_scheduler, ['--jitter', '0'])
+
+        assert result.exit_code == 0, result.output
+        assert "Scheduler stopped: 2 enqueued, 0 failed, 0 skipped." in result.output
@@ -0,0 +1,135 @@
+"""Tests for the auto-update frequencies (intervals and cron expressions)."""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ckanext.activityinfo.schedules import (
+    CronSchedule,
+    IntervalSchedule,
+    ZoneInfo,
+    get_spread,
+    parse_frequency,
+    validate_frequency,
+)
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+class TestParseFrequency:
+    def test_never(self):
+        assert parse_frequency('never') is None
+        assert parse_frequency('') is None
+
+    @pytest.mark.parametrize('value, interval', [
+        ('hourly', timedelta(hours=1)),
+        ('daily', timedelta(days=1)),
+        ('weekly', timedelta(weeks=1)),
+        ('interval:30m', timedelta(minutes=30)),
+        ('interval:6h', timedelta(hours=6)),
+        ('interval:2d', timedelta(days=2)),
+        ('interval:2w', timedelta(weeks=2)),
+    ])
+    def test_intervals(self, value, interval):
+        schedule = parse_frequency(value)
+        assert isinstance(schedule, IntervalSchedule)
+        assert schedule.interval == interval
+
+    def test_cron(self):
+        schedule = parse_frequency('cron:0 2 * * *')
+        assert isinstance(schedule, CronSchedule)
+        assert schedule.min_gap == timedelta(days=1)
+
+    @pytest.mark.parametrize('value', [
+        'monthly',
+        'interval:0h',
+        'interval:6',
+        'interval:6y',
+        'cron:0 2 * *',
+        'cron:60 * * * *',
+        'cron:0 24 * * *',
+        'cron:a * * * *',
+        'cron:0 2 30 2 *',
+    ])
+    def test_invalid(self, value):
+        with pytest.raises(ValueError):
+            schedule = parse_frequency(value)
+            schedule.next_run(_utc(2026, 1, 1))
+
+
+class TestCronSchedule:
+    @pytest.mark.parametrize('expression, last_run, next_run', [
+        # Every night at 02:30
+        ('30 2 * * *', _utc(2026, 1, 1, 1, 0), _utc(2026, 1, 1, 2, 30)),
+        ('30 2 * * *', _utc(2026, 1, 1, 2, 30), _utc(2026, 1, 2, 2, 30)),
+        # Every 15 minutes
+        ('*/15 * * * *', _utc(2026, 1, 1, 10, 7), _utc(2026, 1, 1, 10, 15)),
+        ('*/15 * * * *', _utc(2026, 1, 1, 23, 50), _utc(2026, 1, 2, 0, 0)),
+        # Off-peak hours, weekdays only (2026-01-02 is a Friday)
+        ('0 22-23,0-5/2 * * 1-5', _utc(2026, 1, 2, 23, 0), _utc(2026, 1, 5, 0, 0)),
+        # Sundays, as 0 or 7
+        ('0 3 * * 0', _utc(2026, 1, 1), _utc(2026, 1, 4, 3, 0)),
+        ('0 3 * * 7', _utc(2026, 1, 1), _utc(2026, 1, 4, 3, 0)),
+        # Day of month or day of week, like cron
+        ('0 0 15 * 1', _utc(2026, 1, 1), _utc(2026, 1, 5, 0, 0)),
+        # First day of each quarter
+        ('0 6 1 1,4,7,10 *', _utc(2026, 1, 1, 7, 0), _utc(2026, 4, 1, 6, 0)),
+        # Leap day
+        ('0 0 29 2 *', _utc(2026, 1, 1), _utc(2028, 2, 29, 0, 0)),
+    ])
+    def test_next_run(self, expression, last_run, next_run):
+        assert CronSchedule(expression).next_run(last_run) == next_run
+
+    def test_time_zone(self):
+        schedule = CronSchedule('0 2 * * *', tz=ZoneInfo('America/Bogota'))
+        assert schedule.next_run(_utc(2026, 1, 1)) == _utc(2026, 1, 1, 7, 0)
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.auto_update.timezone', 'Europe/Madrid')
+    def test_time_zone_from_config(self):
+        assert parse_frequency('cron:0 2 * * *').next_run(_utc(2026, 1, 1)) == _utc(2026, 1, 1, 1, 0)
+
+    def test_min_gap(self):
+        assert CronSchedule('*/20 * * * *').min_gap == timedelta(minutes=20)
+        assert CronSchedule('0 9,17 * * *').min_gap == timedelta(hours=8)
+
+
+class TestValidateFrequency:
+    def test_valid(self):
+        validate_frequency('hourly')
+        validate_frequency('cron:0 */2 * * *')
+
+    def test_too_often(self):
+        with pytest.raises(ValueError):
+            validate_frequency('interval:5m')
+        with pytest.raises(ValueError):
+            validate_frequency('cron:*/5 * * * *')
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.auto_update.min_interval', '5')
+    def test_min_interval_from_config(self):
+        validate_frequency('interval:5m')
+
+    @pytest.mark.parametrize('value', ['interval:999999999w', 'interval:5000000d', 'interval:600w'])
+    def test_too_long(self, value):
+        with pytest.raises(ValueError):
+            validate_frequency(value)
+        validate_frequency('interval:52w')
+
+
+class TestSpread:
+    def test_stable_and_bounded(self):
+        resource_ids = [str(uuid.uuid4()) for _ in range(50)]
+        spreads = [get_spread(resource_id, timedelta(hours=1)) for resource_id in resource_ids]
+        # At most a tenth of the period
+        assert all(timedelta(0) <= spread <= timedelta(minutes=6) for spread in spreads)
+        assert len(set(spreads)) > 1
+        assert get_spread(resource_ids[0], timedelta(hours=1)) == spreads[0]
+
+    def test_max_spread(self):
+        resource_ids = [str(uuid.uuid4()) for _ in range(50)]
+        assert all(get_spread(resource_id, timedelta(days=7)) <= timedelta(minutes=10) for resource_id in resource_ids)
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.auto_update.max_spread', '0')
+    def test_disabled(self):
+        assert get_spread(str(uuid.uuid4()), timedelta(days=1)) == timedelta(0)
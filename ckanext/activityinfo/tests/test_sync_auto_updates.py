@@ -5,12 +5,21 @@ from unittest import mock
 
 import pytest
 from click.testing import CliRunner
+from ckan import model
+from ckan.lib.jobs import get_queue
 from ckan.plugins import toolkit
 from ckantoolkit.tests import factories as ckan_factories
 
 from ckanext.activityinfo.cli.resources import sync_auto_updates
+from ckanext.activityinfo.jobs.download import enqueue_download_jobs
+from ckanext.activityinfo.jobs.progress import pop_site_upload_outcomes, record_upload_outcome
 from ckanext.activityinfo.tests import factories
-from ckanext.activityinfo.utils import get_resources_due_for_auto_update
+from ckanext.activityinfo.utils import (
+    get_next_run_at,
+    get_resources_due_for_auto_update,
+    iter_resources_due_for_auto_update,
+    run_sync_auto_updates,
+)
 
 
 @pytest.fixture
@@ -193,6 +202,157 @@ class TestGetResourcesDueForAutoUpdate:
         assert len(result) == 1
         assert result[0]['activityinfo_user'] == user_name
 
+    def test_most_overdue_first(self, setup_data):
+        """Due resources are ordered by how overdue they are."""
+        now = datetime.now(timezone.utc)
+        ids = []
+        for days in (8, 30, 10):
+            ids.append(factories.ActivityInfoResource(
+                activityinfo_auto_update='weekly',
+                activityinfo_auto_update_runs=5,
+                activityinfo_auto_update_count=0,
+                activityinfo_last_updated=(now - timedelta(days=days)).isoformat(),
+            )['id'])
+        result = get_resources_due_for_auto_update()
+        assert [res['id'] for res in result] == [ids[1], ids[2], ids[0]]
+
+    def test_iterates_in_batches(self, setup_data):
+        """All the due resources are returned, whatever the batch size."""
+        resources = [
+            factories.ActivityInfoResource(
+                activityinfo_auto_update='daily',
+                activityinfo_auto_update_runs=5,
+                activityinfo_auto_update_count=0,
+                activityinfo_last_updated='',
+            )
+            for _ in range(3)
+        ]
+        result = list(iter_resources_due_for_auto_update(batch_size=2))
+        assert sorted(res['id'] for res in result) == sorted(res['id'] for res in resources)
+
+    def test_resource_without_next_run_at(self, setup_data):
+        """Resources saved before activityinfo_next_run_at existed are checked in Python."""
+        due = factories.ActivityInfoResource(
+            activityinfo_auto_update='daily',
+            activityinfo_auto_update_runs=5,
+            activityinfo_auto_update_count=0,
+            activityinfo_last_updated=(datetime.now(timezone.utc) - timedelta(hours=25)).isoformat(),
+        )
+        not_due = factories.ActivityInfoResource(
+            activityinfo_auto_update='daily',
+            activityinfo_auto_update_runs=5,
+            activityinfo_auto_update_count=0,
+            activityinfo_last_updated=datetime.now(timezone.utc).isoformat(),
+        )
+        for resource_id in (due['id'], not_due['id']):
+            resource = model.Resource.get(resource_id)
+            extras = dict(resource.extras)
+            del extras['activityinfo_next_run_at']
+            resource.extras = extras
+        model.Session.commit()
+
+        result = get_resources_due_for_auto_update()
+        assert [res['id'] for res in result] == [due['id']]
+
+    def test_update_recomputes_next_run_at(self, setup_data):
+        """Reaching the run limit with resource_patch stops the updates."""
+        resource = factories.ActivityInfoResource(
+            activityinfo_auto_update='daily',
+            activityinfo_auto_update_runs=2,
+            activityinfo_auto_update_count=1,
+            activityinfo_last_updated='',
+        )
+        assert len(get_resources_due_for_auto_update()) == 1
+        toolkit.get_action('resource_patch')(
+            {'ignore_auth': True}, {'id': resource['id'], 'activityinfo_auto_update_count': 2}
+        )
+        updated = toolkit.get_action('resource_show')({'ignore_auth': True}, {'id': resource['id']})
+        assert updated['activityinfo_next_run_at'] == ''
+        assert get_resources_due_for_auto_update() == []
+
+
+class TestGetNextRunAt:
+    """Tests for the activityinfo_next_run_at computation."""
+
+    def test_daily(self):
+        assert get_next_run_at({
+            'activityinfo_auto_update': 'daily',
+            'activityinfo_auto_update_runs': 5,
+            'activityinfo_auto_update_count': 0,
+            'activityinfo_last_updated': '2026-01-01T10:00:00.123456+00:00',
+        }) == '2026-01-02T10:00:00+00:00'
+
+    def test_weekly_in_utc(self):
+        assert get_next_run_at({
+            'activityinfo_auto_update': 'weekly',
+            'activityinfo_auto_update_runs': 5,
+            'activityinfo_auto_update_count': 0,
+            'activityinfo_last_updated': '2026-01-01T10:00:00+02:00',
+        }) == '2026-01-08T08:00:00+00:00'
+
+    def test_never_updated_is_due_now(self):
+        now = datetime(2026, 1, 1, 10, tzinfo=timezone.utc)
+        assert get_next_run_at({
+            'activityinfo_auto_update': 'daily',
+            'activityinfo_auto_update_runs': 5,
+            'activityinfo_auto_update_count': 0,
+            'activityinfo_last_updated': '',
+        }, now=now) == '2026-01-01T10:00:00+00:00'
+
+    def test_hourly(self):
+        assert get_next_run_at({
+            'activityinfo_auto_update': 'hourly',
+            'activityinfo_auto_update_runs': 5,
+            'activityinfo_auto_update_count': 0,
+            'activityinfo_last_updated': '2026-01-01T10:00:00+00:00',
+        }) == '2026-01-01T11:00:00+00:00'
+
+    def test_interval(self):
+        assert get_next_run_at({
+            'activityinfo_auto_update': 'interval:90m',
+            'activityinfo_auto_update_runs': 5,
+            'activityinfo_auto_update_count': 0,
+            'activityinfo_last_updated': '2026-01-01T10:00:00+00:00',
+        }) == '2026-01-01T11:30:00+00:00'
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.auto_update.max_spread', '0')
+    def test_cron(self):
+        assert get_next_run_at({
+            'activityinfo_auto_update': 'cron:0 2 * * *',
+            'activityinfo_auto_update_runs': 5,
+            'activityinfo_auto_update_count': 0,
+            'activityinfo_last_updated': '2026-01-01T10:00:00+00:00',
+        }) == '2026-01-02T02:00:00+00:00'
+
+    def test_cron_resources_are_spread(self):
+        next_runs = set()
+        for i in range(20):
+            next_run_at = get_next_run_at({
+                'id': f"resource-{i}",
+                'activityinfo_auto_update': 'cron:0 * * * *',
+                'activityinfo_auto_update_runs': 5,
+                'activityinfo_auto_update_count': 0,
+                'activityinfo_last_updated': '2026-01-01T10:00:00+00:00',
+            })
+            # Within the first 6 minutes of the hour
+            assert '2026-01-01T11:00:00+00:00' <= next_run_at <= '2026-01-01T11:06:00+00:00'
+            next_runs.add(next_run_at)
+        assert len(next_runs) > 1
+
+    def test_invalid_frequency(self):
+        assert get_next_run_at({'activityinfo_auto_update': 'monthly'}) == ''
+
+    def test_never(self):
+        assert get_next_run_at({'activityinfo_auto_update': 'never'}) == ''
+
+    def test_run_limit_reached(self):
+        assert get_next_run_at({
+            'activityinfo_auto_update': 'daily',
+            'activityinfo_auto_update_runs': 3,
+            'activityinfo_auto_update_count': 3,
+            'activityinfo_last_updated': '',
+        }) == ''
+
 
 @pytest.mark.usefixtures("clean_db")
 class TestSyncAutoUpdatesCounterAndTimestamp:
@@ -347,6 +507,22 @@ class TestSyncAutoUpdatesCLIOutput:
         assert '2 enqueued' in result.output
         assert '0 failed' in result.output
 
+    def test_summary_shows_skip_rate_of_site_uploads(self, setup_data):
+        """Summary should show how many downloads of the site were unchanged since the last sync."""
+        pop_site_upload_outcomes()
+        record_upload_outcome('uploaded')
+        record_upload_outcome('unchanged')
+        record_upload_outcome('unchanged')
+        record_upload_outcome('unchanged')
+
+        runner = CliRunner()
+        result = runner.invoke(sync_auto_updates, [])
+
+        assert result.exit_code == 0
+        assert '1 uploaded, 3 unchanged (skip rate 75%)' in result.output
+        # The counters start again after each sync
+        assert pop_site_upload_outcomes() == {'uploaded': 0, 'unchanged': 0, 'skip_rate': 0.0}
+
     def test_uses_per_resource_user(self, setup_data):
         """Each resource should use its own activityinfo_user."""
         user_a = setup_data.activityinfo_user['name']
@@ -382,3 +558,179 @@ class TestSyncAutoUpdatesCLIOutput:
 
         assert len(calls) == 2
         assert set(calls) == {user_a, user_b}
+
+
+@pytest.mark.usefixtures("clean_db")
+class TestSyncAutoUpdatesModes:
+    """Test the parallel and bulk modes of the sync."""
+
+    def _create_due_resources(self, user_name, count=3):
+        return [
+            factories.ActivityInfoResource(
+                activityinfo_auto_update='daily',
+                activityinfo_auto_update_runs=5,
+                activityinfo_auto_update_count=1,
+                activityinfo_last_updated='',
+                activityinfo_user=user_name,
+            )
+            for _ in range(count)
+        ]
+
+    def test_parallel(self, setup_data):
+        resources = self._create_due_resources(setup_data.activityinfo_user['name'])
+
+        def fake_update(ctx, dd):
+            return {'job_id': f"job-{dd['resource_id']}", 'resource_id': dd['resource_id']}
+
+        with mock.patch.dict('ckan.logic._actions', {'act_info_update_resource_file': fake_update}):
+            summary = run_sync_auto_updates(workers=2)
+
+        assert summary['enqueued'] == 3
+        assert summary['timing']['mode'] == 'parallel'
+        assert summary['timing']['workers'] == 2
+        assert {detail['job_id'] for detail in summary['details']} == {f"job-{res['id']}" for res in resources}
+        for res in resources:
+            updated = toolkit.get_action('resource_show')({'ignore_auth': True}, {'id': res['id']})
+            assert int(updated['activityinfo_auto_update_count']) == 2
+
+    def test_parallel_in_request_context(self, app, setup_data):
+        """The CKAN CLI runs the sync in a test request context, each thread needs its own."""
+        resources = self._create_due_resources(setup_data.activityinfo_user['name'], count=4)
+
+        def fake_update(ctx, dd):
+            return {'job_id': f"job-{dd['resource_id']}", 'resource_id': dd['resource_id']}
+
+        with mock.patch.dict('ckan.logic._actions', {'act_info_update_resource_file': fake_update}):
+            with app.flask_app.test_request_context():
+                summary = run_sync_auto_updates(workers=2)
+
+        assert summary['enqueued'] == 4
+        assert summary['failed'] == 0
+        for res in resources:
+            updated = toolkit.get_action('resource_show')({'ignore_auth': True}, {'id': res['id']})
+            assert int(updated['activityinfo_auto_update_count']) == 2
+
+    def test_bulk(self, setup_data):
+        user_name = setup_data.activityinfo_user['name']
+        resources = self._create_due_resources(user_name)
+        factories.ActivityInfoResource(
+            activityinfo_auto_update='daily',
+            activityinfo_auto_update_runs=5,
+            activityinfo_auto_update_count=0,
+            activityinfo_last_updated='',
+            activityinfo_user='',
+        )
+
+        def fake_enqueue(downloads):
+            return [(f"job-{resource_id}", True) for resource_id, _ in downloads]
+
+        with mock.patch(
+            'ckanext.activityinfo.jobs.download.enqueue_download_jobs', side_effect=fake_enqueue
+        ) as enqueue, mock.patch.dict(toolkit.config, {'ckanext.activityinfo.sync.bulk_size': '2'}):
+            summary = run_sync_auto_updates(bulk=True)
+
+        assert summary['enqueued'] == 3
+        assert summary['skipped'] == 1
+        assert summary['timing']['mode'] == 'bulk'
+        assert enqueue.call_count == 2
+        assert all(user == user_name for call in enqueue.call_args_list for _, user in call[0][0])
+        for res in resources:
+            updated = toolkit.get_action('resource_show')({'ignore_auth': True}, {'id': res['id']})
+            assert int(updated['activityinfo_auto_update_count']) == 2
+            assert updated['activityinfo_last_updated'] != ''
+            assert updated['activityinfo_next_run_at'] > datetime.now(timezone.utc).isoformat()
+        # Only the resource without user is still due
+        assert len(get_resources_due_for_auto_update()) == 1
+
+    def test_bulk_only_updates_run_extras(self, setup_data):
+        res = factories.ActivityInfoResource(
+            activityinfo_auto_update='cron:0 6 * * *',
+            activityinfo_auto_update_runs=5,
+            activityinfo_auto_update_count=1,
+            activityinfo_last_updated='',
+            activityinfo_user=setup_data.activityinfo_user['name'],
+        )
+
+        def fake_enqueue(downloads):
+            # The runs are committed before the jobs are enqueued
+            saved = model.Session.query(model.Resource.extras).filter(model.Resource.id == res['id']).scalar()
+            assert int(saved['activityinfo_auto_update_count']) == 2
+            return [(f"job-{resource_id}", True) for resource_id, _ in downloads]
+
+        with mock.patch(
+            'ckanext.activityinfo.jobs.download.enqueue_download_jobs', side_effect=fake_enqueue
+        ), mock.patch('ckanext.activityinfo.jobs.scheduler.notify_schedule_change') as notify:
+            summary = run_sync_auto_updates(bulk=True)
+
+        assert summary['enqueued'] == 1
+        notify.assert_called_once_with(res['id'])
+        updated = toolkit.get_action('resource_show')({'ignore_auth': True}, {'id': res['id']})
+        assert updated['activityinfo_status'] == res['activityinfo_status']
+        # The next run includes the spread of the resource
+        assert updated['activityinfo_next_run_at'] == get_next_run_at(updated)
+
+    def test_already_queued_is_not_a_run(self, setup_data):
+        resources = self._create_due_resources(setup_data.activityinfo_user['name'], count=2)
+
+        def fake_update(ctx, dd):
+            return {'job_id': 'running-job', 'resource_id': dd['resource_id'], 'already_queued': True}
+
+        with mock.patch.dict('ckan.logic._actions', {'act_info_update_resource_file': fake_update}):
+            summary = run_sync_auto_updates()
+
+        assert summary['enqueued'] == 0
+        assert summary['skipped'] == 2
+        assert {detail['job_id'] for detail in summary['details']} == {'running-job'}
+        for res in resources:
+            updated = toolkit.get_action('resource_show')({'ignore_auth': True}, {'id': res['id']})
+            assert int(updated['activityinfo_auto_update_count']) == 1
+
+    def test_bulk_already_queued_is_not_a_run(self, setup_data):
+        queued, other = self._create_due_resources(setup_data.activityinfo_user['name'], count=2)
+
+        def fake_enqueue(downloads):
+            return [(f"job-{resource_id}", True) for resource_id, _ in downloads]
+
+        with mock.patch(
+            'ckanext.activityinfo.jobs.dedupe.get_active_download_jobs', return_value={queued['id']: 'running-job'}
+        ), mock.patch(
+            'ckanext.activityinfo.jobs.download.enqueue_download_jobs', side_effect=fake_enqueue
+        ) as enqueue:
+            summary = run_sync_auto_updates(bulk=True)
+
+        assert summary['enqueued'] == 1
+        assert summary['skipped'] == 1
+        assert [resource_id for resource_id, _ in enqueue.call_args[0][0]] == [other['id']]
+        updated = toolkit.get_action('resource_show')({'ignore_auth': True}, {'id': queued['id']})
+        assert int(updated['activityinfo_auto_update_count']) == 1
+
+    def test_bulk_enqueue_failure(self, setup_data):
+        resources = self._create_due_resources(setup_data.activityinfo_user['name'], count=2)
+
+        with mock.patch(
+            'ckanext.activityinfo.jobs.download.enqueue_download_jobs', side_effect=Exception('Redis is down')
+        ):
+            summary = run_sync_auto_updates(bulk=True)
+
+        assert summary['failed'] == 2
+        for res in resources:
+            updated = toolkit.get_action('resource_show')({'ignore_auth': True}, {'id': res['id']})
+            assert int(updated['activityinfo_auto_update_count']) == 1
+
+    def test_timing_in_cli_output(self, setup_data):
+        runner = CliRunner()
+        result = runner.invoke(sync_auto_updates, ['--workers', '3'])
+        assert result.exit_code == 0
+        assert 'parallel mode, 3 worker(s)' in result.output
+
+
+class TestEnqueueDownloadJobs:
+    def test_enqueue_with_one_pipeline(self):
+        jobs = enqueue_download_jobs([('res1', 'user1'), ('res2', 'user2')])
+
+        assert len(jobs) == 2
+        assert all(created for _, created in jobs)
+        job = get_queue().fetch_job(jobs[1][0])
+        assert job.args == ['res2', 'user2']
+        assert job.meta['title'] == 'Download ActivityInfo for resource res2'
+        assert job.func_name.endswith('download_activityinfo_resource')
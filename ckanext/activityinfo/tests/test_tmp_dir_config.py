@@ -5,7 +5,7 @@ import pytest
 from ckantoolkit.tests import factories as ckan_factories
 
 from ckanext.activityinfo.tests import factories
-from ckanext.activityinfo.jobs.download import _update_resource_with_file
+from ckanext.activityinfo.jobs.download import _create_tmp_file, _upload_resource_file
 
 
 @pytest.fixture
@@ -17,15 +17,9 @@ def setup_data():
     return obj
 
 
-@pytest.fixture
-def mock_file_data():
-    """Mock file data for testing."""
-    return b"test,data\n1,2\n3,4"
-
-
 @pytest.fixture
 def mock_dependencies():
-    """Mock all external dependencies for _update_resource_with_file."""
+    """Mock all external dependencies for _create_tmp_file and _upload_resource_file."""
     mock_temp = mock.MagicMock()
     mock_temp.name = '/tmp/test_file.csv'
 
@@ -41,14 +35,10 @@ class TestTmpDirConfig:
 
     @pytest.mark.ckan_config('ckanext.activityinfo.tmp_dir', 'sys_tmp')
     def test_default_tmp_dir_uses_system_temp(
-        self, setup_data, mock_file_data, mock_dependencies
+        self, setup_data, mock_dependencies
     ):
         """Test that default configuration uses system temp directory."""
-        context = {'user': setup_data.user['name'], 'ignore_auth': True}
-
-        _update_resource_with_file(
-            context, setup_data.resource['id'], mock_file_data, 'test_file.csv', 'csv'
-        )
+        _create_tmp_file('csv')
 
         mock_dependencies['tempfile'].assert_called_once_with(
             delete=False, suffix='.csv'
@@ -56,14 +46,10 @@ class TestTmpDirConfig:
 
     @pytest.mark.ckan_config('ckanext.activityinfo.tmp_dir', '/custom/tmp/path')
     def test_custom_tmp_dir_uses_specified_directory(
-        self, setup_data, mock_file_data, mock_dependencies
+        self, setup_data, mock_dependencies
     ):
         """Test that custom tmp_dir configuration uses specified directory."""
-        context = {'user': setup_data.user['name'], 'ignore_auth': True}
-
-        _update_resource_with_file(
-            context, setup_data.resource['id'], mock_file_data, 'test_file.csv', 'csv'
-        )
+        _create_tmp_file('csv')
 
         mock_dependencies['tempfile'].assert_called_once_with(
             delete=False, suffix='.csv', dir='/custom/tmp/path'
@@ -71,14 +57,10 @@ class TestTmpDirConfig:
 
     @pytest.mark.ckan_config('ckanext.activityinfo.tmp_dir', None)
     def test_none_value_falls_back_to_default(
-        self, setup_data, mock_file_data, mock_dependencies
+        self, setup_data, mock_dependencies
     ):
         """Test that None value for tmp_dir falls back to default behavior."""
-        context = {'user': setup_data.user['name'], 'ignore_auth': True}
-
-        _update_resource_with_file(
-            context, setup_data.resource['id'], mock_file_data, 'test_file.csv', 'csv'
-        )
+        _create_tmp_file('csv')
 
         mock_dependencies['tempfile'].assert_called_once_with(
             delete=False, suffix='.csv'
@@ -86,14 +68,13 @@ class TestTmpDirConfig:
 
     @pytest.mark.ckan_config('ckanext.activityinfo.tmp_dir', '/custom/xlsx/path')
     def test_xlsx_format_with_custom_tmp_dir(
-        self, setup_data, mock_file_data, mock_dependencies
+        self, setup_data, mock_dependencies
     ):
         """Test that xlsx format works correctly with custom tmp directory."""
         context = {'user': setup_data.user['name'], 'ignore_auth': True}
 
-        _update_resource_with_file(
-            context, setup_data.resource['id'], mock_file_data, 'test_file.xlsx', 'xlsx'
-        )
+        tmp = _create_tmp_file('xlsx')
+        _upload_resource_file(context, setup_data.resource['id'], tmp.name, 'test_file.xlsx', 'xlsx')
 
         mock_dependencies['tempfile'].assert_called_once_with(
             delete=False, suffix='.xlsx', dir='/custom/xlsx/path'
@@ -102,17 +83,15 @@ class TestTmpDirConfig:
         call_args = mock_dependencies['get_action'].return_value.call_args[0][1]
         assert call_args['id'] == setup_data.resource['id']
         assert call_args['activityinfo_status'] == 'complete'
+        # The upload streams the temporary file
+        assert call_args['upload'].filename == 'test_file.xlsx'
 
     @pytest.mark.ckan_config('ckanext.activityinfo.tmp_dir', '')
     def test_empty_string_tmp_dir_falls_back_to_default(
-        self, setup_data, mock_file_data, mock_dependencies
+        self, setup_data, mock_dependencies
     ):
         """Test that empty string for tmp_dir falls back to system temp."""
-        context = {'user': setup_data.user['name'], 'ignore_auth': True}
-
-        _update_resource_with_file(
-            context, setup_data.resource['id'], mock_file_data, 'test_file.csv', 'csv'
-        )
+        _create_tmp_file('csv')
 
         # Empty string config value falls back to default (system temp)
         mock_dependencies['tempfile'].assert_called_once_with(
@@ -0,0 +1,111 @@
+import hashlib
+import io
+from unittest import mock
+import pytest
+from ckanext.activityinfo.data.base import ActivityInfoClient
+from ckanext.activityinfo.jobs.download import _update_targets_with_file
+from ckanext.activityinfo.jobs.progress import pop_site_upload_outcomes, record_upload_outcome
+
+
+CONTENT = b"a,b\n1,2\n"
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture
+def export_path(tmp_path):
+    path = tmp_path / "export.csv"
+    path.write_bytes(CONTENT)
+    return str(path)
+
+
+@pytest.fixture(autouse=True)
+def reset_outcomes():
+    pop_site_upload_outcomes()
+    yield
+    pop_site_upload_outcomes()
+
+
+def _resource(content_hash, url="https://ckan.example.org/dataset/d/resource/res1/download/My form.csv"):
+    return {
+        'id': 'res1',
+        'url': url,
+        'url_type': 'upload',
+        'activityinfo_content_hash': content_hash,
+    }
+
+
+def _update(export_path, current_resource, format_type='csv'):
+    patches = []
+    with mock.patch('ckan.plugins.toolkit.get_action', return_value=lambda context, data_dict: patches.append(data_dict)):
+        _update_targets_with_file(
+            {'user': 'test'}, [('res1', format_type)], export_path, 'csv', 'My form',
+            export_hash=CONTENT_HASH, current_resources={'res1': current_resource},
+        )
+    return patches
+
+
+class TestDownloadHash:
+    def test_download_to_file_updates_the_hasher(self):
+        response = mock.Mock(status_code=200, headers={})
+        response.iter_content.return_value = iter([b"a,b\n", b"1,2\n"])
+        hasher = hashlib.sha256()
+        with mock.patch("requests.Session.request", return_value=response):
+            ActivityInfoClient(api_key="test-api-key").download_to_file(
+                "https://www.activityinfo.org/file.csv", io.BytesIO(), hasher=hasher
+            )
+        assert hasher.hexdigest() == CONTENT_HASH
+
+
+class TestSkipUnchangedUpload:
+    def test_unchanged_export_is_not_uploaded(self, export_path):
+        patches = _update(export_path, _resource(f"csv:{CONTENT_HASH}"))
+
+        assert len(patches) == 1
+        assert 'upload' not in patches[0]
+        assert patches[0]['activityinfo_status'] == 'complete'
+        # The schedule anchor is only set when the update is enqueued
+        assert 'activityinfo_last_updated' not in patches[0]
+        assert pop_site_upload_outcomes() == {'uploaded': 0, 'unchanged': 1, 'skip_rate': 1.0}
+
+    def test_changed_export_is_uploaded(self, export_path):
+        patches = _update(export_path, _resource("csv:old-hash"))
+
+        assert len(patches) == 1
+        assert patches[0]['upload'].filename == "My form.csv"
+        assert patches[0]['activityinfo_content_hash'] == f"csv:{CONTENT_HASH}"
+        assert pop_site_upload_outcomes() == {'uploaded': 1, 'unchanged': 0, 'skip_rate': 0.0}
+
+    def test_first_export_is_uploaded(self, export_path):
+        patches = _update(export_path, _resource('', url='My form.csv'))
+        assert 'upload' in patches[0]
+
+    def test_hash_includes_the_target_format(self, export_path):
+        # Same CSV export, but the resource used to be a CSV and is now a TSV
+        resource = _resource(f"csv:{CONTENT_HASH}", url="https://ckan.example.org/download/My form.tsv")
+        patches = _update(export_path, resource, format_type='tsv')
+        assert patches[0]['upload'].filename == "My form.tsv"
+        assert patches[0]['activityinfo_content_hash'] == f"tsv:{CONTENT_HASH}"
+
+    def test_renamed_form_is_uploaded(self, export_path):
+        resource = _resource(f"csv:{CONTENT_HASH}", url="https://ckan.example.org/download/Old label.csv")
+        patches = _update(export_path, resource)
+        assert 'upload' in patches[0]
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.skip_unchanged', 'false')
+    def test_skip_unchanged_disabled(self, export_path):
+        patches = _update(export_path, _resource(f"csv:{CONTENT_HASH}"))
+        assert 'upload' in patches[0]
+
+
+class TestUploadOutcomes:
+    def test_skip_rate(self):
+        record_upload_outcome('uploaded')
+        record_upload_outcome('unchanged')
+        record_upload_outcome('unchanged')
+        record_upload_outcome('unchanged')
+        assert pop_site_upload_outcomes() == {'uploaded': 1, 'unchanged': 3, 'skip_rate': 0.75}
+
+    def test_pop_resets_the_counters(self):
+        record_upload_outcome('uploaded')
+        pop_site_upload_outcomes()
+        assert pop_site_upload_outcomes() == {'uploaded': 0, 'unchanged': 0, 'skip_rate': 0.0}
@@ -0,0 +1,67 @@
+from unittest import mock
+import pytest
+from ckan.plugins import toolkit
+from ckantoolkit.tests import factories as ckan_factories
+from ckanext.activityinfo import utils
+from ckanext.activityinfo.utils import get_user_token, invalidate_user_token
+
+
+@pytest.mark.usefixtures("clean_db")
+class TestGetUserToken:
+    def test_token_by_name_and_id(self, ai_user_with_api_key):
+        expected = ai_user_with_api_key["plugin_extras"]["activity_info"]["api_key"]
+        assert get_user_token(ai_user_with_api_key["name"]) == expected
+        assert get_user_token(ai_user_with_api_key["id"]) == expected
+
+    def test_user_without_token(self):
+        user = ckan_factories.User()
+        assert get_user_token(user["name"]) is None
+
+    def test_unknown_user(self):
+        assert get_user_token("not-a-user") is None
+        assert get_user_token(None) is None
+
+    def test_token_is_cached(self, ai_user_with_api_key):
+        get_user_token(ai_user_with_api_key["name"])
+        with mock.patch.object(utils, "_query_user_token") as mock_query:
+            get_user_token(ai_user_with_api_key["name"])
+        mock_query.assert_not_called()
+
+    def test_invalidate(self, ai_user_with_api_key):
+        get_user_token(ai_user_with_api_key["name"])
+        invalidate_user_token(ai_user_with_api_key["name"])
+        with mock.patch.object(utils, "_query_user_token", return_value="new-key") as mock_query:
+            assert get_user_token(ai_user_with_api_key["name"]) == "new-key"
+        mock_query.assert_called_once()
+
+    @pytest.mark.ckan_config('ckanext.activityinfo.token_cache_ttl', '0')
+    def test_process_cache_disabled(self, ai_user_with_api_key):
+        get_user_token(ai_user_with_api_key["name"])
+        with mock.patch.object(utils, "_query_user_token", return_value="new-key"):
+            assert get_user_token(ai_user_with_api_key["name"]) == "new-key"
+
+    def test_single_query_per_request(self, app, ai_user_with_api_key):
+        environ = {"Authorization": ai_user_with_api_key["token"]}
+        api_key = ai_user_with_api_key["plugin_extras"]["activity_info"]["api_key"]
+        utils.clear_user_token_cache()
+        with mock.patch.object(utils, "_query_user_token", return_value=api_key) as mock_query:
+            app.get(toolkit.url_for("activity_info.api_key"), headers=environ)
+        mock_query.assert_called_once()
+
+    def test_cache_invalidated_on_update(self, app, ai_user_with_api_key):
+        environ = {"Authorization": ai_user_with_api_key["token"]}
+        get_user_token(ai_user_with_api_key["name"])
+        app.post(
+            toolkit.url_for("activity_info.update_api_key"),
+            params={"activityinfo_api_key": "new-activityinfo-api-key"},
+            headers=environ,
+        )
+        assert get_user_token(ai_user_with_api_key["name"]) == "new-activityinfo-api-key"
+        assert get_user_token(ai_user_with_api_key["id"]) == "new-activityinfo-api-key"
+
+    def test_cache_invalidated_on_remove(self, app, ai_user_with_api_key):
+        environ = {"Authorization": ai_user_with_api_key["token"]}
+        get_user_token(ai_user_with_api_key["id"])
+        app.post(toolkit.url_for("activity_info.remove_api_key"), headers=environ)
+        assert get_user_token(ai_user_with_api_key["name"]) is None
+        assert get_user_token(ai_user_with_api_key["id"]) is None
@@ -1,23 +1,38 @@
 import logging
-from datetime import datetime, timedelta, timezone
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime, timezone
 from functools import wraps
+from flask import current_app, g, has_app_context, has_request_context
 from ckan.plugins import toolkit
 from ckan import model
-from sqlalchemy import and_, cast
+from sqlalchemy import and_, bindparam, cast, func, or_, tuple_
 from sqlalchemy.dialects.postgresql import JSONB
 
+from ckanext.activityinfo.jobs.progress import pop_site_upload_outcomes
+from ckanext.activityinfo.schedules import CronSchedule, get_spread, parse_frequency
+
 
 log = logging.getLogger(__name__)
 
-# Valid values for the activityinfo_auto_update field.
-# 'never' means auto-update is disabled.
-VALID_AUTO_UPDATE_VALUES = ('never', 'daily', 'weekly')
-SCHEDULABLE_AUTO_UPDATE_VALUES = ('daily', 'weekly')
+# Named values for the activityinfo_auto_update field, 'never' means auto-update
+# is disabled. Intervals and cron expressions are also valid, see schedules.
+VALID_AUTO_UPDATE_VALUES = ('never', 'hourly', 'daily', 'weekly')
+# Resources saved before activityinfo_next_run_at existed can only have these values
+LEGACY_AUTO_UPDATE_VALUES = ('daily', 'weekly')
 
 # Resource.extras is stored as UnicodeText (JSON string), not native JSONB.
 # Cast it to JSONB so we can use PostgreSQL JSON operators in queries.
+# The activityinfo_form_id, activityinfo_status and activityinfo_auto_update
+# lookups use the indexes of the activityinfo migration: the expression must be
+# _extras_jsonb[<extra>].astext and the query must filter active resources.
 _extras_jsonb = cast(model.Resource.extras, JSONB)
 
+# Process-wide cache of ActivityInfo API keys: {user_name_or_id: (token, expires_at)}
+_token_cache = {}
+_token_cache_lock = threading.Lock()
+
 
 def get_activity_info_user_plugin_extras(user_name_or_id):
     """
@@ -44,16 +59,75 @@ def get_activity_info_user_plugin_extras(user_name_or_id):
 def get_user_token(user_name_or_id):
     """
     Utility function to get the ActivityInfo user token.
+
+    This runs in every auth function, action and template helper, so the token
+    is cached for the current request and, for a short time (see
+    ckanext.activityinfo.token_cache_ttl), for the whole process.
+    Only found tokens are cached process-wide, so a new API key is available
+    right away in every process. A removed key can still be returned by other
+    processes until the cache expires.
     """
     log.debug(f"Retrieving ActivityInfo token for user {user_name_or_id}")
-
-    plugin_extras = get_activity_info_user_plugin_extras(user_name_or_id)
-    if not plugin_extras:
+    if not user_name_or_id:
         return None
-    if 'activity_info' not in plugin_extras:
+
+    request_cache = _get_request_token_cache()
+    if request_cache is not None and user_name_or_id in request_cache:
+        return request_cache[user_name_or_id]
+
+    now = time.monotonic()
+    with _token_cache_lock:
+        token, expires_at = _token_cache.get(user_name_or_id, (None, 0))
+    if not token or expires_at <= now:
+        token = _query_user_token(user_name_or_id)
+        ttl = toolkit.asint(toolkit.config.get('ckanext.activityinfo.token_cache_ttl', 60))
+        if token and ttl > 0:
+            with _token_cache_lock:
+                _token_cache[user_name_or_id] = (token, now + ttl)
+
+    if request_cache is not None:
+        request_cache[user_name_or_id] = token
+    return token
+
+
+def invalidate_user_token(*user_names_or_ids):
+    """Forget the cached API key of a user (call it with the user name and ID)."""
+    request_cache = _get_request_token_cache()
+    with _token_cache_lock:
+        for user_name_or_id in user_names_or_ids:
+            _token_cache.pop(user_name_or_id, None)
+            if request_cache is not None:
+                request_cache.pop(user_name_or_id, None)
+
+
+def clear_user_token_cache():
+    """Forget all the API keys cached by this process."""
+    with _token_cache_lock:
+        _token_cache.clear()
+
+
+def _get_request_token_cache():
+    """Get the API keys cached for the current request, None outside requests."""
+    if not has_request_context():
         return None
+    if not hasattr(g, 'activityinfo_tokens'):
+        g.activityinfo_tokens = {}
+    return g.activityinfo_tokens
+
 
-    return plugin_extras['activity_info'].get('api_key')
+def _query_user_token(user_name_or_id):
+    """Read the API key straight from the user plugin_extras column.
+
+    A single lightweight query instead of get_site_user + user_show.
+    """
+    row = model.Session.query(
+        model.User.plugin_extras['activity_info']['api_key'].astext
+    ).filter(
+        or_(model.User.id == user_name_or_id, model.User.name == user_name_or_id)
+    ).first()
+    if not row or not row[0]:
+        return None
+    return row[0]
 
 
 def get_ckan_resources(form_id):
@@ -63,24 +137,42 @@ def get_ckan_resources(form_id):
     Returns:
         A list of tuples (resource_name, resource_url)
     """
-    resources = model.Session.query(model.Resource).filter(
+    return get_ckan_resources_by_form([form_id])[form_id]
+
+
+def get_ckan_resources_by_form(form_ids):
+    """ Search for internal resources linked to any of the given ActivityInfo form IDs
+    Resources and their datasets are read with a single query, use this instead
+    of calling get_ckan_resources for each form of a page.
+    Args:
+        form_ids: A list of ActivityInfo form IDs
+    Returns:
+        A dict {form_id: [(resource_name, resource_url), ...]} with every form ID
+    """
+    ret = {form_id: [] for form_id in form_ids}
+    if not ret:
+        return ret
+
+    form_id_column = _extras_jsonb['activityinfo_form_id'].astext
+    rows = model.Session.query(
+        model.Resource.id,
+        model.Resource.name,
+        form_id_column,
+        model.Package.name,
+        model.Package.type,
+    ).join(
+        model.Package, model.Package.id == model.Resource.package_id
+    ).filter(
         and_(
             model.Resource.state == 'active',
-            _extras_jsonb['activityinfo_form_id'].astext == form_id,
+            form_id_column.in_(list(ret)),
         )
-    ).all()
+    ).order_by(model.Package.name, model.Resource.position).all()
 
-    ret = []
-    for res in resources:
-        pkg = toolkit.get_action('package_show')(
-            {'ignore_auth': True}, {'id': res.package_id}
-        )
-        pkg_type = pkg.get('type', 'dataset')
-        resource_url = toolkit.url_for(
-            f'{pkg_type}_resource.read', id=pkg['name'], resource_id=res.id
-        )
-        ret.append(
-            (res.name or 'Unnamed resource', resource_url)
+    for resource_id, resource_name, form_id, package_name, package_type in rows:
+        resource_url = _get_resource_url(package_type, package_name, resource_id)
+        ret[form_id].append(
+            (resource_name or 'Unnamed resource', resource_url)
         )
 
     return ret
@@ -91,9 +183,17 @@ def get_ai_resources(limit=100):
     Args:
         limit: Maximum number of resources to return, default 100
     Returns:
-        A list of resources with their URLs
+        A list of resources with their URLs. The 'package' key only includes
+        the id, name, title and type of the dataset.
     """
-    resources = model.Session.query(model.Resource).filter(
+    rows = model.Session.query(
+        model.Resource,
+        model.Package.name,
+        model.Package.title,
+        model.Package.type,
+    ).join(
+        model.Package, model.Package.id == model.Resource.package_id
+    ).filter(
         and_(
             model.Resource.state == 'active',
             _extras_jsonb['activityinfo_status'].astext == 'complete',
@@ -101,22 +201,26 @@ def get_ai_resources(limit=100):
     ).limit(limit).all()
 
     ret = []
-    for res in resources:
-        pkg = toolkit.get_action('package_show')(
-            {'ignore_auth': True}, {'id': res.package_id}
-        )
-        pkg_type = pkg.get('type', 'dataset')
-        resource_url = toolkit.url_for(
-            f'{pkg_type}_resource.read', id=pkg['name'], resource_id=res.id
-        )
+    for res, package_name, package_title, package_type in rows:
         res_dict = res.as_dict()
-        res_dict['final_url'] = resource_url
-        res_dict['package'] = pkg
+        res_dict['final_url'] = _get_resource_url(package_type, package_name, res.id)
+        res_dict['package'] = {
+            'id': res.package_id,
+            'name': package_name,
+            'title': package_title,
+            'type': package_type or 'dataset',
+        }
         ret.append(res_dict)
 
     return ret
 
 
+def _get_resource_url(package_type, package_name, resource_id):
+    return toolkit.url_for(
+        f'{package_type or "dataset"}_resource.read', id=package_name, resource_id=resource_id
+    )
+
+
 def get_users_with_activity_info_token():
     """
     Get all users that have an ActivityInfo API key set in their plugin_extras.
@@ -147,75 +251,237 @@ def get_users_with_activity_info_token():
     return final_users
 
 
+def get_next_run_at(resource_dict, now=None):
+    """Compute the activityinfo_next_run_at value of a resource.
+
+    The resource is due at the next run of its activityinfo_auto_update
+    frequency after activityinfo_last_updated, or right away if it was never
+    updated. Runs of cron frequencies are delayed by the spread of the
+    resource (see schedules.get_spread).
+
+    Returns:
+        An ISO timestamp in UTC, with a fixed width so the values sort by date
+        in SQL, or '' if the resource has no more automatic updates to run.
+    """
+    try:
+        schedule = parse_frequency(resource_dict.get('activityinfo_auto_update'))
+    except ValueError as e:
+        log.warning(f"Invalid activityinfo_auto_update for resource {resource_dict.get('id')}: {e}")
+        return ''
+    if schedule is None:
+        return ''
+
+    max_runs = _safe_int(resource_dict.get('activityinfo_auto_update_runs'), 1)
+    current_count = _safe_int(resource_dict.get('activityinfo_auto_update_count'), 0)
+    if current_count >= max_runs:
+        return ''
+
+    last_run = _parse_timestamp(resource_dict.get('activityinfo_last_updated'))
+    if last_run is None:
+        next_run = now or datetime.now(timezone.utc)
+    else:
+        next_run = schedule.next_run(last_run)
+        if isinstance(schedule, CronSchedule):
+            next_run += get_spread(resource_dict.get('id'), schedule.min_gap)
+    return next_run.astimezone(timezone.utc).isoformat(timespec='seconds')
+
+
+def get_export_columns(resource_dict):
+    """Get the column IDs selected in activityinfo_columns, None to export all the columns.
+
+    The value is a comma separated string (as saved in the resource extras) or a list.
+    """
+    value = resource_dict.get('activityinfo_columns')
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    column_ids = [str(column_id).strip() for column_id in value if str(column_id).strip()]
+    return column_ids or None
+
+
+def get_export_filter(resource_dict):
+    """Get the activityinfo_filter formula of a resource, None to export all the records."""
+    return (resource_dict.get('activityinfo_filter') or '').strip() or None
+
+
+def is_form_bundle(resource_dict):
+    """Check if a resource exports its form with all the sub-forms (see jobs.bundle)."""
+    return toolkit.asbool(resource_dict.get('activityinfo_bundle') or False)
+
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
 def get_resources_due_for_auto_update():
     """Find all ActivityInfo resources that are due for automatic update.
 
+    See iter_resources_due_for_auto_update.
+
+    Returns:
+        A list of resource dicts that need updating, the most overdue first.
+    """
+    return list(iter_resources_due_for_auto_update())
+
+
+def iter_resources_due_for_auto_update(now=None, batch_size=500):
+    """Iterate over the ActivityInfo resources that are due for automatic update.
+
     A resource is due when:
-    - activityinfo_auto_update is 'daily' or 'weekly'
     - activityinfo_status is 'complete' (not currently processing)
-    - activityinfo_auto_update_count < activityinfo_auto_update_runs
-    - Enough time has passed since activityinfo_last_updated
-      (24h for daily, 7 days for weekly), or never updated yet
+    - activityinfo_next_run_at is set and not in the future. It is computed
+      by resource_create and resource_update (see get_next_run_at) and it is
+      empty when auto-update is 'never' or the run limit is reached.
 
-    Returns:
-        A list of resource dicts that need updating.
+    Both conditions are evaluated by the database. Resources are read in
+    batches ordered by activityinfo_next_run_at, so the most overdue come
+    first. Each batch is a new query, so the caller can update (and commit)
+    the resources while iterating.
+
+    Resources saved before activityinfo_next_run_at existed are checked in
+    Python first. They get the value the next time they are updated.
+
+    Yields:
+        Resource dicts that need updating.
     """
-    now = datetime.now(timezone.utc)
+    now = now or datetime.now(timezone.utc)
+    now_iso = now.astimezone(timezone.utc).isoformat(timespec='seconds')
 
-    # Query resources with auto-update enabled and status complete
-    resources = model.Session.query(model.Resource).filter(
+    # Resources without activityinfo_next_run_at
+    legacy = model.Session.query(model.Resource).filter(
         and_(
             model.Resource.state == 'active',
             _extras_jsonb['activityinfo_status'].astext == 'complete',
             _extras_jsonb['activityinfo_auto_update'].astext.in_(
-                SCHEDULABLE_AUTO_UPDATE_VALUES
+                LEGACY_AUTO_UPDATE_VALUES
             ),
+            _extras_jsonb['activityinfo_next_run_at'].astext.is_(None),
         )
     ).all()
-
-    due_resources = []
-    for res in resources:
-        extras = res.extras or {}
-        frequency = extras.get('activityinfo_auto_update')
-        max_runs = _safe_int(extras.get('activityinfo_auto_update_runs'), 1)
-        current_count = _safe_int(extras.get('activityinfo_auto_update_count'), 0)
-
-        # Check run limit
-        if current_count >= max_runs:
-            log.debug(
-                f"Skipping resource {res.id}: "
-                f"run limit reached ({current_count}/{max_runs})"
+    # Read everything before yielding: the caller may commit, which expires the objects
+    legacy = [res.as_dict() for res in legacy]
+    for res_dict in legacy:
+        next_run_at = get_next_run_at(res_dict, now=now)
+        if next_run_at and next_run_at <= now_iso:
+            yield res_dict
+        else:
+            log.debug(f"Skipping resource {res_dict['id']}: not due ({next_run_at or 'no more runs'})")
+
+    next_run_column = _extras_jsonb['activityinfo_next_run_at'].astext
+    last = None
+    while True:
+        query = model.Session.query(model.Resource, next_run_column).filter(
+            and_(
+                model.Resource.state == 'active',
+                _extras_jsonb['activityinfo_status'].astext == 'complete',
+                next_run_column != '',
+                next_run_column <= now_iso,
             )
-            continue
+        )
+        if last is not None:
+            query = query.filter(tuple_(next_run_column, model.Resource.id) > last)
+        rows = query.order_by(next_run_column, model.Resource.id).limit(batch_size).all()
+        if not rows:
+            return
+        last = (rows[-1][1], rows[-1][0].id)
+        batch = [res.as_dict() for res, _ in rows]
+        yield from batch
+        if len(batch) < batch_size:
+            return
+
+
+def get_auto_update_schedule(resource_ids=None):
+    """Get when the ActivityInfo resources with automatic updates are due.
+
+    Only resources with a 'complete' status and runs left are included: the
+    download job saves the resources that are processing when it ends.
+
+    Args:
+        resource_ids: Only read these resources (default: all of them)
+
+    Returns:
+        A dict {resource_id: (activityinfo_next_run_at, activityinfo_auto_update)},
+        see get_next_run_at.
+    """
+    next_run_column = _extras_jsonb['activityinfo_next_run_at'].astext
+    query = model.Session.query(model.Resource.id, model.Resource.extras).filter(
+        and_(
+            model.Resource.state == 'active',
+            _extras_jsonb['activityinfo_status'].astext == 'complete',
+            or_(
+                next_run_column > '',
+                and_(
+                    next_run_column.is_(None),
+                    _extras_jsonb['activityinfo_auto_update'].astext.in_(
+                        LEGACY_AUTO_UPDATE_VALUES
+                    ),
+                ),
+            ),
+        )
+    )
+    if resource_ids is not None:
+        query = query.filter(model.Resource.id.in_(list(resource_ids)))
+
+    schedule = {}
+    for resource_id, extras in query:
+        extras = extras or {}
+        next_run_at = extras.get('activityinfo_next_run_at')
+        if next_run_at is None:
+            # Saved before activityinfo_next_run_at existed
+            next_run_at = get_next_run_at(extras)
+        if next_run_at:
+            schedule[resource_id] = (next_run_at, extras.get('activityinfo_auto_update'))
+    return schedule
+
+
+def get_resources_status(resource_ids):
+    """Get the saved ActivityInfo status of several resources with one query.
+
+    Returns:
+        A dict {resource_id: dict} with the active resources only. Each dict has
+        'package_id', 'private' (the dataset is private or not active),
+        'status', 'progress' and 'error' keys.
+    """
+    if not resource_ids:
+        return {}
+    rows = model.Session.query(
+        model.Resource.id,
+        model.Resource.package_id,
+        model.Resource.extras,
+        model.Package.private,
+        model.Package.state,
+    ).join(
+        model.Package, model.Package.id == model.Resource.package_id
+    ).filter(
+        and_(
+            model.Resource.id.in_(list(resource_ids)),
+            model.Resource.state == 'active',
+        )
+    ).all()
 
-        # Check timing
-        last_updated = extras.get('activityinfo_last_updated')
-        if last_updated:
-            try:
-                last_dt = datetime.fromisoformat(last_updated)
-                if last_dt.tzinfo is None:
-                    last_dt = last_dt.replace(tzinfo=timezone.utc)
-                if frequency == 'daily' and (now - last_dt) < timedelta(hours=24):
-                    log.debug(
-                        f"Skipping resource {res.id}: "
-                        f"last updated {last_updated}, not yet due (daily)"
-                    )
-                    continue
-                if frequency == 'weekly' and (now - last_dt) < timedelta(days=7):
-                    log.debug(
-                        f"Skipping resource {res.id}: "
-                        f"last updated {last_updated}, not yet due (weekly)"
-                    )
-                    continue
-            except (ValueError, TypeError):
-                pass
-
-        due_resources.append(res.as_dict())
-
-    return due_resources
-
-
-def run_sync_auto_updates(dry_run=False):
+    ret = {}
+    for resource_id, package_id, extras, private, package_state in rows:
+        extras = extras or {}
+        ret[resource_id] = {
+            'package_id': package_id,
+            'private': bool(private) or package_state != 'active',
+            'status': extras.get('activityinfo_status'),
+            'progress': int(extras.get('activityinfo_progress') or 0),
+            'error': extras.get('activityinfo_error') or '',
+        }
+    return ret
+
+
+def run_sync_auto_updates(dry_run=False, workers=None, bulk=None):
     """Find resources due for auto-update and enqueue download jobs.
 
     Pure function with no CLI dependencies. Emits progress via ``log.info`` /
@@ -223,8 +489,17 @@ def run_sync_auto_updates(dry_run=False):
     call from another extension (e.g. ckanext-unhcr) to log outcomes to a
     system activity record.
 
+    Resources are processed one by one by default. With more than one worker,
+    they are processed by a bounded thread pool. In bulk mode, the jobs of
+    each batch of resources are enqueued with a single Redis pipeline and the
+    run counters are saved with a single UPDATE, without resource_patch: the
+    search index and the dataset metadata_modified are only updated when the
+    download job saves the new file.
+
     Args:
         dry_run: If True, do not enqueue jobs, just list what would be done.
+        workers: Number of threads (default: ckanext.activityinfo.sync.workers, 1)
+        bulk: Use the bulk mode (default: ckanext.activityinfo.sync.bulk, false)
 
     Returns:
         A summary dict:
@@ -236,8 +511,24 @@ def run_sync_auto_updates(dry_run=False):
                 'skipped': int,
                 'details': [ {resource_id, form_label, user, status, ...}, ... ],
                 'finished': bool,
+                'site_uploads': {'uploaded': int, 'unchanged': int, 'skip_rate': float},
+                'timing': {'mode': str, 'workers': int, 'elapsed': float, 'per_resource': float},
             }
+
+        ``site_uploads`` counts all the download jobs of the site finished
+        since the last (non dry run) sync, not only the ones enqueued by that
+        sync: the files uploaded and the unchanged exports whose upload was
+        skipped. ``timing`` has the mode used ('serial', 'parallel'
+        or 'bulk') and the seconds spent in total and per due resource.
     """
+    config = toolkit.config
+    if workers is None:
+        workers = toolkit.asint(config.get('ckanext.activityinfo.sync.workers', 1))
+    if bulk is None:
+        bulk = toolkit.asbool(config.get('ckanext.activityinfo.sync.bulk', False))
+    workers = max(1, workers)
+    mode = 'bulk' if bulk else 'parallel' if workers > 1 else 'serial'
+
     summary = {
         'dry_run': dry_run,
         'total_due': 0,
@@ -246,114 +537,376 @@ def run_sync_auto_updates(dry_run=False):
         'skipped': 0,
         'details': [],
         'finished': False,
+        'site_uploads': None,
+        'timing': {'mode': mode, 'workers': workers, 'elapsed': 0.0, 'per_resource': 0.0},
     }
+    started_at = time.monotonic()
+
+    if not dry_run:
+        summary['site_uploads'] = pop_site_upload_outcomes()
+        log.info(
+            f"Downloads on the site since the last sync: {summary['site_uploads']['uploaded']} file(s) uploaded, "
+            f"{summary['site_uploads']['unchanged']} unchanged export(s) not uploaded again "
+            f"(skip rate {summary['site_uploads']['skip_rate']:.0%})"
+        )
 
     log.info("Checking for ActivityInfo resources due for auto-update...")
-    due_resources = get_resources_due_for_auto_update()
-    summary['total_due'] = len(due_resources)
+    # Resources are streamed from the database, the most overdue first
+    due_resources = _count_due(iter_resources_due_for_auto_update(), summary)
+    if dry_run:
+        for res in due_resources:
+            _log_dry_run_resource(res, summary)
+    elif mode == 'bulk':
+        _sync_bulk(due_resources, summary)
+    elif mode == 'parallel':
+        _sync_parallel(due_resources, summary, workers)
+    else:
+        for res in due_resources:
+            _add_to_summary(summary, sync_resource_auto_update(res))
 
-    if not due_resources:
+    if summary['total_due']:
+        log.info(f"Found {summary['total_due']} resource(s) due for update.")
+    else:
         log.info("No resources due for update.")
-        summary['finished'] = True
-        return summary
 
-    log.info(f"Found {len(due_resources)} resource(s) due for update.")
+    elapsed = time.monotonic() - started_at
+    summary['timing']['elapsed'] = round(elapsed, 3)
+    if summary['total_due']:
+        summary['timing']['per_resource'] = round(elapsed / summary['total_due'], 4)
+    log.info(f"Sync took {elapsed:.2f}s ({mode} mode, {workers} worker(s))")
+    summary['finished'] = True
+    return summary
 
-    if dry_run:
-        for res in due_resources:
-            count = res.get('activityinfo_auto_update_count', 0)
-            max_runs = res.get('activityinfo_auto_update_runs', 1)
-            user = res.get('activityinfo_user', '?')
-            log.info(
-                f"[DRY RUN] {res['id']} - "
-                f"{res.get('activityinfo_form_label', '?')} "
-                f"({res.get('activityinfo_auto_update')}, "
-                f"run {count}/{max_runs}, user: {user})"
-            )
-            summary['details'].append({
-                'resource_id': res['id'],
-                'form_label': res.get('activityinfo_form_label', '?'),
-                'user': user,
-                'status': 'dry-run',
-            })
-        summary['finished'] = True
-        return summary
-
-    for res in due_resources:
-        resource_id = res['id']
-        form_label = res.get('activityinfo_form_label', resource_id)
-        current_count = _safe_int(res.get('activityinfo_auto_update_count'), 0)
-        max_runs = _safe_int(res.get('activityinfo_auto_update_runs'), 1)
-        user_name = res.get('activityinfo_user')
-
-        if not user_name:
-            log.info(
-                f"Skipping: {form_label} ({resource_id}) "
-                f"- no activityinfo_user set"
-            )
-            summary['skipped'] += 1
-            summary['details'].append({
-                'resource_id': resource_id,
-                'form_label': form_label,
-                'status': 'skipped',
-                'reason': 'no activityinfo_user set',
-            })
-            continue
 
-        log.info(
-            f"Updating: {form_label} ({resource_id}) "
-            f"- run {current_count + 1}/{max_runs}, user: {user_name}"
+def _count_due(resources, summary):
+    for res in resources:
+        summary['total_due'] += 1
+        yield res
+
+
+def _add_to_summary(summary, detail):
+    # The 'enqueued', 'failed' and 'skipped' statuses are also the summary counters
+    summary[detail['status']] += 1
+    summary['details'].append(detail)
+
+
+def _log_dry_run_resource(res, summary):
+    count = res.get('activityinfo_auto_update_count', 0)
+    max_runs = res.get('activityinfo_auto_update_runs', 1)
+    user = res.get('activityinfo_user', '?')
+    log.info(
+        f"[DRY RUN] {res['id']} - "
+        f"{res.get('activityinfo_form_label', '?')} "
+        f"({res.get('activityinfo_auto_update')}, "
+        f"run {count}/{max_runs}, user: {user})"
+    )
+    summary['details'].append({
+        'resource_id': res['id'],
+        'form_label': res.get('activityinfo_form_label', '?'),
+        'user': user,
+        'status': 'dry-run',
+    })
+
+
+def _skip_without_user(res):
+    """Get the 'skipped' summary detail of a resource without activityinfo_user, None if it has one."""
+    if res.get('activityinfo_user'):
+        return None
+    form_label = res.get('activityinfo_form_label', res['id'])
+    log.info(
+        f"Skipping: {form_label} ({res['id']}) "
+        f"- no activityinfo_user set"
+    )
+    return {
+        'resource_id': res['id'],
+        'form_label': form_label,
+        'status': 'skipped',
+        'reason': 'no activityinfo_user set',
+    }
+
+
+def _skip_already_queued(res, job_id):
+    form_label = res.get('activityinfo_form_label', res['id'])
+    log.info(f"Skipping: {form_label} ({res['id']}) - download job {job_id} already queued")
+    return {
+        'resource_id': res['id'],
+        'form_label': form_label,
+        'user': res.get('activityinfo_user'),
+        'status': 'skipped',
+        'reason': 'download job already queued',
+        'job_id': job_id,
+    }
+
+
+def sync_resource_auto_update(res):
+    """Enqueue the download job of a resource due for auto-update and count the run.
+
+    Returns:
+        The summary detail of the resource.
+    """
+    skipped = _skip_without_user(res)
+    if skipped:
+        return skipped
+
+    resource_id = res['id']
+    form_label = res.get('activityinfo_form_label', resource_id)
+    current_count = _safe_int(res.get('activityinfo_auto_update_count'), 0)
+    max_runs = _safe_int(res.get('activityinfo_auto_update_runs'), 1)
+    user_name = res.get('activityinfo_user')
+
+    log.info(
+        f"Updating: {form_label} ({resource_id}) "
+        f"- run {current_count + 1}/{max_runs}, user: {user_name}"
+    )
+
+    try:
+        result = toolkit.get_action('act_info_update_resource_file')(
+            {'user': user_name, 'ignore_auth': True},
+            {'resource_id': resource_id}
+        )
+        if result.get('already_queued'):
+            # Not a new run, the running job updates the resource when it ends
+            return _skip_already_queued(res, result['job_id'])
+
+        # Update the counter and timestamp now that the job is enqueued.
+        # We count this as a run even if the background job later fails,
+        # to avoid infinite retries. Errors will be captured in the
+        # activityinfo_error resource extra field by the download job.
+        # resource_update computes the new activityinfo_next_run_at.
+        now_iso = datetime.now(timezone.utc).isoformat()
+        toolkit.get_action('resource_patch')(
+            {'user': user_name, 'ignore_auth': True},
+            {
+                'id': resource_id,
+                'activityinfo_last_updated': now_iso,
+                'activityinfo_auto_update_count': current_count + 1,
+            }
         )
+    except Exception as e:
+        log.error(f"FAILED - {e}")
+        return {
+            'resource_id': resource_id,
+            'form_label': form_label,
+            'user': user_name,
+            'status': 'failed',
+            'error': str(e),
+        }
+
+    job_id = result.get('job_id', '?')
+    log.info(
+        f"OK - job {job_id} enqueued "
+        f"(run {current_count + 1}/{max_runs})"
+    )
+    return {
+        'resource_id': resource_id,
+        'form_label': form_label,
+        'user': user_name,
+        'status': 'enqueued',
+        'job_id': job_id,
+        'run': current_count + 1,
+        'max_runs': max_runs,
+    }
 
-        try:
-            result = toolkit.get_action('act_info_update_resource_file')(
-                {'user': user_name, 'ignore_auth': True},
-                {'resource_id': resource_id}
-            )
 
-            # Update the counter and timestamp now that the job is enqueued.
-            # We count this as a run even if the background job later fails,
-            # to avoid infinite retries. Errors will be captured in the
-            # activityinfo_error resource extra field by the download job.
-            now_iso = datetime.now(timezone.utc).isoformat()
-            toolkit.get_action('resource_patch')(
-                {'user': user_name, 'ignore_auth': True},
-                {
-                    'id': resource_id,
-                    'activityinfo_last_updated': now_iso,
-                    'activityinfo_auto_update_count': current_count + 1,
-                }
-            )
+def _sync_parallel(resources, summary, workers):
+    """Run sync_resource_auto_update in a thread pool.
 
-            job_id = result.get('job_id', '?')
-            log.info(
-                f"OK - job {job_id} enqueued "
-                f"(run {current_count + 1}/{max_runs})"
-            )
-            summary['enqueued'] += 1
-            summary['details'].append({
-                'resource_id': resource_id,
-                'form_label': form_label,
-                'user': user_name,
+    At most two resources per worker are waiting in the pool, so the due
+    resources are still streamed from the database.
+    """
+    worker = _with_app_context(_sync_resource_in_thread)
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='activityinfo-sync') as executor:
+        for res in resources:
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _add_to_summary(summary, future.result())
+            pending.add(executor.submit(worker, res))
+        for future in as_completed(pending):
+            _add_to_summary(summary, future.result())
+
+
+def _sync_resource_in_thread(res):
+    try:
+        return sync_resource_auto_update(res)
+    finally:
+        # Each thread has its own scoped session
+        model.Session.remove()
+
+
+def _with_app_context(func):
+    """Run func in worker threads with the Flask app of the calling thread.
+
+    Each call pushes a new context (a request context if the caller has one, as
+    in the CKAN CLI). A context object can not be pushed by several threads at
+    the same time.
+    """
+    if not has_app_context():
+        return func
+    app = current_app._get_current_object()
+    new_context = app.test_request_context if has_request_context() else app.app_context
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with new_context():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _sync_bulk(resources, summary):
+    """Count the runs and enqueue the jobs of the due resources in batches.
+
+    The runs of a batch are saved and committed first, then the jobs are
+    enqueued with one Redis pipeline. If the jobs can not be enqueued, the runs
+    are not counted. Resources with a queued or running download job are
+    skipped. The resources are not updated with resource_update, so
+    their search index is only updated when the download job saves the new file.
+
+    Config settings:
+        ckanext.activityinfo.sync.bulk_size: resources per batch (default 100)
+    """
+    # Imported here, jobs.download imports this module
+    from ckanext.activityinfo.jobs.dedupe import get_active_download_jobs
+    from ckanext.activityinfo.jobs.download import enqueue_download_jobs
+    from ckanext.activityinfo.jobs.scheduler import notify_schedule_change
+
+    bulk_size = toolkit.asint(toolkit.config.get('ckanext.activityinfo.sync.bulk_size', 100))
+    for batch in _batches(resources, bulk_size):
+        to_update = []
+        for res in batch:
+            skipped = _skip_without_user(res)
+            if skipped:
+                _add_to_summary(summary, skipped)
+            else:
+                to_update.append(res)
+        active_jobs = get_active_download_jobs([res['id'] for res in to_update])
+        for res in [res for res in to_update if res['id'] in active_jobs]:
+            _add_to_summary(summary, _skip_already_queued(res, active_jobs[res['id']]))
+            to_update.remove(res)
+        if not to_update:
+            continue
+
+        try:
+            previous_values = _bulk_count_runs(to_update)
+        except Exception as e:
+            model.Session.rollback()
+            _bulk_failed(summary, to_update, e)
+            continue
+        try:
+            jobs = enqueue_download_jobs([(res['id'], res['activityinfo_user']) for res in to_update])
+        except Exception as e:
+            _bulk_restore_runs(previous_values)
+            _bulk_failed(summary, to_update, e)
+            continue
+
+        # Queued by someone else since get_active_download_jobs, not a new run
+        queued = {res['id']: job_id for res, (job_id, created) in zip(to_update, jobs) if not created}
+        if queued:
+            _bulk_restore_runs({resource_id: previous_values[resource_id] for resource_id in queued})
+        for res, (job_id, created) in zip(to_update, jobs):
+            if not created:
+                _add_to_summary(summary, _skip_already_queued(res, job_id))
+                continue
+            notify_schedule_change(res['id'])
+            run = _safe_int(res.get('activityinfo_auto_update_count'), 0) + 1
+            _add_to_summary(summary, {
+                'resource_id': res['id'],
+                'form_label': res.get('activityinfo_form_label', res['id']),
+                'user': res['activityinfo_user'],
                 'status': 'enqueued',
                 'job_id': job_id,
-                'run': current_count + 1,
-                'max_runs': max_runs,
+                'run': run,
+                'max_runs': _safe_int(res.get('activityinfo_auto_update_runs'), 1),
             })
+        log.info(f"OK - {len(to_update) - len(queued)} job(s) enqueued")
 
-        except Exception as e:
-            log.error(f"FAILED - {e}")
-            summary['failed'] += 1
-            summary['details'].append({
-                'resource_id': resource_id,
-                'form_label': form_label,
-                'user': user_name,
-                'status': 'failed',
-                'error': str(e),
-            })
 
-    summary['finished'] = True
-    return summary
+def _bulk_failed(summary, resources, error):
+    log.error(f"FAILED - batch of {len(resources)} resource(s): {error}")
+    for res in resources:
+        _add_to_summary(summary, {
+            'resource_id': res['id'],
+            'form_label': res.get('activityinfo_form_label', res['id']),
+            'user': res['activityinfo_user'],
+            'status': 'failed',
+            'error': str(error),
+        })
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Extras saved for each run in bulk mode
+_RUN_EXTRAS = ('activityinfo_last_updated', 'activityinfo_auto_update_count', 'activityinfo_next_run_at')
+
+
+def _bulk_count_runs(resources):
+    """Save the new run count, activityinfo_last_updated and next run of the resources with one UPDATE.
+
+    Returns:
+        The previous values of these extras by resource ID, for _bulk_restore_runs.
+    """
+    now_iso = datetime.now(timezone.utc).isoformat()
+    ids = [res['id'] for res in resources]
+    current_extras = dict(
+        model.Session.query(model.Resource.id, model.Resource.extras).filter(model.Resource.id.in_(ids))
+    )
+    changes = {}
+    previous_values = {}
+    for resource_id in ids:
+        extras = current_extras.get(resource_id) or {}
+        previous_values[resource_id] = {key: extras.get(key) for key in _RUN_EXTRAS}
+        run_extras = {
+            'activityinfo_last_updated': now_iso,
+            'activityinfo_auto_update_count': _safe_int(extras.get('activityinfo_auto_update_count'), 0) + 1,
+        }
+        # With the resource ID for the spread of cron frequencies
+        run_extras['activityinfo_next_run_at'] = get_next_run_at(dict(extras, id=resource_id, **run_extras))
+        changes[resource_id] = run_extras
+    _bulk_merge_extras(changes)
+    return previous_values
+
+
+def _bulk_restore_runs(previous_values):
+    """Undo _bulk_count_runs, the jobs of the resources were not enqueued."""
+    try:
+        _bulk_merge_extras(previous_values)
+    except Exception as e:
+        model.Session.rollback()
+        log.error(f"Could not restore the run counters of {len(previous_values)} resource(s): {e}")
+
+
+def _bulk_merge_extras(changes):
+    """Set some extras of several resources with one UPDATE and commit.
+
+    Only the given keys are changed (a JSONB merge in the database), so the
+    status or progress saved meanwhile by a download job is kept.
+
+    Args:
+        changes: {resource_id: {extra: value}}
+    """
+    resource_table = model.Resource.__table__
+    extras_type = resource_table.c.extras.type
+    merged = cast(
+        func.coalesce(cast(resource_table.c.extras, JSONB), cast('{}', JSONB)).op('||')(
+            bindparam('changed_extras', type_=JSONB)
+        ),
+        extras_type,
+    )
+    model.Session.execute(
+        resource_table.update().where(resource_table.c.id == bindparam('resource_id')).values(extras=merged),
+        [{'resource_id': resource_id, 'changed_extras': extras} for resource_id, extras in changes.items()],
+    )
+    model.Session.commit()
 
 
 def _safe_int(value, default=0):